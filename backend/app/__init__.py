@@ -1,11 +1,23 @@
 from flask import Flask
 from flask_cors import CORS
-from flask_socketio import SocketIO
-from app.models.models import Base
+from app.extensions import socketio
+from app.models.schema import check_schema_version
 # Import configurations and routes
 from app.routes.api import register_api_routes
 from app.routes.webrtc import register_webrtc_routes
+from app.routes.metrics import register_metrics_routes
+from app.routes.admin import register_admin_routes
 from app.socket.events import register_socket_events
+from app.services.presence import presence_store
+from app.services.chat_ingest import chat_ingest
+from app.services.sfu_cluster import sfu_cluster
+from app.services.sfu_stats import sfu_stats
+from app.services.active_speakers import active_speakers
+from app.services.recording import recordings
+from app.services.hls import broadcasts
+from app.socket.message_queue import message_queue_options
+from app.socket.serializer import serializer_options
+from app.socket.coalescer import room_events
 from config import Config
 
 def create_app():
@@ -14,16 +26,43 @@ def create_app():
     app = Flask(__name__)
     CORS(app)  # Enable CORS for all routes
     
-    # Create SocketIO instance
-    socketio = SocketIO(app, cors_allowed_origins="*")
+    # Attach the shared SocketIO instance; with SOCKETIO_MESSAGE_QUEUE set, emits
+    # from any backend process reach clients connected to every other process
+    socketio.init_app(
+        app,
+        cors_allowed_origins="*",
+        async_mode=Config.SOCKETIO_ASYNC_MODE,
+        **message_queue_options(Config.SOCKETIO_MESSAGE_QUEUE, Config.SOCKETIO_CHANNEL),
+        **serializer_options(Config.SOCKETIO_SERIALIZER)
+    )
     
-    # Initialize database tables if they don't exist
-    Base.metadata.create_all(Config.engine)
+    # Make sure the database schema matches the latest migration
+    check_schema_version(Config.engine, auto_migrate=Config.DB_AUTO_MIGRATE)
     
     # Register routes and socket events
     register_api_routes(app)
     register_webrtc_routes(app, socketio)
+    register_metrics_routes(app, socketio)
+    register_admin_routes(app, socketio)
     register_socket_events(socketio)
     
+    # Batch room broadcasts per tick (disabled when EMIT_COALESCE_MS is 0)
+    room_events.init_app(socketio, Config.EMIT_COALESCE_MS)
+    
+    # Start write-behind flushing of presence toggles and chat messages
+    presence_store.start(socketio)
+    chat_ingest.start(socketio)
+    
+    # Track health and load of every SFU node for session placement
+    sfu_cluster.start(socketio)
+    
+    # Sample loss, bitrate and RTT of every tracked SFU object
+    sfu_stats.start(socketio)
+    
+    # Announce who is speaking in each room
+    active_speakers.start(socketio)
+    recordings.init_app(socketio)
+    broadcasts.init_app(socketio)
+    
     return app, socketio
 
@@ -0,0 +1,39 @@
+import time
+
+from flask_socketio import SocketIO
+
+from app.services import timing
+from app.services.metrics import metrics
+from app.socket.serializer import NegotiatedPacket, NegotiatingServer
+
+
+class InstrumentedSocketIO(SocketIO):
+    """SocketIO that records handler latency and emit counts per event"""
+
+    def _handle_event(self, handler, message, namespace, sid, *args):
+        labels = (('event', message),)
+        start = time.perf_counter()
+        try:
+            return super()._handle_event(handler, message, namespace, sid, *args)
+        except Exception:
+            metrics.inc('socketio_event_errors_total', labels)
+            raise
+        finally:
+            metrics.observe('socketio_event_duration_seconds', labels, time.perf_counter() - start)
+
+    def init_app(self, app, **kwargs):
+        super().init_app(app, **kwargs)
+        if self.server.packet_class is NegotiatedPacket:
+            # Flask-SocketIO always builds a plain socketio.Server; switch it to
+            # the one that encodes per client before any client connects
+            self.server.__class__ = NegotiatingServer
+
+    def emit(self, event, *args, **kwargs):
+        metrics.inc('socketio_emits_total', (('event', event),))
+        with timing.span('emit'):
+            return super().emit(event, *args, **kwargs)
+
+
+# Single SocketIO instance shared by the REST routes and socket handlers.
+# It is attached to the app (and to the message queue, if any) in create_app().
+socketio = InstrumentedSocketIO()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Table, Text
+from sqlalchemy import Column, String, Boolean, DateTime, Integer, ForeignKey, Table, Text, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -11,7 +11,9 @@ session_participants = Table(
     'session_participants',
     Base.metadata,
     Column('session_id', String, ForeignKey('sessions.session_id'), primary_key=True),
-    Column('user_id', String, ForeignKey('users.user_id'), primary_key=True)
+    Column('user_id', String, ForeignKey('users.user_id'), primary_key=True),
+    Column('in_roster', Boolean, nullable=False, default=False, server_default=text('false')),  # join recorded in the shared roster
+    Index('ix_session_participants_user_id', 'user_id', 'session_id')
 )
 
 class User(Base):
@@ -48,12 +50,25 @@ class Session(Base):
     shared_screen = Column(String, nullable=True)  # user_id of user sharing screen
     is_livestreaming = Column(Boolean, default=False)
     recording_url = Column(String, nullable=True)
-    producer_id = Column(String, nullable=True)  # Stores mediasoup producer ID
+    sfu_node = Column(String, nullable=True)  # base URL of the SFU node hosting the session
+    sfu_worker = Column(Integer, nullable=True)  # mediasoup worker index hosting the session
+    sfu_router_id = Column(String, nullable=True)  # mediasoup router created for the session
+    sfu_edge_node = Column(String, nullable=True)  # second SFU node serving overflow viewers
+    sfu_edge_router_id = Column(String, nullable=True)  # router on the edge node, fed through pipe transports
+    roster_version = Column(Integer, nullable=False, default=0, server_default='0')  # roster changes so far, in multi-process mode
+    
+    # Partial index covering only live sessions (get_active_sessions)
+    __table_args__ = (
+        Index('ix_sessions_live', 'created_at',
+              postgresql_where=text('is_active AND is_livestreaming'),
+              sqlite_where=text('is_active AND is_livestreaming')),
+    )
     
     # Relationships
     teacher = relationship("User", foreign_keys=[teacher_id])
     participants = relationship("User", secondary=session_participants, backref="sessions")
     messages = relationship("Message", back_populates="session", cascade="all, delete-orphan")
+    producers = relationship("Producer", back_populates="session", cascade="all, delete-orphan")
     
     def add_participant(self, user):
         """Add a participant to the session"""
@@ -81,13 +96,22 @@ class Session(Base):
         self.is_livestreaming = True
     
     def stop_livestream(self):
-        """Stop the livestream session"""
+        """Stop the livestream session (its producers are closed separately)"""
         self.is_livestreaming = False
-        self.producer_id = None  # Clear producer ID when livestream stops
     
-    def set_producer_id(self, producer_id):
-        """Set the mediasoup producer ID for the session"""
-        self.producer_id = producer_id
+    def assign_router(self, node_id, worker_index, router_id):
+        """Record the SFU node, mediasoup worker and router hosting the session"""
+        self.sfu_node = node_id
+        self.sfu_worker = worker_index
+        self.sfu_router_id = router_id
+    
+    def clear_router(self):
+        """Forget the session's mediasoup routers"""
+        self.sfu_node = None
+        self.sfu_worker = None
+        self.sfu_router_id = None
+        self.sfu_edge_node = None
+        self.sfu_edge_router_id = None
     
     def to_dict(self):
         """Convert session to dictionary for JSON serialization"""
@@ -100,7 +124,43 @@ class Session(Base):
             'participants': self.get_participant_list(),
             'isLivestreaming': self.is_livestreaming,
             'recordingUrl': self.recording_url,
-            'producerId': self.producer_id
+            'producers': [p.to_dict() for p in self.producers if p.state != Producer.CLOSED],
+            'routerId': self.sfu_router_id
+        }
+
+class Producer(Base):
+    __tablename__ = 'producers'
+    
+    LIVE = 'live'
+    PAUSED = 'paused'
+    CLOSED = 'closed'
+    
+    producer_id = Column(String, primary_key=True)  # mediasoup producer ID
+    session_id = Column(String, ForeignKey('sessions.session_id'), nullable=False)
+    user_id = Column(String, ForeignKey('users.user_id'), nullable=True)
+    kind = Column(String, nullable=False)  # audio or video
+    source = Column(String, nullable=False, default='camera')  # camera, mic or screen
+    state = Column(String, nullable=False, default=LIVE)  # live, paused or closed
+    sfu_node = Column(String, nullable=True)  # SFU node holding the producer
+    created_at = Column(DateTime, nullable=False)
+    closed_at = Column(DateTime, nullable=True)
+    
+    # Live producers of a session (late joiners, teardown) in one index scan
+    __table_args__ = (
+        Index('ix_producers_session_state', 'session_id', 'state', 'kind', 'source'),
+    )
+    
+    # Relationships
+    session = relationship("Session", back_populates="producers")
+    
+    def to_dict(self):
+        """Convert producer to dictionary for JSON serialization"""
+        return {
+            'id': self.producer_id,
+            'kind': self.kind,
+            'source': self.source,
+            'userId': self.user_id,
+            'paused': self.state == self.PAUSED
         }
 
 class Message(Base):
@@ -115,6 +175,11 @@ class Message(Base):
     is_question = Column(Boolean, default=False)
     answered = Column(Boolean, default=False)
     
+    # Keyset index for paging a session's chat history by (timestamp, message_id)
+    __table_args__ = (
+        Index('ix_messages_session_timestamp', 'session_id', 'timestamp', 'message_id'),
+    )
+    
     # Relationships
     session = relationship("Session", back_populates="messages")
     user = relationship("User")
@@ -0,0 +1,61 @@
+import logging
+import os
+
+from alembic import command
+from alembic.config import Config as AlembicConfig
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ALEMBIC_INI = os.path.join(BACKEND_DIR, 'alembic.ini')
+
+
+class SchemaVersionError(RuntimeError):
+    """Raised when the database schema is not at the latest migration"""
+
+
+def alembic_config():
+    """Return the Alembic configuration for this backend"""
+    config = AlembicConfig(ALEMBIC_INI)
+    config.set_main_option('script_location', os.path.join(BACKEND_DIR, 'migrations'))
+    config.attributes['configure_logger'] = False
+    return config
+
+
+def head_revision():
+    """Return the newest migration revision"""
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def current_revision(engine):
+    """Return the revision the database is stamped with, or None"""
+    with engine.connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision()
+
+
+def check_schema_version(engine, auto_migrate=False):
+    """Verify the database is at the latest migration, upgrading it if allowed
+
+    Raises SchemaVersionError when the schema is behind and auto_migrate is
+    off, so the app never runs against a schema it doesn't match.
+    """
+    head = head_revision()
+    current = current_revision(engine)
+    if current == head:
+        logger.info(f"Database schema is at revision {current}")
+        return current
+
+    if not auto_migrate:
+        raise SchemaVersionError(
+            f"Database schema is at revision {current or 'none'} but the code expects {head}. "
+            f"Run 'alembic upgrade head' from the backend directory or set DB_AUTO_MIGRATE=true."
+        )
+
+    logger.info(f"Upgrading database schema from {current or 'empty'} to {head}")
+    config = alembic_config()
+    with engine.begin() as connection:
+        config.attributes['connection'] = connection
+        command.upgrade(config, 'head')
+    return head
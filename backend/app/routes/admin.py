@@ -0,0 +1,46 @@
+from flask import Blueprint, request, jsonify
+import hmac
+import logging
+from app.services.profiler import profiler, ProfilerBusyError
+from config import Config
+
+admin_bp = Blueprint('admin', __name__)
+logger = logging.getLogger(__name__)
+
+def register_admin_routes(app, socketio):
+    app.register_blueprint(admin_bp)
+    admin_bp.socketio = socketio
+
+def _is_admin():
+    """Check the request's bearer token against ADMIN_TOKEN"""
+    if not Config.ADMIN_TOKEN:
+        return False
+    header = request.headers.get('Authorization', '')
+    token = header[7:] if header.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+    return hmac.compare_digest(token.encode(), Config.ADMIN_TOKEN.encode())
+
+@admin_bp.route('/api/admin/profile', methods=['POST'])
+def run_profile():
+    """Sample every thread for a fixed window and return the aggregated profile"""
+    if not _is_admin():
+        return jsonify({'error': 'Admin token required', 'success': False}), 403
+    
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'error': 'seconds and limit must be numbers', 'success': False}), 400
+    
+    if not 0 < seconds <= Config.PROFILER_MAX_SECONDS:
+        return jsonify({
+            'error': f"seconds must be between 0 and {Config.PROFILER_MAX_SECONDS:g}",
+            'success': False
+        }), 400
+    
+    logger.info(f"Profiling for {seconds:g}s requested by {request.remote_addr}")
+    try:
+        profile = profiler.profile(seconds, sleep=admin_bp.socketio.sleep, limit=max(1, limit))
+    except ProfilerBusyError as e:
+        return jsonify({'error': str(e), 'success': False}), 409
+    
+    return jsonify({'profile': profile, 'success': True})
@@ -1,15 +1,35 @@
-from flask import Flask, jsonify, request, Blueprint
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask import Flask, jsonify, request, Blueprint, send_from_directory
+import os
 import uuid
 from datetime import datetime
 import logging
-from sqlalchemy import text
+from sqlalchemy import text, func, and_
 from sqlalchemy.orm import Session as SQLSession
 from sqlalchemy.exc import SQLAlchemyError, OperationalError
-from app.models.models import Session, User, Message
+from app.models.models import Session, User, Message, session_participants
+from app.extensions import socketio
+from app.socket.coalescer import room_events
+from app.services.mediasoup_client import mediasoup_client, MediasoupError
+from app.socket.workers import sfu_workers
+from app.services.presence import presence_store
+from app.services.chat_history import fetch_page
+from app.services.producers import (live_producers, close_session_producers, producer_in_session, start_producer,
+                                    producer_event)
+from app.services.cache import active_sessions_cache, session_info_cache, get_session_info
+from app.services.chat_ingest import chat_ingest, ChatBackpressureError
+from app.services import timing
+from app.services.sfu_placement import sfu_placement
+from app.services.sfu_cluster import sfu_cluster
+from app.services.rtp_capabilities import rtp_capabilities
+from app.services.layer_policy import layer_policy
+from app.services.sfu_stats import sfu_stats
+from app.services.active_speakers import active_speakers
+from app.services.recording import recordings
+from app.services.hls import broadcasts
+from app.services.roster import rosters
+from app.socket.serializer import offered_serializers
 from config import Config
 import traceback
-import requests
 import pytz
 
 logger = logging.getLogger(__name__)
@@ -17,15 +37,8 @@ logger = logging.getLogger(__name__)
 # Create Blueprint
 api_bp = Blueprint('api', __name__)
 
-# Initialize SocketIO (will be attached in run.py)
-socketio = SocketIO(cors_allowed_origins="http://127.0.0.1:8000")
-
-# Mediasoup server URL
-MEDIASOUP_SERVER_URL = "http://127.0.0.1:3000"
-
 def register_api_routes(app):
     app.register_blueprint(api_bp)
-    socketio.init_app(app)
 
 def handle_db_error(error, operation):
     """Handle database errors consistently"""
@@ -45,6 +58,11 @@ def handle_db_error(error, operation):
             'success': False
         }), 500
 
+@api_bp.route('/api/socketio-serializers', methods=['GET'])
+def socketio_serializers():
+    """Socket.IO serializers a client may ask for with ?serializer=, preferred first"""
+    return jsonify({'serializers': offered_serializers(Config.SOCKETIO_SERIALIZER), 'success': True})
+
 @api_bp.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -55,6 +73,15 @@ def health_check():
         return jsonify({
             'status': 'healthy',
             'database': 'connected',
+            'mediasoup': mediasoup_client.stats(),
+            'sfuNodes': sfu_cluster.stats(),
+            'rtpCapabilities': rtp_capabilities.stats(),
+            'layers': layer_policy.stats(),
+            'sfuStats': sfu_stats.stats(),
+            'activeSpeakers': active_speakers.stats(),
+            'recordings': recordings.stats(),
+            'broadcasts': broadcasts.stats(),
+            'rosters': rosters.stats(),
             'timestamp': datetime.now(pytz.UTC).isoformat()
         })
     except Exception as e:
@@ -68,12 +95,9 @@ def health_check():
 
 @api_bp.route('/api/router-capabilities', methods=['GET'])
 def router_capabilities():
-    """Fetch mediasoup router RTP capabilities"""
+    """Fetch RTP capabilities of the session's mediasoup router"""
     try:
-        response = requests.get(f"{MEDIASOUP_SERVER_URL}/router-capabilities")
-        if response.status_code != 200:
-            raise Exception("Failed to fetch router capabilities")
-        return jsonify(response.json())
+        return jsonify({'rtpCapabilities': sfu_placement.capabilities(request.args.get('sessionId'))})
     except Exception as e:
         logger.error(f"Error fetching router capabilities: {str(e)}")
         return jsonify({'error': str(e), 'success': False}), 500
@@ -170,50 +194,41 @@ def join_session():
                     is_teacher=is_teacher
                 )
                 db_session.add(user)
+                db_session.flush()
                 
-                session.add_participant(user)
+                # The user is new, so insert the link row directly rather than
+                # loading every participant through session.participants
+                db_session.execute(session_participants.insert().values(session_id=session_id, user_id=user_id))
                 
                 # If the joining user is a teacher, reset the livestream state
                 if is_teacher:
                     if session.is_livestreaming:
-                        # Check if the producer is still active on mediasoup server
-                        if session.producer_id:
-                            try:
-                                response = requests.post(f"{MEDIASOUP_SERVER_URL}/closeProducer", json={
-                                    'producerId': session.producer_id
-                                })
-                                if response.status_code == 200:
-                                    logger.info(f"Closed stale producer {session.producer_id} for session {session_id}")
-                                    socketio.emit('producerClosed', {'producerId': session.producer_id}, room=session_id)
-                            except Exception as e:
-                                logger.error(f"Error closing stale producer: {str(e)}")
+                        # Close the previous stream's producers on the mediasoup server
+                        for closed_id in close_session_producers(db_session, session_id):
+                            logger.info(f"Closed stale producer {closed_id} for session {session_id}")
+                            socketio.emit('producerClosed', {'producerId': closed_id}, room=session_id)
                         session.stop_livestream()  # Reset the livestream state
                         logger.info(f"Reset livestream state for session {session_id} as teacher rejoined")
                 
+                # Place the session on a mediasoup router if it has none yet
+                try:
+                    sfu_placement.assign(session)
+                except MediasoupError as e:
+                    logger.error(f"Could not place session {session_id} on a router: {str(e)}")
+                
                 db_session.commit()
+                active_sessions_cache.invalidate()
                 
                 db_session.refresh(session)
-                
-                participants = session.get_participant_list()
-                messages = [msg.to_dict() for msg in session.messages]
+                joined = rosters.join(db_session, session_id, user)
+                snapshot = _session_snapshot(db_session, session)
                 
                 logger.info(f"User {user_id} ({user_name}) joined session {session_id}")
                 
-                # Emit user_joined event to all clients in the session
-                socketio.emit('user_joined', {
-                    'userId': user_id,
-                    'name': user_name,
-                    'isTeacher': is_teacher
-                }, room=session_id)
+                # Emit user_joined event (tagged with the roster version) to all clients in the session
+                room_events.emit('user_joined', joined, room=session_id)
                 
-                return jsonify({
-                    'sessionId': session_id,
-                    'userId': user_id,
-                    'participants': participants,
-                    'messages': messages,
-                    'isLivestreaming': session.is_livestreaming,
-                    'success': True
-                })
+                return jsonify({**snapshot, 'userId': user_id, 'success': True})
         
         except SQLAlchemyError as e:
             return handle_db_error(e, 'join_session')
@@ -227,6 +242,24 @@ def join_session():
             'success': False
         }), 500
     
+def _session_snapshot(db_session, session):
+    """Participants, latest chat page and stream state for a joining client"""
+    with timing.span('serialize'):
+        roster_epoch, roster_version, participants = rosters.snapshot(db_session, session.session_id)
+        messages, messages_cursor = fetch_page(db_session, session.session_id, Config.CHAT_HISTORY_PAGE_SIZE)
+        producers = [p.to_dict() for p in live_producers(db_session, session.session_id)]
+    return {
+        'sessionId': session.session_id,
+        'participants': participants,
+        'rosterEpoch': roster_epoch,
+        'rosterVersion': roster_version,
+        'messages': messages,
+        'messagesCursor': messages_cursor,
+        'isLivestreaming': session.is_livestreaming,
+        'producers': producers,
+        'routerId': session.sfu_router_id
+    }
+
 @api_bp.route('/api/leave-session', methods=['POST'])
 def leave_session():
     """Leave a video conference session and clean up mediasoup resources if session ends"""
@@ -251,43 +284,61 @@ def leave_session():
                 if not user:
                     return jsonify({'error': 'User not found', 'success': False}), 404
                 
-                session.remove_participant(user_id)
+                db_session.execute(session_participants.delete().where(and_(
+                    session_participants.c.session_id == session_id,
+                    session_participants.c.user_id == user_id
+                )))
+                remaining, teachers = db_session.query(
+                    func.count(User.user_id), func.count(User.user_id).filter(User.is_teacher)
+                ).join(session_participants, session_participants.c.user_id == User.user_id).filter(
+                    session_participants.c.session_id == session_id
+                ).one()
                 
                 should_cleanup = False
                 if user.is_teacher:
-                    teacher_still_present = any(u.is_teacher for u in session.get_participants())
-                    if not teacher_still_present:
+                    if not teachers:
                         session.is_active = False
                         session.stop_livestream()
                         should_cleanup = True
                 
-                if len(session.get_participants()) == 0:
+                if remaining == 0:
                     session.is_active = False
                     should_cleanup = True
                     logger.info(f"Session {session_id} marked inactive as it's empty")
                 
-                if should_cleanup and session.producer_id:
-                    try:
-                        response = requests.post(f"{MEDIASOUP_SERVER_URL}/closeProducer", json={
-                            'producerId': session.producer_id
-                        })
-                        if response.status_code != 200:
-                            logger.error(f"Failed to close producer {session.producer_id} on mediasoup server")
-                        else:
-                            socketio.emit('producerClosed', {'producerId': session.producer_id}, room=session_id)
-                    except Exception as e:
-                        logger.error(f"Error closing producer on mediasoup server: {str(e)}")
+                # Close everything the user opened on the SFU in one batched call, then
+                # the user's (or, when the session ends, everyone's) remaining producers
+                closed_producers = close_session_producers(
+                    db_session, session_id,
+                    user_id=None if should_cleanup else user_id,
+                    already_closed=sfu_placement.close_user(user_id, session_id)
+                )
+                for closed_id in closed_producers:
+                    socketio.emit('producerClosed', {'producerId': closed_id}, room=session_id)
+                
+                if should_cleanup:
+                    sfu_placement.release(session)
+                    active_speakers.forget_session(session_id)
                 
                 # Ensure teacher's livestream state is reset
                 if user.is_teacher:
                     user.is_streaming = False
                 
                 db_session.commit()
+                active_sessions_cache.invalidate()
+                session_info_cache.invalidate(session_id)
+                presence_store.sync(user_id, is_streaming=False)
+                presence_store.discard(user_id)
+                left = rosters.leave(db_session, session_id, user_id)
+                if should_cleanup:
+                    recordings.stop(session_id)
+                    broadcasts.stop(session_id)
+                    rosters.forget(session_id)
                 
                 logger.info(f"User {user_id} left session {session_id}")
                 
-                # Emit user_left event
-                socketio.emit('user_left', {'userId': user_id}, room=session_id)
+                # Emit user_left event (tagged with the roster version)
+                room_events.emit('user_left', left, room=session_id)
                 
                 return jsonify({'success': True})
         
@@ -317,21 +368,19 @@ def raise_hand():
             return jsonify({'error': 'Session ID and User ID are required', 'success': False}), 400
         
         try:
-            with SQLSession(Config.engine) as db_session:
-                user = db_session.query(User).filter_by(user_id=user_id).first()
-                if not user:
-                    return jsonify({'error': 'User not found', 'success': False}), 404
-                
-                user.hand_raised = is_raised
-                db_session.commit()
-                
-                # Emit hand_raised event
-                socketio.emit('hand_raised', {
-                    'userId': user_id,
-                    'isRaised': is_raised
-                }, room=session_id)
-                
-                return jsonify({'success': True})
+            if not presence_store.ensure(user_id):
+                return jsonify({'error': 'User not found', 'success': False}), 404
+            
+            # Persisted by the presence store's write-behind flush
+            presence_store.update(user_id, hand_raised=is_raised)
+            
+            # Emit hand_raised event
+            room_events.emit('hand_raised', {
+                'userId': user_id,
+                'isRaised': is_raised
+            }, room=session_id)
+            
+            return jsonify({'success': True})
         
         except SQLAlchemyError as e:
             return handle_db_error(e, 'raise_hand')
@@ -354,7 +403,10 @@ def send_message():
         is_question = data.get('isQuestion', False)
         timestamp = data.get('timestamp')
         if isinstance(timestamp, str):
-            timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+            try:
+                timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+            except ValueError:
+                return jsonify({'error': 'timestamp must be an ISO 8601 date and time', 'success': False}), 400
         else:
             timestamp = datetime.now(pytz.UTC)
         
@@ -364,43 +416,112 @@ def send_message():
                 'success': False
             }), 400
         
+        try:
+            # Validate against cached info instead of querying Session and User per message
+            session_info = get_session_info(session_id)
+            user = presence_store.ensure(user_id)
+            
+            if not session_info or not user:
+                return jsonify({'error': 'Session or user not found', 'success': False}), 404
+            
+            if not session_info['isActive']:
+                return jsonify({'error': 'Session is no longer active', 'success': False}), 400
+            
+            row = {
+                'message_id': str(uuid.uuid4()),
+                'user_id': user_id,
+                'user_name': user['name'],
+                'content': message_text.strip(),
+                'timestamp': timestamp,
+                'session_id': session_id,
+                'is_question': is_question,
+                'answered': False
+            }
+            
+            # Persisted by the group-commit writer (see app/services/chat_ingest.py)
+            try:
+                chat_ingest.submit(row)
+            except ChatBackpressureError as e:
+                logger.warning(f"Rejecting message in session {session_id}: {str(e)}")
+                return jsonify({
+                    'error': 'Chat is busy, please retry',
+                    'success': False
+                }), 503, {'Retry-After': '1'}
+            
+            message_dict = Message(**row).to_dict()
+            
+            # Emit new_message event
+            room_events.emit('new_message', message_dict, room=session_id)
+            
+            return jsonify({
+                'success': True,
+                'message': message_dict
+            })
+        
+        except SQLAlchemyError as e:
+            return handle_db_error(e, 'send_message')
+    
+    except Exception as e:
+        logger.error(f"Unexpected error in send_message: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+@api_bp.route('/api/sessions/<session_id>/messages', methods=['GET'])
+def get_message_history(session_id):
+    """Page backward through a session's chat history"""
+    try:
+        before = request.args.get('before')
+        try:
+            limit = int(request.args.get('limit', Config.CHAT_HISTORY_PAGE_SIZE))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer', 'success': False}), 400
+        limit = max(1, min(limit, Config.CHAT_HISTORY_MAX_PAGE_SIZE))
+        
         try:
             with SQLSession(Config.engine) as db_session:
-                session = db_session.query(Session).filter_by(session_id=session_id).first()
-                user = db_session.query(User).filter_by(user_id=user_id).first()
-                
-                if not session or not user:
-                    return jsonify({'error': 'Session or user not found', 'success': False}), 404
-                
-                msg_id = str(uuid.uuid4())
-                message = Message(
-                    message_id=msg_id,
-                    user_id=user_id,
-                    user_name=user.name,
-                    content=message_text.strip(),
-                    timestamp=timestamp,
-                    session_id=session_id,
-                    is_question=is_question
-                )
-                
-                db_session.add(message)
-                db_session.commit()
-                
-                message_dict = message.to_dict()
+                if not db_session.get(Session, session_id):
+                    return jsonify({'error': 'Session not found', 'success': False}), 404
                 
-                # Emit new_message event
-                socketio.emit('new_message', message_dict, room=session_id)
+                try:
+                    messages, next_cursor = fetch_page(db_session, session_id, limit, before=before)
+                except ValueError as e:
+                    return jsonify({'error': str(e), 'success': False}), 400
                 
                 return jsonify({
-                    'success': True,
-                    'message': message_dict
+                    'messages': messages,
+                    'nextCursor': next_cursor,
+                    'success': True
                 })
         
         except SQLAlchemyError as e:
-            return handle_db_error(e, 'send_message')
+            return handle_db_error(e, 'get_message_history')
     
     except Exception as e:
-        logger.error(f"Unexpected error in send_message: {str(e)}")
+        logger.error(f"Unexpected error in get_message_history: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+@api_bp.route('/api/sessions/<session_id>/roster', methods=['GET'])
+def get_roster(session_id):
+    """Roster changes after ?since=<version> of ?epoch=<epoch>, or the whole roster"""
+    try:
+        since = request.args.get('since')
+        try:
+            since = int(since) if since is not None else None
+        except ValueError:
+            return jsonify({'error': 'since must be an integer', 'success': False}), 400
+
+        try:
+            with SQLSession(Config.engine) as db_session:
+                if not db_session.get(Session, session_id):
+                    return jsonify({'error': 'Session not found', 'success': False}), 404
+
+                roster = rosters.since(db_session, session_id, since, request.args.get('epoch'))
+                return jsonify({**roster, 'success': True})
+
+        except SQLAlchemyError as e:
+            return handle_db_error(e, 'get_roster')
+
+    except Exception as e:
+        logger.error(f"Unexpected error in get_roster: {str(e)}")
         return jsonify({'error': 'Internal server error', 'success': False}), 500
 
 @api_bp.route('/api/start-livestream', methods=['POST'])
@@ -429,21 +550,20 @@ def start_livestream():
                     return jsonify({'error': 'Only teachers can start livestream', 'success': False}), 403
                 
                 if session.is_livestreaming:
-                    # Check if the producer is still active on mediasoup server
-                    if session.producer_id:
-                        try:
-                            response = requests.post(f"{MEDIASOUP_SERVER_URL}/closeProducer", json={
-                                'producerId': session.producer_id
-                            })
-                            if response.status_code == 200:
-                                logger.info(f"Closed stale producer {session.producer_id} for session {session_id}")
-                                socketio.emit('producerClosed', {'producerId': session.producer_id}, room=session_id)
-                            session.producer_id = None  # Clear the producer ID
-                        except Exception as e:
-                            logger.error(f"Error closing stale producer: {str(e)}")
+                    # Close the previous stream's producers on the mediasoup server
+                    for closed_id in close_session_producers(db_session, session_id):
+                        logger.info(f"Closed stale producer {closed_id} for session {session_id}")
+                        socketio.emit('producerClosed', {'producerId': closed_id}, room=session_id)
                     session.stop_livestream()  # Reset the livestream state
                     logger.info(f"Reset livestream state for session {session_id} to allow new stream")
                 
+                # Stream through the session's own router, re-creating it if the SFU lost it
+                try:
+                    sfu_placement.assign(session, verify=True)
+                except MediasoupError as e:
+                    logger.error(f"Could not place session {session_id} on a router: {str(e)}")
+                    return jsonify({'error': 'Media server unavailable', 'success': False}), 503
+                
                 session.start_livestream()
                 user.is_streaming = True
                 
@@ -451,13 +571,38 @@ def start_livestream():
                     session.created_at = datetime.now(pytz.UTC)
                 
                 db_session.commit()
+                active_sessions_cache.invalidate()
+                presence_store.sync(user_id, is_streaming=True)
                 
                 logger.info(f"Livestream started in session {session_id} by teacher {user_id}")
                 
+                # Optionally record the stream; producers join the recording as they are created
+                recording = None
+                if data.get('record'):
+                    try:
+                        recording = recordings.start(session_id, [])
+                    except (MediasoupError, OSError) as e:
+                        logger.error(f"Failed to start recording session {session_id}: {str(e)}")
+                
+                # In broadcast mode viewers pull HLS instead of consuming from the SFU
+                broadcasts.stop(session_id)
+                broadcast = None
+                if data.get('mode') == 'hls':
+                    try:
+                        broadcast = broadcasts.start(session_id)
+                    except (MediasoupError, OSError) as e:
+                        logger.error(f"Failed to start HLS broadcast of session {session_id}: {str(e)}")
+                hls_url = broadcast.url if broadcast else None
+                
                 # Emit livestream_started event
-                socketio.emit('livestream_started', {}, room=session_id)
+                socketio.emit('livestream_started', {'hlsUrl': hls_url} if hls_url else {}, room=session_id)
                 
-                return jsonify({'success': True})
+                return jsonify({
+                    'routerId': session.sfu_router_id,
+                    'recording': recording is not None,
+                    'hlsUrl': hls_url,
+                    'success': True
+                })
         
         except SQLAlchemyError as e:
             return handle_db_error(e, 'start_livestream')
@@ -476,7 +621,7 @@ def stop_livestream():
         data = request.json
         session_id = data.get('sessionId')
         user_id = data.get('userId')
-        producer_id = data.get('producerId')  # Optional, as we can use session.producer_id
+        producer_id = data.get('producerId')  # Optional, the session's producers are closed anyway
         
         if not session_id or not user_id:
             return jsonify({'error': 'Session ID and User ID are required', 'success': False}), 400
@@ -495,25 +640,28 @@ def stop_livestream():
                 if not session.is_livestreaming:
                     return jsonify({'error': 'Livestream is not active', 'success': False}), 400
                 
+                if producer_id and not producer_in_session(db_session, session_id, producer_id):
+                    return jsonify({'error': 'Producer does not belong to this session', 'success': False}), 403
+                
                 session.stop_livestream()
                 user.is_streaming = False
                 
-                effective_producer_id = producer_id or session.producer_id
-                if effective_producer_id:
+                # Close all of the stream's producers (camera, mic, screen) in one batch
+                closed_producers = close_session_producers(db_session, session_id)
+                if producer_id and producer_id not in closed_producers:
                     try:
-                        response = requests.post(f"{MEDIASOUP_SERVER_URL}/closeProducer", json={
-                            'producerId': effective_producer_id
-                        })
-                        if response.status_code != 200:
-                            logger.error(f"Failed to close producer {effective_producer_id} on mediasoup server")
-                        else:
-                            socketio.emit('producerClosed', {'producerId': effective_producer_id}, room=session_id)
-                    except Exception as e:
-                        logger.error(f"Error closing producer on mediasoup server: {str(e)}")
-                
-                session.producer_id = None  # Clear the producer ID
+                        sfu_placement.close_producer(session_id, producer_id)
+                        closed_producers.append(producer_id)
+                    except MediasoupError as e:
+                        logger.error(f"Failed to close producer {producer_id} on mediasoup server: {str(e)}")
+                for closed_id in closed_producers:
+                    socketio.emit('producerClosed', {'producerId': closed_id}, room=session_id)
                 
                 db_session.commit()
+                active_sessions_cache.invalidate()
+                presence_store.sync(user_id, is_streaming=False)
+                recordings.stop(session_id)
+                broadcasts.stop(session_id)
                 
                 logger.info(f"Livestream stopped in session {session_id} by teacher {user_id}")
                 
@@ -529,6 +677,101 @@ def stop_livestream():
         logger.error(f"Unexpected error in stop_livestream: {str(e)}")
         return jsonify({'error': 'Internal server error', 'success': False}), 500
 
+@api_bp.route('/api/start-recording', methods=['POST'])
+def start_recording():
+    """Record the session's live producers (and those created later) to segmented files"""
+    try:
+        if not request.json:
+            return jsonify({'error': 'No JSON data provided', 'success': False}), 400
+        
+        data = request.json
+        session_id = data.get('sessionId')
+        user_id = data.get('userId')
+        
+        if not session_id or not user_id:
+            return jsonify({'error': 'Session ID and User ID are required', 'success': False}), 400
+        
+        try:
+            with SQLSession(Config.engine) as db_session:
+                session = db_session.query(Session).filter_by(session_id=session_id).first()
+                user = db_session.query(User).filter_by(user_id=user_id).first()
+                
+                if not session or not user:
+                    return jsonify({'error': 'Session or user not found', 'success': False}), 404
+                
+                if not user.is_teacher:
+                    return jsonify({'error': 'Only teachers can record a session', 'success': False}), 403
+                
+                if not session.is_livestreaming:
+                    return jsonify({'error': 'Livestream is not active', 'success': False}), 400
+                
+                producer_ids = [p.producer_id for p in live_producers(db_session, session_id)]
+        
+        except SQLAlchemyError as e:
+            return handle_db_error(e, 'start_recording')
+        
+        try:
+            recording = recordings.start(session_id, producer_ids)
+        except (MediasoupError, OSError) as e:
+            logger.error(f"Failed to start recording session {session_id}: {str(e)}")
+            return jsonify({'error': 'Could not start recording', 'success': False}), 503
+        
+        return jsonify({'recordingId': recording.recording_id, 'recordingUrl': recording.url, 'success': True})
+    
+    except Exception as e:
+        logger.error(f"Unexpected error in start_recording: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+@api_bp.route('/api/stop-recording', methods=['POST'])
+def stop_recording():
+    """Stop recording the session and finalize its last segment"""
+    try:
+        if not request.json:
+            return jsonify({'error': 'No JSON data provided', 'success': False}), 400
+        
+        data = request.json
+        session_id = data.get('sessionId')
+        user_id = data.get('userId')
+        
+        try:
+            with SQLSession(Config.engine) as db_session:
+                user = db_session.query(User).filter_by(user_id=user_id).first()
+                if not user or not user.is_teacher:
+                    return jsonify({'error': 'Only teachers can stop a recording', 'success': False}), 403
+        except SQLAlchemyError as e:
+            return handle_db_error(e, 'stop_recording')
+        
+        recording = recordings.stop(session_id)
+        if recording is None:
+            return jsonify({'error': 'Session is not being recorded', 'success': False}), 400
+        
+        return jsonify({
+            'recordingId': recording.recording_id,
+            'recordingUrl': recording.url,
+            'segments': len(recording.segments),
+            'success': True
+        })
+    
+    except Exception as e:
+        logger.error(f"Unexpected error in stop_recording: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+@api_bp.route('/api/recordings/<session_id>/<recording_id>/<path:filename>', methods=['GET'])
+def get_recording_file(session_id, recording_id, filename):
+    """A recording's index.json or one of its segments"""
+    directory = os.path.join(os.path.abspath(Config.RECORDING_DIR), session_id, recording_id)
+    return send_from_directory(directory, filename)
+
+@api_bp.route('/api/hls/<session_id>/<broadcast_id>/<path:filename>', methods=['GET'])
+def get_hls_file(session_id, broadcast_id, filename):
+    """A broadcast's live playlist (revalidated every time) or one of its segments (immutable)"""
+    directory = os.path.join(os.path.abspath(Config.HLS_DIR), session_id, broadcast_id)
+    if filename.endswith('.m3u8'):
+        return send_from_directory(directory, filename, max_age=0)
+    response = send_from_directory(directory, filename, max_age=86400)
+    response.cache_control.immutable = True  # segment names are never reused within a broadcast
+    return response
+
 @api_bp.route('/api/mark-question-answered', methods=['POST'])
 def mark_question_answered():
     """Mark a question as answered"""
@@ -545,11 +788,17 @@ def mark_question_answered():
         
         try:
             with SQLSession(Config.engine) as db_session:
-                message = db_session.query(Message).filter_by(
+                query = db_session.query(Message).filter_by(
                     message_id=message_id, 
                     session_id=session_id,
                     is_question=True
-                ).first()
+                )
+                message = query.first()
+                
+                if not message and chat_ingest.pending():
+                    # The question may still be waiting in the ingestion queue
+                    chat_ingest.flush()
+                    message = query.first()
                 
                 if not message:
                     return jsonify({'error': 'Question not found', 'success': False}), 404
@@ -558,7 +807,7 @@ def mark_question_answered():
                 db_session.commit()
                 
                 # Emit question_answered event
-                socketio.emit('question_answered', {'messageId': message_id}, room=session_id)
+                room_events.emit('question_answered', {'messageId': message_id}, room=session_id)
                 
                 return jsonify({'success': True})
         
@@ -569,32 +818,40 @@ def mark_question_answered():
         logger.error(f"Unexpected error in mark_question_answered: {str(e)}")
         return jsonify({'error': 'Internal server error', 'success': False}), 500
 
+def _load_active_sessions():
+    """Load live sessions with teacher name and participant count in one query"""
+    with SQLSession(Config.engine) as db_session:
+        rows = db_session.query(
+            Session.session_id,
+            Session.name,
+            Session.teacher_id,
+            User.name.label('teacher_name'),
+            func.count(session_participants.c.user_id).label('participant_count'),
+            Session.created_at
+        ).join(
+            User, User.user_id == Session.teacher_id
+        ).outerjoin(
+            session_participants, session_participants.c.session_id == Session.session_id
+        ).filter(
+            and_(Session.is_active, Session.is_livestreaming)  # matches the ix_sessions_live predicate
+        ).group_by(
+            Session.session_id, User.user_id
+        ).all()
+    
+    return [{
+        'sessionId': row.session_id,
+        'name': row.name,
+        'teacherId': row.teacher_id,
+        'teacherName': row.teacher_name,
+        'participantCount': row.participant_count,
+        'createdAt': row.created_at.isoformat() if row.created_at else None
+    } for row in rows]
+
 @api_bp.route('/api/get-active-sessions', methods=['GET'])
 def get_active_sessions():
     """Get list of active livestream sessions"""
     try:
-        active_streams = []
-        
-        with SQLSession(Config.engine) as db_session:
-            active_sessions = db_session.query(Session).filter_by(
-                is_active=True,
-                is_livestreaming=True
-            ).all()
-            
-            for session in active_sessions:
-                teacher = db_session.query(User).filter_by(user_id=session.teacher_id).first()
-                
-                if teacher:
-                    participant_count = len(session.participants)
-                    
-                    active_streams.append({
-                        'sessionId': session.session_id,
-                        'name': session.name,
-                        'teacherId': session.teacher_id,
-                        'teacherName': teacher.name,
-                        'participantCount': participant_count,
-                        'createdAt': session.created_at.isoformat() if session.created_at else None
-                    })
+        active_streams = active_sessions_cache.get_or_load('active_sessions', _load_active_sessions)
         
         return jsonify({
             'sessions': active_streams,
@@ -608,101 +865,147 @@ def get_active_sessions():
         logger.error(f"Unexpected error in get_active_sessions: {str(e)}")
         return jsonify({'error': 'Internal server error', 'success': False}), 500
 
-# SocketIO event handlers
-@socketio.on('join')
-def handle_join(data):
-    session_id = data.get('sessionId')
-    user_id = data.get('userId')
-    if session_id and user_id:
-        join_room(session_id)
-        logger.info(f"User {user_id} joined SocketIO room {session_id}")
-
-@socketio.on('leave')
-def handle_leave(data):
-    session_id = data.get('sessionId')
-    user_id = data.get('userId')
-    if session_id and user_id:
-        leave_room(session_id)
-        logger.info(f"User {user_id} left SocketIO room {session_id}")
-
-# ... (previous code remains unchanged)
+# SocketIO event handlers (room membership is handled in app/socket/events.py)
+
+# SFU handlers hand their blocking work to sfu_workers and return the ack payload
+# (Flask-SocketIO sends a handler's return value through the client's ack callback)
+
+def _sfu_call(route, data):
+    """Forward a transport-scoped call to the node that owns the transport (runs in a worker)"""
+    return sfu_placement.client_for_transport(data.get('transportId'), data.get('sessionId')).post(route, data)
+
+def _socket_owner(data):
+    """(user_id, session_id) for an SFU socket event: the payload's, else those bound on join"""
+    user_id, session_id = sfu_placement.resources.owner(request.sid) or (None, None)
+    return data.get('userId') or user_id, data.get('sessionId') or session_id
 
 @socketio.on('createProducerTransport')
-def handle_create_producer_transport(data=None, callback=None):
+def handle_create_producer_transport(data=None):
     try:
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/createProducerTransport").json()
-        if callback:
-            callback(response)
+        user_id, session_id = _socket_owner(data or {})
+        return sfu_workers.run(socketio.async_mode, sfu_placement.create_transport,
+                               '/createProducerTransport', session_id, user_id=user_id)
     except Exception as e:
         logger.error(f"Error creating producer transport: {str(e)}")
-        if callback:
-            callback({'error': str(e)})
+        return {'error': str(e)}
 
 @socketio.on('createConsumerTransport')
-def handle_create_consumer_transport(data=None, callback=None):
+def handle_create_consumer_transport(data=None):
     try:
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/createConsumerTransport").json()
-        if callback:
-            callback(response)
+        user_id, session_id = _socket_owner(data or {})
+        return sfu_workers.run(socketio.async_mode, sfu_placement.create_transport,
+                               '/createConsumerTransport', session_id, consumer=True, user_id=user_id)
     except Exception as e:
         logger.error(f"Error creating consumer transport: {str(e)}")
-        if callback:
-            callback({'error': str(e)})
-
-# ... (rest of the code remains unchanged)
+        return {'error': str(e)}
 
 @socketio.on('connectTransport')
-def handle_connect_transport(data, callback):
+def handle_connect_transport(data):
     try:
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/connectTransport", json=data).json()
-        if 'error' in response:
-            callback({'error': response['error']})
-        else:
-            callback({'success': True})
+        sfu_workers.run(socketio.async_mode, _sfu_call, '/connectTransport', data)
+        return {'success': True}
     except Exception as e:
         logger.error(f"Error connecting transport: {str(e)}")
-        callback({'error': str(e)})
+        return {'error': str(e)}
 
 @socketio.on('produce')
-def handle_produce(data, callback):
-    session_id = data.get('sessionId')
+def handle_produce(data):
+    user_id, session_id = _socket_owner(data)
     kind = data.get('kind')
-    user_id = data.get('userId')
     try:
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/produce", json={
-            'transportId': data['transportId'],
-            'kind': kind,
-            'rtpParameters': data['rtpParameters']
-        }).json()
-        if 'error' in response:
-            callback({'error': response['error']})
-        else:
-            producer_id = response['id']
-            # Update session with producer ID
-            with SQLSession(Config.engine) as db_session:
-                session = db_session.query(Session).filter_by(session_id=session_id).first()
-                if session:
-                    session.producer_id = producer_id
-                    db_session.commit()
-            # Notify other clients
-            socketio.emit('newProducer', {
-                'producerId': producer_id,
-                'kind': kind,
-                'userId': user_id
-            }, room=session_id)
-            callback({'id': producer_id})
+        producer_id = sfu_workers.run(
+            socketio.async_mode, start_producer,
+            session_id, user_id, data['transportId'], kind, data['rtpParameters'], data.get('source')
+        )
+        # Notify other clients
+        socketio.emit('newProducer', producer_event(producer_id, kind, data.get('source'), user_id), room=session_id)
+        return {'id': producer_id}
     except Exception as e:
         logger.error(f"Error producing: {str(e)}")
-        callback({'error': str(e)})
+        return {'error': str(e)}
+
+@socketio.on('register_rtp_capabilities')
+def handle_register_rtp_capabilities(data):
+    """Store the client's device capabilities once; later consumes refer to them by hash"""
+    rtp_caps = (data or {}).get('rtpCapabilities')
+    if not rtp_caps:
+        return {'error': 'rtpCapabilities are required'}
+    return {'capsHash': rtp_capabilities.register(rtp_caps, sid=request.sid)}
 
 @socketio.on('consume')
-def handle_consume(data, callback):
+def handle_consume(data):
     try:
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/consume", json=data).json()
-        if 'error' in response:
-            callback({'error': response['error']})
-        else:
-            callback(response)
+        user_id, session_id = _socket_owner(data)
+        if not data.get('rtpCapabilities') and not data.get('capsHash'):
+            data = dict(data, capsHash=rtp_capabilities.for_sid(request.sid))
+        return sfu_workers.run(socketio.async_mode, sfu_placement.consume, session_id, user_id, data)
+    except MediasoupError as e:
+        # 409 tells the client to register its capabilities again
+        logger.error(f"Error consuming: {str(e)}")
+        return {'error': str(e), 'status': e.status_code}
     except Exception as e:
         logger.error(f"Error consuming: {str(e)}")
-        callback({'error': str(e)})
\ No newline at end of file
+        return {'error': str(e)}
+
+@socketio.on('set_preferred_layers')
+def handle_set_preferred_layers(data):
+    """Pin a video consumer to a simulcast layer, or hand it back to the layer policy with null"""
+    try:
+        user_id, _ = _socket_owner(data)
+        spatial_layer = data.get('spatialLayer')
+        return sfu_workers.run(socketio.async_mode, sfu_placement.prefer_layers, user_id, data.get('consumerId'),
+                               None if spatial_layer is None else int(spatial_layer))
+    except MediasoupError as e:
+        return {'error': str(e), 'status': e.status_code}
+    except (TypeError, ValueError) as e:
+        return {'error': str(e), 'status': 400}
+
+@socketio.on('viewer_conditions')
+def handle_viewer_conditions(data):
+    """Downlink estimate (kbps) and video viewport height (px) reported by a viewer"""
+    try:
+        user_id, session_id = _socket_owner(data)
+        bandwidth_kbps = data.get('bandwidthKbps')
+        viewport_height = data.get('viewportHeight')
+        sfu_workers.run(socketio.async_mode, sfu_placement.report_viewer, session_id, user_id,
+                        None if bandwidth_kbps is None else float(bandwidth_kbps),
+                        None if viewport_height is None else int(viewport_height))
+        return {'success': True}
+    except (TypeError, ValueError) as e:
+        return {'error': str(e), 'status': 400}
+
+def _viewer_media(session_id, user_id):
+    """Router capabilities and a consumer transport for a viewer (runs in a worker)"""
+    return {
+        'rtpCapabilities': sfu_placement.capabilities(session_id),
+        'consumerTransport': sfu_placement.create_transport('/createConsumerTransport', session_id,
+                                                            consumer=True, user_id=user_id)
+    }
+
+@socketio.on('viewer_join')
+def handle_viewer_join(data):
+    """Everything a viewer needs before the first frame, in one round trip"""
+    user_id, session_id = _socket_owner(data)
+    try:
+        with SQLSession(Config.engine) as db_session:
+            session = db_session.query(Session).filter_by(session_id=session_id).first()
+            if not session or not session.is_active:
+                return {'error': 'Session not found or no longer active'}
+            is_participant = db_session.query(session_participants.c.user_id).filter(
+                session_participants.c.session_id == session_id,
+                session_participants.c.user_id == user_id
+            ).first()
+            if not is_participant:
+                return {'error': 'Join the session first'}
+            snapshot = _session_snapshot(db_session, session)
+        
+        # Broadcast viewers play the HLS playlist and need no SFU transport
+        hls_url = broadcasts.url(session_id)
+        if hls_url:
+            return {**snapshot, 'hlsUrl': hls_url, 'success': True}
+        
+        media = sfu_workers.run(socketio.async_mode, _viewer_media, session_id, user_id)
+        return {**snapshot, **media, 'success': True}
+    except Exception as e:
+        logger.error(f"Error in viewer join for session {session_id}: {str(e)}")
+        return {'error': str(e)}
@@ -0,0 +1,99 @@
+from flask import Blueprint, Response, g, request
+import time
+import logging
+from app.services import timing
+from app.services.metrics import metrics
+from app.services.chat_ingest import chat_ingest
+from app.services.sfu_cluster import sfu_cluster
+from app.services.sfu_placement import sfu_placement
+from config import Config
+
+metrics_bp = Blueprint('metrics', __name__)
+logger = logging.getLogger(__name__)
+
+def register_metrics_routes(app, socketio):
+    """Expose /metrics and start timing every Flask request"""
+    app.register_blueprint(metrics_bp)
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.teardown_request(_end_timer)
+    
+    # Break request time down into db/sfu/serialize/emit for Server-Timing
+    if Config.SERVER_TIMING_ENABLED:
+        app.json = timing.TimedJSONProvider(app)
+        timing.instrument_engine(Config.engine)
+
+    metrics.register_gauge('db_pool_checked_out', 'Connections currently checked out of the SQLAlchemy pool',
+                           _pool_gauge(lambda pool: pool.checkedout()))
+    metrics.register_gauge('db_pool_overflow', 'Connections opened beyond the SQLAlchemy pool size',
+                           _pool_gauge(lambda pool: pool.overflow()))
+    metrics.register_gauge('db_pool_size', 'Configured SQLAlchemy pool size',
+                           _pool_gauge(lambda pool: pool.size()))
+    metrics.register_gauge('socketio_connected_clients', 'Socket.IO clients connected to this process',
+                           lambda: _connected_clients(socketio))
+    metrics.register_gauge('socketio_room_members', 'Members of each shared room on this process',
+                           lambda: _room_sizes(socketio))
+    metrics.register_gauge('sfu_node_healthy', 'Whether each SFU node passed its last health checks',
+                           lambda: [({'node': n['node']}, int(n['healthy'])) for n in sfu_cluster.stats()])
+    metrics.register_gauge('sfu_node_load', 'Objects and bitrate reported by each SFU node',
+                           _sfu_node_load)
+    metrics.register_gauge('sfu_tracked_objects', 'SFU objects this process created and still tracks, by kind',
+                           lambda: [({'kind': kind}, count)
+                                    for kind, count in sfu_placement.resources.counts().items()])
+    metrics.register_gauge('chat_ingest_pending', 'Chat messages waiting for the group-commit writer',
+                           lambda: [({}, chat_ingest.pending())])
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+    if Config.SERVER_TIMING_ENABLED:
+        g.timing_token = timing.begin()
+
+def _end_timer(error=None):
+    token = g.pop('timing_token', None)
+    if token is not None:
+        timing.end(token)
+
+def _record_request(response):
+    request_timing = timing.current()
+    if request_timing is not None:
+        response.headers['Server-Timing'] = request_timing.header()
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds', (('method', request.method), ('route', route)),
+                        time.perf_counter() - start)
+        metrics.inc('http_requests_total', (('method', request.method), ('route', route),
+                                            ('status', str(response.status_code))))
+    return response
+
+def _pool_gauge(read):
+    def collect():
+        pool = Config.engine.pool
+        try:
+            return [({}, read(pool))]
+        except (AttributeError, NotImplementedError):
+            # Pools without a fixed size (e.g. SQLite's) have nothing to report
+            return []
+    return collect
+
+def _rooms(socketio):
+    manager = socketio.server.manager if socketio.server else None
+    return manager.rooms.get('/', {}) if manager else {}
+
+def _connected_clients(socketio):
+    return [({}, len(_rooms(socketio).get(None, ())))]
+
+def _room_sizes(socketio):
+    # Skip the implicit all-clients room, each client's own sid room and
+    # single-member rooms, which keeps per-user rooms out of the label set
+    return [({'room': room}, len(members)) for room, members in list(_rooms(socketio).items())
+            if room is not None and room not in members and len(members) > 1]
+
+def _sfu_node_load():
+    return [({'node': n['node'], 'kind': kind}, n[kind]) for n in sfu_cluster.stats()
+            for kind in ('routers', 'transports', 'producers', 'consumers', 'bitrate')]
@@ -1,7 +1,11 @@
 from flask import Blueprint, request, jsonify
 from sqlalchemy.orm import Session as SQLSession
 from config import Config
-import requests
+from app.services.mediasoup_client import MediasoupError
+from app.services.sfu_placement import sfu_placement
+from app.services.producers import start_producer, producer_event, mark_producers_closed
+from app.services.sfu_stats import sfu_stats
+from app.services.active_speakers import active_speakers
 import time
 import hmac
 import hashlib
@@ -15,9 +19,6 @@ def register_webrtc_routes(app, socketio):
     app.register_blueprint(webrtc_bp)
     webrtc_bp.socketio = socketio
 
-# Mediasoup server URL
-MEDIASOUP_SERVER_URL = Config.MEDIASOUP_SERVER_URL
-
 # TURN server settings (used only when TURN is enabled)
 # Uncomment the following lines to enable TURN
 """
@@ -60,12 +61,12 @@ def create_producer_transport():
         session_id = data.get('sessionId')
         user_id = data.get('userId')
         
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/createProducerTransport", json={})
-        if response.status_code != 200:
+        try:
+            transport_data = sfu_placement.create_transport('/createProducerTransport', session_id, user_id=user_id)
+        except MediasoupError as e:
+            logger.error(f"Failed to create producer transport: {str(e)}")
             return jsonify({'error': 'Failed to create producer transport', 'success': False}), 500
         
-        transport_data = response.json()
-        
         webrtc_bp.socketio.emit('producer_transport_created', {
             'transportId': transport_data['id'],
             'iceParameters': transport_data['iceParameters'],
@@ -86,11 +87,13 @@ def connect_producer_transport():
         transport_id = data.get('transportId')
         dtls_parameters = data.get('dtlsParameters')
         
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/connectProducerTransport", json={
-            'transportId': transport_id,
-            'dtlsParameters': dtls_parameters
-        })
-        if response.status_code != 200:
+        try:
+            sfu_placement.client_for_transport(transport_id, data.get('sessionId')).post('/connectProducerTransport', {
+                'transportId': transport_id,
+                'dtlsParameters': dtls_parameters
+            })
+        except MediasoupError as e:
+            logger.error(f"Failed to connect producer transport: {str(e)}")
             return jsonify({'error': 'Failed to connect producer transport', 'success': False}), 500
         
         return jsonify({'success': True})
@@ -100,7 +103,7 @@ def connect_producer_transport():
 
 @webrtc_bp.route('/api/produce', methods=['POST'])
 def produce():
-    """Create a producer on the mediasoup server and store producer_id in Session"""
+    """Create a producer on the mediasoup server and record it in the producers table"""
     try:
         data = request.json
         session_id = data.get('sessionId')
@@ -108,31 +111,15 @@ def produce():
         transport_id = data.get('transportId')
         kind = data.get('kind')  # audio or video
         rtp_parameters = data.get('rtpParameters')
+        source = data.get('source')  # camera, mic or screen
         
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/produce", json={
-            'transportId': transport_id,
-            'kind': kind,
-            'rtpParameters': rtp_parameters
-        })
-        if response.status_code != 200:
+        try:
+            producer_id = start_producer(session_id, user_id, transport_id, kind, rtp_parameters, source)
+        except MediasoupError as e:
+            logger.error(f"Failed to produce stream: {str(e)}")
             return jsonify({'error': 'Failed to produce stream', 'success': False}), 500
         
-        producer_data = response.json()
-        producer_id = producer_data['id']
-        
-        with SQLSession(Config.engine) as db_session:
-            session = db_session.query(Session).filter_by(session_id=session_id).first()
-            if session:
-                session.set_producer_id(producer_id)
-                db_session.commit()
-            else:
-                logger.error(f"Session {session_id} not found when storing producer_id")
-        
-        webrtc_bp.socketio.emit('new_producer', {
-            'producerId': producer_id,
-            'kind': kind,
-            'userId': user_id
-        }, room=session_id, include_self=False)
+        webrtc_bp.socketio.emit('newProducer', producer_event(producer_id, kind, source, user_id), room=session_id)
         
         return jsonify({'success': True, 'producerId': producer_id})
     except Exception as e:
@@ -144,14 +131,15 @@ def create_consumer_transport():
     """Create a consumer transport on the mediasoup server"""
     try:
         data = request.json
+        session_id = data.get('sessionId')
         user_id = data.get('userId')
         
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/createConsumerTransport", json={})
-        if response.status_code != 200:
+        try:
+            transport_data = sfu_placement.create_transport('/createConsumerTransport', session_id, consumer=True, user_id=user_id)
+        except MediasoupError as e:
+            logger.error(f"Failed to create consumer transport: {str(e)}")
             return jsonify({'error': 'Failed to create consumer transport', 'success': False}), 500
         
-        transport_data = response.json()
-        
         webrtc_bp.socketio.emit('consumer_transport_created', {
             'transportId': transport_data['id'],
             'iceParameters': transport_data['iceParameters'],
@@ -172,11 +160,13 @@ def connect_consumer_transport():
         transport_id = data.get('transportId')
         dtls_parameters = data.get('dtlsParameters')
         
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/connectConsumerTransport", json={
-            'transportId': transport_id,
-            'dtlsParameters': dtls_parameters
-        })
-        if response.status_code != 200:
+        try:
+            sfu_placement.client_for_transport(transport_id, data.get('sessionId')).post('/connectConsumerTransport', {
+                'transportId': transport_id,
+                'dtlsParameters': dtls_parameters
+            })
+        except MediasoupError as e:
+            logger.error(f"Failed to connect consumer transport: {str(e)}")
             return jsonify({'error': 'Failed to connect consumer transport', 'success': False}), 500
         
         return jsonify({'success': True})
@@ -194,16 +184,18 @@ def consume():
         rtp_capabilities = data.get('rtpCapabilities')
         transport_id = data.get('transportId')
         
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/consume", json={
-            'producerId': producer_id,
-            'rtpCapabilities': rtp_capabilities,
-            'transportId': transport_id
-        })
-        if response.status_code != 200:
+        try:
+            consumer_data = sfu_placement.consume(data.get('sessionId'), user_id, {
+                'producerId': producer_id,
+                'rtpCapabilities': rtp_capabilities,
+                'transportId': transport_id,
+                'bandwidthKbps': data.get('bandwidthKbps'),
+                'viewportHeight': data.get('viewportHeight')
+            })
+        except MediasoupError as e:
+            logger.error(f"Failed to consume stream: {str(e)}")
             return jsonify({'error': 'Failed to consume stream', 'success': False}), 500
         
-        consumer_data = response.json()
-        
         webrtc_bp.socketio.emit('consumer_created', consumer_data, room=user_id)
         
         return jsonify({'success': True})
@@ -211,6 +203,62 @@ def consume():
         logger.error(f"Error consuming stream: {str(e)}")
         return jsonify({'error': 'Internal server error', 'success': False}), 500
 
+@webrtc_bp.route('/api/consumer-layers', methods=['POST'])
+def consumer_layers():
+    """Pin a video consumer to a simulcast layer (spatialLayer null returns it to the layer policy)"""
+    try:
+        data = request.json
+        spatial_layer = data.get('spatialLayer')
+        try:
+            layers = sfu_placement.prefer_layers(data.get('userId'), data.get('consumerId'),
+                                                 None if spatial_layer is None else int(spatial_layer))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e), 'success': False}), 400
+        except MediasoupError as e:
+            return jsonify({'error': str(e), 'success': False}), e.status_code or 500
+        
+        return jsonify({'success': True, **layers})
+    except Exception as e:
+        logger.error(f"Error setting consumer layers: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+@webrtc_bp.route('/api/sessions/<session_id>/quality', methods=['GET'])
+def session_quality(session_id):
+    """Bitrate, loss, RTT and score of a session's SFU objects over the stats window, overall and per user"""
+    try:
+        return jsonify({'sessionId': session_id, **sfu_stats.session_summary(session_id), 'success': True})
+    except Exception as e:
+        logger.error(f"Error summarizing session quality: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+@webrtc_bp.route('/api/users/<user_id>/quality', methods=['GET'])
+def user_quality(user_id):
+    """Quality of one user's transports, producers and consumers (optionally ?sessionId=)"""
+    try:
+        summary = sfu_stats.user_summary(user_id, request.args.get('sessionId'))
+        return jsonify({'userId': user_id, **summary, 'success': True})
+    except Exception as e:
+        logger.error(f"Error summarizing user quality: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+@webrtc_bp.route('/api/sessions/<session_id>/speakers', methods=['GET'])
+def session_speakers(session_id):
+    """Top speakers of a session (?limit=N), loudest first, then the most recently heard"""
+    try:
+        try:
+            limit = int(request.args.get('limit', Config.ACTIVE_SPEAKER_TOP_N))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer', 'success': False}), 400
+        return jsonify({
+            'sessionId': session_id,
+            'activeSpeaker': active_speakers.active_speaker(session_id),
+            'speakers': active_speakers.top_speakers(session_id, max(1, limit)),
+            'success': True
+        })
+    except Exception as e:
+        logger.error(f"Error listing speakers: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
 @webrtc_bp.route('/api/close-producer', methods=['POST'])
 def close_producer():
     """Close a producer on the mediasoup server"""
@@ -218,12 +266,16 @@ def close_producer():
         data = request.json
         producer_id = data.get('producerId')
         
-        response = requests.post(f"{MEDIASOUP_SERVER_URL}/closeProducer", json={
-            'producerId': producer_id
-        })
-        if response.status_code != 200:
+        try:
+            sfu_placement.close_producer(data.get('sessionId'), producer_id)
+        except MediasoupError as e:
+            logger.error(f"Failed to close producer {producer_id}: {str(e)}")
             return jsonify({'error': 'Failed to close producer', 'success': False}), 500
         
+        with SQLSession(Config.engine) as db_session:
+            mark_producers_closed(db_session, [producer_id])
+            db_session.commit()
+        
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error closing producer: {str(e)}")
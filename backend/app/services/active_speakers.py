@@ -0,0 +1,176 @@
+"""Active speaker detection from the SFU's audio level observers
+
+Every router on the SFU has an AudioLevelObserver that reports its loudest
+audio producers a few times a second. This tracker polls GET /audioLevels on
+each node every ACTIVE_SPEAKER_INTERVAL seconds, asking only for routers
+that changed since the last poll. Levels are attributed to a session and user
+through the producer ids recorded in sfu_resources, and a level not
+refreshed within LEVEL_TTL counts as silence.
+
+The loudest fresh speaker of a room becomes the active speaker once it has
+stayed loudest for ACTIVE_SPEAKER_HOLD seconds, and a room gets at most
+ACTIVE_SPEAKER_MAX_RATE 'active_speaker' events per second, so raw observer
+callbacks never reach clients one by one.
+"""
+import logging
+import threading
+import time
+
+from app.services.mediasoup_client import MediasoupError
+from app.services.sfu_placement import sfu_placement
+from app.socket.coalescer import room_events
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which an unrefreshed level counts as silence
+LEVEL_TTL = 1.0
+
+
+class RoomSpeakers:
+    """Audio levels and speaker state of one session"""
+
+    __slots__ = ('levels', 'last_spoke', 'current', 'candidate', 'candidate_since', 'last_emit')
+
+    def __init__(self):
+        self.levels = {}      # user_id -> (volume dBov, monotonic time)
+        self.last_spoke = {}  # user_id -> wall-clock time the user was last heard
+        self.current = None
+        self.candidate = None
+        self.candidate_since = 0.0
+        self.last_emit = 0.0
+
+    def fresh(self, now):
+        return {user_id: volume for user_id, (volume, at) in self.levels.items() if now - at <= LEVEL_TTL}
+
+
+class ActiveSpeakerTracker:
+    """Turns polled audio levels into debounced, rate-limited active speaker events"""
+
+    def __init__(self, placement, interval, hold, max_rate, top_n):
+        self.placement = placement
+        self.interval = interval
+        self.hold = hold
+        self.min_gap = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._rooms = {}  # session_id -> RoomSpeakers
+        self._since = {}  # node id -> last sequence number seen
+        self._running = False
+        self.emitted = 0
+
+    def start(self, socketio):
+        """Start polling in the background (no-op when ACTIVE_SPEAKER_INTERVAL is 0)"""
+        if self._running or self.interval <= 0:
+            return
+        self._running = True
+        socketio.start_background_task(self._poll_loop, socketio)
+        logger.info(f"Polling SFU audio levels every {self.interval}s")
+
+    def stop(self):
+        self._running = False
+
+    def poll(self, now=None):
+        """Fetch changed audio levels from every healthy node, then emit speaker changes"""
+        now = time.monotonic() if now is None else now
+        for node in list(self.placement.cluster.nodes.values()):
+            if not node.healthy:
+                continue
+            since = self._since.get(node.id, 0)
+            try:
+                body = node.client.get(f'/audioLevels?since={since}')
+            except MediasoupError as e:
+                if e.status_code != 404:  # 404: SFU without audio level observers
+                    logger.warning(f"Failed to poll audio levels of SFU node {node.id}: {str(e)}")
+                continue
+            # A sequence number going backwards means the node restarted
+            self._since[node.id] = body.get('seq', 0) if body.get('seq', 0) >= since else 0
+            self.update(body.get('routers') or {}, now)
+        return self.decide(now)
+
+    def update(self, routers, now):
+        """Record the volumes reported per router ({routerId: [{producerId, userId, volume}]})"""
+        wall_clock = time.time()
+        with self._lock:
+            for volumes in routers.values():
+                for entry in volumes:
+                    resource = self.placement.resources.get(entry.get('producerId'))
+                    if resource is None or not resource.session_id:
+                        continue
+                    user_id = resource.user_id or entry.get('userId')
+                    room = self._rooms.setdefault(resource.session_id, RoomSpeakers())
+                    room.levels[user_id] = (entry.get('volume'), now)
+                    room.last_spoke[user_id] = wall_clock
+
+    def decide(self, now):
+        """Emit 'active_speaker' for rooms whose loudest speaker settled; returns the events sent"""
+        events = []
+        with self._lock:
+            for session_id, room in self._rooms.items():
+                fresh = room.fresh(now)
+                loudest = max(fresh, key=fresh.get) if fresh else None
+                if loudest == room.current:
+                    room.candidate = None
+                    continue
+                if loudest != room.candidate:
+                    room.candidate, room.candidate_since = loudest, now
+                if now - room.candidate_since < self.hold or now - room.last_emit < self.min_gap:
+                    continue
+                room.current, room.candidate, room.last_emit = loudest, None, now
+                events.append((session_id, {
+                    'userId': loudest,
+                    'volume': fresh.get(loudest),
+                    'speakers': self._top(room, now, self.top_n)
+                }))
+        for session_id, payload in events:
+            room_events.emit('active_speaker', payload, room=session_id)
+        self.emitted += len(events)
+        return events
+
+    def top_speakers(self, session_id, limit=None):
+        """Up to limit users, loudest first, then the most recently heard"""
+        with self._lock:
+            room = self._rooms.get(session_id)
+            if room is None:
+                return []
+            return self._top(room, time.monotonic(), limit or self.top_n)
+
+    def active_speaker(self, session_id):
+        with self._lock:
+            room = self._rooms.get(session_id)
+            return room.current if room else None
+
+    def forget_session(self, session_id):
+        with self._lock:
+            self._rooms.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'rooms': len(self._rooms), 'emitted': self.emitted}
+
+    @staticmethod
+    def _top(room, now, limit):
+        # Caller holds the lock
+        fresh = room.fresh(now)
+        ranked = sorted(room.last_spoke, key=lambda u: (u in fresh, fresh.get(u, -128), room.last_spoke[u]),
+                        reverse=True)
+        return [{'userId': user_id, 'volume': fresh.get(user_id), 'lastSpokeAt': room.last_spoke[user_id]}
+                for user_id in ranked[:limit]]
+
+    def _poll_loop(self, socketio):
+        while self._running:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Unexpected error polling audio levels: {str(e)}")
+            socketio.sleep(self.interval)
+
+
+# Shared tracker for the process
+active_speakers = ActiveSpeakerTracker(
+    sfu_placement,
+    Config.ACTIVE_SPEAKER_INTERVAL,
+    Config.ACTIVE_SPEAKER_HOLD,
+    Config.ACTIVE_SPEAKER_MAX_RATE,
+    Config.ACTIVE_SPEAKER_TOP_N
+)
@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import Session
+from config import Config
+
+
+class TTLCache:
+    """Small thread-safe in-memory cache with per-entry expiry
+
+    Entries expire ttl seconds after they are stored and the least recently
+    used entry is dropped once maxsize is reached. get_or_load() lets only one
+    caller per key run the loader, so an expiring hot key does not turn into
+    a burst of identical queries.
+    """
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._generation = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store value under key"""
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, calling loader() once to fill a miss"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            value = self.get(key, missing)
+            if value is not missing:
+                return value
+
+            with self._lock:
+                generation = self._generation
+            value = loader()
+            with self._lock:
+                # Don't cache a value loaded before an invalidation landed
+                if generation == self._generation:
+                    self._store(key, value)
+                self._load_locks.pop(key, None)
+            return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or every entry if no key is given"""
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+# Lobby listing served by get_active_sessions; invalidated whenever a
+# livestream starts/stops or someone joins/leaves a session
+active_sessions_cache = TTLCache(Config.ACTIVE_SESSIONS_CACHE_TTL, maxsize=1)
+
+
+# Per-session validation info used on the chat hot path
+session_info_cache = TTLCache(Config.SESSION_INFO_CACHE_TTL, maxsize=10000)
+
+
+def get_session_info(session_id):
+    """Return cached {'sessionId', 'isActive'} for a session, or None if it doesn't exist"""
+    info = session_info_cache.get(session_id)
+    if info is None:
+        with SQLSession(Config.engine) as db_session:
+            session = db_session.get(Session, session_id)
+            if not session:
+                return None
+            info = {'sessionId': session.session_id, 'isActive': session.is_active}
+        session_info_cache.set(session_id, info)
+    return info
@@ -0,0 +1,43 @@
+import base64
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from app.models.models import Message
+
+
+def encode_cursor(message):
+    """Encode a message's (timestamp, message_id) keyset position as an opaque cursor"""
+    raw = f"{message.timestamp.isoformat()}|{message.message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into (timestamp, message_id); raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, message_id = raw.split('|', 1)
+        return datetime.fromisoformat(timestamp), message_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor}") from e
+
+
+def fetch_page(db_session, session_id, limit, before=None):
+    """Return up to limit messages older than the cursor, oldest first
+
+    Uses the (session_id, timestamp, message_id) index to seek straight to the
+    page instead of loading the whole history. The returned cursor points at
+    the oldest message of the page, or is None when there is nothing older.
+    """
+    query = db_session.query(Message).filter(Message.session_id == session_id)
+    if before:
+        timestamp, message_id = decode_cursor(before)
+        query = query.filter(tuple_(Message.timestamp, Message.message_id) < tuple_(timestamp, message_id))
+
+    rows = query.order_by(Message.timestamp.desc(), Message.message_id.desc()).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]) if has_more else None
+    rows.reverse()
+    return [message.to_dict() for message in rows], next_cursor
@@ -0,0 +1,167 @@
+"""Group-commit ingestion of chat messages
+
+send_message validates against cached session/user info, broadcasts the
+message and hands the row to ChatIngestQueue, which writes queued rows with
+one multi-row INSERT and one commit per tick.
+
+Guarantees:
+- Ordering: rows are inserted in the order this process accepted them, and
+  history is read back ordered by (timestamp, message_id).
+- Durability: a message is broadcast and acknowledged before it is durable.
+  Rows are normally committed within CHAT_FLUSH_INTERVAL seconds, and pending
+  rows are flushed on clean shutdown. A hard crash can lose whatever was
+  still queued.
+- Failures: a batch that fails with an error that can clear (connection
+  lost, database unavailable) goes back to the head of the queue and is
+  retried, up to CHAT_MAX_RETRIES times in a row before it is dropped. Any
+  other error is blamed on the rows: the batch is split until the failing
+  rows are isolated, those are logged and dropped, and the rest are written.
+- Backpressure: at most CHAT_QUEUE_MAX_PENDING rows wait in memory. When the
+  database falls behind, submit() raises ChatBackpressureError and the route
+  answers 503 instead of growing the queue.
+"""
+import atexit
+import logging
+import threading
+from collections import deque
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, DisconnectionError, OperationalError, SQLAlchemyError
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import Message
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ChatBackpressureError(Exception):
+    """Raised when the ingestion queue is full"""
+
+
+def is_transient(error):
+    """Whether a database error may clear if the same rows are retried"""
+    if isinstance(error, (OperationalError, DisconnectionError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+class ChatIngestQueue:
+    """Bounded in-memory queue of chat rows persisted in batches"""
+
+    def __init__(self, max_pending, batch_size, flush_interval, max_retries):
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.dropped = 0
+        self._retries = 0  # consecutive transient failures of the head of the queue
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._running = False
+
+    def start(self, socketio):
+        """Start the group-commit writer and register the shutdown flush"""
+        if self._running:
+            return
+        self._running = True
+        socketio.start_background_task(self._writer_loop, socketio)
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the writer and persist everything still queued"""
+        self._running = False
+        self.flush()
+
+    def submit(self, row):
+        """Queue a messages row (a dict of column values) for persistence"""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                raise ChatBackpressureError(f"Chat ingestion queue is full ({self.max_pending} pending)")
+            self._pending.append(row)
+
+    def pending(self):
+        """Number of rows waiting to be written"""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write all queued rows now; returns the number of rows committed"""
+        written = 0
+        while True:
+            count, consumed = self._write_batch()
+            written += count
+            if not consumed:
+                return written
+
+    def _write_batch(self):
+        """Write one batch; returns (rows committed, whether the whole batch left the queue)
+
+        A batch whose rows were all written or dropped is consumed, so flush()
+        moves on to the next one. An empty queue, or a transient failure that
+        put rows back, ends the flush until the next tick.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                return 0, False
+
+            written = 0
+            chunks = [batch]  # a stack; bad rows are isolated by splitting chunks in half
+            while chunks:
+                rows = chunks.pop()
+                try:
+                    self._insert(rows)
+                except SQLAlchemyError as e:
+                    if is_transient(e):
+                        remaining = rows + [row for chunk in reversed(chunks) for row in chunk]
+                        self._retry(remaining, e)
+                        return written, False
+                    if len(rows) == 1:
+                        self._drop(rows, e)
+                    else:
+                        middle = len(rows) // 2
+                        chunks.extend((rows[middle:], rows[:middle]))
+                    continue
+                written += len(rows)
+
+            self._retries = 0
+            logger.debug(f"Persisted {written} chat messages")
+            return written, True
+
+    def _insert(self, rows):
+        with SQLSession(Config.engine) as db_session:
+            db_session.execute(insert(Message).values(rows))
+            db_session.commit()
+
+    def _retry(self, rows, error):
+        self._retries += 1
+        if self._retries > self.max_retries:
+            self._retries = 0
+            self._drop(rows, error)
+            return
+        logger.error(f"Failed to persist {len(rows)} chat messages (attempt {self._retries}), "
+                     f"will retry: {str(error)}")
+        with self._lock:
+            self._pending.extendleft(reversed(rows))
+
+    def _drop(self, rows, error):
+        self.dropped += len(rows)
+        for row in rows:
+            logger.error(f"Dropping chat message {row.get('message_id')} of session {row.get('session_id')}: "
+                         f"{str(error)}")
+
+    def _writer_loop(self, socketio):
+        while self._running:
+            socketio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Unexpected error in chat writer: {str(e)}")
+
+
+# Shared ingestion queue for the process
+chat_ingest = ChatIngestQueue(Config.CHAT_QUEUE_MAX_PENDING, Config.CHAT_BATCH_SIZE, Config.CHAT_FLUSH_INTERVAL,
+                              Config.CHAT_MAX_RETRIES)
@@ -0,0 +1,284 @@
+"""RTP depacketizing and fragmented MP4 boxes for HLS, without transcoding
+
+H264Depacketizer turns RTP (RFC 6184 single NAL units, STAP-A and FU-A) back
+into access units, keeping the latest SPS and PPS aside for the init segment.
+Opus needs no reassembly: each RTP payload is one Opus packet.
+
+init_segment() and media_segment() write the CMAF-style fragmented MP4 that
+HLS (version 7) accepts: an init segment with one track per stream, then one
+moof + mdat per media segment. Samples are (decode time, data, keyframe) in
+the track's timescale; video samples hold length-prefixed NAL units.
+"""
+import struct
+
+from app.services.rtp_tap import rtp_header, rtp_payload
+
+VIDEO_TIMESCALE = 90000
+AUDIO_TIMESCALE = 48000
+OPUS_PRE_SKIP = 312
+
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+NAL_STAP_A = 24
+NAL_FU_A = 28
+
+# trun sample flags: sync sample, and non-sync sample depending on others
+SYNC_SAMPLE = 0x02000000
+NON_SYNC_SAMPLE = 0x01010000
+
+
+class H264Depacketizer:
+    """Reassembles H.264 access units from RTP packets of one SSRC"""
+
+    def __init__(self):
+        self.sps = None
+        self.pps = None
+        self._timestamp = None
+        self._nals = []
+        self._fragment = None
+        self._sequence = None
+        self._broken = False
+        self._need_keyframe = True  # nothing decodes until the first IDR
+
+    def push(self, packet):
+        """Add one packet; returns the access units it completed as [(rtp timestamp, nals, keyframe)]"""
+        _, marker, sequence, timestamp, _ = rtp_header(packet)
+        frames = []
+        if self._timestamp is not None and timestamp != self._timestamp:
+            self._broken = True  # the previous access unit never got its marker packet
+            frames.extend(self._complete())
+        if self._sequence is not None and sequence != (self._sequence + 1) & 0xFFFF:
+            self._broken = True  # lost packet: this access unit is incomplete
+            self._fragment = None
+        self._sequence = sequence
+        self._timestamp = timestamp
+        self._unpack(rtp_payload(packet))
+        if marker:
+            frames.extend(self._complete())
+        return frames
+
+    def _unpack(self, payload):
+        if not payload:
+            return
+        nal_type = payload[0] & 0x1F
+        if nal_type == NAL_STAP_A:
+            offset = 1
+            while offset + 2 <= len(payload):
+                size = struct.unpack_from('!H', payload, offset)[0]
+                self._add(payload[offset + 2:offset + 2 + size])
+                offset += 2 + size
+        elif nal_type == NAL_FU_A:
+            if len(payload) < 2:
+                return
+            start, end = payload[1] & 0x80, payload[1] & 0x40
+            if start:
+                self._fragment = bytearray([(payload[0] & 0xE0) | (payload[1] & 0x1F)])
+            elif self._fragment is None:
+                return  # missed the start of this NAL unit
+            self._fragment += payload[2:]
+            if end:
+                self._add(bytes(self._fragment))
+                self._fragment = None
+        elif 1 <= nal_type <= 23:
+            self._add(payload)
+
+    def _add(self, nal):
+        if not nal:
+            return
+        nal_type = nal[0] & 0x1F
+        if nal_type == NAL_SPS:
+            self.sps = bytes(nal)
+        elif nal_type == NAL_PPS:
+            self.pps = bytes(nal)
+        elif nal_type != NAL_AUD:
+            self._nals.append(bytes(nal))
+
+    def _complete(self):
+        nals, broken, timestamp = self._nals, self._broken, self._timestamp
+        self._nals, self._broken, self._fragment, self._timestamp = [], False, None, None
+        if not nals:
+            return []
+        keyframe = any(nal[0] & 0x1F == NAL_IDR for nal in nals)
+        if broken:
+            self._need_keyframe = True
+            return []
+        if self._need_keyframe and not (keyframe and self.sps and self.pps):
+            return []
+        self._need_keyframe = False
+        return [(timestamp, nals, keyframe)]
+
+    @property
+    def waiting_for_keyframe(self):
+        return self._need_keyframe
+
+
+class _BitReader:
+    def __init__(self, data):
+        # Drop emulation prevention bytes (00 00 03)
+        self.data = data.replace(b'\x00\x00\x03', b'\x00\x00')
+        self.position = 0
+
+    def bits(self, count):
+        value = 0
+        for _ in range(count):
+            byte = self.data[self.position >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.position & 7))) & 1)
+            self.position += 1
+        return value
+
+    def ue(self):
+        zeros = 0
+        while self.bits(1) == 0:
+            zeros += 1
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def sps_dimensions(sps):
+    """(width, height) in pixels from an H.264 sequence parameter set"""
+    reader = _BitReader(sps[1:])
+    profile = reader.bits(8)
+    reader.bits(16)  # constraint flags and level
+    reader.ue()      # seq_parameter_set_id
+    chroma_format = 1
+    if profile in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format = reader.ue()
+        if chroma_format == 3:
+            reader.bits(1)
+        reader.ue()
+        reader.ue()
+        reader.bits(1)
+        if reader.bits(1):  # scaling matrices
+            for index in range(8 if chroma_format != 3 else 12):
+                if reader.bits(1):
+                    last, next_scale = 8, 8
+                    for _ in range(16 if index < 6 else 64):
+                        if next_scale:
+                            next_scale = (last + reader.se()) % 256
+                        last = next_scale or last
+    reader.ue()  # log2_max_frame_num_minus4
+    poc_type = reader.ue()
+    if poc_type == 0:
+        reader.ue()
+    elif poc_type == 1:
+        reader.bits(1)
+        reader.se()
+        reader.se()
+        for _ in range(reader.ue()):
+            reader.se()
+    reader.ue()      # max_num_ref_frames
+    reader.bits(1)
+    width_mbs = reader.ue() + 1
+    height_units = reader.ue() + 1
+    frame_mbs_only = reader.bits(1)
+    if not frame_mbs_only:
+        reader.bits(1)
+    reader.bits(1)
+    crop = (0, 0, 0, 0)
+    if reader.bits(1):
+        crop = (reader.ue(), reader.ue(), reader.ue(), reader.ue())
+    crop_x = 2 if chroma_format in (1, 2) else 1
+    crop_y = (2 if chroma_format == 1 else 1) * (2 - frame_mbs_only)
+    return (width_mbs * 16 - crop_x * (crop[0] + crop[1]),
+            (2 - frame_mbs_only) * height_units * 16 - crop_y * (crop[2] + crop[3]))
+
+
+def avc_codec_string(sps):
+    return 'avc1.' + sps[1:4].hex()
+
+
+def box(kind, *payloads):
+    payload = b''.join(payloads)
+    return struct.pack('!I4s', 8 + len(payload), kind) + payload
+
+
+def full_box(kind, version, flags, *payloads):
+    return box(kind, struct.pack('!I', (version << 24) | flags), *payloads)
+
+
+UNITY_MATRIX = struct.pack('!9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+
+class Track:
+    """One stream of a fragmented MP4: its sample entry and timescale"""
+
+    def __init__(self, track_id, kind, timescale, sample_entry, width=0, height=0):
+        self.track_id = track_id
+        self.kind = kind
+        self.timescale = timescale
+        self.sample_entry = sample_entry
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def h264(cls, track_id, sps, pps):
+        width, height = sps_dimensions(sps)
+        avcc = box(b'avcC', bytes([1, sps[1], sps[2], sps[3], 0xFF, 0xE1]), struct.pack('!H', len(sps)), sps,
+                   b'\x01', struct.pack('!H', len(pps)), pps)
+        entry = box(b'avc1', b'\x00' * 6, struct.pack('!H', 1), b'\x00' * 16,
+                    struct.pack('!HHIII', width, height, 0x00480000, 0x00480000, 0),
+                    struct.pack('!H', 1), b'\x00' * 32, struct.pack('!Hh', 0x18, -1), avcc)
+        return cls(track_id, 'video', VIDEO_TIMESCALE, entry, width, height)
+
+    @classmethod
+    def opus(cls, track_id, channels=2):
+        dops = box(b'dOps', struct.pack('!BBHIhB', 0, channels, OPUS_PRE_SKIP, AUDIO_TIMESCALE, 0, 0))
+        entry = box(b'Opus', b'\x00' * 6, struct.pack('!H', 1), b'\x00' * 8,
+                    struct.pack('!HHHHI', channels, 16, 0, 0, AUDIO_TIMESCALE << 16), dops)
+        return cls(track_id, 'audio', AUDIO_TIMESCALE, entry)
+
+    def trak(self):
+        video = self.kind == 'video'
+        tkhd = full_box(b'tkhd', 0, 3, struct.pack('!IIIII', 0, 0, self.track_id, 0, 0), b'\x00' * 8,
+                        struct.pack('!hhhH', 0, 0, 0 if video else 0x0100, 0), UNITY_MATRIX,
+                        struct.pack('!II', self.width << 16, self.height << 16))
+        mdhd = full_box(b'mdhd', 0, 0, struct.pack('!IIIIHH', 0, 0, self.timescale, 0, 0x55C4, 0))
+        handler, name = (b'vide', b'VideoHandler\x00') if video else (b'soun', b'SoundHandler\x00')
+        hdlr = full_box(b'hdlr', 0, 0, struct.pack('!I4s', 0, handler), b'\x00' * 12, name)
+        media_header = full_box(b'vmhd', 0, 1, b'\x00' * 8) if video else full_box(b'smhd', 0, 0, b'\x00' * 4)
+        dinf = box(b'dinf', full_box(b'dref', 0, 0, struct.pack('!I', 1), full_box(b'url ', 0, 1)))
+        stbl = box(b'stbl',
+                   full_box(b'stsd', 0, 0, struct.pack('!I', 1), self.sample_entry),
+                   full_box(b'stts', 0, 0, struct.pack('!I', 0)),
+                   full_box(b'stsc', 0, 0, struct.pack('!I', 0)),
+                   full_box(b'stsz', 0, 0, struct.pack('!II', 0, 0)),
+                   full_box(b'stco', 0, 0, struct.pack('!I', 0)))
+        return box(b'trak', tkhd, box(b'mdia', mdhd, hdlr, box(b'minf', media_header, dinf, stbl)))
+
+
+def init_segment(tracks):
+    """ftyp + moov describing tracks, with no samples"""
+    ftyp = box(b'ftyp', b'iso6', struct.pack('!I', 0), b'iso6', b'cmfc', b'mp41')
+    mvhd = full_box(b'mvhd', 0, 0, struct.pack('!IIIIIH', 0, 0, 1000, 0, 0x00010000, 0x0100),
+                    b'\x00' * 10, UNITY_MATRIX, b'\x00' * 24,
+                    struct.pack('!I', max(t.track_id for t in tracks) + 1))
+    mvex = box(b'mvex', *(full_box(b'trex', 0, 0, struct.pack('!IIIII', t.track_id, 1, 0, 0, 0)) for t in tracks))
+    return ftyp + box(b'moov', mvhd, *(t.trak() for t in tracks), mvex)
+
+
+def media_segment(sequence, fragments):
+    """One moof + mdat; fragments are [(track, base decode time, [(duration, data, keyframe)])]"""
+    def moof(offsets):
+        trafs = []
+        for (track, base_time, samples), offset in zip(fragments, offsets):
+            entries = b''.join(struct.pack('!III', duration, len(data), SYNC_SAMPLE if keyframe else NON_SYNC_SAMPLE)
+                               for duration, data, keyframe in samples)
+            trafs.append(box(b'traf',
+                             full_box(b'tfhd', 0, 0x020000, struct.pack('!I', track.track_id)),
+                             full_box(b'tfdt', 1, 0, struct.pack('!Q', base_time)),
+                             full_box(b'trun', 0, 0x000701, struct.pack('!Ii', len(samples), offset), entries)))
+        return box(b'moof', full_box(b'mfhd', 0, 0, struct.pack('!I', sequence)), *trafs)
+
+    # trun data offsets are relative to the start of moof, whose size does not depend on them
+    moof_size = len(moof([0] * len(fragments)))
+    offsets, position = [], moof_size + 8
+    for _, _, samples in fragments:
+        offsets.append(position)
+        position += sum(len(data) for _, data, _ in samples)
+    mdat = box(b'mdat', *(data for _, _, samples in fragments for _, data, _ in samples))
+    return moof(offsets) + mdat
@@ -0,0 +1,385 @@
+"""HLS broadcast of a session's producers, packaged from RTP without transcoding
+
+In broadcast mode (start-livestream with mode 'hls') the session's H.264
+video and Opus audio producers are tapped over a PlainTransport (see
+rtp_tap), reassembled, and cut into fragmented MP4 segments of about
+HLS_SEGMENT_SECONDS. A segment always starts on a video keyframe, so a
+keyframe is requested from the SFU whenever one is overdue. Only the open
+segment's samples are held in memory.
+
+Segments and the live playlist go to HLS_DIR/<session id>/<broadcast id>/
+and are served over plain HTTP, so viewers pull them from the backend (or any
+cache in front of it) instead of each holding a WebRTC consumer. The playlist
+lists the last HLS_PLAYLIST_SEGMENTS segments; older segment files are
+deleted once they have been out of the playlist for as long again. A new
+init segment (with a discontinuity) is written when the tracks change, e.g.
+when the video resolution does; the segment is cut at the keyframe that
+carries the new SPS and PPS, so every segment matches its init segment.
+"""
+import logging
+import math
+import os
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+import pytz
+
+from app.services.fmp4 import (AUDIO_TIMESCALE, VIDEO_TIMESCALE, H264Depacketizer, Track,
+                               init_segment, media_segment)
+from app.services.mediasoup_client import MediasoupError
+from app.services.rtp_tap import RtpTap, rtp_header, rtp_payload
+from app.services.sfu_placement import sfu_placement
+from app.socket.workers import sfu_workers
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Codecs that HLS players take as-is: mime type -> track kind
+PACKAGED_CODECS = {'video/h264': 'video', 'audio/opus': 'audio'}
+# A segment is cut without a keyframe once it is this many target durations long
+MAX_SEGMENT_FACTOR = 2
+OPUS_FRAME = 960  # 20 ms at 48 kHz, the duration of an Opus packet of unknown length
+
+
+class _Stream:
+    """One packaged track: depacketizer, timestamp mapping and the open segment's samples"""
+
+    def __init__(self, kind, ssrc, track_id):
+        self.kind = kind
+        self.ssrc = ssrc
+        self.track_id = track_id
+        self.timescale = VIDEO_TIMESCALE if kind == 'video' else AUDIO_TIMESCALE
+        self.depacketizer = H264Depacketizer() if kind == 'video' else None
+        self.samples = []  # (decode time, data, keyframe)
+        self.parameter_sets = None  # (SPS, PPS) the buffered video samples were encoded with
+        self.offset = None
+        self.first_rtp = None
+        self.last_rtp = None
+        self.extended = 0
+
+    def decode_time(self, rtp_timestamp, arrival, origin):
+        """Unwrapped RTP timestamp, shifted so every track counts from the broadcast origin"""
+        if self.first_rtp is None:
+            self.first_rtp = self.last_rtp = rtp_timestamp
+            self.offset = round((arrival - origin) * self.timescale)
+        else:
+            self.extended += (rtp_timestamp - self.last_rtp + 2 ** 31) % 2 ** 32 - 2 ** 31
+            self.last_rtp = rtp_timestamp
+        return max(self.offset + self.extended, 0)
+
+    def track(self):
+        if self.kind == 'audio':
+            return Track.opus(self.track_id)
+        if self.parameter_sets:
+            return Track.h264(self.track_id, *self.parameter_sets)
+        return None
+
+
+class HlsPackager:
+    """Turns RTP packets into a rolling fMP4 HLS playlist in one directory"""
+
+    def __init__(self, directory, target_duration, window, on_key_frame_needed=None):
+        self.directory = directory
+        self.target_duration = target_duration
+        self.window = window
+        self.on_key_frame_needed = on_key_frame_needed
+        self.streams = {}           # ssrc -> _Stream
+        self.segments = deque()     # playlist entries: (index, duration, init name, discontinuity)
+        self.expired = deque()      # segment indexes out of the playlist but still on disk
+        self.next_index = 0
+        self.discontinuity_sequence = 0
+        self.max_duration = target_duration
+        self.finished = False
+        self.origin = None
+        self._segment_start = None  # seconds since origin; None until the first keyframe
+        self._init = None           # (name, bytes) of the current init segment
+        self._inits = 0
+        self._last_key_request = 0.0
+        self._lock = threading.Lock()
+
+    def add_streams(self, streams):
+        """Package the streams (as described by rtp_tap) whose codec HLS can carry; returns those"""
+        accepted = []
+        with self._lock:
+            kinds = {s.kind for s in self.streams.values()}
+            for stream in streams:
+                kind = PACKAGED_CODECS.get(stream['mimeType'].lower())
+                if kind is None or kind in kinds or stream.get('ssrc') is None:
+                    continue
+                kinds.add(kind)
+                self.streams[stream['ssrc']] = _Stream(kind, stream['ssrc'], len(self.streams) + 1)
+                accepted.append(stream)
+        return accepted
+
+    def feed(self, packet, arrival):
+        """Sink for the RTP tap (or a replayed fixture)"""
+        with self._lock:
+            stream = self.streams.get(rtp_header(packet)[4])
+            if stream is None or self.finished:
+                return
+            if self.origin is None:
+                self.origin = arrival
+            if stream.kind == 'video':
+                for rtp_timestamp, nals, keyframe in stream.depacketizer.push(packet):
+                    data = b''.join(struct.pack('!I', len(nal)) + nal for nal in nals)
+                    self._add_video(stream, stream.decode_time(rtp_timestamp, arrival, self.origin), data, keyframe)
+                if stream.depacketizer.waiting_for_keyframe:
+                    self._request_key_frame()
+            else:
+                payload = rtp_payload(packet)
+                if payload:
+                    self._add_audio(stream, stream.decode_time(rtp_header(packet)[3], arrival, self.origin), payload)
+
+    def finish(self):
+        """Write out the open segment and end the playlist"""
+        with self._lock:
+            if self.finished:
+                return
+            if self._segment_start is not None:
+                self._cut(math.inf)
+            self.finished = True
+            self._write_playlist()
+
+    def _has_video(self):
+        return any(s.kind == 'video' for s in self.streams.values())
+
+    def _add_video(self, stream, decode_time, data, keyframe):
+        now = decode_time / stream.timescale
+        # The depacketizer already holds this keyframe's SPS and PPS, which may be new
+        parameter_sets = (stream.depacketizer.sps, stream.depacketizer.pps)
+        if self._segment_start is None:
+            if keyframe:
+                self._cut(now)
+                stream.parameter_sets = parameter_sets
+                stream.samples.append((decode_time, data, keyframe))
+            return
+        elapsed = now - self._segment_start
+        if keyframe and (elapsed >= self.target_duration or parameter_sets != stream.parameter_sets):
+            self._cut(now)
+        elif elapsed >= self.target_duration * MAX_SEGMENT_FACTOR:
+            self._cut(now)
+        elif elapsed >= self.target_duration:
+            self._request_key_frame()
+        if keyframe:
+            stream.parameter_sets = parameter_sets
+        stream.samples.append((decode_time, data, keyframe))
+
+    def _add_audio(self, stream, decode_time, data):
+        now = decode_time / stream.timescale
+        if self._has_video():
+            if self._segment_start is None:
+                # Keep about one segment of audio until video starts the first one
+                cutoff = (now - self.target_duration) * stream.timescale
+                while stream.samples and stream.samples[0][0] < cutoff:
+                    stream.samples.pop(0)
+        elif self._segment_start is None:
+            self._segment_start = now
+        elif now - self._segment_start >= self.target_duration:
+            self._cut(now)
+        stream.samples.append((decode_time, data, True))
+
+    def _request_key_frame(self):
+        now = time.monotonic()
+        if self.on_key_frame_needed and now - self._last_key_request >= self.target_duration:
+            self._last_key_request = now
+            self.on_key_frame_needed()
+
+    def _cut(self, at):
+        # Caller holds the lock. Writes samples before `at` (seconds) as a segment, unless
+        # this is the first keyframe, before which everything is dropped.
+        start, self._segment_start = self._segment_start, at
+        fragments, end = [], start
+        for stream in sorted(self.streams.values(), key=lambda s: s.track_id):
+            limit = at * stream.timescale
+            taken = [s for s in stream.samples if s[0] < limit]
+            stream.samples = stream.samples[len(taken):]
+            if start is None or not taken:
+                continue
+            samples = []
+            for i, (decode_time, data, keyframe) in enumerate(taken):
+                following = taken[i + 1][0] if i + 1 < len(taken) else (
+                    stream.samples[0][0] if stream.samples else decode_time + self._default_duration(stream))
+                samples.append((max(following - decode_time, 1), data, keyframe))
+            fragments.append((stream, taken[0][0], samples))
+            end = max(end, (taken[-1][0] + samples[-1][0]) / stream.timescale)
+        if start is None or not fragments:
+            return
+        tracks = {s.track_id: s.track() for s in self.streams.values()}
+        fragments = [(tracks[s.track_id], base, samples) for s, base, samples in fragments if tracks[s.track_id]]
+        if not fragments:
+            return
+        discontinuity = self._update_init(sorted((t for t in tracks.values() if t), key=lambda t: t.track_id))
+        duration = (at if at != math.inf else end) - start
+        index = self.next_index
+        self.next_index += 1
+        name = f'segment-{index:05d}.m4s'
+        with open(os.path.join(self.directory, name), 'wb') as file:
+            file.write(media_segment(index + 1, fragments))
+        self.max_duration = max(self.max_duration, duration)
+        self.segments.append((index, duration, self._init[0], discontinuity))
+        while len(self.segments) > self.window:
+            expired = self.segments.popleft()
+            if expired[3]:
+                self.discontinuity_sequence += 1
+            self.expired.append(expired[0])
+        while len(self.expired) > self.window:
+            self._remove(f'segment-{self.expired.popleft():05d}.m4s')
+        self._write_playlist()
+
+    def _default_duration(self, stream):
+        if stream.kind == 'audio':
+            return OPUS_FRAME
+        return stream.timescale // 30
+
+    def _update_init(self, tracks):
+        """Write a new init segment if the tracks changed; True when that starts a discontinuity"""
+        data = init_segment(tracks)
+        if self._init and self._init[1] == data:
+            return False
+        name = f'init-{self._inits}.mp4'
+        self._inits += 1
+        with open(os.path.join(self.directory, name), 'wb') as file:
+            file.write(data)
+        first = self._init is None
+        self._init = (name, data)
+        return not first
+
+    def _write_playlist(self):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:7',
+            # Every EXTINF, rounded to the nearest second, must fit the target duration
+            f'#EXT-X-TARGETDURATION:{max(math.ceil(self.target_duration), round(self.max_duration))}',
+            f'#EXT-X-MEDIA-SEQUENCE:{self.segments[0][0] if self.segments else self.next_index}',
+            f'#EXT-X-DISCONTINUITY-SEQUENCE:{self.discontinuity_sequence}',
+            '#EXT-X-INDEPENDENT-SEGMENTS'
+        ]
+        current_map = None
+        for index, duration, init_name, discontinuity in self.segments:
+            if discontinuity:
+                lines.append('#EXT-X-DISCONTINUITY')
+            if init_name != current_map:
+                lines.append(f'#EXT-X-MAP:URI="{init_name}"')
+                current_map = init_name
+            lines.append(f'#EXTINF:{duration:.3f},')
+            lines.append(f'segment-{index:05d}.m4s')
+        if self.finished:
+            lines.append('#EXT-X-ENDLIST')
+        path = os.path.join(self.directory, 'index.m3u8')
+        with open(path + '.tmp', 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+
+class Broadcast:
+    """One HLS broadcast of a session: its packager and RTP tap"""
+
+    def __init__(self, session_id, root=None, broadcast_id=None, on_key_frame_needed=None):
+        self.session_id = session_id
+        self.broadcast_id = broadcast_id or datetime.now(pytz.UTC).strftime('%Y%m%dT%H%M%SZ-') + uuid.uuid4().hex[:6]
+        self.directory = os.path.join(root or Config.HLS_DIR, session_id, self.broadcast_id)
+        os.makedirs(self.directory, exist_ok=True)
+        self.tap = None
+        self.packager = HlsPackager(self.directory, Config.HLS_SEGMENT_SECONDS, Config.HLS_PLAYLIST_SEGMENTS,
+                                    on_key_frame_needed)
+
+    @property
+    def url(self):
+        return f'/api/hls/{self.session_id}/{self.broadcast_id}/index.m3u8'
+
+    def video_consumer_ids(self):
+        if not self.tap:
+            return []
+        return [s['consumerId'] for s in self.tap.streams.values() if s['kind'] == 'video']
+
+
+class BroadcastManager:
+    """Live HLS broadcasts by session"""
+
+    def __init__(self):
+        self.socketio = None
+        self._lock = threading.Lock()
+        self._broadcasts = {}  # session_id -> Broadcast
+
+    def init_app(self, socketio):
+        self.socketio = socketio
+
+    def url(self, session_id):
+        """Playlist URL of the session's broadcast, or None when it is not broadcasting"""
+        with self._lock:
+            broadcast = self._broadcasts.get(session_id)
+        return broadcast.url if broadcast else None
+
+    def start(self, session_id):
+        """Start broadcasting session_id; producers join through add_producer as they are created"""
+        with self._lock:
+            if session_id in self._broadcasts:
+                return self._broadcasts[session_id]
+            broadcast = Broadcast(session_id)
+            broadcast.packager.on_key_frame_needed = lambda: self._request_key_frame(broadcast)
+            self._broadcasts[session_id] = broadcast
+        try:
+            broadcast.tap = RtpTap(session_id, broadcast.packager.feed)
+            broadcast.tap.open(self.socketio, [])
+        except Exception:
+            with self._lock:
+                self._broadcasts.pop(session_id, None)
+            broadcast.packager.finish()
+            raise
+        logger.info(f"Broadcasting session {session_id} as HLS from {broadcast.directory}")
+        return broadcast
+
+    def add_producer(self, session_id, producer_id, rtp_parameters):
+        """Package a new producer if the broadcast still lacks a track of its kind and can carry its codec"""
+        with self._lock:
+            broadcast = self._broadcasts.get(session_id)
+        if broadcast is None or broadcast.tap is None:
+            return False
+        codecs = (rtp_parameters or {}).get('codecs') or [{}]
+        kind = PACKAGED_CODECS.get(str(codecs[0].get('mimeType', '')).lower())
+        if kind is None or any(s.kind == kind for s in broadcast.packager.streams.values()):
+            logger.info(f"Producer {producer_id} is not part of the HLS broadcast of session {session_id}")
+            return False
+        return bool(broadcast.packager.add_streams(broadcast.tap.add_producers([producer_id])))
+
+    def stop(self, session_id):
+        """End the session's broadcast and its playlist; returns the Broadcast or None"""
+        with self._lock:
+            broadcast = self._broadcasts.pop(session_id, None)
+        if broadcast is None:
+            return None
+        if broadcast.tap:
+            broadcast.tap.close()
+        broadcast.packager.finish()
+        logger.info(f"Stopped HLS broadcast of session {session_id}: {broadcast.packager.next_index} segment(s)")
+        return broadcast
+
+    def stats(self):
+        with self._lock:
+            return {'active': len(self._broadcasts)}
+
+    def _request_key_frame(self, broadcast):
+        # Called from the packet path: hand the SFU round trip to a task of its own
+        consumer_ids = broadcast.video_consumer_ids()
+        if consumer_ids and self.socketio:
+            self.socketio.start_background_task(self._send_key_frame_request, broadcast.session_id, consumer_ids)
+
+    def _send_key_frame_request(self, session_id, consumer_ids):
+        try:
+            sfu_workers.run(self.socketio.async_mode, sfu_placement.request_key_frame, session_id, consumer_ids)
+        except MediasoupError as e:
+            logger.warning(f"Failed to request a keyframe for the HLS broadcast of session {session_id}: {str(e)}")
+
+
+# Shared broadcasts for the process
+broadcasts = BroadcastManager()
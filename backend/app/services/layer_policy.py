@@ -0,0 +1,210 @@
+"""Simulcast/SVC layer selection for video consumers
+
+Every simulcast or SVC consumer is registered here with the node that holds
+it. Its spatial layer is the lower of:
+
+- the layer the client pinned with set_preferred_layers, or else the highest
+  layer that fits the client's reported bandwidth and is no larger than
+  needed to fill its viewport;
+- the room cap: the highest layer whose bitrate times the number of video
+  consumers in the session stays within SFU_SESSION_EGRESS_BUDGET_KBPS.
+
+Defaults therefore step down as a room grows. Every call returns the
+consumers whose layers changed as (node id, consumer id, spatial, temporal)
+tuples, which the caller pushes to the SFU in one request per node. The room
+cap only moves at thresholds, so most joins change nothing but the new
+consumer.
+"""
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from config import Config
+
+# Share of the reported downlink a layer may use; the rest is audio and headroom
+BANDWIDTH_HEADROOM = 0.8
+
+
+@dataclass
+class ConsumerLayers:
+    consumer_id: str
+    node_id: str
+    session_id: str
+    user_id: Optional[str] = None
+    preferred: Optional[int] = None  # spatial layer pinned by the client; None lets the policy choose
+    spatial: int = 0
+    temporal: int = 0
+
+
+class LayerPolicy:
+    """Chooses and tracks the preferred layers of every video consumer"""
+
+    def __init__(self, layer_kbps, layer_heights, max_temporal_layer, budget_kbps):
+        self.layer_kbps = layer_kbps
+        self.layer_heights = layer_heights
+        self.max_temporal_layer = max_temporal_layer
+        self.budget_kbps = budget_kbps
+        self._lock = threading.Lock()
+        self._consumers = {}   # consumer_id -> ConsumerLayers
+        self._by_session = {}  # session_id -> set of consumer ids
+        self._caps = {}        # session_id -> room cap the session's layers were last chosen with
+        self._viewers = {}     # (session_id, user_id) -> (bandwidth kbps, viewport height)
+
+    @property
+    def top_layer(self):
+        return len(self.layer_kbps) - 1
+
+    def room_cap(self, consumer_count):
+        """Highest spatial layer that keeps consumer_count streams within the egress budget"""
+        if not self.budget_kbps:
+            return self.top_layer
+        for layer in range(self.top_layer, 0, -1):
+            if consumer_count * self.layer_kbps[layer] <= self.budget_kbps:
+                return layer
+        return 0
+
+    def initial(self, session_id, user_id):
+        """Layers for a consumer about to be created, to pass to the SFU with the consume"""
+        with self._lock:
+            cap = self.room_cap(len(self._by_session.get(session_id, ())) + 1)
+            spatial, temporal = self._target(session_id, user_id, None, cap)
+        return {'spatialLayer': spatial, 'temporalLayer': temporal}
+
+    def add(self, consumer_id, node_id, session_id, user_id, layers=None):
+        """Register a video consumer created with layers; returns changes for the rest of the room"""
+        with self._lock:
+            consumer = ConsumerLayers(consumer_id, node_id, session_id, user_id)
+            if layers:
+                consumer.spatial = layers.get('spatialLayer', 0)
+                consumer.temporal = layers.get('temporalLayer', self.max_temporal_layer)
+            self._consumers[consumer_id] = consumer
+            self._by_session.setdefault(session_id, set()).add(consumer_id)
+            return self._rebalance(session_id, [consumer_id])
+
+    def forget(self, consumer_ids):
+        """Drop closed consumers; returns changes if the room cap went up"""
+        with self._lock:
+            sessions = set()
+            for consumer_id in consumer_ids:
+                consumer = self._consumers.pop(consumer_id, None)
+                if consumer is None:
+                    continue
+                sessions.add(consumer.session_id)
+                members = self._by_session.get(consumer.session_id)
+                if members is not None:
+                    members.discard(consumer_id)
+                    if not members:
+                        del self._by_session[consumer.session_id]
+                        self._caps.pop(consumer.session_id, None)
+            changes = []
+            for session_id in sessions:
+                changes.extend(self._rebalance(session_id, []))
+            return changes
+
+    def forget_viewer(self, session_id, user_id):
+        with self._lock:
+            self._viewers.pop((session_id, user_id), None)
+
+    def prefer(self, consumer_id, spatial_layer=None):
+        """Pin a consumer to spatial_layer (None goes back to automatic); returns (consumer, changes)"""
+        if spatial_layer is not None and not 0 <= spatial_layer <= self.top_layer:
+            raise ValueError(f"spatialLayer must be between 0 and {self.top_layer}")
+        with self._lock:
+            consumer = self._consumers.get(consumer_id)
+            if consumer is None:
+                return None, []
+            consumer.preferred = spatial_layer
+            changes = self._rebalance(consumer.session_id, [consumer_id])
+            return self._describe(consumer), changes
+
+    def report(self, session_id, user_id, bandwidth_kbps=None, viewport_height=None):
+        """Record a viewer's downlink and viewport; returns changes for the viewer's consumers"""
+        with self._lock:
+            previous = self._viewers.get((session_id, user_id), (None, None))
+            self._viewers[(session_id, user_id)] = (
+                bandwidth_kbps if bandwidth_kbps is not None else previous[0],
+                viewport_height if viewport_height is not None else previous[1]
+            )
+            touched = [i for i in self._by_session.get(session_id, ())
+                       if self._consumers[i].user_id == user_id]
+            return self._rebalance(session_id, touched)
+
+    def describe(self, consumer_id):
+        with self._lock:
+            consumer = self._consumers.get(consumer_id)
+            return self._describe(consumer) if consumer else None
+
+    def summary(self, session_id):
+        """Consumer count, room cap and estimated video egress of a session"""
+        with self._lock:
+            ids = self._by_session.get(session_id, ())
+            return {
+                'consumers': len(ids),
+                'roomCap': self._caps.get(session_id, self.room_cap(len(ids))),
+                'egressKbps': sum(self.layer_kbps[self._consumers[i].spatial] for i in ids),
+                'budgetKbps': self.budget_kbps
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'consumers': len(self._consumers),
+                'sessions': len(self._by_session),
+                'egressKbps': sum(self.layer_kbps[c.spatial] for c in self._consumers.values()),
+                'budgetKbps': self.budget_kbps
+            }
+
+    def _target(self, session_id, user_id, preferred, cap):
+        # Caller holds the lock
+        if preferred is not None:
+            return min(preferred, cap), self.max_temporal_layer
+        bandwidth, viewport = self._viewers.get((session_id, user_id), (None, None))
+        spatial = self.top_layer
+        if viewport:
+            spatial = next((layer for layer, height in enumerate(self.layer_heights) if height >= viewport),
+                           self.top_layer)
+        temporal = self.max_temporal_layer
+        if bandwidth:
+            usable = bandwidth * BANDWIDTH_HEADROOM
+            fitting = [layer for layer, kbps in enumerate(self.layer_kbps) if kbps <= usable]
+            spatial = min(spatial, fitting[-1] if fitting else 0)
+            if not fitting:
+                temporal = 0  # Not even the lowest layer fits: keep the base frame rate only
+        return min(spatial, cap), temporal
+
+    def _rebalance(self, session_id, touched):
+        # Caller holds the lock. Everyone is re-evaluated when the room cap moved,
+        # otherwise only the touched consumers.
+        ids = self._by_session.get(session_id, set())
+        cap = self.room_cap(len(ids))
+        if self._caps.get(session_id) != cap:
+            self._caps[session_id] = cap
+            touched = ids
+        changes = []
+        for consumer_id in touched:
+            consumer = self._consumers.get(consumer_id)
+            if consumer is None:
+                continue
+            spatial, temporal = self._target(session_id, consumer.user_id, consumer.preferred, cap)
+            if (spatial, temporal) != (consumer.spatial, consumer.temporal):
+                consumer.spatial, consumer.temporal = spatial, temporal
+                changes.append((consumer.node_id, consumer.consumer_id, spatial, temporal))
+        return changes
+
+    @staticmethod
+    def _describe(consumer):
+        return {
+            'consumerId': consumer.consumer_id,
+            'spatialLayer': consumer.spatial,
+            'temporalLayer': consumer.temporal,
+            'preferredSpatialLayer': consumer.preferred
+        }
+
+
+# Shared policy for the process
+layer_policy = LayerPolicy(
+    Config.SIMULCAST_LAYER_KBPS,
+    Config.SIMULCAST_LAYER_HEIGHTS,
+    Config.SIMULCAST_MAX_TEMPORAL_LAYER,
+    Config.SFU_SESSION_EGRESS_BUDGET_KBPS
+)
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.services import timing
+from app.services.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class MediasoupError(Exception):
+    """Raised when a call to the mediasoup server fails or is rejected"""
+
+    def __init__(self, message, status_code=None, route=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.route = route
+
+
+class RouteStats:
+    """Latency and error counters for one mediasoup route"""
+
+    SAMPLE_SIZE = 512
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=self.SAMPLE_SIZE)
+
+    def record(self, elapsed_ms, failed):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.samples.append(elapsed_ms)
+        if failed:
+            self.errors += 1
+
+    def to_dict(self):
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 2)
+
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avgMs': round(self.total_ms / self.count, 2) if self.count else 0.0,
+            'maxMs': round(self.max_ms, 2),
+            'p50Ms': percentile(0.50),
+            'p95Ms': percentile(0.95),
+            'p99Ms': percentile(0.99)
+        }
+
+
+class MediasoupClient:
+    """Keep-alive HTTP client for the mediasoup control plane (mediasoup/server.js)
+
+    One instance is shared by every route and socket handler in the process. It
+    reuses pooled connections, applies a connect/read timeout to every call,
+    caps the number of in-flight calls and keeps per-route latency stats.
+    """
+
+    def __init__(self, base_url, connect_timeout=None, timeout=None,
+                 pool_size=None, max_concurrency=None):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout or Config.MEDIASOUP_CONNECT_TIMEOUT
+        self.timeout = timeout or Config.MEDIASOUP_TIMEOUT
+
+        pool_size = pool_size or Config.MEDIASOUP_POOL_SIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._slots = threading.BoundedSemaphore(max_concurrency or Config.MEDIASOUP_MAX_CONCURRENCY)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def get(self, route, timeout=None):
+        """Issue a GET request and return the decoded JSON body"""
+        return self.request('GET', route, timeout=timeout)
+
+    def post(self, route, payload=None, timeout=None):
+        """Issue a POST request with a JSON body and return the decoded JSON body"""
+        return self.request('POST', route, payload if payload is not None else {}, timeout=timeout)
+
+    def request(self, method, route, payload=None, timeout=None):
+        """Send a request to the mediasoup server
+
+        Raises MediasoupError on transport failures, timeouts, saturation and
+        non-2xx responses, so callers only need a single except clause.
+        """
+        read_timeout = timeout or self.timeout
+        if not self._slots.acquire(timeout=read_timeout):
+            self._record(route, 0.0, failed=True)
+            raise MediasoupError('Mediasoup server is saturated', status_code=503, route=route)
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(
+                method,
+                f"{self.base_url}{route}",
+                json=payload,
+                timeout=(self.connect_timeout, read_timeout)
+            )
+            body = self._decode(response)
+            if response.status_code >= 400:
+                message = body.get('error') if isinstance(body, dict) else None
+                raise MediasoupError(message or f"HTTP {response.status_code}",
+                                     status_code=response.status_code, route=route)
+            failed = False
+            return body
+        except requests.Timeout as e:
+            raise MediasoupError(f"Mediasoup request timed out: {str(e)}", status_code=504, route=route) from e
+        except requests.RequestException as e:
+            raise MediasoupError(f"Mediasoup request failed: {str(e)}", status_code=502, route=route) from e
+        finally:
+            self._slots.release()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._record(route, elapsed_ms, failed)
+            if failed:
+                logger.warning(f"Mediasoup {method} {route} failed after {elapsed_ms:.1f}ms")
+
+    def stats(self):
+        """Return a snapshot of per-route latency and error counters"""
+        with self._stats_lock:
+            return {route: stats.to_dict() for route, stats in self._stats.items()}
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+
+    def _record(self, route, elapsed_ms, failed):
+        route = route.split('?', 1)[0]
+        with self._stats_lock:
+            stats = self._stats.get(route)
+            if stats is None:
+                stats = self._stats[route] = RouteStats()
+            stats.record(elapsed_ms, failed)
+        timing.record('sfu', elapsed_ms / 1000.0)
+        labels = (('route', route),)
+        metrics.observe('sfu_request_duration_seconds', labels, elapsed_ms / 1000.0)
+        if failed:
+            metrics.inc('sfu_request_errors_total', labels)
+
+    @staticmethod
+    def _decode(response):
+        try:
+            return response.json()
+        except ValueError:
+            return {}
+
+
+# Shared client used by all routes and socket handlers
+mediasoup_client = MediasoupClient(Config.MEDIASOUP_SERVER_URL)
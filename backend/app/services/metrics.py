@@ -0,0 +1,182 @@
+"""Low-overhead Prometheus-style metrics
+
+Counters and histograms are recorded into a per-thread shard, so the hot
+path never takes a lock: each shard has a single writer. A scrape sums the
+shards. Shards of threads that have exited (werkzeug spawns one thread per
+request in threading mode) are folded into a retired total so the shard list
+stays small. Gauges are computed at scrape time by registered callbacks.
+"""
+import bisect
+import threading
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MAX_LIVE_SHARDS = 256
+
+
+class _Shard:
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}    # (name, labels) -> float
+        self.histograms = {}  # (name, labels) -> [bucket counts..., count, sum]
+
+    def merge_into(self, other):
+        for key, value in self.counters.items():
+            other.counters[key] = other.counters.get(key, 0) + value
+        for key, values in self.histograms.items():
+            target = other.histograms.get(key)
+            if target is None:
+                other.histograms[key] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    target[i] += value
+
+
+class MetricsRegistry:
+    """Counters, histograms and callback gauges rendered in Prometheus text format"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards = []      # (thread, shard)
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+        self._help = {}        # name -> (type, help)
+        self._gauges = []      # (name, help, fn)
+
+    def describe(self, name, metric_type, help_text):
+        """Declare the TYPE and HELP lines for a counter or histogram"""
+        self._help[name] = (metric_type, help_text)
+
+    def register_gauge(self, name, help_text, fn):
+        """Register fn() -> iterable of (labels dict, value), evaluated on scrape"""
+        self._gauges.append((name, help_text, fn))
+
+    def inc(self, name, labels=(), amount=1):
+        """Add amount to a counter; labels is a tuple of (key, value) pairs"""
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, labels, seconds):
+        """Record one histogram observation in seconds"""
+        histograms = self._shard().histograms
+        key = (name, labels)
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(self.buckets) + 2)
+        values[bisect.bisect_left(self.buckets, seconds)] += 1
+        values[-2] += 1
+        values[-1] += seconds
+
+    def snapshot(self):
+        """Return a merged copy of all counters and histograms"""
+        with self._lock:
+            self._fold_dead_shards()
+            merged = _Shard()
+            self._retired.merge_into(merged)
+            for _, shard in self._shards:
+                # Copy first: the owning thread may be writing concurrently
+                copy = _Shard()
+                copy.counters = dict(shard.counters)
+                copy.histograms = {key: list(values) for key, values in list(shard.histograms.items())}
+                copy.merge_into(merged)
+        return merged
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        merged = self.snapshot()
+        lines = []
+
+        counters = {}
+        for (name, labels), value in merged.counters.items():
+            counters.setdefault(name, []).append((labels, value))
+        for name in sorted(counters):
+            self._header(lines, name, 'counter')
+            for labels, value in sorted(counters[name]):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        histograms = {}
+        for (name, labels), values in merged.histograms.items():
+            histograms.setdefault(name, []).append((labels, values))
+        for name in sorted(histograms):
+            self._header(lines, name, 'histogram')
+            for labels, values in sorted(histograms[name]):
+                cumulative = 0
+                for bound, count in zip(self.buckets, values):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {values[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {values[-2]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+
+        for name, help_text, fn in self._gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                samples = list(fn())
+            except Exception as e:
+                lines.append(f"# error collecting {name}: {str(e)}")
+                continue
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines, name, default_type):
+        metric_type, help_text = self._help.get(name, (default_type, name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > MAX_LIVE_SHARDS:
+                    self._fold_dead_shards()
+        return shard
+
+    def _fold_dead_shards(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                shard.merge_into(self._retired)
+        self._shards = live
+
+
+def _escape_label(value):
+    # The exposition format escapes backslash, double quote and line feed in label values
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
+
+metrics.describe('http_request_duration_seconds', 'histogram', 'Flask request latency by route')
+metrics.describe('http_requests_total', 'counter', 'Flask requests by route and status')
+metrics.describe('socketio_event_duration_seconds', 'histogram', 'Socket.IO handler latency by event')
+metrics.describe('socketio_event_errors_total', 'counter', 'Socket.IO handlers that raised, by event')
+metrics.describe('socketio_emits_total', 'counter', 'Socket.IO frames emitted by event name')
+metrics.describe('socketio_coalesced_events_total', 'counter', 'Room events buffered into batched frames')
+metrics.describe('socketio_encoded_bytes_total', 'counter', 'Socket.IO packet bytes encoded by serializer (SOCKETIO_SERIALIZER=msgpack)')
+metrics.describe('socketio_encode_duration_seconds', 'histogram', 'Socket.IO packet encoding time by serializer (SOCKETIO_SERIALIZER=msgpack)')
+metrics.describe('sfu_request_duration_seconds', 'histogram', 'mediasoup control-plane call latency by route')
+metrics.describe('sfu_request_errors_total', 'counter', 'Failed mediasoup control-plane calls by route')
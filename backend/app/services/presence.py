@@ -0,0 +1,173 @@
+import atexit
+import logging
+import threading
+
+from sqlalchemy import update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import User
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# User columns owned by the presence store, mapped to their to_dict() keys
+PRESENCE_FIELDS = {
+    'hand_raised': 'handRaised',
+    'is_muted': 'isMuted',
+    'video_enabled': 'videoEnabled',
+    'is_streaming': 'isStreaming'
+}
+
+
+class PresenceStore:
+    """In-process presence state with write-behind persistence
+
+    Toggle events update memory and are broadcast immediately; changed rows
+    are written to the users table in batched UPDATEs at most flush_interval
+    seconds later, and once more when the process exits. If a flush fails the
+    changes stay pending and are retried on the next tick.
+    """
+
+    def __init__(self, flush_interval, max_batch):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._state = {}    # user_id -> {'name': ..., field: value}
+        self._dirty = {}    # user_id -> {field: value} not yet persisted
+        self._evict = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._running = False
+
+    def start(self, socketio):
+        """Start the periodic flush task and register the shutdown flush"""
+        if self._running:
+            return
+        self._running = True
+        socketio.start_background_task(self._flush_loop, socketio)
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flush loop and persist anything still pending"""
+        self._running = False
+        self.flush()
+
+    def ensure(self, user_id):
+        """Return the presence entry for user_id, loading it once from the database
+
+        Returns None if the user does not exist.
+        """
+        with self._lock:
+            entry = self._state.get(user_id)
+            if entry is not None:
+                return dict(entry)
+
+        with SQLSession(Config.engine) as db_session:
+            user = db_session.query(User).filter_by(user_id=user_id).first()
+            if not user:
+                return None
+            return self.seed(user)
+
+    def seed(self, user):
+        """Cache a loaded User row; pending in-memory changes win over the row"""
+        with self._lock:
+            entry = self._state.get(user.user_id)
+            if entry is None:
+                entry = {'name': user.name}
+                for field in PRESENCE_FIELDS:
+                    entry[field] = getattr(user, field)
+                self._state[user.user_id] = entry
+            self._evict.discard(user.user_id)
+            return dict(entry)
+
+    def update(self, user_id, **fields):
+        """Change presence fields in memory and schedule them for persistence"""
+        self._apply(user_id, fields, persist=True)
+
+    def sync(self, user_id, **fields):
+        """Record fields the caller has already committed to the database"""
+        self._apply(user_id, fields, persist=False)
+
+    def overlay(self, user_dict):
+        """Return a User.to_dict() payload with the latest in-memory presence"""
+        with self._lock:
+            entry = self._state.get(user_dict.get('userId'))
+            if entry is None:
+                return user_dict
+            merged = dict(user_dict)
+            for field, key in PRESENCE_FIELDS.items():
+                merged[key] = entry[field]
+            return merged
+
+    def discard(self, user_id):
+        """Forget a user once their pending changes have been flushed"""
+        with self._lock:
+            if user_id in self._dirty:
+                self._evict.add(user_id)
+            else:
+                self._state.pop(user_id, None)
+
+    def flush(self):
+        """Write all pending changes to the users table in batched UPDATEs"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                pending, self._dirty = self._dirty, {}
+
+            rows = [dict(changes, user_id=user_id) for user_id, changes in pending.items()]
+            try:
+                with SQLSession(Config.engine) as db_session:
+                    for start in range(0, len(rows), self.max_batch):
+                        db_session.execute(update(User), rows[start:start + self.max_batch])
+                    db_session.commit()
+            except SQLAlchemyError as e:
+                logger.error(f"Presence flush of {len(rows)} users failed: {str(e)}")
+                self._requeue(pending)
+                return 0
+
+            with self._lock:
+                for user_id in list(self._evict):
+                    if user_id not in self._dirty:
+                        self._state.pop(user_id, None)
+                        self._evict.discard(user_id)
+
+            logger.debug(f"Presence flushed {len(rows)} users")
+            return len(rows)
+
+    def _apply(self, user_id, fields, persist):
+        unknown = set(fields) - set(PRESENCE_FIELDS)
+        if unknown:
+            raise ValueError(f"Not a presence field: {', '.join(sorted(unknown))}")
+        with self._lock:
+            entry = self._state.get(user_id)
+            if entry is not None:
+                entry.update(fields)
+            if persist:
+                self._dirty.setdefault(user_id, {}).update(fields)
+            elif user_id in self._dirty:
+                pending = self._dirty[user_id]
+                for field in fields:
+                    pending.pop(field, None)
+                if not pending:
+                    del self._dirty[user_id]
+
+    def _requeue(self, pending):
+        with self._lock:
+            for user_id, changes in pending.items():
+                # Changes made while the flush was running are newer; keep them
+                merged = dict(changes)
+                merged.update(self._dirty.get(user_id, {}))
+                self._dirty[user_id] = merged
+
+    def _flush_loop(self, socketio):
+        while self._running:
+            socketio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Unexpected error in presence flush: {str(e)}")
+
+
+# Shared presence store for the process
+presence_store = PresenceStore(Config.PRESENCE_FLUSH_INTERVAL, Config.PRESENCE_MAX_BATCH)
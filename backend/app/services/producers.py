@@ -0,0 +1,123 @@
+import logging
+from datetime import datetime
+
+import pytz
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import Producer
+from app.services.hls import broadcasts
+from app.services.mediasoup_client import MediasoupError
+from app.services.recording import recordings
+from app.services.sfu_placement import sfu_placement
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ('camera', 'mic', 'screen')
+
+
+def default_source(kind, source=None):
+    """The producer's source as sent by the client, or camera/mic by kind"""
+    if source in SOURCES:
+        return source
+    return 'mic' if kind == 'audio' else 'camera'
+
+
+def record_producer(db_session, session_id, user_id, producer_id, kind, source=None, node_id=None):
+    """Add a live producer row for the session (the caller commits)"""
+    producer = Producer(
+        producer_id=producer_id,
+        session_id=session_id,
+        user_id=user_id,
+        kind=kind,
+        source=default_source(kind, source),
+        state=Producer.LIVE,
+        sfu_node=node_id,
+        created_at=datetime.now(pytz.UTC)
+    )
+    db_session.add(producer)
+    return producer
+
+
+def start_producer(session_id, user_id, transport_id, kind, rtp_parameters, source=None):
+    """Create a producer on the SFU, feed it to the session's edge, recording and broadcast, and record it
+
+    Blocks on SFU and database calls, so socket handlers run it through
+    sfu_workers. Returns the producer id; the caller announces it with
+    producer_event().
+    """
+    producer_id = sfu_placement.produce(session_id, user_id, transport_id, kind, rtp_parameters)['id']
+    try:
+        # Feed the session's edge router on the second node, if it has one
+        sfu_placement.pipe_producers(session_id, [producer_id])
+    except MediasoupError as e:
+        logger.error(f"Failed to pipe producer {producer_id} to the edge of session {session_id}: {str(e)}")
+    try:
+        recordings.add_producers(session_id, [producer_id])
+    except MediasoupError as e:
+        logger.error(f"Failed to add producer {producer_id} to the recording of session {session_id}: {str(e)}")
+    try:
+        broadcasts.add_producer(session_id, producer_id, rtp_parameters)
+    except MediasoupError as e:
+        logger.error(f"Failed to add producer {producer_id} to the HLS broadcast of session {session_id}: {str(e)}")
+    with SQLSession(Config.engine) as db_session:
+        resource = sfu_placement.resources.get(producer_id)
+        record_producer(db_session, session_id, user_id, producer_id, kind, source,
+                        resource.node_id if resource else None)
+        db_session.commit()
+    return producer_id
+
+
+def producer_event(producer_id, kind, source, user_id):
+    """The newProducer payload sent to the session's room"""
+    return {'producerId': producer_id, 'kind': kind, 'source': source, 'userId': user_id}
+
+
+def live_producers(db_session, session_id):
+    """Every producer of the session that is not closed, from one scan of ix_producers_session_state"""
+    return db_session.query(Producer).filter(
+        Producer.session_id == session_id,
+        Producer.state.in_((Producer.LIVE, Producer.PAUSED))
+    ).all()
+
+
+def open_producer_ids(db_session, session_id, user_id=None):
+    """Ids of the session's (or one user's) producers that are not closed"""
+    query = db_session.query(Producer.producer_id).filter(
+        Producer.session_id == session_id,
+        Producer.state != Producer.CLOSED
+    )
+    if user_id:
+        query = query.filter(Producer.user_id == user_id)
+    return [row.producer_id for row in query]
+
+
+def producer_in_session(db_session, session_id, producer_id):
+    """Whether producer_id was produced in session_id"""
+    return db_session.query(Producer.producer_id).filter_by(
+        producer_id=producer_id, session_id=session_id
+    ).first() is not None
+
+
+def mark_producers_closed(db_session, producer_ids):
+    """Flag producers closed with one UPDATE (the caller commits)"""
+    if not producer_ids:
+        return 0
+    return db_session.query(Producer).filter(
+        Producer.producer_id.in_(list(producer_ids)),
+        Producer.state != Producer.CLOSED
+    ).update({'state': Producer.CLOSED, 'closed_at': datetime.now(pytz.UTC)}, synchronize_session=False)
+
+
+def close_session_producers(db_session, session_id, user_id=None, already_closed=()):
+    """Close the session's (or one user's) open producers in one UPDATE and one SFU batch
+
+    already_closed lists producers the caller has just closed on the SFU
+    (e.g. with the user's transports); they are marked closed here without
+    another SFU call. The caller commits. Returns every closed producer id.
+    """
+    producer_ids = open_producer_ids(db_session, session_id, user_id)
+    closed = list(dict.fromkeys([*already_closed, *producer_ids]))
+    mark_producers_closed(db_session, closed)
+    sfu_placement.close_producers(session_id, [p for p in producer_ids if p not in set(already_closed)])
+    return closed
@@ -0,0 +1,109 @@
+"""Statistical profiler for diagnosing production hot spots on demand
+
+A sampler thread snapshots every thread's stack with sys._current_frames()
+at a fixed interval and aggregates self/total sample counts per function and
+per collapsed stack (flamegraph format). The sampler always runs on a real
+OS thread, so under eventlet it also catches whichever greenlet holds the
+hub thread at each sample.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import Config
+
+try:
+    from eventlet import patcher as _eventlet_patcher
+except ImportError:  # eventlet is optional outside production
+    _eventlet_patcher = None
+
+if _eventlet_patcher is not None and _eventlet_patcher.is_monkey_patched('thread'):
+    _threading = _eventlet_patcher.original('threading')
+    _time = _eventlet_patcher.original('time')
+else:
+    _threading = threading
+    _time = time
+
+MAX_STACK_DEPTH = 64
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profiling window is already running"""
+
+
+class SamplingProfiler:
+    """Runs one fixed-length profiling window at a time"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._busy = threading.Lock()
+
+    def profile(self, seconds, sleep=time.sleep, limit=50):
+        """Sample all threads for the given window and return the aggregated profile
+
+        sleep is used to wait out the window so the caller can yield to its
+        event loop (pass socketio.sleep under eventlet or gevent).
+        """
+        if not self._busy.acquire(blocking=False):
+            raise ProfilerBusyError('A profiling window is already running')
+        try:
+            stop = _threading.Event()
+            result = {}
+            sampler = _threading.Thread(target=self._sample, args=(stop, result), name='profiler', daemon=True)
+            sampler.start()
+            sleep(seconds)
+            stop.set()
+            sampler.join()
+        finally:
+            self._busy.release()
+        return self._summarize(result, seconds, limit)
+
+    def _sample(self, stop, result):
+        own_id = _threading.get_ident()
+        self_counts = Counter()
+        total_counts = Counter()
+        stacks = Counter()
+        samples = 0
+        while not stop.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                samples += 1
+                self_counts[stack[0]] += 1
+                total_counts.update(set(stack))
+                stacks[';'.join(reversed(stack))] += 1
+            _time.sleep(self.interval)
+        result.update(samples=samples, self=self_counts, total=total_counts, stacks=stacks)
+
+    def _summarize(self, result, seconds, limit):
+        samples = result.get('samples', 0)
+
+        def pct(count):
+            return round(100.0 * count / samples, 2) if samples else 0.0
+
+        total_counts = result.get('total', Counter())
+        self_counts = result.get('self', Counter())
+        return {
+            'seconds': seconds,
+            'intervalMs': self.interval * 1000,
+            'samples': samples,
+            'topSelf': [{'function': name, 'samples': count, 'percent': pct(count),
+                         'totalPercent': pct(total_counts[name])}
+                        for name, count in self_counts.most_common(limit)],
+            'topTotal': [{'function': name, 'samples': count, 'percent': pct(count)}
+                         for name, count in total_counts.most_common(limit)],
+            'stacks': [{'stack': stack, 'samples': count}
+                       for stack, count in result.get('stacks', Counter()).most_common(limit)]
+        }
+
+
+# Shared profiler; only one window runs per process at a time
+profiler = SamplingProfiler(Config.PROFILER_SAMPLE_INTERVAL_MS / 1000.0)
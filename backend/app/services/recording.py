@@ -0,0 +1,253 @@
+"""Server-side recording of a session's producers into segmented rtpdump files
+
+A recording taps the session's producers (see rtp_tap) and streams every RTP
+packet straight to disk in rtpdump format, which rtpplay, Wireshark and
+ffmpeg-based tooling can read. A segment is closed and a new one started once
+it reaches RECORDING_SEGMENT_MAX_BYTES or RECORDING_SEGMENT_SECONDS, and
+nothing is held in memory but the open file's write buffer, so memory stays
+constant however long the class runs.
+
+Each recording lives in RECORDING_DIR/<session id>/<recording id>/ with an
+index.json listing its streams (SSRC, payload type, codec) and finalized
+segments. The index is rewritten each time a segment is finalized, and the
+session's recording_url points at it from the first finalized segment on.
+"""
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pytz
+from sqlalchemy import update
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import Session
+from app.services.rtp_tap import RtpTap, rtp_header
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+RTPDUMP_MAGIC = b'#!rtpplay1.0 '
+WRITE_BUFFER = 64 * 1024
+
+
+def write_rtpdump_header(file, start, address='0.0.0.0', port=0):
+    """File header: text line plus RD_hdr_t (start time, source address and port)"""
+    file.write(RTPDUMP_MAGIC + f'{address}/{port}\n'.encode())
+    seconds = int(start)
+    file.write(struct.pack('!IIIHH', seconds, int((start - seconds) * 1_000_000),
+                           struct.unpack('!I', socket.inet_aton(address))[0], port, 0))
+
+
+def write_rtpdump_record(file, packet, offset_ms):
+    """One RD_packet_t: record length, packet length, offset from the file start, packet"""
+    file.write(struct.pack('!HHI', 8 + len(packet), len(packet), offset_ms))
+    file.write(packet)
+
+
+def read_rtpdump(path):
+    """Yield (arrival time, packet) from an rtpdump file, e.g. a segment or a fixture"""
+    with open(path, 'rb') as file:
+        if not file.readline().startswith(RTPDUMP_MAGIC):
+            raise ValueError(f"{path} is not an rtpdump file")
+        seconds, microseconds, _, _, _ = struct.unpack('!IIIHH', file.read(16))
+        start = seconds + microseconds / 1_000_000
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                return
+            length, packet_length, offset_ms = struct.unpack('!HHI', header)
+            packet = file.read(length - 8)
+            yield start + offset_ms / 1000, packet[:packet_length]
+
+
+class SegmentWriter:
+    """Appends RTP packets to rtpdump segment files, rolling over by size and duration"""
+
+    def __init__(self, directory, max_bytes, max_seconds, on_segment):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.on_segment = on_segment  # called with each finalized segment's metadata
+        self.index = 0
+        self._file = None
+        self._segment = None
+
+    def write(self, packet, arrival):
+        record_size = 8 + len(packet)
+        segment = self._segment
+        if (segment is None or segment['bytes'] + record_size > self.max_bytes
+                or arrival - segment['start'] >= self.max_seconds):
+            self._roll(arrival)
+            segment = self._segment
+        write_rtpdump_record(self._file, packet, max(int((arrival - segment['start']) * 1000), 0))
+        segment['bytes'] += record_size
+        segment['packets'] += 1
+        segment['end'] = arrival
+        segment['ssrcs'].add(rtp_header(packet)[4])
+
+    def close(self):
+        """Finalize the open segment, if any"""
+        self._finalize()
+
+    def _roll(self, start):
+        self._finalize()
+        name = f'segment-{self.index:05d}.rtpdump'
+        self.index += 1
+        self._file = open(os.path.join(self.directory, name), 'wb', buffering=WRITE_BUFFER)
+        write_rtpdump_header(self._file, start)
+        self._segment = {'name': name, 'start': start, 'end': start, 'packets': 0,
+                         'bytes': self._file.tell(), 'ssrcs': set()}
+
+    def _finalize(self):
+        if self._file is None:
+            return
+        self._file.close()
+        segment, self._file, self._segment = self._segment, None, None
+        self.on_segment(dict(segment, ssrcs=sorted(segment['ssrcs'])))
+
+
+class Recording:
+    """One recording of a session: its writer, index and (when live) its RTP tap"""
+
+    def __init__(self, session_id, root=None, recording_id=None, max_bytes=None, max_seconds=None, publish=True,
+                 schedule=None):
+        self.session_id = session_id
+        self.recording_id = recording_id or datetime.now(pytz.UTC).strftime('%Y%m%dT%H%M%SZ-') + uuid.uuid4().hex[:6]
+        self.directory = os.path.join(root or Config.RECORDING_DIR, session_id, self.recording_id)
+        os.makedirs(self.directory, exist_ok=True)
+        self.started_at = time.time()
+        self.streams = []
+        self.segments = []
+        self.finished = False
+        self.tap = None
+        self._lock = threading.Lock()
+        self._published = not publish  # offline replays leave the database alone
+        self._schedule = schedule or (lambda fn: fn())  # runs the recording_url update off the packet path
+        self.writer = SegmentWriter(self.directory, max_bytes or Config.RECORDING_SEGMENT_MAX_BYTES,
+                                    max_seconds or Config.RECORDING_SEGMENT_SECONDS, self._on_segment)
+
+    @property
+    def url(self):
+        return f'/api/recordings/{self.session_id}/{self.recording_id}/index.json'
+
+    def feed(self, packet, arrival):
+        """Sink for the RTP tap (or a replayed fixture)"""
+        with self._lock:
+            if not self.finished:
+                self.writer.write(packet, arrival)
+
+    def add_streams(self, streams):
+        with self._lock:
+            self.streams.extend(streams)
+            self._write_index()
+
+    def finish(self):
+        with self._lock:
+            self.writer.close()
+            self.finished = True
+            self._write_index()
+
+    def _on_segment(self, segment):
+        # Runs under self._lock, from write() or finish(), on the packet path
+        self.segments.append(segment)
+        self._write_index()
+        if not self._published:
+            self._published = True
+            self._schedule(self._publish)
+
+    def _publish(self):
+        if not publish_recording_url(self.session_id, self.url):
+            self._published = False  # try again after the next segment
+
+    def _write_index(self):
+        index = {
+            'sessionId': self.session_id,
+            'recordingId': self.recording_id,
+            'startedAt': self.started_at,
+            'finished': self.finished,
+            'streams': self.streams,
+            'segments': self.segments
+        }
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.tmp', 'w') as file:
+            json.dump(index, file)
+        os.replace(path + '.tmp', path)
+
+
+def publish_recording_url(session_id, url):
+    """Point the session's recording_url at a recording index; True once stored"""
+    try:
+        with SQLSession(Config.engine) as db_session:
+            db_session.execute(update(Session).where(Session.session_id == session_id).values(recording_url=url))
+            db_session.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Failed to store recording_url of session {session_id}: {str(e)}")
+        return False
+
+
+class RecordingManager:
+    """Live recordings by session"""
+
+    def __init__(self):
+        self.socketio = None
+        self._lock = threading.Lock()
+        self._recordings = {}  # session_id -> Recording
+
+    def init_app(self, socketio):
+        self.socketio = socketio
+
+    def is_recording(self, session_id):
+        with self._lock:
+            return session_id in self._recordings
+
+    def start(self, session_id, producer_ids):
+        """Start recording the given producers of session_id; returns the Recording"""
+        with self._lock:
+            if session_id in self._recordings:
+                return self._recordings[session_id]
+            recording = self._recordings[session_id] = Recording(
+                session_id, schedule=self.socketio.start_background_task)
+        try:
+            recording.tap = RtpTap(session_id, recording.feed)
+            recording.add_streams(recording.tap.open(self.socketio, producer_ids))
+        except Exception:
+            with self._lock:
+                self._recordings.pop(session_id, None)
+            recording.finish()
+            raise
+        logger.info(f"Recording session {session_id} to {recording.directory}")
+        return recording
+
+    def add_producers(self, session_id, producer_ids):
+        """Include producers created after the recording started"""
+        with self._lock:
+            recording = self._recordings.get(session_id)
+        if recording and recording.tap:
+            recording.add_streams(recording.tap.add_producers(producer_ids))
+
+    def stop(self, session_id):
+        """Stop recording session_id and finalize its last segment; returns the Recording or None"""
+        with self._lock:
+            recording = self._recordings.pop(session_id, None)
+        if recording is None:
+            return None
+        if recording.tap:
+            recording.tap.close()
+        recording.finish()
+        logger.info(f"Stopped recording session {session_id}: {len(recording.segments)} segment(s)")
+        return recording
+
+    def stats(self):
+        with self._lock:
+            return {'active': len(self._recordings)}
+
+
+# Shared recordings for the process
+recordings = RecordingManager()
@@ -0,0 +1,230 @@
+"""Versioned in-memory rosters with delta history
+
+Each session's roster holds a compact entry per participant (userId, name,
+isTeacher) and a version that goes up by one on every join and leave. The
+last ROSTER_LOG_SIZE changes are kept as deltas, so a client that knows the
+roster at version V catches up with just the changes after V. When those are
+no longer in the log, or the client's version belongs to another epoch, it
+gets a snapshot instead.
+
+A roster is loaded from session_participants the first time this process
+needs it, and that starts a new epoch. A process restart therefore never
+answers a version from before it with deltas. Presence toggles (mute, hand,
+video) are not roster changes: they keep their own events and are merged
+into snapshot entries from the presence store.
+
+With SOCKETIO_MESSAGE_QUEUE set, joins and leaves of one session are handled
+by several processes, so versions cannot be counted in memory. The
+SharedRosterStore used then bumps sessions.roster_version for every change,
+reads members from session_participants for each snapshot, and answers with
+deltas only when its own log holds every change after the client's version.
+A participant's join is recorded once, when session_participants.in_roster
+flips, so the REST join and the socket join that follows it share a version.
+"""
+import threading
+import uuid
+from collections import deque
+
+from sqlalchemy import and_, select, update
+
+from app.models.models import Session, User, session_participants
+from app.services.presence import presence_store
+from config import Config
+
+
+# Database versions never restart, so one epoch serves every process
+SHARED_EPOCH = 'shared'
+
+
+def roster_entry(user):
+    return {'userId': user.user_id, 'name': user.name, 'isTeacher': user.is_teacher}
+
+
+def load_members(db_session, session_id):
+    """user_id -> roster entry for the session's participants"""
+    rows = db_session.query(User.user_id, User.name, User.is_teacher).join(
+        session_participants, session_participants.c.user_id == User.user_id
+    ).filter(session_participants.c.session_id == session_id).all()
+    return {row.user_id: roster_entry(row) for row in rows}
+
+
+class SessionRoster:
+    """Participants of one session, their version and recent changes"""
+
+    __slots__ = ('epoch', 'version', 'members', 'log')
+
+    def __init__(self, members, log_size):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.members = members  # user_id -> roster entry
+        self.log = deque(maxlen=log_size)  # deltas, oldest first
+
+    def apply(self, op, user_id, entry=None):
+        """Record a join or leave; returns the delta, or None if it changes nothing"""
+        if op == 'join':
+            if self.members.get(user_id) == entry:
+                return None
+            self.members[user_id] = entry
+        elif self.members.pop(user_id, None) is None:
+            return None
+        self.version += 1
+        delta = {'version': self.version, 'op': op, 'userId': user_id}
+        if entry is not None:
+            delta['user'] = entry
+        self.log.append(delta)
+        return delta
+
+
+class RosterStore:
+    """Rosters by session, loaded lazily and changed in place"""
+
+    def __init__(self, log_size):
+        self.log_size = log_size
+        self._lock = threading.Lock()
+        self._rosters = {}  # session_id -> SessionRoster
+
+    def join(self, db_session, session_id, user):
+        """Add user to the roster; returns the event payload with the roster's version"""
+        roster = self._load(db_session, session_id)
+        entry = roster_entry(user)
+        with self._lock:
+            roster.apply('join', user.user_id, entry)
+            return dict(entry, version=roster.version, epoch=roster.epoch)
+
+    def leave(self, db_session, session_id, user_id):
+        """Remove user_id from the roster; returns the event payload with the roster's version"""
+        roster = self._load(db_session, session_id)
+        with self._lock:
+            roster.apply('leave', user_id)
+            return {'userId': user_id, 'version': roster.version, 'epoch': roster.epoch}
+
+    def snapshot(self, db_session, session_id):
+        """(epoch, version, participants with current presence)"""
+        roster = self._load(db_session, session_id)
+        with self._lock:
+            members = list(roster.members.values())
+            epoch, version = roster.epoch, roster.version
+        return epoch, version, [presence_store.overlay(entry) for entry in members]
+
+    def since(self, db_session, session_id, version=None, epoch=None):
+        """Deltas after version when the log still has them, else a snapshot"""
+        roster = self._load(db_session, session_id)
+        with self._lock:
+            current = {'epoch': roster.epoch, 'version': roster.version}
+            if epoch == roster.epoch and version is not None and version <= roster.version:
+                oldest = roster.log[0]['version'] if roster.log else roster.version + 1
+                if version >= oldest - 1:
+                    return dict(current, deltas=[d for d in roster.log if d['version'] > version])
+        epoch, version, participants = self.snapshot(db_session, session_id)
+        return {'epoch': epoch, 'version': version, 'participants': participants}
+
+    def forget(self, session_id):
+        with self._lock:
+            self._rosters.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._rosters),
+                'members': sum(len(r.members) for r in self._rosters.values())
+            }
+
+    def _load(self, db_session, session_id):
+        with self._lock:
+            roster = self._rosters.get(session_id)
+        if roster is not None:
+            return roster
+        loaded = SessionRoster(load_members(db_session, session_id), self.log_size)
+        with self._lock:
+            # Another request may have loaded it meanwhile; keep the first
+            return self._rosters.setdefault(session_id, loaded)
+
+
+class SharedRosterStore(RosterStore):
+    """Rosters whose versions live in sessions.roster_version, for multi-process mode
+
+    join and leave commit db_session. Each process logs only the changes it
+    handled itself, so catch-up falls back to a snapshot whenever another
+    process made one of the changes the client missed.
+    """
+
+    def __init__(self, log_size):
+        super().__init__(log_size)
+        self._logs = {}  # session_id -> deltas made by this process
+
+    def join(self, db_session, session_id, user):
+        entry = roster_entry(user)
+        if not self._flag(db_session, session_id, user.user_id, True):
+            # Already announced, by the REST join or by another process
+            return dict(entry, version=self._version(db_session, session_id), epoch=SHARED_EPOCH)
+        version = self._record(db_session, session_id, {'op': 'join', 'userId': user.user_id, 'user': entry})
+        return dict(entry, version=version, epoch=SHARED_EPOCH)
+
+    def leave(self, db_session, session_id, user_id):
+        self._flag(db_session, session_id, user_id, False)
+        version = self._record(db_session, session_id, {'op': 'leave', 'userId': user_id})
+        return {'userId': user_id, 'version': version, 'epoch': SHARED_EPOCH}
+
+    def snapshot(self, db_session, session_id):
+        # Version first: a change committed in between is sent again as a delta, which is harmless
+        version = self._version(db_session, session_id)
+        members = load_members(db_session, session_id)
+        return SHARED_EPOCH, version, [presence_store.overlay(entry) for entry in members.values()]
+
+    def since(self, db_session, session_id, version=None, epoch=None):
+        if epoch == SHARED_EPOCH and version is not None:
+            current = self._version(db_session, session_id)
+            with self._lock:
+                deltas = sorted((d for d in self._logs.get(session_id, ()) if d['version'] > version),
+                                key=lambda d: d['version'])
+            if [d['version'] for d in deltas] == list(range(version + 1, current + 1)):
+                return {'epoch': SHARED_EPOCH, 'version': current, 'deltas': deltas}
+        epoch, version, participants = self.snapshot(db_session, session_id)
+        return {'epoch': epoch, 'version': version, 'participants': participants}
+
+    def forget(self, session_id):
+        with self._lock:
+            self._logs.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._logs),
+                'deltas': sum(len(log) for log in self._logs.values())
+            }
+
+    @staticmethod
+    def _flag(db_session, session_id, user_id, in_roster):
+        """Set the participant's in_roster flag; False if it was already set that way
+
+        Users without a participant row have no flag and always count as a change.
+        """
+        member = and_(session_participants.c.session_id == session_id, session_participants.c.user_id == user_id)
+        changed = db_session.execute(
+            session_participants.update().where(member, session_participants.c.in_roster != in_roster)
+            .values(in_roster=in_roster)
+        ).rowcount
+        if changed:
+            return True
+        return db_session.execute(select(session_participants.c.user_id).where(member)).first() is None
+
+    def _record(self, db_session, session_id, change):
+        """Bump the session's roster version and log change under the new version"""
+        db_session.execute(
+            update(Session).where(Session.session_id == session_id)
+            .values(roster_version=Session.roster_version + 1)
+        )
+        version = self._version(db_session, session_id)
+        db_session.commit()
+        delta = dict(change, version=version)
+        with self._lock:
+            self._logs.setdefault(session_id, deque(maxlen=self.log_size)).append(delta)
+        return version
+
+    @staticmethod
+    def _version(db_session, session_id):
+        return db_session.query(Session.roster_version).filter_by(session_id=session_id).scalar() or 0
+
+
+# Shared rosters for the process
+rosters = (SharedRosterStore if Config.SOCKETIO_MESSAGE_QUEUE else RosterStore)(Config.ROSTER_LOG_SIZE)
@@ -0,0 +1,140 @@
+"""Client RTP capabilities registered once and referred to by hash
+
+Browsers of the same build send identical capabilities, so they are stored
+once under a content hash. A connection registers its capabilities once and
+later consumes carry only the hash. SFU nodes get the full blob the first
+time they see a hash and keep it themselves, so consume requests to a node
+that already knows it carry only ids.
+
+Whether a producer can be consumed depends only on the producer's codecs and
+the client's capabilities, so verdicts are memoized per (producer codec set,
+capabilities hash) and a viewer that cannot decode a stream is turned away
+without a round trip to the SFU. The consumer's rtpParameters carry fresh
+SSRCs per consumer and are not cached.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from config import Config
+
+
+def capabilities_hash(rtp_capabilities):
+    """Stable short hash of an rtpCapabilities object"""
+    canonical = json.dumps(rtp_capabilities, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+
+
+def codec_key(rtp_parameters):
+    """Hashable summary of the codecs a producer sends (what canConsume depends on)"""
+    return tuple(sorted(
+        (codec.get('mimeType', '').lower(), codec.get('clockRate'), codec.get('channels'),
+         json.dumps(codec.get('parameters') or {}, sort_keys=True))
+        for codec in (rtp_parameters or {}).get('codecs', [])
+        if not codec.get('mimeType', '').lower().endswith('/rtx')
+    ))
+
+
+class _LRU:
+    """Bounded mapping that drops the least recently used entry"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def set(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RtpCapabilityCache:
+    """Capabilities by hash, per-connection registrations and memoized canConsume verdicts"""
+
+    def __init__(self, maxsize):
+        self._lock = threading.Lock()
+        self._capabilities = _LRU(maxsize)       # hash -> rtpCapabilities
+        self._node_hashes = _LRU(maxsize * 4)    # (node id, hash) -> True once the node stored it
+        self._verdicts = _LRU(maxsize * 4)       # (codec key, hash) -> can consume
+        self._producer_codecs = _LRU(maxsize * 4)  # producer id -> codec key
+        self._sids = {}                          # socket sid -> hash
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, rtp_capabilities, sid=None):
+        """Store capabilities (once per distinct blob) and return their hash"""
+        caps_hash = capabilities_hash(rtp_capabilities)
+        with self._lock:
+            if self._capabilities.get(caps_hash) is None:
+                self._capabilities.set(caps_hash, rtp_capabilities)
+            if sid:
+                self._sids[sid] = caps_hash
+        return caps_hash
+
+    def for_sid(self, sid):
+        with self._lock:
+            return self._sids.get(sid)
+
+    def forget_sid(self, sid):
+        with self._lock:
+            self._sids.pop(sid, None)
+
+    def get(self, caps_hash):
+        with self._lock:
+            return self._capabilities.get(caps_hash)
+
+    def node_knows(self, node_id, caps_hash):
+        with self._lock:
+            return self._node_hashes.get((node_id, caps_hash), False)
+
+    def mark_known(self, node_id, caps_hash):
+        with self._lock:
+            self._node_hashes.set((node_id, caps_hash), True)
+
+    def note_producer(self, producer_id, rtp_parameters):
+        key = codec_key(rtp_parameters)
+        if key:
+            with self._lock:
+                self._producer_codecs.set(producer_id, key)
+
+    def verdict(self, producer_id, caps_hash):
+        """Memoized canConsume for (producer's codecs, caps_hash), or None if unknown"""
+        with self._lock:
+            key = self._producer_codecs.get(producer_id)
+            result = self._verdicts.get((key, caps_hash)) if key else None
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def remember(self, producer_id, caps_hash, can_consume):
+        with self._lock:
+            key = self._producer_codecs.get(producer_id)
+            if key:
+                self._verdicts.set((key, caps_hash), can_consume)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capabilities': len(self._capabilities),
+                'verdicts': len(self._verdicts),
+                'connections': len(self._sids),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+# Shared cache for the process
+rtp_capabilities = RtpCapabilityCache(Config.RTP_CAPABILITY_CACHE_SIZE)
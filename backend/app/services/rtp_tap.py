@@ -0,0 +1,160 @@
+"""RTP taps: a session's producers delivered as plain RTP to a local UDP socket
+
+A tap binds a UDP socket on RTP_TAP_BIND_IP, asks the session's SFU node for
+a PlainTransport that sends to it, and consumes the producers into that
+transport. Every RTP packet that arrives is handed to the tap's sink with its
+arrival time; RTCP (multiplexed on the same port) is dropped. Streams are
+told apart by SSRC, and the tap keeps each consumer's SSRC, payload type and
+codec so the sink can interpret the packets. The receive loop runs as a
+background task, so under eventlet or gevent its socket is the hub's green
+socket and it yields after every packet.
+
+feed() is the only entry point a sink depends on, so recorded RTP can be
+replayed into a sink without an SFU (see benchmarks/rtp_fixture.py).
+"""
+import logging
+import socket
+import struct
+import threading
+import time
+
+from app.services.mediasoup_client import MediasoupError
+from app.services.sfu_placement import sfu_placement
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MAX_DATAGRAM = 2048
+# Second byte of RTCP packets (200-204) with the marker bit masked off, as seen under rtcp-mux
+RTCP_TYPES = frozenset(range(72, 77))
+
+
+def is_rtp(packet):
+    return len(packet) >= 12 and packet[0] >> 6 == 2 and (packet[1] & 0x7F) not in RTCP_TYPES
+
+
+def rtp_header(packet):
+    """(payload type, marker, sequence number, timestamp, ssrc) of an RTP packet"""
+    sequence, timestamp, ssrc = struct.unpack_from('!HII', packet, 2)
+    return packet[1] & 0x7F, bool(packet[1] & 0x80), sequence, timestamp, ssrc
+
+
+def rtp_payload(packet):
+    """Payload of an RTP packet, past CSRCs and header extensions and without padding"""
+    offset = 12 + 4 * (packet[0] & 0x0F)
+    if packet[0] & 0x10:
+        offset += 4 + 4 * struct.unpack_from('!H', packet, offset + 2)[0]
+    end = len(packet) - (packet[-1] if packet[0] & 0x20 else 0)
+    return packet[offset:end]
+
+
+def udp_socket(async_mode):
+    """UDP socket whose waits yield to the event loop in async_mode, whatever is monkey-patched"""
+    if async_mode == 'eventlet':
+        from eventlet.green import socket as green_socket
+        return green_socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if async_mode == 'gevent':
+        from gevent import socket as gevent_socket
+        return gevent_socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+
+def describe_consumer(consumer):
+    """What a sink needs to know about one consumed stream"""
+    codec = consumer['rtpParameters']['codecs'][0]
+    encoding = (consumer['rtpParameters'].get('encodings') or [{}])[0]
+    return {
+        'consumerId': consumer['id'],
+        'producerId': consumer['producerId'],
+        'kind': consumer['kind'],
+        'ssrc': encoding.get('ssrc'),
+        'payloadType': codec['payloadType'],
+        'mimeType': codec['mimeType'],
+        'clockRate': codec['clockRate'],
+        'channels': codec.get('channels')
+    }
+
+
+class RtpTap:
+    """UDP receiver fed by a PlainTransport on the session's router"""
+
+    def __init__(self, session_id, sink, bind_ip=None):
+        self.session_id = session_id
+        self.sink = sink
+        self.bind_ip = bind_ip or Config.RTP_TAP_BIND_IP
+        self.transport_id = None
+        self.streams = {}  # producer_id -> describe_consumer()
+        self.packets = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._sock = None
+        self._sleep = time.sleep
+
+    @property
+    def port(self):
+        return self._sock.getsockname()[1] if self._sock else None
+
+    def open(self, socketio, producer_ids):
+        """Bind the socket, open the PlainTransport and start receiving"""
+        self._sock = udp_socket(socketio.async_mode)
+        self._sleep = socketio.sleep
+        self._sock.bind((self.bind_ip, 0))
+        self._sock.settimeout(0.5)
+        try:
+            self.transport_id = sfu_placement.open_plain_transport(self.session_id, self.bind_ip, self.port)
+            self._running = True
+            socketio.start_background_task(self._receive_loop)
+            return self.add_producers(producer_ids)
+        except Exception:
+            self.close()
+            raise
+
+    def add_producers(self, producer_ids):
+        """Consume more producers into the tap; returns the new streams"""
+        with self._lock:
+            producer_ids = [p for p in producer_ids if p not in self.streams]
+        if not producer_ids or not self.transport_id:
+            return []
+        added = [describe_consumer(c) for c in
+                 sfu_placement.plain_consume(self.session_id, self.transport_id, producer_ids)]
+        with self._lock:
+            for stream in added:
+                self.streams[stream['producerId']] = stream
+        return added
+
+    def feed(self, packet, arrival=None):
+        """Pass one datagram to the sink if it is RTP"""
+        if not is_rtp(packet):
+            self.dropped += 1
+            return
+        self.packets += 1
+        self.sink(packet, time.time() if arrival is None else arrival)
+
+    def close(self):
+        """Stop receiving and close the PlainTransport (and its consumers) on the SFU"""
+        self._running = False
+        if self.transport_id:
+            try:
+                sfu_placement.close_transport(self.session_id, self.transport_id)
+            except MediasoupError as e:
+                logger.error(f"Failed to close plain transport {self.transport_id}: {str(e)}")
+            self.transport_id = None
+        if self._sock:
+            self._sock.close()
+
+    def _receive_loop(self):
+        sock = self._sock
+        while self._running:
+            try:
+                packet, _ = sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                break  # socket closed
+            try:
+                self.feed(packet)
+            except Exception as e:
+                logger.error(f"RTP sink of session {self.session_id} failed: {str(e)}")
+            # A busy socket never blocks, so give other green threads a turn per packet
+            self._sleep(0)
@@ -0,0 +1,192 @@
+"""Registry of mediasoup nodes with background health checks
+
+Nodes are listed in Config.MEDIASOUP_NODES. A background task polls every
+node's GET /workers, which doubles as the health check and as the source of
+load figures (routers, transports, producers, consumers and bitrate per
+worker, plus object counts per router). A node is marked unhealthy after
+MEDIASOUP_UNHEALTHY_AFTER consecutive failed checks and healthy again on the
+first successful one. Nodes are identified by their base URL.
+"""
+import logging
+import threading
+import time
+
+from app.services.mediasoup_client import MediasoupClient, MediasoupError, mediasoup_client
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# A router costs about as much as this many transports/producers/consumers
+ROUTER_WEIGHT = 5
+# Bits per second that count as one transport/producer/consumer
+BITRATE_UNIT = 1_000_000
+
+
+def worker_score(worker):
+    """Relative load of one entry of GET /workers"""
+    return (worker.get('routers', 0) * ROUTER_WEIGHT + worker.get('transports', 0)
+            + worker.get('producers', 0) + worker.get('consumers', 0)
+            + (worker.get('bitrate') or 0) / BITRATE_UNIT)
+
+
+class SFUNode:
+    """One mediasoup server and the load it reported at the last check"""
+
+    def __init__(self, url, client=None):
+        self.id = url.rstrip('/')
+        self.client = client or MediasoupClient(url)
+        self.healthy = True  # optimistic until the first check
+        self.failures = 0
+        self.last_error = None
+        self.checked_at = None
+        self.workers = []
+        self.router_load = {}
+        self.pending_routers = {}     # worker index -> routers placed since the last check
+        self.pending_transports = {}  # router id -> transports created since the last check
+
+    def update(self, body):
+        self.workers = body.get('workers', [])
+        self.router_load = body.get('routerLoad', {})
+        self.pending_routers = {}
+        self.pending_transports = {}
+        self.healthy = True
+        self.failures = 0
+        self.last_error = None
+        self.checked_at = time.monotonic()
+
+    def score(self):
+        """Average load per worker, so bigger hosts take proportionally more sessions"""
+        if not self.workers:
+            return sum(self.pending_routers.values()) * ROUTER_WEIGHT
+        total = sum(worker_score(w) for w in self.workers) + sum(self.pending_routers.values()) * ROUTER_WEIGHT
+        return total / len(self.workers)
+
+    def router_transports(self, router_id):
+        """Transports on router_id, including ones created since the last check"""
+        reported = self.router_load.get(router_id, {}).get('transports', 0)
+        return reported + self.pending_transports.get(router_id, 0)
+
+    def totals(self):
+        return {key: sum(w.get(key) or 0 for w in self.workers)
+                for key in ('routers', 'transports', 'producers', 'consumers', 'bitrate')}
+
+    def to_dict(self):
+        return {
+            'node': self.id,
+            'healthy': self.healthy,
+            'failures': self.failures,
+            'lastError': self.last_error,
+            'workers': len(self.workers),
+            'score': round(self.score(), 2),
+            **self.totals()
+        }
+
+
+class SFUCluster:
+    """All configured SFU nodes; picks the least-loaded healthy one for new sessions"""
+
+    def __init__(self, urls, health_interval, unhealthy_after):
+        self.health_interval = health_interval
+        self.unhealthy_after = unhealthy_after
+        self.nodes = {}
+        self._lock = threading.Lock()
+        self._running = False
+        for url in urls:
+            # Reuse the shared client for the primary SFU so its stats stay in one place
+            client = mediasoup_client if url.rstrip('/') == mediasoup_client.base_url else None
+            node = SFUNode(url, client)
+            self.nodes.setdefault(node.id, node)
+        if not self.nodes:
+            node = SFUNode(mediasoup_client.base_url, mediasoup_client)
+            self.nodes[node.id] = node
+        self.default = next(iter(self.nodes.values()))
+
+    def start(self, socketio):
+        """Start the background health checks"""
+        if self._running:
+            return
+        self._running = True
+        socketio.start_background_task(self._health_loop, socketio)
+        logger.info(f"Health-checking {len(self.nodes)} SFU node(s) every {self.health_interval}s")
+
+    def stop(self):
+        self._running = False
+
+    def node(self, node_id):
+        """The node with this id, or the default node for None/unknown ids"""
+        return self.nodes.get(node_id, self.default) if node_id else self.default
+
+    def pick_node(self, exclude=()):
+        """Least-loaded healthy node not in exclude, or None if there is none
+
+        With nothing healthy and nothing excluded, falls back to the default
+        node so a cluster of one keeps working through a failed check.
+        """
+        with self._lock:
+            candidates = [n for n in self.nodes.values() if n.healthy and n.id not in exclude]
+            if not candidates:
+                return None if exclude else self.default
+            return min(candidates, key=lambda n: n.score())
+
+    def ensure_loaded(self, node):
+        """Check node now if it has never reported its workers"""
+        if node.checked_at is None:
+            self.check(node)
+
+    def check(self, node):
+        """Poll one node's GET /workers and update its health and load"""
+        try:
+            body = node.client.get('/workers', timeout=Config.MEDIASOUP_CONNECT_TIMEOUT)
+        except MediasoupError as e:
+            if e.status_code == 404:
+                # Older single-router SFU: reachable, but no placement data
+                body = {'workers': []}
+            else:
+                with self._lock:
+                    node.failures += 1
+                    node.last_error = str(e)
+                    node.checked_at = time.monotonic()
+                    if node.healthy and node.failures >= self.unhealthy_after:
+                        node.healthy = False
+                        logger.warning(f"SFU node {node.id} marked unhealthy: {str(e)}")
+                return False
+        with self._lock:
+            if not node.healthy:
+                logger.info(f"SFU node {node.id} is healthy again")
+            node.update(body)
+        return True
+
+    def check_all(self):
+        for node in list(self.nodes.values()):
+            self.check(node)
+
+    def note_transport(self, node, router_id):
+        with self._lock:
+            node.pending_transports[router_id] = node.pending_transports.get(router_id, 0) + 1
+
+    def pick_worker(self, node):
+        """Least-loaded worker index on node, or None if it reports no workers"""
+        self.ensure_loaded(node)
+        with self._lock:
+            if not node.workers:
+                return None
+            best = min(node.workers, key=lambda w: (
+                worker_score(w) + node.pending_routers.get(w['index'], 0) * ROUTER_WEIGHT, w['index']))
+            node.pending_routers[best['index']] = node.pending_routers.get(best['index'], 0) + 1
+            return best['index']
+
+    def stats(self):
+        with self._lock:
+            return [node.to_dict() for node in self.nodes.values()]
+
+    def _health_loop(self, socketio):
+        while self._running:
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"Unexpected error checking SFU nodes: {str(e)}")
+            socketio.sleep(self.health_interval)
+
+
+# Shared registry for the process
+sfu_cluster = SFUCluster(Config.MEDIASOUP_NODES, Config.MEDIASOUP_HEALTH_INTERVAL, Config.MEDIASOUP_UNHEALTHY_AFTER)
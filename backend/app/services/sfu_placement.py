@@ -0,0 +1,545 @@
+"""Backend-owned placement of sessions onto mediasoup nodes, workers and routers
+
+Each session gets its own router, created on the least-loaded worker of the
+least-loaded healthy node in the SFU cluster. Loads come from the cluster's
+health checks; routers and transports handed out since the last check are
+counted locally so a burst of new sessions does not all land in one place.
+
+When MEDIASOUP_SPILL_TRANSPORTS is set and a session's router already carries
+that many transports, new viewers are served from an edge router on a second
+node. The session's producers reach the edge through a pair of pipe
+transports: the origin consumes each producer into its pipe transport and the
+edge re-produces it under the same id, so viewers consume the usual ids.
+
+Transports, producers and consumers created through here are recorded per
+user and session (see sfu_resources), so a user's objects can be closed in
+one POST /closeResources per node when they leave or disconnect.
+
+Video consumers are created with the layers layer_policy picks for the
+viewer and the room, and later layer changes go out as one POST
+/consumerLayers per node.
+"""
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session as SQLSession, object_session
+
+from app.models.models import Session
+from app.services.layer_policy import layer_policy
+from app.services.mediasoup_client import MediasoupError
+from app.services.rtp_capabilities import rtp_capabilities
+from app.services.sfu_cluster import sfu_cluster
+from app.services.sfu_resources import KINDS, SFUResourceRegistry
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Edge:
+    """Second-node router serving a session's overflow audience"""
+    node_id: str
+    router_id: str
+    origin_pipe_id: Optional[str] = None  # pipe transports are per process, opened on first use
+    edge_pipe_id: Optional[str] = None
+
+
+@dataclass
+class SessionPlacement:
+    node_id: Optional[str]
+    router_id: Optional[str]
+    edge: Optional[Edge] = None
+
+
+class SFUPlacement:
+    """Assigns sessions to routers and routes SFU calls to the node hosting them"""
+
+    def __init__(self, cluster, spill_transports):
+        self.cluster = cluster
+        self.spill_transports = spill_transports
+        self._lock = threading.Lock()
+        self._edge_lock = threading.Lock()
+        self._sessions = {}        # session_id -> SessionPlacement
+        self._capabilities = {}    # router_id -> rtpCapabilities
+        self.resources = SFUResourceRegistry()
+
+    def assign(self, session, verify=False):
+        """Make sure session has a router, creating one on the least-loaded node and worker
+
+        The caller commits the session. With verify, an existing assignment is
+        checked against its node first (routers do not survive an SFU restart,
+        and an unhealthy node should not take a new stream). Returns the
+        router id, or None if the SFU does not support placement.
+
+        The new router is claimed with a conditional UPDATE in the caller's
+        transaction, so of two requests placing the same session at once only
+        one router is kept; the other request closes its own and adopts it.
+        """
+        expected = session.sfu_router_id
+        if session.sfu_router_id:
+            node = self.cluster.node(session.sfu_node)
+            if not verify or (node.healthy and self._router_exists(node, session.sfu_router_id)):
+                self._remember(session)
+                return session.sfu_router_id
+            logger.warning(f"Router {session.sfu_router_id} of session {session.session_id} is gone, reassigning")
+            self.release(session)
+
+        node = self.cluster.pick_node()
+        worker_index = self.cluster.pick_worker(node)
+        if worker_index is None:
+            return None
+
+        response = node.client.post('/routers', {'workerIndex': worker_index})
+        router_id = response['routerId']
+        if not self._claim(session, expected, node.id, worker_index, router_id):
+            # Lost the race to another request: use its router, drop ours
+            try:
+                node.client.post('/closeRouter', {'routerId': router_id})
+            except MediasoupError as e:
+                logger.error(f"Failed to close surplus router {router_id}: {str(e)}")
+            object_session(session).refresh(session)
+            self.forget(session.session_id)
+            self._remember(session)
+            logger.info(f"Session {session.session_id} was placed concurrently on router {session.sfu_router_id}")
+            return session.sfu_router_id
+        session.assign_router(node.id, worker_index, router_id)
+        self._remember(session)
+        if response.get('rtpCapabilities'):
+            with self._lock:
+                self._capabilities[router_id] = response['rtpCapabilities']
+        logger.info(f"Placed session {session.session_id} on {node.id} worker {worker_index} (router {router_id})")
+        return router_id
+
+    def release(self, session):
+        """Close the session's routers (origin and edge) and clear the assignment"""
+        placement = self._sessions.get(session.session_id) or self._from_row(session)
+        resources = self.resources.take_session(session.session_id)
+        layer_policy.forget([r.id for r in resources if r.kind == 'consumer'])
+        if not placement.router_id and resources:
+            # Default router outlives the session: close its objects instead
+            self._close_resources(session.session_id, resources)
+        targets = [(placement.node_id, placement.router_id)]
+        if placement.edge:
+            targets.append((placement.edge.node_id, placement.edge.router_id))
+        for node_id, router_id in targets:
+            if not router_id:
+                continue
+            try:
+                self.cluster.node(node_id).client.post('/closeRouter', {'routerId': router_id})
+            except MediasoupError as e:
+                logger.error(f"Failed to close router {router_id} of session {session.session_id}: {str(e)}")
+        self.forget(session.session_id)
+        session.clear_router()
+
+    def forget(self, session_id):
+        with self._lock:
+            placement = self._sessions.pop(session_id, None)
+            if placement:
+                self._capabilities.pop(placement.router_id, None)
+
+    def locate(self, session_id):
+        """SessionPlacement for session_id (cached), or None if it has no router"""
+        if not session_id:
+            return None
+        with self._lock:
+            placement = self._sessions.get(session_id)
+        if placement:
+            return placement
+
+        with SQLSession(Config.engine) as db_session:
+            session = db_session.query(Session).filter_by(session_id=session_id).first()
+            if not session or not session.sfu_router_id:
+                return None
+            return self._remember(session)
+
+    def router_for(self, session_id):
+        """Router id hosting session_id, or None for the SFU's default router"""
+        placement = self.locate(session_id)
+        return placement.router_id if placement else None
+
+    def client_for(self, session_id):
+        """Client of the node hosting session_id's origin router"""
+        placement = self.locate(session_id)
+        return self.cluster.node(placement.node_id if placement else None).client
+
+    def client_for_transport(self, transport_id, session_id=None):
+        """Client of the node that created transport_id"""
+        return self._node_for_transport(transport_id, session_id).client
+
+    def capabilities(self, session_id=None):
+        """RTP capabilities of the session's router (cached; they never change)"""
+        placement = self.locate(session_id)
+        router_id = placement.router_id if placement else None
+        with self._lock:
+            cached = self._capabilities.get(router_id)
+        if cached is not None:
+            return cached
+
+        node = self.cluster.node(placement.node_id if placement else None)
+        route = f"/router-capabilities?routerId={router_id}" if router_id else '/router-capabilities'
+        rtp_capabilities = node.client.get(route)['rtpCapabilities']
+        with self._lock:
+            self._capabilities[router_id] = rtp_capabilities
+        return rtp_capabilities
+
+    def create_transport(self, route, session_id, consumer=False, user_id=None):
+        """Create a WebRTC transport for session_id on the router that should carry it
+
+        Producer transports always go to the origin router; consumer
+        transports go to the edge once the origin is past the spill threshold.
+        """
+        placement = self.locate(session_id)
+        if placement is None:
+            node, router_id = self.cluster.default, None
+        else:
+            node = self.cluster.node(placement.node_id)
+            router_id = placement.router_id
+            if consumer and self._should_spill(node, placement):
+                edge = self._ensure_edge(session_id, placement)
+                if edge:
+                    node, router_id = self.cluster.node(edge.node_id), edge.router_id
+
+        transport = node.client.post(route, {'routerId': router_id} if router_id else {})
+        if router_id:
+            self.cluster.note_transport(node, router_id)
+        self.resources.add('transport', transport['id'], node.id, session_id, user_id)
+        return transport
+
+    def produce(self, session_id, user_id, transport_id, kind, rtp_parameters):
+        """Create a producer on the node that owns transport_id and record it for user_id"""
+        node = self._node_for_transport(transport_id, session_id)
+        response = node.client.post('/produce', {
+            'transportId': transport_id,
+            'kind': kind,
+            'rtpParameters': rtp_parameters,
+            'userId': user_id
+        })
+        self.resources.add('producer', response['id'], node.id, session_id, user_id, (transport_id,))
+        rtp_capabilities.note_producer(response['id'], rtp_parameters)
+        return response
+
+    def consume(self, session_id, user_id, data):
+        """Create a consumer on the node that owns data['transportId'] and record it for user_id
+
+        data names the client's capabilities by capsHash (see rtp_capabilities)
+        or carries them in full. Pairs already known to be incompatible are
+        refused without asking the SFU, and the full capabilities only go to
+        a node that has not stored them under their hash yet.
+        """
+        transport_id, producer_id = data.get('transportId'), data.get('producerId')
+        if data.get('rtpCapabilities'):
+            caps_hash = rtp_capabilities.register(data['rtpCapabilities'])
+        else:
+            caps_hash = data.get('capsHash')
+        caps = rtp_capabilities.get(caps_hash) if caps_hash else None
+        if caps is None:
+            raise MediasoupError('Unknown RTP capabilities, register them first', status_code=409, route='/consume')
+        if rtp_capabilities.verdict(producer_id, caps_hash) is False:
+            raise MediasoupError('Cannot consume this producer', status_code=400, route='/consume')
+
+        if data.get('bandwidthKbps') or data.get('viewportHeight'):
+            self.report_viewer(session_id, user_id, data.get('bandwidthKbps'), data.get('viewportHeight'))
+
+        node = self._node_for_transport(transport_id, session_id)
+        payload = {'transportId': transport_id, 'producerId': producer_id, 'capsHash': caps_hash,
+                   'preferredLayers': layer_policy.initial(session_id, user_id)}
+        try:
+            response = self._post_consume(node, payload, caps)
+        except MediasoupError as e:
+            if e.status_code == 400:
+                rtp_capabilities.remember(producer_id, caps_hash, False)
+            raise
+        rtp_capabilities.remember(producer_id, caps_hash, True)
+        self.resources.add('consumer', response['id'], node.id, session_id, user_id, (transport_id, producer_id))
+        if response.get('type') in ('simulcast', 'svc'):
+            self.apply_layers(layer_policy.add(response['id'], node.id, session_id, user_id,
+                                               response.get('preferredLayers')))
+        return response
+
+    def prefer_layers(self, user_id, consumer_id, spatial_layer=None):
+        """Pin one of user_id's consumers to a spatial layer (None for automatic)"""
+        resource = self.resources.get(consumer_id)
+        if resource is None or resource.kind != 'consumer' or resource.user_id != user_id:
+            raise MediasoupError('Consumer not found', status_code=404, route='/consumerLayers')
+        layers, changes = layer_policy.prefer(consumer_id, spatial_layer)
+        if layers is None:
+            raise MediasoupError('Consumer has a single layer', status_code=400, route='/consumerLayers')
+        self.apply_layers(changes)
+        return layers
+
+    def report_viewer(self, session_id, user_id, bandwidth_kbps=None, viewport_height=None):
+        """Re-pick the layers of a viewer's consumers for a new downlink estimate or viewport"""
+        self.apply_layers(layer_policy.report(session_id, user_id, bandwidth_kbps, viewport_height))
+
+    def apply_layers(self, changes):
+        """Send layer changes from layer_policy in one POST /consumerLayers per node"""
+        by_node = {}
+        for node_id, consumer_id, spatial, temporal in changes:
+            by_node.setdefault(node_id, []).append(
+                {'consumerId': consumer_id, 'spatialLayer': spatial, 'temporalLayer': temporal})
+        for node_id, layers in by_node.items():
+            try:
+                self.cluster.node(node_id).client.post('/consumerLayers', {'layers': layers})
+            except MediasoupError as e:
+                logger.error(f"Failed to set layers of {len(layers)} consumers on node {node_id}: {str(e)}")
+
+    def close_user(self, user_id, session_id=None, kinds=KINDS):
+        """Close every recorded resource of user_id (optionally only in session_id) in one call per node
+
+        Returns the ids of the producers that were closed so the caller can
+        tell the room.
+        """
+        resources = self.resources.take_user(user_id, session_id, kinds)
+        if resources:
+            self._close_resources(session_id, resources)
+            self._forget_consumers(resources)
+        if session_id and 'consumer' in kinds:
+            layer_policy.forget_viewer(session_id, user_id)
+        return [r.id for r in resources if r.kind == 'producer' and r.user_id == user_id]
+
+    def close_producer(self, session_id, producer_id):
+        """Close a producer on its origin router and on the session's edge, if any"""
+        self._forget_consumers(self.resources.take([producer_id]))
+        placement = self.locate(session_id)
+        self.client_for(session_id).post('/closeProducer', {'producerId': producer_id})
+        if placement and placement.edge:
+            try:
+                self.cluster.node(placement.edge.node_id).client.post('/closeProducer', {'producerId': producer_id})
+            except MediasoupError as e:
+                if e.status_code != 404:
+                    logger.error(f"Failed to close piped producer {producer_id} on edge: {str(e)}")
+
+    def close_producers(self, session_id, producer_ids):
+        """Close producers of session_id with one POST /closeResources to its origin node (and edge)"""
+        if not producer_ids:
+            return
+        self._forget_consumers(self.resources.take(producer_ids))
+        placement = self.locate(session_id)
+        node_ids = [placement.node_id if placement else None]
+        if placement and placement.edge:
+            node_ids.append(placement.edge.node_id)
+        for node_id in node_ids:
+            try:
+                self.cluster.node(node_id).client.post('/closeResources', {'producerIds': list(producer_ids)})
+            except MediasoupError as e:
+                logger.error(f"Failed to close {len(producer_ids)} producers of session {session_id}: {str(e)}")
+
+    def pipe_producers(self, session_id, producer_ids=None):
+        """Pipe the given producers (or all of the origin's) to the session's edge router"""
+        placement = self.locate(session_id)
+        if not placement or not placement.edge:
+            return []
+        with self._edge_lock:
+            return self._pipe(placement, placement.edge, producer_ids)
+
+    def open_plain_transport(self, session_id, ip, port):
+        """Plain transport on the session's origin router sending RTP to ip:port; returns its id"""
+        placement = self.locate(session_id)
+        node = self.cluster.node(placement.node_id if placement else None)
+        response = node.client.post('/plainTransports', {
+            'routerId': placement.router_id if placement else None, 'ip': ip, 'port': port})
+        self.resources.add('transport', response['id'], node.id, session_id)
+        return response['id']
+
+    def plain_consume(self, session_id, transport_id, producer_ids):
+        """Consume producers into a plain transport; returns [{id, producerId, kind, rtpParameters}]"""
+        node = self._node_for_transport(transport_id, session_id)
+        response = node.client.post('/plainConsume', {'transportId': transport_id, 'producerIds': list(producer_ids)})
+        for consumer in response.get('consumers', []):
+            self.resources.add('consumer', consumer['id'], node.id, session_id, None,
+                               (transport_id, consumer['producerId']))
+        return response.get('consumers', [])
+
+    def request_key_frame(self, session_id, consumer_ids):
+        """Ask the SFU for a keyframe on each video consumer, in one call per node"""
+        by_node = {}
+        for consumer_id in consumer_ids:
+            resource = self.resources.get(consumer_id)
+            if resource:
+                by_node.setdefault(resource.node_id, []).append(consumer_id)
+        for node_id, ids in by_node.items():
+            self.cluster.node(node_id).client.post('/requestKeyFrame', {'consumerIds': ids})
+
+    def close_transport(self, session_id, transport_id):
+        """Close one transport (and what lives on it) that was opened through here"""
+        resources = self.resources.take([transport_id])
+        if resources:
+            self._close_resources(session_id, resources)
+
+    def _forget_consumers(self, resources):
+        consumer_ids = [r.id for r in resources if r.kind == 'consumer']
+        if consumer_ids:
+            self.apply_layers(layer_policy.forget(consumer_ids))
+
+    def _node_for_transport(self, transport_id, session_id):
+        resource = self.resources.get(transport_id)
+        if resource:
+            return self.cluster.node(resource.node_id)
+        placement = self.locate(session_id)
+        return self.cluster.node(placement.node_id if placement else None)
+
+    @staticmethod
+    def _post_consume(node, payload, caps):
+        """POST /consume with just the capabilities hash when the node has them stored"""
+        caps_hash = payload['capsHash']
+        if rtp_capabilities.node_knows(node.id, caps_hash):
+            try:
+                return node.client.post('/consume', payload)
+            except MediasoupError as e:
+                if e.status_code != 409:
+                    raise
+                # The node lost them (restart or eviction): send them again
+        response = node.client.post('/consume', dict(payload, rtpCapabilities=caps))
+        rtp_capabilities.mark_known(node.id, caps_hash)
+        return response
+
+    def _close_resources(self, session_id, resources):
+        """POST /closeResources once per node holding any of resources
+
+        Children of a closed transport or producer are already closed by the
+        SFU, so only the top-most objects are sent. Producers are also closed
+        on the session's edge, where they were piped under the same id.
+        """
+        taken = {r.id for r in resources}
+        batches = {}
+        for resource in resources:
+            if any(parent in taken for parent in resource.parent_ids):
+                continue
+            batch = batches.setdefault(resource.node_id, {'transportIds': [], 'producerIds': [], 'consumerIds': []})
+            batch[f"{resource.kind}Ids"].append(resource.id)
+
+        for resource in resources:
+            placement = self.locate(resource.session_id or session_id) if resource.kind == 'producer' else None
+            if placement and placement.edge:
+                batch = batches.setdefault(placement.edge.node_id, {'transportIds': [], 'producerIds': [], 'consumerIds': []})
+                if resource.id not in batch['producerIds']:
+                    batch['producerIds'].append(resource.id)
+
+        for node_id, batch in batches.items():
+            try:
+                self.cluster.node(node_id).client.post('/closeResources', batch)
+            except MediasoupError as e:
+                logger.error(f"Failed to close {sum(map(len, batch.values()))} SFU objects on {node_id}: {str(e)}")
+
+    def _should_spill(self, node, placement):
+        if not self.spill_transports or len(self.cluster.nodes) < 2:
+            return False
+        return placement.edge is not None or node.router_transports(placement.router_id) >= self.spill_transports
+
+    def _ensure_edge(self, session_id, placement):
+        with self._edge_lock:
+            if placement.edge:
+                return placement.edge
+
+            # Another backend process may already have opened one
+            existing = self._stored_edge(session_id)
+            if existing:
+                placement.edge = existing
+                return existing
+
+            node = self.cluster.pick_node(exclude={placement.node_id})
+            worker_index = self.cluster.pick_worker(node) if node else None
+            if worker_index is None:
+                return None
+
+            try:
+                router_id = node.client.post('/routers', {'workerIndex': worker_index})['routerId']
+                edge = Edge(node.id, router_id)
+                self._pipe(placement, edge)
+            except MediasoupError as e:
+                logger.error(f"Could not open an edge router for session {session_id} on {node.id}: {str(e)}")
+                return None
+
+            with SQLSession(Config.engine) as db_session:
+                result = db_session.execute(
+                    update(Session)
+                    .where(Session.session_id == session_id, Session.sfu_edge_router_id.is_(None))
+                    .values(sfu_edge_node=edge.node_id, sfu_edge_router_id=edge.router_id)
+                )
+                db_session.commit()
+            if result.rowcount == 0:
+                # Lost the race to another process: use its edge, drop ours
+                node.client.post('/closeRouter', {'routerId': router_id})
+                edge = self._stored_edge(session_id)
+            else:
+                logger.info(f"Session {session_id} spilled onto {node.id} (router {router_id})")
+            placement.edge = edge
+            return edge
+
+    @staticmethod
+    def _claim(session, expected, node_id, worker_index, router_id):
+        """Store the router on the session's row if it still has the router we saw; False if it changed"""
+        db_session = object_session(session)
+        if db_session is None:
+            return True  # detached session: nothing to race with
+        current = Session.sfu_router_id.is_(None) if expected is None else Session.sfu_router_id == expected
+        with db_session.no_autoflush:
+            result = db_session.execute(
+                update(Session)
+                .where(Session.session_id == session.session_id, current)
+                .values(sfu_node=node_id, sfu_worker=worker_index, sfu_router_id=router_id)
+                .execution_options(synchronize_session=False)
+            )
+        return result.rowcount == 1
+
+    @staticmethod
+    def _stored_edge(session_id):
+        with SQLSession(Config.engine) as db_session:
+            row = db_session.query(Session.sfu_edge_node, Session.sfu_edge_router_id).filter_by(
+                session_id=session_id).first()
+        if row and row.sfu_edge_router_id:
+            return Edge(row.sfu_edge_node, row.sfu_edge_router_id)
+        return None
+
+    def _pipe(self, placement, edge, producer_ids=None):
+        """Connect origin and edge routers with pipe transports and pipe producers across"""
+        origin = self.cluster.node(placement.node_id).client
+        remote = self.cluster.node(edge.node_id).client
+        if not edge.origin_pipe_id:
+            origin_pipe = origin.post('/pipeTransports', {'routerId': placement.router_id})
+            edge_pipe = remote.post('/pipeTransports', {'routerId': edge.router_id})
+            origin.post('/connectPipeTransport', {'transportId': origin_pipe['id'],
+                                                  'ip': edge_pipe['ip'], 'port': edge_pipe['port']})
+            remote.post('/connectPipeTransport', {'transportId': edge_pipe['id'],
+                                                  'ip': origin_pipe['ip'], 'port': origin_pipe['port']})
+            edge.origin_pipe_id, edge.edge_pipe_id = origin_pipe['id'], edge_pipe['id']
+
+        payload = {'transportId': edge.origin_pipe_id}
+        if producer_ids:
+            payload['producerIds'] = list(producer_ids)
+        piped = origin.post('/pipeConsume', payload)['producers']
+        if piped:
+            remote.post('/pipeProduce', {'transportId': edge.edge_pipe_id, 'producers': piped})
+        return [p['producerId'] for p in piped]
+
+    def _router_exists(self, node, router_id):
+        try:
+            rtp_capabilities = node.client.get(f"/router-capabilities?routerId={router_id}")['rtpCapabilities']
+        except MediasoupError as e:
+            if e.status_code == 404:
+                return False
+            raise
+        with self._lock:
+            self._capabilities[router_id] = rtp_capabilities
+        return True
+
+    @staticmethod
+    def _from_row(session):
+        edge = Edge(session.sfu_edge_node, session.sfu_edge_router_id) if session.sfu_edge_router_id else None
+        return SessionPlacement(session.sfu_node, session.sfu_router_id, edge)
+
+    def _remember(self, session):
+        placement = self._from_row(session)
+        with self._lock:
+            current = self._sessions.get(session.session_id)
+            if current and current.router_id == placement.router_id:
+                return current
+            self._sessions[session.session_id] = placement
+        return placement
+
+
+# Shared placement for the process
+sfu_placement = SFUPlacement(sfu_cluster, Config.MEDIASOUP_SPILL_TRANSPORTS)
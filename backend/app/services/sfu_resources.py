@@ -0,0 +1,121 @@
+"""Registry of the SFU objects this process created, by user and session
+
+Every transport, producer and consumer created through the backend is
+recorded with the node that holds it, its owner and its parent (the
+transport a producer/consumer lives on, the producer a consumer reads). Taking
+a user's or session's resources removes them together with their children,
+which the SFU closes implicitly, so the registry only holds live objects.
+Socket sids are bound to (user, session) on join so a disconnect can release
+whatever the client left behind.
+"""
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+KINDS = ('transport', 'producer', 'consumer')
+
+
+@dataclass
+class SFUResource:
+    kind: str
+    id: str
+    node_id: str
+    session_id: Optional[str] = None
+    user_id: Optional[str] = None
+    parent_ids: tuple = ()
+
+
+class SFUResourceRegistry:
+    """Live SFU objects indexed by id, user, session and parent"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resources = {}  # id -> SFUResource
+        self._by_user = {}    # user_id -> set of ids
+        self._by_session = {}  # session_id -> set of ids
+        self._children = {}   # parent id -> set of child ids
+        self._sids = {}       # socket sid -> (user_id, session_id)
+
+    def bind(self, sid, user_id, session_id):
+        """Remember which user and session a socket connection belongs to"""
+        with self._lock:
+            self._sids[sid] = (user_id, session_id)
+
+    def unbind(self, sid):
+        """Forget a socket connection; returns its (user_id, session_id) or None"""
+        with self._lock:
+            return self._sids.pop(sid, None)
+
+    def owner(self, sid):
+        with self._lock:
+            return self._sids.get(sid)
+
+    def add(self, kind, object_id, node_id, session_id=None, user_id=None, parent_ids=()):
+        resource = SFUResource(kind, object_id, node_id, session_id, user_id, tuple(p for p in parent_ids if p))
+        with self._lock:
+            self._resources[object_id] = resource
+            if user_id:
+                self._by_user.setdefault(user_id, set()).add(object_id)
+            if session_id:
+                self._by_session.setdefault(session_id, set()).add(object_id)
+            for parent_id in resource.parent_ids:
+                self._children.setdefault(parent_id, set()).add(object_id)
+        return resource
+
+    def get(self, object_id):
+        with self._lock:
+            return self._resources.get(object_id)
+
+    def take_user(self, user_id, session_id=None, kinds=KINDS):
+        """Remove and return a user's resources of the given kinds (plus dependents)"""
+        with self._lock:
+            ids = [i for i in self._by_user.get(user_id, ())
+                   if self._resources[i].kind in kinds
+                   and (session_id is None or self._resources[i].session_id == session_id)]
+            return self._take(ids)
+
+    def take_session(self, session_id):
+        """Remove and return every resource of a session"""
+        with self._lock:
+            return self._take(list(self._by_session.get(session_id, ())))
+
+    def take(self, object_ids):
+        """Remove and return specific resources (plus dependents)"""
+        with self._lock:
+            return self._take([i for i in object_ids if i in self._resources])
+
+    def snapshot(self):
+        """Every live resource, as a list the caller may iterate without the lock"""
+        with self._lock:
+            return list(self._resources.values())
+
+    def counts(self):
+        with self._lock:
+            counts = dict.fromkeys(KINDS, 0)
+            for resource in self._resources.values():
+                counts[resource.kind] += 1
+            return counts
+
+    def _take(self, ids):
+        # Caller holds the lock. Children go too: the SFU closes them with their parent.
+        taken = []
+        pending = list(ids)
+        while pending:
+            resource = self._resources.pop(pending.pop(), None)
+            if resource is None:
+                continue
+            taken.append(resource)
+            for index, key in ((self._by_user, resource.user_id), (self._by_session, resource.session_id)):
+                members = index.get(key)
+                if members is not None:
+                    members.discard(resource.id)
+                    if not members:
+                        del index[key]
+            for parent_id in resource.parent_ids:
+                siblings = self._children.get(parent_id)
+                if siblings is not None:
+                    siblings.discard(resource.id)
+                    if not siblings:
+                        del self._children[parent_id]
+            pending.extend(self._children.pop(resource.id, ()))
+        return taken
@@ -0,0 +1,206 @@
+"""Background collection of SFU stats into fixed-size time series
+
+Every SFU_STATS_INTERVAL seconds the collector sends one POST /stats per
+node, listing every transport, producer and consumer this process tracks
+(see sfu_resources). The node reduces mediasoup's getStats() output to a few
+numbers per object. Each object keeps the last SFU_STATS_WINDOW seconds of
+them in a ring buffer with one preallocated array per metric, so an object's
+memory stays fixed however long it lives. A series is dropped once its
+object is closed.
+
+Summaries reduce the window per object (average bitrate, RTT and jitter,
+packets lost, worst loss, lowest score) and aggregate those per session and
+per user. User figures cover producers and consumers only, since a
+transport's bitrate is the sum of the streams on it.
+"""
+import logging
+import math
+import threading
+import time
+from array import array
+
+from app.services.mediasoup_client import MediasoupError
+from app.services.sfu_placement import sfu_placement
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Objects whose figures are summed per user (a transport carries its streams)
+STREAM_KINDS = ('producer', 'consumer')
+# Per-sample metrics: bits/s, cumulative packets lost, loss fraction (0-1), RTT ms, jitter, score (0-10)
+METRICS = ('bitrate', 'packetsLost', 'loss', 'rtt', 'jitter', 'score')
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else None
+
+
+class StatsSeries:
+    """Ring buffer of one object's samples, stored as one array column per metric"""
+
+    __slots__ = ('kind', 'session_id', 'user_id', 'capacity', 'timestamps', 'columns', 'head', 'size')
+
+    def __init__(self, capacity, kind, session_id=None, user_id=None):
+        self.kind = kind
+        self.session_id = session_id
+        self.user_id = user_id
+        self.capacity = capacity
+        self.timestamps = array('d', [0.0]) * capacity
+        self.columns = {metric: array('d', [math.nan]) * capacity for metric in METRICS}
+        self.head = 0  # slot the next sample goes to
+        self.size = 0
+
+    def append(self, timestamp, sample):
+        slot = self.head
+        self.timestamps[slot] = timestamp
+        for metric, column in self.columns.items():
+            value = sample.get(metric)
+            column[slot] = math.nan if value is None else float(value)
+        self.head = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def values(self, metric):
+        """Samples of metric, oldest first, without gaps"""
+        column = self.columns[metric]
+        start = (self.head - self.size) % self.capacity
+        ordered = (column[(start + i) % self.capacity] for i in range(self.size))
+        return [value for value in ordered if not math.isnan(value)]
+
+    def summary(self):
+        lost = self.values('packetsLost')
+        loss = self.values('loss')
+        score = self.values('score')
+        return {
+            'kind': self.kind,
+            'userId': self.user_id,
+            'samples': self.size,
+            'bitrate': _mean(self.values('bitrate')),
+            'packetsLost': max(lost[-1] - lost[0], 0) if lost else None,  # over the window
+            'maxLoss': max(loss) if loss else None,
+            'rtt': _mean(self.values('rtt')),
+            'jitter': _mean(self.values('jitter')),
+            'minScore': min(score) if score else None
+        }
+
+
+def aggregate(summaries):
+    """Combine per-object summaries: total bitrate, worst loss and score, average RTT"""
+    summaries = list(summaries)
+    losses = [s['maxLoss'] for s in summaries if s['maxLoss'] is not None]
+    scores = [s['minScore'] for s in summaries if s['minScore'] is not None]
+    return {
+        'objects': len(summaries),
+        'bitrate': sum(s['bitrate'] or 0 for s in summaries),
+        'packetsLost': sum(s['packetsLost'] or 0 for s in summaries),
+        'maxLoss': max(losses) if losses else None,
+        'rtt': _mean([s['rtt'] for s in summaries if s['rtt'] is not None]),
+        'minScore': min(scores) if scores else None
+    }
+
+
+class SFUStatsCollector:
+    """Polls every tracked SFU object once per tick and keeps a window of samples"""
+
+    def __init__(self, placement, interval, window):
+        self.placement = placement
+        self.interval = interval
+        self.capacity = max(1, math.ceil(window / interval)) if interval > 0 else 1
+        self._lock = threading.Lock()
+        self._series = {}  # object id -> StatsSeries
+        self._running = False
+        self.ticks = 0
+        self.failures = 0
+        self.last_duration = None
+
+    def start(self, socketio):
+        """Start polling in the background (no-op when SFU_STATS_INTERVAL is 0)"""
+        if self._running or self.interval <= 0:
+            return
+        self._running = True
+        socketio.start_background_task(self._collect_loop, socketio)
+        logger.info(f"Collecting SFU stats every {self.interval}s ({self.capacity} samples per object)")
+
+    def stop(self):
+        self._running = False
+
+    def collect(self, now=None):
+        """Poll every node once for the stats of everything tracked on it"""
+        started = time.monotonic()
+        now = time.time() if now is None else now
+        live = {r.id: r for r in self.placement.resources.snapshot()}
+        by_node = {}
+        for resource in live.values():
+            ids = by_node.setdefault(resource.node_id, {'transportIds': [], 'producerIds': [], 'consumerIds': []})
+            ids[f'{resource.kind}Ids'].append(resource.id)
+
+        samples = {}
+        for node_id, ids in by_node.items():
+            try:
+                body = self.placement.cluster.node(node_id).client.post('/stats', ids)
+            except MediasoupError as e:
+                self.failures += 1
+                logger.warning(f"Failed to collect stats from SFU node {node_id}: {str(e)}")
+                continue
+            samples.update(body.get('stats') or {})
+
+        with self._lock:
+            for object_id in [i for i in self._series if i not in live]:
+                del self._series[object_id]
+            for object_id, sample in samples.items():
+                resource = live.get(object_id)
+                if resource is None:
+                    continue
+                series = self._series.get(object_id)
+                if series is None:
+                    series = self._series[object_id] = StatsSeries(
+                        self.capacity, resource.kind, resource.session_id, resource.user_id)
+                series.append(now, sample)
+            self.ticks += 1
+            self.last_duration = time.monotonic() - started
+        return len(samples)
+
+    def session_summary(self, session_id):
+        """Quality of a session by object kind and by user"""
+        with self._lock:
+            summaries = [s.summary() for s in self._series.values() if s.session_id == session_id]
+        by_user = {}
+        for summary in summaries:
+            if summary['userId'] and summary['kind'] in STREAM_KINDS:
+                by_user.setdefault(summary['userId'], []).append(summary)
+        return {
+            'byKind': {kind: aggregate(s for s in summaries if s['kind'] == kind)
+                       for kind in ('transport', 'producer', 'consumer')},
+            'users': {user_id: aggregate(items) for user_id, items in by_user.items()}
+        }
+
+    def user_summary(self, user_id, session_id=None):
+        """Quality of one user's objects (optionally in one session), overall and per object"""
+        with self._lock:
+            objects = {object_id: s.summary() for object_id, s in self._series.items()
+                       if s.user_id == user_id and (session_id is None or s.session_id == session_id)}
+        return {
+            'overall': aggregate(s for s in objects.values() if s['kind'] in STREAM_KINDS),
+            'objects': objects
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'series': len(self._series),
+                'samplesPerSeries': self.capacity,
+                'ticks': self.ticks,
+                'failures': self.failures,
+                'lastDurationMs': round(self.last_duration * 1000, 1) if self.last_duration is not None else None
+            }
+
+    def _collect_loop(self, socketio):
+        while self._running:
+            try:
+                self.collect()
+            except Exception as e:
+                logger.error(f"Unexpected error collecting SFU stats: {str(e)}")
+            socketio.sleep(self.interval)
+
+
+# Shared collector for the process
+sfu_stats = SFUStatsCollector(sfu_placement, Config.SFU_STATS_INTERVAL, Config.SFU_STATS_WINDOW)
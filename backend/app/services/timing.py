@@ -0,0 +1,111 @@
+"""Per-request timing breakdown reported in the Server-Timing header
+
+A RequestTiming is bound to the current request (or greenlet) through a
+context variable. Database time is collected from engine events, SFU time
+from the mediasoup client, emit time from the SocketIO instance and
+serialization time from the JSON provider and explicit span() blocks. Spans
+report exclusive time: a DB query inside a serialize span counts as db only.
+"""
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+
+_current = ContextVar('request_timing', default=None)
+
+# Order of the entries in the Server-Timing header
+PHASES = ('db', 'sfu', 'serialize', 'emit')
+
+
+class RequestTiming:
+    """Accumulated time per phase for one request"""
+
+    __slots__ = ('start', 'durations', 'counts')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = {}
+        self.counts = {}
+
+    def add(self, phase, seconds):
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def recorded(self):
+        return sum(self.durations.values())
+
+    def header(self):
+        """Format the Server-Timing header value, durations in milliseconds"""
+        entries = []
+        for phase in PHASES + tuple(sorted(set(self.durations) - set(PHASES))):
+            if phase in self.durations:
+                entries.append(f'{phase};desc="{self.counts[phase]} calls";dur={self.durations[phase] * 1000:.2f}')
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.2f}")
+        return ', '.join(entries)
+
+
+def begin():
+    """Start timing the current request; returns a token for end()"""
+    return _current.set(RequestTiming())
+
+
+def end(token):
+    """Stop timing and return the finished RequestTiming"""
+    timing = _current.get()
+    _current.reset(token)
+    return timing
+
+
+def current():
+    return _current.get()
+
+
+def record(phase, seconds):
+    """Add seconds to phase for the current request, if it is being timed"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+
+@contextmanager
+def _span(timing, phase):
+    before = timing.recorded()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start - (timing.recorded() - before)
+        timing.add(phase, max(elapsed, 0.0))
+
+
+def span(phase):
+    """Context manager timing a block as phase, excluding nested phases"""
+    timing = _current.get()
+    if timing is None:
+        return nullcontext()
+    return _span(timing, phase)
+
+
+def instrument_engine(engine):
+    """Attribute cursor execution time on engine to the db phase"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and _current.get() is not None:
+            context._timing_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_timing_start', None)
+        if start is not None:
+            record('db', time.perf_counter() - start)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that counts response encoding as serialize time"""
+
+    def response(self, *args, **kwargs):
+        with span('serialize'):
+            return super().response(*args, **kwargs)
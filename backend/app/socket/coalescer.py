@@ -0,0 +1,112 @@
+import logging
+import threading
+
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Events that must reach clients immediately; they are never buffered
+BYPASS_EVENTS = frozenset({
+    'producerClosed',
+    'newProducer',
+    'livestream_started',
+    'livestream_ended',
+    'livestream_active',
+    'start_webrtc_setup'
+})
+
+
+class RoomEmitCoalescer:
+    """Batches room broadcasts into one 'events' frame per room per tick
+
+    With a tick of N ms, every event emitted to a room within the tick goes
+    out as a single frame: [{'event': name, 'data': payload}, ...] in emit
+    order. A tick with a single event sends it unwrapped. Events emitted
+    with skip_sid go in the room's frame with those sids skipped, and each
+    skipped sid gets its own frame without them, so no sid is sent to the
+    room. When disabled (tick 0) or for BYPASS_EVENTS, emit() goes straight
+    to socketio.emit; a bypass event first flushes whatever is buffered for
+    its room so ordering is preserved. Sends hold one lock from taking a
+    room's buffer until its frames are out, so a room's frames never pass
+    each other.
+    """
+
+    def __init__(self):
+        self.socketio = None
+        self.tick = 0
+        self._buffers = {}  # room -> list of (event, data, skip_sid)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._running = False
+
+    @property
+    def enabled(self):
+        return self.tick > 0
+
+    def init_app(self, socketio, tick_ms):
+        """Bind to the SocketIO instance and start the flush loop if enabled"""
+        self.socketio = socketio
+        self.tick = tick_ms / 1000.0
+        if self.enabled and not self._running:
+            self._running = True
+            socketio.start_background_task(self._flush_loop)
+            logger.info(f"Coalescing room events every {tick_ms}ms")
+
+    def emit(self, event, data, room, skip_sid=None):
+        """Emit event to room, buffering it for the current tick when enabled"""
+        if not self.enabled or event in BYPASS_EVENTS:
+            with self._send_lock:
+                self._send(room, self._take(room))
+                self.socketio.emit(event, data, room=room, skip_sid=skip_sid)
+            return
+
+        with self._lock:
+            self._buffers.setdefault(room, []).append((event, data, skip_sid))
+        metrics.inc('socketio_coalesced_events_total', (('event', event),))
+
+    def flush(self):
+        """Send everything buffered so far"""
+        with self._send_lock:
+            with self._lock:
+                buffers, self._buffers = self._buffers, {}
+            for room, entries in buffers.items():
+                self._send(room, entries)
+
+    def _flush_room(self, room):
+        with self._send_lock:
+            self._send(room, self._take(room))
+
+    def _take(self, room):
+        with self._lock:
+            return self._buffers.pop(room, None)
+
+    def _send(self, room, entries):
+        if not entries:
+            return
+        skipped = list(dict.fromkeys(sid for _, _, sid in entries if sid))
+        self._emit_batch(entries, room, skipped or None)
+        for sid in skipped:
+            if room in self.socketio.server.rooms(sid):
+                self._emit_batch([e for e in entries if e[2] != sid], sid)
+
+    def _emit_batch(self, entries, room, skip_sid=None):
+        if not entries:
+            return
+        if len(entries) == 1:
+            event, data, _ = entries[0]
+            self.socketio.emit(event, data, room=room, skip_sid=skip_sid)
+        else:
+            batch = [{'event': event, 'data': data} for event, data, _ in entries]
+            self.socketio.emit('events', batch, room=room, skip_sid=skip_sid)
+
+    def _flush_loop(self):
+        while self._running:
+            self.socketio.sleep(self.tick)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing coalesced room events: {str(e)}")
+
+
+# Shared coalescer for room broadcasts
+room_events = RoomEmitCoalescer()
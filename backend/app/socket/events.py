@@ -6,14 +6,30 @@ from config import Config
 from app.models.models import User, Session
 from datetime import datetime
 import pytz
-import requests
+from app.services.sfu_placement import sfu_placement
+from app.services.rtp_capabilities import rtp_capabilities
+from app.services.presence import presence_store
+from app.services.producers import mark_producers_closed, open_producer_ids
+from app.services.recording import recordings
+from app.services.hls import broadcasts
+from app.services.roster import rosters
+from app.socket.coalescer import room_events
+from app.socket.workers import sfu_workers
+from app.services.cache import active_sessions_cache, get_session_info
 
 logger = logging.getLogger(__name__)
 
-# Mediasoup server URL
-MEDIASOUP_SERVER_URL = Config.MEDIASOUP_SERVER_URL
-
 def register_socket_events(socketio):
+    def release_sfu_resources(user_id, session_id):
+        """Close the user's transports, producers and consumers and tell the room"""
+        closed_producers = sfu_workers.run(socketio.async_mode, sfu_placement.close_user, user_id, session_id)
+        if closed_producers:
+            with SQLSession(Config.engine) as db_session:
+                mark_producers_closed(db_session, closed_producers)
+                db_session.commit()
+        for producer_id in closed_producers:
+            socketio.emit('producerClosed', {'producerId': producer_id}, room=session_id)
+
     @socketio.on('connect')
     def handle_connect():
         logger.info(f"Client connected: {request.sid}")
@@ -21,6 +37,11 @@ def register_socket_events(socketio):
     @socketio.on('disconnect')
     def handle_disconnect():
         logger.info(f"Client disconnected: {request.sid}")
+        rtp_capabilities.forget_sid(request.sid)
+        owner = sfu_placement.resources.unbind(request.sid)
+        if owner:
+            release_sfu_resources(*owner)
+            presence_store.discard(owner[0])
 
     @socketio.on('join')
     def handle_join(data):
@@ -29,6 +50,7 @@ def register_socket_events(socketio):
         
         join_room(session_id)
         join_room(user_id)
+        sfu_placement.resources.bind(request.sid, user_id, session_id)
         
         logger.info(f"User {user_id} joined socket room {session_id}")
         
@@ -37,7 +59,9 @@ def register_socket_events(socketio):
             session = db_session.query(Session).filter_by(session_id=session_id).first()
             
             if user and session:
-                emit('user_joined', user.to_dict(), room=session_id, include_self=False)
+                presence_store.seed(user)
+                joined = rosters.join(db_session, session_id, user)
+                room_events.emit('user_joined', presence_store.overlay(joined), room=session_id, skip_sid=request.sid)
                 
                 if session.is_livestreaming:
                     teacher = db_session.query(User).filter_by(user_id=session.teacher_id).first()
@@ -54,9 +78,14 @@ def register_socket_events(socketio):
         
         leave_room(session_id)
         leave_room(user_id)
+        sfu_placement.resources.unbind(request.sid)
+        release_sfu_resources(user_id, session_id)
         
         logger.info(f"User {user_id} left socket room {session_id}")
-        emit('user_left', {'userId': user_id}, room=session_id)
+        presence_store.discard(user_id)
+        with SQLSession(Config.engine) as db_session:
+            left = rosters.leave(db_session, session_id, user_id)
+        room_events.emit('user_left', left, room=session_id)
 
     @socketio.on('toggle_mute')
     def handle_toggle_mute(data):
@@ -64,15 +93,12 @@ def register_socket_events(socketio):
         user_id = data.get('userId')
         is_muted = data.get('isMuted')
         
-        with SQLSession(Config.engine) as db_session:
-            user = db_session.query(User).filter_by(user_id=user_id).first()
-            if user:
-                user.is_muted = is_muted
-                db_session.commit()
-                emit('user_mute_changed', {
-                    'userId': user_id,
-                    'isMuted': is_muted
-                }, room=session_id)
+        if presence_store.ensure(user_id):
+            presence_store.update(user_id, is_muted=is_muted)
+            room_events.emit('user_mute_changed', {
+                'userId': user_id,
+                'isMuted': is_muted
+            }, room=session_id)
 
     @socketio.on('toggle_video')
     def handle_toggle_video(data):
@@ -80,15 +106,12 @@ def register_socket_events(socketio):
         user_id = data.get('userId')
         video_enabled = data.get('videoEnabled')
         
-        with SQLSession(Config.engine) as db_session:
-            user = db_session.query(User).filter_by(user_id=user_id).first()
-            if user:
-                user.video_enabled = video_enabled
-                db_session.commit()
-                emit('user_video_changed', {
-                    'userId': user_id,
-                    'videoEnabled': video_enabled
-                }, room=session_id)
+        if presence_store.ensure(user_id):
+            presence_store.update(user_id, video_enabled=video_enabled)
+            room_events.emit('user_video_changed', {
+                'userId': user_id,
+                'videoEnabled': video_enabled
+            }, room=session_id)
 
     @socketio.on('raise_hand')
     def handle_raise_hand(data):
@@ -96,22 +119,24 @@ def register_socket_events(socketio):
         user_id = data.get('userId')
         is_raised = data.get('isRaised')
         
-        with SQLSession(Config.engine) as db_session:
-            user = db_session.query(User).filter_by(user_id=user_id).first()
-            if user:
-                user.hand_raised = is_raised
-                db_session.commit()
-                emit('hand_raise_changed', {
-                    'userId': user_id,
-                    'userName': user.name,
-                    'isRaised': is_raised
-                }, room=session_id)
+        user = presence_store.ensure(user_id)
+        if user:
+            presence_store.update(user_id, hand_raised=is_raised)
+            room_events.emit('hand_raise_changed', {
+                'userId': user_id,
+                'userName': user['name'],
+                'isRaised': is_raised
+            }, room=session_id)
 
     @socketio.on('send_message')
     def handle_send_message(data):
         session_id = data.get('sessionId')
         message_data = data.get('message')
-        emit('new_message', message_data, room=session_id)
+        session_info = get_session_info(session_id)
+        if not session_info or not session_info['isActive']:
+            emit('error', {'message': 'Session is no longer active'})
+            return
+        room_events.emit('new_message', message_data, room=session_id)
 
     @socketio.on('start_screen_share')
     def handle_start_screen_share(data):
@@ -159,6 +184,8 @@ def register_socket_events(socketio):
                 if not session.created_at:
                     session.created_at = datetime.now(pytz.UTC)
                 db_session.commit()
+                presence_store.sync(user_id, is_streaming=True)
+                active_sessions_cache.invalidate()
                 
                 emit('start_webrtc_setup', {}, room=user_id)
                 
@@ -179,18 +206,19 @@ def register_socket_events(socketio):
             if session and user and user.is_teacher:
                 session.is_livestreaming = False
                 user.is_streaming = False
+                producer_ids = open_producer_ids(db_session, session_id)
+                mark_producers_closed(db_session, producer_ids)
+                db_session.commit()
                 
-                if session.producer_id:
-                    try:
-                        response = requests.post(f"{MEDIASOUP_SERVER_URL}/closeProducer", json={
-                            'producerId': session.producer_id
-                        })
-                        if response.status_code != 200:
-                            logger.error(f"Failed to close producer {session.producer_id} on mediasoup server")
-                    except Exception as e:
-                        logger.error(f"Error closing producer on mediasoup server: {str(e)}")
+                # Only the SFU batch runs off the event loop, as on leave and disconnect
+                sfu_workers.run(socketio.async_mode, sfu_placement.close_producers, session_id, producer_ids)
+                for producer_id in producer_ids:
+                    emit('producerClosed', {'producerId': producer_id}, room=session_id)
                 
-                db_session.commit()
+                presence_store.sync(user_id, is_streaming=False)
+                active_sessions_cache.invalidate()
+                recordings.stop(session_id)
+                broadcasts.stop(session_id)
                 
                 emit('livestream_ended', {
                     'userId': user_id,
@@ -0,0 +1,116 @@
+"""Socket.IO message queue backends for multi-process mode
+
+With SOCKETIO_MESSAGE_QUEUE set, every backend process publishes its emits to
+the queue and delivers the ones meant for its own clients, so a room spans
+processes. Only emits are shared; other in-memory state stays per process:
+
+- presence_store: snapshots overlay only the mute, hand and video toggles
+  this process handled
+- the session-info and active-sessions caches: a change made by another
+  process shows up once the cached entry expires
+- rosters: the delta log is per process, but versions move to the database
+  in this mode (see SharedRosterStore)
+"""
+import logging
+import pickle
+import threading
+from urllib.parse import urlparse
+
+import socketio as python_socketio
+
+logger = logging.getLogger(__name__)
+
+
+class LocalQueueManager(python_socketio.PubSubManager):
+    """In-process stand-in for a message queue
+
+    Every server created in the same Python process with the same channel
+    shares its emits, exactly as separate processes would through Redis or
+    RabbitMQ. Meant for tests and local multi-server experiments.
+    """
+
+    name = 'local'
+
+    _subscribers = {}  # channel -> list of inbox queues
+    _registry_lock = threading.Lock()
+
+    def __init__(self, url='local://', channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.url = url
+        self._inbox = None
+
+    def initialize(self):
+        if not self.write_only:
+            self._inbox = self.server.eio.create_queue()
+            with self._registry_lock:
+                self._subscribers.setdefault(self.channel, []).append(self._inbox)
+        super().initialize()
+
+    def _publish(self, data):
+        payload = pickle.dumps(data)
+        with self._registry_lock:
+            inboxes = list(self._subscribers.get(self.channel, []))
+        for inbox in inboxes:
+            inbox.put(payload)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+    @classmethod
+    def reset(cls, channel=None):
+        """Drop registered subscribers (all channels if none given)"""
+        with cls._registry_lock:
+            if channel is None:
+                cls._subscribers.clear()
+            else:
+                cls._subscribers.pop(channel, None)
+
+
+# Queue backends handled here; any other URL scheme (redis://, amqp://,
+# kafka://, zmq+tcp://) is passed to Flask-SocketIO's built-in managers
+QUEUE_BACKENDS = {
+    'local': LocalQueueManager
+}
+
+
+def register_queue_backend(scheme, manager_class):
+    """Plug in a client manager class for message queue URLs with the given scheme"""
+    QUEUE_BACKENDS[scheme] = manager_class
+
+
+def message_queue_options(url, channel):
+    """Build the SocketIO init options for the configured message queue
+
+    Returns an empty dict when no queue is configured (single-process mode).
+    """
+    if not url:
+        return {}
+
+    scheme = urlparse(url).scheme
+    manager_class = QUEUE_BACKENDS.get(scheme)
+    if manager_class is not None:
+        logger.info(f"Using {scheme} Socket.IO message queue on channel {channel}")
+        return {'client_manager': manager_class(url, channel=channel)}
+
+    logger.info(f"Using Socket.IO message queue {scheme}:// on channel {channel}")
+    return {'message_queue': url, 'channel': channel}
+
+
+def create_emitter(url, channel):
+    """Create a write-only SocketIO instance for emitting from outside a server
+
+    Workers and scripts use it to reach clients connected to any backend
+    process through the same message queue.
+    """
+    from flask_socketio import SocketIO
+
+    options = message_queue_options(url, channel)
+    if not options:
+        raise ValueError("A message queue URL is required to emit from outside the server")
+    if 'client_manager' in options:
+        options['client_manager'].write_only = True
+        emitter = SocketIO()
+        emitter.init_app(None, **options)
+        return emitter
+    return SocketIO(**options)
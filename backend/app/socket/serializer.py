@@ -0,0 +1,122 @@
+"""MessagePack Socket.IO frames, negotiated per connection
+
+With SOCKETIO_SERIALIZER=msgpack, a client that connects with
+?serializer=msgpack (and the matching socket.io-msgpack-parser) gets every
+packet as one binary MessagePack frame. Every other client keeps the default
+JSON text frames. The server encodes each packet once, as MessagePack. When a
+JSON client is among the recipients, the same packet is also encoded once as
+JSON and that copy goes to every JSON client. Incoming frames are decoded by
+type: binary as MessagePack, text as JSON.
+
+The JSON fallback does not use Socket.IO binary attachments, so payloads must
+not contain bytes. Nothing in this app sends any. Engine.IO long-polling
+carries binary frames base64-encoded, so the byte savings only show on the
+wire once a client has upgraded to WebSocket.
+"""
+import logging
+import time
+from urllib.parse import parse_qs
+
+import msgpack
+import socketio as python_socketio
+from engineio import packet as eio_packet
+from socketio import packet
+
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SERIALIZERS = ('json', 'msgpack')
+QUERY_PARAMETER = 'serializer'
+ENVIRON_KEY = 'socketio.serializer'  # negotiated serializer, cached in the connection's WSGI environ
+
+
+def _count(serializer, encoded, start):
+    labels = (('serializer', serializer),)
+    metrics.inc('socketio_encoded_bytes_total', labels, len(encoded))
+    metrics.observe('socketio_encode_duration_seconds', labels, time.perf_counter() - start)
+
+
+class EncodedPacket(bytes):
+    """MessagePack encoding of a packet that can also produce its JSON text"""
+
+    def __new__(cls, encoded, pkt):
+        self = super().__new__(cls, encoded)
+        self.packet = pkt
+        self._json = None
+        return self
+
+    def json(self):
+        if self._json is None:
+            start = time.perf_counter()
+            self._json = packet.Packet.encode(self.packet)
+            _count('json', self._json, start)
+        return self._json
+
+
+class NegotiatedPacket(packet.Packet):
+    """Socket.IO packet encoded as MessagePack, decoded from MessagePack or JSON"""
+
+    uses_binary_events = False
+
+    def encode(self):
+        start = time.perf_counter()
+        encoded = EncodedPacket(msgpack.dumps(self._to_dict()), self)
+        _count('msgpack', encoded, start)
+        return encoded
+
+    def decode(self, encoded_packet):
+        if not isinstance(encoded_packet, (bytes, bytearray)):
+            return super().decode(encoded_packet)
+        decoded = msgpack.loads(encoded_packet)
+        self.packet_type = decoded['type']
+        self.data = decoded.get('data')
+        self.id = decoded.get('id')
+        self.namespace = decoded['nsp']
+
+
+class NegotiatingServer(python_socketio.Server):
+    """socketio.Server that sends each client the serializer it asked for"""
+
+    def client_serializer(self, eio_sid):
+        environ = self.environ.get(eio_sid)
+        if environ is None:
+            return 'json'
+        serializer = environ.get(ENVIRON_KEY)
+        if serializer is None:
+            requested = parse_qs(environ.get('QUERY_STRING', '')).get(QUERY_PARAMETER, ['json'])[0]
+            serializer = environ[ENVIRON_KEY] = 'msgpack' if requested == 'msgpack' else 'json'
+        return serializer
+
+    def _send_packet(self, eio_sid, pkt):
+        self.eio.send(eio_sid, self._for_client(eio_sid, pkt.encode()))
+
+    def _send_eio_packet(self, eio_sid, eio_pkt):
+        # Broadcasts arrive encoded once, wrapped in an Engine.IO packet shared by all recipients
+        encoded = self._for_client(eio_sid, eio_pkt.data)
+        if encoded is not eio_pkt.data:
+            eio_pkt = eio_packet.Packet(eio_packet.MESSAGE, encoded)
+        self.eio.send_packet(eio_sid, eio_pkt)
+
+    def _for_client(self, eio_sid, encoded):
+        if isinstance(encoded, EncodedPacket) and self.client_serializer(eio_sid) != 'msgpack':
+            return encoded.json()
+        return encoded
+
+
+def serializer_options(name):
+    """Build the SocketIO init options for the configured serializer
+
+    Returns an empty dict for plain JSON, Flask-SocketIO's default.
+    """
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown SOCKETIO_SERIALIZER {name!r}; expected one of {', '.join(SERIALIZERS)}")
+    if name == 'json':
+        return {}
+    logger.info('Socket.IO clients may negotiate MessagePack frames')
+    return {'serializer': NegotiatedPacket}
+
+
+def offered_serializers(name):
+    """Serializers a client may ask for, preferred first"""
+    return ['msgpack', 'json'] if name == 'msgpack' else ['json']
@@ -0,0 +1,82 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class SFUWorkerPool:
+    """Runs blocking SFU (and related DB) work off the Socket.IO event loop
+
+    Socket.IO handlers call run() and get the result back once the work is
+    done, so they can reply through their ack. The waiting is cooperative:
+    under eventlet/gevent with the socket module monkey-patched, the HTTP
+    and DB calls already yield to the hub, so the call runs inline in the
+    handler's green thread. Without the patch it is handed to the hub's
+    native thread pool so other events keep being processed, and in
+    threading mode it runs on a bounded executor shared by all handlers.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+        self._tpool_sized = False
+
+    def run(self, async_mode, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the pool and return its result"""
+        if async_mode == 'eventlet':
+            from eventlet import patcher, tpool
+            if patcher.is_monkey_patched('socket'):
+                # Green sockets must stay on the hub; blocking on them yields anyway
+                return fn(*args, **kwargs)
+            if not self._tpool_sized:
+                tpool.set_num_threads(self.max_workers)
+                self._tpool_sized = True
+            return tpool.execute(fn, *args, **kwargs)
+
+        if async_mode == 'gevent':
+            import gevent
+            from gevent import monkey
+            if monkey.is_module_patched('socket'):
+                return fn(*args, **kwargs)
+            return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sfu-worker')
+        return self._executor.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self):
+        """Stop the executor used in threading mode"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def make_psycopg2_green():
+    """Make psycopg2 wait for the database through the eventlet hub
+
+    Monkey-patching cannot reach psycopg2's C socket calls; with this wait
+    callback (the technique psycogreen uses) queries yield like any other I/O.
+    """
+    import psycopg2
+    from eventlet.hubs import trampoline
+    from psycopg2 import extensions
+
+    def wait(conn, timeout=None):
+        while True:
+            state = conn.poll()
+            if state == extensions.POLL_OK:
+                return
+            if state == extensions.POLL_READ:
+                trampoline(conn.fileno(), read=True)
+            elif state == extensions.POLL_WRITE:
+                trampoline(conn.fileno(), write=True)
+            else:
+                raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+    extensions.set_wait_callback(wait)
+
+
+# Shared pool for socket handlers that talk to the mediasoup server
+sfu_workers = SFUWorkerPool(Config.SFU_WORKER_THREADS)
@@ -0,0 +1,437 @@
+"""End-to-end load test for the streaming backend
+
+Starts the stub SFU and the Flask app from create_app() (or targets an
+already running backend with --server-url), then drives simulated teachers
+and students over real HTTP and Socket.IO connections through
+create / join / start-livestream / consume / chat / raise-hand / leave, and
+reports throughput and p50/p95/p99 latency per REST route and per event,
+plus the Socket.IO frames and bytes the clients received.
+
+    DATABASE_URL=postgresql://localhost/streaming_bench DATABASE_SSLMODE=disable \\
+        python -m benchmarks.loadtest --teachers 4 --students 50 --sfu-latency-ms 5
+
+The database must be a disposable local one; migrations are applied to it
+automatically. Install websocket-client to let the clients upgrade to
+WebSocket; otherwise they stay on long-polling. With --serializer msgpack the
+clients ask for MessagePack frames (the in-process backend is started with
+SOCKETIO_SERIALIZER=msgpack; a --server-url backend must offer it, or the
+clients fall back to JSON).
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+logger = logging.getLogger('loadtest')
+
+# Minimal RTP parameters accepted by the stub SFU's produce route
+FAKE_RTP_PARAMETERS = {
+    'video': {'codecs': [{'mimeType': 'video/VP8', 'payloadType': 101, 'clockRate': 90000}],
+              'encodings': [{'ssrc': 1111, 'rid': 'r0'}, {'ssrc': 2222, 'rid': 'r1'}, {'ssrc': 3333, 'rid': 'r2'}]},
+    'audio': {'codecs': [{'mimeType': 'audio/opus', 'payloadType': 100, 'clockRate': 48000, 'channels': 2}],
+              'encodings': [{'ssrc': 4444}]}
+}
+FAKE_DTLS_PARAMETERS = {'role': 'client', 'fingerprints': [{'algorithm': 'sha-256', 'value': '00' * 32}]}
+
+
+class Recorder:
+    """Thread-safe latency samples keyed by operation name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._errors = {}
+        self.frames = 0
+        self.frame_bytes = 0
+
+    def record(self, name, elapsed_ms, ok=True):
+        with self._lock:
+            self._samples.setdefault(name, []).append(elapsed_ms)
+            if not ok:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def received(self, size):
+        with self._lock:
+            self.frames += 1
+            self.frame_bytes += size
+
+    def timed(self, name, fn, *args, **kwargs):
+        """Call fn, record its latency under name and return its result"""
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = not (isinstance(result, dict) and result.get('error'))
+            return result
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000, ok)
+
+    def summary(self, wall_seconds):
+        rows = []
+        with self._lock:
+            for name in sorted(self._samples):
+                samples = sorted(self._samples[name])
+                count = len(samples)
+
+                def percentile(p):
+                    return samples[min(count - 1, int(count * p))]
+
+                rows.append({
+                    'name': name,
+                    'count': count,
+                    'errors': self._errors.get(name, 0),
+                    'throughput': count / wall_seconds if wall_seconds else 0.0,
+                    'p50': percentile(0.50),
+                    'p95': percentile(0.95),
+                    'p99': percentile(0.99),
+                    'max': samples[-1]
+                })
+        return rows
+
+
+class SimClient:
+    """One simulated browser: an HTTP session plus a Socket.IO connection"""
+
+    def __init__(self, base_url, recorder, transports=None, serializer='json'):
+        import socketio
+
+        self.base_url = base_url
+        self.recorder = recorder
+        self.transports = transports
+        self.serializer = serializer
+        self.http = requests.Session()
+        self.sio = socketio.Client(reconnection=False, serializer='msgpack' if serializer == 'msgpack' else 'default')
+        self.sio.on('*', self._on_event)
+        # Measure every Engine.IO message on its way to the Socket.IO client
+        self.sio.eio.on('message', self._on_frame)
+        self._waiters = []
+        self._waiters_lock = threading.Lock()
+
+    # HTTP
+
+    def post(self, route, payload, name=None):
+        return self.recorder.timed(f"POST {name or route}", self._request, 'POST', route, payload)
+
+    def get(self, route, name=None):
+        return self.recorder.timed(f"GET {name or route}", self._request, 'GET', route, None)
+
+    def _request(self, method, route, payload):
+        response = self.http.request(method, f"{self.base_url}{route}", json=payload, timeout=30)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if response.status_code >= 400:
+            return {'error': body.get('error') or f"HTTP {response.status_code}"}
+        return body
+
+    # Socket.IO
+
+    def connect(self):
+        url = self.base_url if self.serializer == 'json' else f"{self.base_url}?serializer={self.serializer}"
+        self.recorder.timed('socket connect', self.sio.connect, url, transports=self.transports, wait_timeout=30)
+
+    def call(self, event, data=None):
+        """Emit an event and wait for its ack"""
+        return self.recorder.timed(f"event {event}", self.sio.call, event, data, timeout=30)
+
+    def emit(self, event, data):
+        self.sio.emit(event, data)
+
+    def round_trip(self, event, data, reply_event, predicate, timeout=10):
+        """Emit an event and time until the matching broadcast comes back"""
+        waiter = {'event': reply_event, 'predicate': predicate, 'done': threading.Event()}
+        with self._waiters_lock:
+            self._waiters.append(waiter)
+        start = time.perf_counter()
+        self.sio.emit(event, data)
+        ok = waiter['done'].wait(timeout)
+        self.recorder.record(f"event {event} -> {reply_event}", (time.perf_counter() - start) * 1000, ok)
+        with self._waiters_lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def disconnect(self):
+        self.sio.disconnect()
+        self.http.close()
+
+    def _on_frame(self, data):
+        self.recorder.received(len(data))
+        self.sio._handle_eio_message(data)
+
+    def _on_event(self, event, data=None):
+        # Unpack coalesced frames so waiters see the individual events
+        if event == 'events' and isinstance(data, list):
+            for entry in data:
+                self._deliver(entry.get('event'), entry.get('data'))
+        else:
+            self._deliver(event, data)
+
+    def _deliver(self, event, data):
+        with self._waiters_lock:
+            for waiter in list(self._waiters):
+                if waiter['event'] == event and waiter['predicate'](data):
+                    waiter['done'].set()
+                    self._waiters.remove(waiter)
+
+
+def run_teacher(base_url, recorder, transports, index, serializer='json'):
+    """Create a session, start the livestream and produce video and audio"""
+    teacher = SimClient(base_url, recorder, transports, serializer)
+    created = teacher.post('/api/create-session', {'teacherName': f"Teacher {index}",
+                                                   'sessionName': f"Bench class {index}"})
+    if created.get('error'):
+        raise RuntimeError(f"create-session failed: {created['error']}")
+    session_id, user_id = created['sessionId'], created['userId']
+
+    teacher.connect()
+    teacher.emit('join', {'sessionId': session_id, 'userId': user_id})
+    teacher.post('/api/start-livestream', {'sessionId': session_id, 'userId': user_id})
+
+    transport = teacher.call('createProducerTransport', {'sessionId': session_id})
+    teacher.call('connectTransport', {'transportId': transport['id'], 'dtlsParameters': FAKE_DTLS_PARAMETERS})
+    producer_ids = []
+    for kind in ('video', 'audio'):
+        produced = teacher.call('produce', {'transportId': transport['id'], 'kind': kind,
+                                            'rtpParameters': FAKE_RTP_PARAMETERS[kind],
+                                            'sessionId': session_id, 'userId': user_id})
+        if produced and produced.get('id'):
+            producer_ids.append(produced['id'])
+
+    return {'client': teacher, 'sessionId': session_id, 'userId': user_id, 'producerIds': producer_ids}
+
+
+def finish_teacher(teacher):
+    client = teacher['client']
+    client.post('/api/stop-livestream', {'sessionId': teacher['sessionId'], 'userId': teacher['userId']})
+    client.post('/api/leave-session', {'sessionId': teacher['sessionId'], 'userId': teacher['userId']})
+    client.emit('leave', {'sessionId': teacher['sessionId'], 'userId': teacher['userId']})
+    client.disconnect()
+
+
+def run_student(base_url, recorder, transports, teacher, index, messages, legacy_join=False, serializer='json'):
+    """Join a session, consume its producers, chat, raise a hand and leave"""
+    session_id = teacher['sessionId']
+    student = SimClient(base_url, recorder, transports, serializer)
+    started = time.perf_counter()
+    joined = student.post('/api/join-session', {'sessionId': session_id, 'userName': f"Student {index}"})
+    if joined.get('error'):
+        raise RuntimeError(f"join-session failed: {joined['error']}")
+    user_id = joined['userId']
+
+    try:
+        student.connect()
+        student.emit('join', {'sessionId': session_id, 'userId': user_id})
+        if legacy_join:
+            capabilities = student.get(f"/api/router-capabilities?sessionId={session_id}",
+                                       name='/api/router-capabilities').get('rtpCapabilities')
+            transport = student.call('createConsumerTransport', {'sessionId': session_id})
+            producer_ids = teacher['producerIds']
+        else:
+            viewer = student.call('viewer_join', {'sessionId': session_id, 'userId': user_id})
+            if not viewer or viewer.get('error'):
+                raise RuntimeError(f"viewer_join failed: {(viewer or {}).get('error')}")
+            transport = viewer['consumerTransport']
+            producer_ids = [p['id'] for p in viewer['producers']]
+            # Stand-in for the device's capabilities, registered once so consumes carry only ids
+            registered = student.call('register_rtp_capabilities', {'rtpCapabilities': viewer['rtpCapabilities']})
+            capabilities = None
+
+        student.call('connectTransport', {'transportId': transport['id'], 'dtlsParameters': FAKE_DTLS_PARAMETERS})
+        for producer_id in producer_ids:
+            consume = {'transportId': transport['id'], 'producerId': producer_id}
+            if capabilities:
+                consume['rtpCapabilities'] = capabilities
+            else:
+                consume['capsHash'] = registered['capsHash']
+            student.call('consume', consume)
+        recorder.record('student join -> consuming', (time.perf_counter() - started) * 1000)
+
+        for n in range(messages):
+            student.post('/api/send-message', {'sessionId': session_id, 'userId': user_id,
+                                               'message': f"message {n} from student {index}",
+                                               'isQuestion': n == 0})
+
+        student.round_trip('raise_hand', {'sessionId': session_id, 'userId': user_id, 'isRaised': True},
+                           'hand_raise_changed', lambda data: data and data.get('userId') == user_id)
+        student.round_trip('toggle_mute', {'sessionId': session_id, 'userId': user_id, 'isMuted': False},
+                           'user_mute_changed', lambda data: data and data.get('userId') == user_id)
+        student.post('/api/raise-hand', {'sessionId': session_id, 'userId': user_id, 'isRaised': False})
+        student.get('/api/get-active-sessions')
+        student.get(f"/api/sessions/{session_id}/messages?limit=20", name='/api/sessions/<id>/messages')
+
+        student.post('/api/leave-session', {'sessionId': session_id, 'userId': user_id})
+        student.emit('leave', {'sessionId': session_id, 'userId': user_id})
+    finally:
+        student.disconnect()
+
+
+def start_backend(host, port):
+    """Start the Flask-SocketIO app from create_app() in a background thread"""
+    from app import create_app
+
+    app, socketio = create_app()
+    thread = threading.Thread(
+        target=socketio.run,
+        args=(app,),
+        kwargs={'host': host, 'port': port, 'allow_unsafe_werkzeug': True, 'log_output': False},
+        name='backend',
+        daemon=True
+    )
+    thread.start()
+
+    base_url = f"http://{host}:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/api/health", timeout=2).status_code == 200:
+                return base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('Backend did not become healthy within 30s')
+
+
+def negotiate_serializer(base_url, requested):
+    """requested if the backend offers it, else JSON"""
+    if requested == 'json':
+        return requested
+    try:
+        offered = requests.get(f"{base_url}/api/socketio-serializers", timeout=10).json().get('serializers', [])
+    except (requests.RequestException, ValueError):
+        offered = []
+    if requested not in offered:
+        logger.warning(f"Backend does not offer {requested} Socket.IO frames; using JSON")
+        return 'json'
+    return requested
+
+
+def print_report(rows, wall_seconds, total_ops, recorder=None, serializer='json'):
+    print(f"\nWall time {wall_seconds:.2f}s, {total_ops} operations, {total_ops / wall_seconds:.1f} ops/s")
+    if recorder is not None and recorder.frames:
+        print(f"Socket.IO ({serializer}): {recorder.frames} frames, {recorder.frame_bytes / 1024:.1f} KiB received, "
+              f"{recorder.frame_bytes / recorder.frames:.0f} bytes per frame")
+    print()
+    header = f"{'operation':<52}{'count':>7}{'errors':>8}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        print(f"{row['name']:<52}{row['count']:>7}{row['errors']:>8}{row['throughput']:>9.1f}"
+              f"{row['p50']:>9.1f}{row['p95']:>9.1f}{row['p99']:>9.1f}{row['max']:>9.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the streaming backend')
+    parser.add_argument('--teachers', type=int, default=2, help='Concurrent sessions')
+    parser.add_argument('--students', type=int, default=20, help='Students per session')
+    parser.add_argument('--messages', type=int, default=3, help='Chat messages per student')
+    parser.add_argument('--concurrency', type=int, default=50, help='Students driven at the same time')
+    parser.add_argument('--ramp-s', type=float, default=0.0, help='Spread student arrivals over this many seconds')
+    parser.add_argument('--transport', choices=['auto', 'polling', 'websocket'], default='auto')
+    parser.add_argument('--server-url', help='Target an already running backend instead of starting one')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--sfu-port', type=int, default=3055)
+    parser.add_argument('--sfu-latency-ms', type=float, default=2.0)
+    parser.add_argument('--sfu-jitter-ms', type=float, default=1.0)
+    parser.add_argument('--sfu-nodes', type=int, default=1, help='Stub SFU nodes, on consecutive ports from --sfu-port')
+    parser.add_argument('--spill-transports', type=int, default=0,
+                        help='Transports per session router before viewers spill to a second node (0 disables)')
+    parser.add_argument('--legacy-join', action='store_true',
+                        help='Students fetch capabilities and create their transport separately instead of viewer_join')
+    parser.add_argument('--async-mode', default='threading', help='Socket.IO async mode for the in-process backend')
+    parser.add_argument('--serializer', choices=['json', 'msgpack'], default='json',
+                        help='Socket.IO frame encoding the clients ask for')
+    parser.add_argument('--json', dest='json_path', help='Also write the report to this JSON file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    transports = None if args.transport == 'auto' else [args.transport]
+
+    stubs = []
+    if args.server_url:
+        base_url = args.server_url.rstrip('/')
+    else:
+        if not os.getenv('DATABASE_URL'):
+            sys.exit('DATABASE_URL must point at a disposable local database')
+        from benchmarks.stub_sfu import StubSFU
+
+        stubs = [StubSFU(args.host, args.sfu_port + i, args.sfu_latency_ms, args.sfu_jitter_ms).start()
+                 for i in range(max(args.sfu_nodes, 1))]
+        # The backend reads these when config is first imported
+        os.environ['MEDIASOUP_SERVER_URL'] = stubs[0].url
+        os.environ['MEDIASOUP_NODES'] = ','.join(stub.url for stub in stubs)
+        os.environ['MEDIASOUP_SPILL_TRANSPORTS'] = str(args.spill_transports)
+        os.environ.setdefault('SOCKETIO_ASYNC_MODE', args.async_mode)
+        os.environ.setdefault('DB_AUTO_MIGRATE', 'true')
+        os.environ.setdefault('SOCKETIO_SERIALIZER', args.serializer)
+        base_url = start_backend(args.host, args.port)
+    serializer = negotiate_serializer(base_url, args.serializer)
+
+    recorder = Recorder()
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(args.teachers, 1)) as pool:
+        teachers = [f.result() for f in as_completed(
+            pool.submit(run_teacher, base_url, recorder, transports, i, serializer) for i in range(args.teachers)
+        )]
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = []
+        total = args.teachers * args.students
+        for index in range(total):
+            teacher = teachers[index % len(teachers)]
+            futures.append(pool.submit(run_student, base_url, recorder, transports, teacher, index,
+                                       args.messages, args.legacy_join, serializer))
+            if args.ramp_s and total:
+                time.sleep(args.ramp_s / total * random.uniform(0.5, 1.5))
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failures += 1
+                logger.error(f"Simulated student failed: {str(e)}")
+
+    # Where the SFU load ended up, before teardown closes the routers
+    if len(stubs) > 1:
+        for stub in stubs:
+            print(f"{stub.url}: {len(stub.state.routers)} routers, {len(stub.state.transports)} transports, "
+                  f"{len(stub.state.consumers)} consumers")
+
+    for teacher in teachers:
+        finish_teacher(teacher)
+
+    wall_seconds = time.perf_counter() - started
+    rows = recorder.summary(wall_seconds)
+    total_ops = sum(row['count'] for row in rows)
+    print_report(rows, wall_seconds, total_ops, recorder, serializer)
+    if failures:
+        print(f"\n{failures} simulated students failed")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'id': str(uuid.uuid4()), 'args': vars(args), 'wallSeconds': wall_seconds,
+                       'operations': total_ops, 'failures': failures, 'serializer': serializer,
+                       'socketio': {'frames': recorder.frames, 'bytes': recorder.frame_bytes},
+                       'results': rows}, f, indent=2)
+
+    for stub in stubs:
+        stub.stop()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""RTP fixtures for exercising the recording and HLS pipelines without an SFU
+
+    python -m benchmarks.rtp_fixture generate fixture.rtpdump --seconds 30 --video-codec h264
+    python -m benchmarks.rtp_fixture replay fixture.rtpdump --out /tmp/recordings --segment-seconds 5
+    python -m benchmarks.rtp_fixture replay fixture.rtpdump --into hls --out /tmp/hls
+    python -m benchmarks.rtp_fixture send fixture.rtpdump 127.0.0.1:40000
+
+generate writes a synthetic opus + VP8 or H.264 stream (payload types and
+clock rates as in mediasoup/config.js) in rtpdump format; any rtpdump capture
+works as a fixture too. The synthetic H.264 has a valid SPS and PPS and
+correctly packetized (STAP-A, FU-A) NAL units around random slice data, so it
+exercises packaging but does not decode. replay feeds a fixture into a
+Recording or an HlsPackager offline, as fast as it reads, and prints the
+resulting index or playlist. send replays it over UDP in real time, e.g. to
+the port of a live RtpTap.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import struct
+import sys
+import time
+
+from app.services.hls import HlsPackager
+from app.services.recording import Recording, read_rtpdump, write_rtpdump_header, write_rtpdump_record
+from app.services.rtp_tap import rtp_header
+
+AUDIO = {'payloadType': 100, 'clockRate': 48000, 'ptime': 0.02, 'bytes': 80}
+VIDEO = {'clockRate': 90000, 'fps': 30, 'mtu': 1100, 'width': 640, 'height': 360}
+# Payload types of config.mediasoup.router.mediaCodecs
+PAYLOAD_TYPES = {100: ('audio', 'audio/opus'), 101: ('video', 'video/VP8'), 102: ('video', 'video/H264')}
+VIDEO_PAYLOAD_TYPES = {'vp8': 101, 'h264': 102}
+H264_PPS = bytes([0x68, 0xCE, 0x38, 0x80])
+
+
+def rtp_packet(payload_type, marker, sequence, timestamp, ssrc, payload):
+    return struct.pack('!BBHII', 0x80, payload_type | (0x80 if marker else 0),
+                       sequence & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc) + payload
+
+
+def synthetic_sps(width, height):
+    """Baseline-profile H.264 SPS for width x height (cropped from whole macroblocks)"""
+    bits = []
+
+    def u(count, value):
+        bits.extend((value >> (count - 1 - i)) & 1 for i in range(count))
+
+    def ue(value):
+        value += 1
+        u(value.bit_length() - 1, 0)
+        u(value.bit_length(), value)
+
+    width_mbs, height_mbs = (width + 15) // 16, (height + 15) // 16
+    u(8, 66)
+    u(8, 0xC0)
+    u(8, 31)
+    for value in (0, 0, 0, 0, 1):  # sps id, log2_max_frame_num-4, poc type, log2_max_poc_lsb-4, ref frames
+        ue(value)
+    u(1, 0)
+    ue(width_mbs - 1)
+    ue(height_mbs - 1)
+    u(2, 0b11)  # frame_mbs_only, direct_8x8_inference
+    crop_right, crop_bottom = (width_mbs * 16 - width) // 2, (height_mbs * 16 - height) // 2
+    u(1, 1 if crop_right or crop_bottom else 0)
+    if crop_right or crop_bottom:
+        for value in (0, crop_right, 0, crop_bottom):
+            ue(value)
+    u(1, 0)  # no VUI
+    u(1, 1)  # rbsp stop bit
+    bits.extend([0] * (-len(bits) % 8))
+    return bytes([0x67]) + bytes(int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+
+
+def h264_payloads(nals, mtu):
+    """RTP payloads of one access unit: SPS/PPS aggregated in a STAP-A, large NAL units as FU-A"""
+    payloads = []
+    parameter_sets = [nal for nal in nals if nal[0] & 0x1F in (7, 8)]
+    if parameter_sets:
+        payloads.append(bytes([0x78]) + b''.join(struct.pack('!H', len(nal)) + nal for nal in parameter_sets))
+    for nal in (nal for nal in nals if nal[0] & 0x1F not in (7, 8)):
+        if len(nal) <= mtu:
+            payloads.append(nal)
+            continue
+        body = nal[1:]
+        for start in range(0, len(body), mtu):
+            header = nal[0] & 0x1F
+            if start == 0:
+                header |= 0x80
+            if start + mtu >= len(body):
+                header |= 0x40
+            payloads.append(bytes([(nal[0] & 0xE0) | 28, header]) + body[start:start + mtu])
+    return payloads
+
+
+def synthetic_packets(seconds, video_kbps=800, video_codec='vp8'):
+    """(offset seconds, packet) of one opus and one video stream, in arrival order"""
+    packets = []
+    audio_ssrc, video_ssrc = random.randint(1, 2 ** 31), random.randint(1, 2 ** 31)
+    for n in range(int(seconds / AUDIO['ptime'])):
+        payload = os.urandom(AUDIO['bytes'])
+        packets.append((n * AUDIO['ptime'], rtp_packet(AUDIO['payloadType'], False, n,
+                                                       int(n * AUDIO['ptime'] * AUDIO['clockRate']),
+                                                       audio_ssrc, payload)))
+    sequence = 0
+    payload_type = VIDEO_PAYLOAD_TYPES[video_codec]
+    frame_bytes = int(video_kbps * 1000 / 8 / VIDEO['fps'])
+    sps = synthetic_sps(VIDEO['width'], VIDEO['height'])
+    for frame in range(int(seconds * VIDEO['fps'])):
+        offset = frame / VIDEO['fps']
+        timestamp = frame * VIDEO['clockRate'] // VIDEO['fps']
+        keyframe = frame % (VIDEO['fps'] * 2) == 0  # a keyframe every 2 s
+        size = frame_bytes * (4 if keyframe else 1)
+        if video_codec == 'h264':
+            slice_nal = bytes([0x65 if keyframe else 0x41]) + os.urandom(size)
+            payloads = h264_payloads([sps, H264_PPS, slice_nal] if keyframe else [slice_nal], VIDEO['mtu'])
+        else:
+            payloads = [os.urandom(min(VIDEO['mtu'], size - start)) for start in range(0, size, VIDEO['mtu'])]
+        for i, payload in enumerate(payloads):
+            packets.append((offset, rtp_packet(payload_type, i == len(payloads) - 1, sequence,
+                                               timestamp, video_ssrc, payload)))
+            sequence += 1
+    packets.sort(key=lambda item: item[0])
+    return packets
+
+
+def generate(args):
+    start = time.time()
+    packets = synthetic_packets(args.seconds, args.video_kbps, args.video_codec)
+    with open(args.fixture, 'wb') as file:
+        write_rtpdump_header(file, start)
+        for offset, packet in packets:
+            write_rtpdump_record(file, packet, int(offset * 1000))
+    print(f"Wrote {len(packets)} packets ({args.seconds}s) to {args.fixture}")
+
+
+def fixture_streams(path):
+    """Stream descriptions (as rtp_tap gives them) for the SSRCs in a fixture, by payload type"""
+    streams = {}
+    for _, packet in read_rtpdump(path):
+        payload_type, _, _, _, ssrc = rtp_header(packet)
+        if ssrc not in streams and payload_type in PAYLOAD_TYPES:
+            kind, mime_type = PAYLOAD_TYPES[payload_type]
+            streams[ssrc] = {'kind': kind, 'ssrc': ssrc, 'payloadType': payload_type, 'mimeType': mime_type}
+    return list(streams.values())
+
+
+def replay(args):
+    if args.into == 'hls':
+        return replay_hls(args)
+    recording = Recording(args.session_id, root=args.out, max_bytes=args.segment_max_bytes,
+                          max_seconds=args.segment_seconds, publish=False)
+    packets = 0
+    for arrival, packet in read_rtpdump(args.fixture):
+        recording.feed(packet, arrival)
+        packets += 1
+    recording.finish()
+    print(f"Replayed {packets} packets into {recording.directory}")
+    with open(os.path.join(recording.directory, 'index.json')) as file:
+        print(json.dumps(json.load(file), indent=2))
+
+
+def replay_hls(args):
+    directory = os.path.join(args.out, args.session_id)
+    os.makedirs(directory, exist_ok=True)
+    packager = HlsPackager(directory, args.segment_seconds or 2, args.playlist_segments)
+    accepted = packager.add_streams(fixture_streams(args.fixture))
+    print(f"Packaging {', '.join(s['mimeType'] for s in accepted) or 'no streams'}")
+    packets = 0
+    for arrival, packet in read_rtpdump(args.fixture):
+        packager.feed(packet, arrival)
+        packets += 1
+    packager.finish()
+    print(f"Replayed {packets} packets into {directory}")
+    with open(os.path.join(directory, 'index.m3u8')) as file:
+        print(file.read())
+
+
+def send(args):
+    host, port = args.target.rsplit(':', 1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    first, started, packets = None, time.monotonic(), 0
+    for arrival, packet in read_rtpdump(args.fixture):
+        first = arrival if first is None else first
+        delay = (arrival - first) / args.speed - (time.monotonic() - started)
+        if delay > 0:
+            time.sleep(delay)
+        sock.sendto(packet, (host, int(port)))
+        packets += 1
+    print(f"Sent {packets} packets to {args.target}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('generate', help='write a synthetic opus + VP8 fixture')
+    command.add_argument('fixture')
+    command.add_argument('--seconds', type=float, default=30)
+    command.add_argument('--video-kbps', type=int, default=800)
+    command.add_argument('--video-codec', choices=sorted(VIDEO_PAYLOAD_TYPES), default='vp8')
+    command.set_defaults(run=generate)
+
+    command = commands.add_parser('replay', help='feed a fixture into an offline Recording or HLS packager')
+    command.add_argument('fixture')
+    command.add_argument('--into', choices=('recording', 'hls'), default='recording')
+    command.add_argument('--out', default='recordings')
+    command.add_argument('--playlist-segments', type=int, default=6)
+    command.add_argument('--session-id', default='fixture')
+    command.add_argument('--segment-seconds', type=float)
+    command.add_argument('--segment-max-bytes', type=int)
+    command.set_defaults(run=replay)
+
+    command = commands.add_parser('send', help='replay a fixture over UDP to host:port')
+    command.add_argument('fixture')
+    command.add_argument('target')
+    command.add_argument('--speed', type=float, default=1.0, help='playback speed multiplier')
+    command.set_defaults(run=send)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,458 @@
+"""Python stand-in for mediasoup/server.js
+
+Implements the same HTTP routes with fake transport/producer/consumer
+objects and a configurable per-request latency, so the backend can be load
+tested without a real SFU.
+
+    python -m benchmarks.stub_sfu --port 3000 --latency-ms 5 --jitter-ms 2
+
+Run several on different ports and list them in MEDIASOUP_NODES to exercise
+multi-node placement and spilling.
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Mirrors config.mediasoup.router.mediaCodecs in mediasoup/config.js
+RTP_CAPABILITIES = {
+    'codecs': [
+        {'kind': 'audio', 'mimeType': 'audio/opus', 'clockRate': 48000, 'channels': 2,
+         'preferredPayloadType': 100, 'parameters': {}, 'rtcpFeedback': []},
+        {'kind': 'video', 'mimeType': 'video/VP8', 'clockRate': 90000, 'preferredPayloadType': 101,
+         'parameters': {'x-google-start-bitrate': 1000}, 'rtcpFeedback': [{'type': 'nack'}]},
+        {'kind': 'video', 'mimeType': 'video/H264', 'clockRate': 90000, 'preferredPayloadType': 102,
+         'parameters': {'packetization-mode': 1, 'profile-level-id': '4d0032',
+                        'level-asymmetry-allowed': 1, 'x-google-start-bitrate': 1000},
+         'rtcpFeedback': [{'type': 'nack'}]}
+    ],
+    'headerExtensions': []
+}
+
+
+class StubState:
+    """In-memory SFU objects shared by all request threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routers = {}     # id -> worker index
+        self.transports = {}  # id -> {'connected': bool, 'worker': index}
+        self.producers = {}   # id -> {'transportId', 'kind', 'worker'}
+        self.consumers = {}   # id -> {'transportId', 'producerId', 'worker', 'layers'}
+        self.capabilities = {}  # capsHash -> rtpCapabilities
+        self.audio_seq = 0
+        self.requests = 0
+
+
+class StubSFU:
+    """Threaded HTTP server implementing the mediasoup control-plane routes"""
+
+    def __init__(self, host='127.0.0.1', port=3000, latency_ms=0.0, jitter_ms=0.0, num_workers=4):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.num_workers = num_workers
+        self.state = StubState()
+        self.routes = {
+            ('GET', '/workers'): self.workers,
+            ('POST', '/routers'): self.create_router,
+            ('POST', '/closeRouter'): self.close_router,
+            ('GET', '/router-capabilities'): self.router_capabilities,
+            ('POST', '/createProducerTransport'): self.create_transport,
+            ('POST', '/createConsumerTransport'): self.create_transport,
+            ('POST', '/connectTransport'): self.connect_transport,
+            ('POST', '/connectProducerTransport'): self.connect_transport,
+            ('POST', '/connectConsumerTransport'): self.connect_transport,
+            ('POST', '/produce'): self.produce,
+            ('POST', '/consume'): self.consume,
+            ('POST', '/closeProducer'): self.close_producer,
+            ('POST', '/closeResources'): self.close_resources,
+            ('POST', '/consumerLayers'): self.consumer_layers,
+            ('POST', '/stats'): self.object_stats,
+            ('GET', '/audioLevels'): self.audio_levels,
+            ('POST', '/plainTransports'): self.create_plain_transport,
+            ('POST', '/plainConsume'): self.plain_consume,
+            ('POST', '/requestKeyFrame'): self.request_key_frame,
+            ('POST', '/pipeTransports'): self.create_pipe_transport,
+            ('POST', '/connectPipeTransport'): self.connect_transport,
+            ('POST', '/pipeConsume'): self.pipe_consume,
+            ('POST', '/pipeProduce'): self.pipe_produce,
+        }
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='stub-sfu', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Route handlers return (status, body)
+
+    def workers(self, body):
+        with self.state.lock:
+            loads = [{'index': i, 'pid': 0, 'routers': 0, 'transports': 0, 'producers': 0, 'consumers': 0,
+                      'bitrate': 0, 'cpuMs': 0} for i in range(self.num_workers)]
+            router_load = {router_id: {'transports': 0, 'producers': 0, 'consumers': 0}
+                           for router_id in self.state.routers}
+            for worker in self.state.routers.values():
+                loads[worker]['routers'] += 1
+            for key in ('transports', 'producers', 'consumers'):
+                for item in getattr(self.state, key).values():
+                    loads[item['worker']][key] += 1
+                    if item.get('routerId') in router_load:
+                        router_load[item['routerId']][key] += 1
+        return 200, {'workers': loads, 'routerLoad': router_load}
+
+    def create_router(self, body):
+        worker = body.get('workerIndex')
+        if not isinstance(worker, int) or not 0 <= worker < self.num_workers:
+            return 404, {'error': 'Worker not found'}
+        router_id = str(uuid.uuid4())
+        with self.state.lock:
+            self.state.routers[router_id] = worker
+        return 200, {'routerId': router_id, 'workerIndex': worker, 'rtpCapabilities': RTP_CAPABILITIES}
+
+    def close_router(self, body):
+        with self.state.lock:
+            if self.state.routers.pop(body.get('routerId'), None) is None:
+                return 404, {'error': 'Router not found'}
+            for key in ('transports', 'producers', 'consumers'):
+                objects = getattr(self.state, key)
+                for object_id in [i for i, item in objects.items() if item.get('routerId') == body['routerId']]:
+                    del objects[object_id]
+        return 200, {'success': True}
+
+    def router_capabilities(self, body):
+        if body.get('routerId') and body['routerId'] not in self.state.routers:
+            return 404, {'error': 'Router not found'}
+        return 200, {'rtpCapabilities': RTP_CAPABILITIES}
+
+    def create_transport(self, body):
+        transport_id = str(uuid.uuid4())
+        with self.state.lock:
+            router_id = body.get('routerId')
+            if router_id and router_id not in self.state.routers:
+                return 404, {'error': 'Router not found'}
+            worker = self.state.routers.get(router_id, 0)
+            self.state.transports[transport_id] = {'connected': False, 'worker': worker, 'routerId': router_id}
+        return 200, {
+            'id': transport_id,
+            'iceParameters': {'usernameFragment': uuid.uuid4().hex[:16], 'password': uuid.uuid4().hex, 'iceLite': True},
+            'iceCandidates': [{'foundation': 'udpcandidate', 'ip': '127.0.0.1', 'port': random.randint(10000, 20000),
+                               'priority': 1076302079, 'protocol': 'udp', 'type': 'host'}],
+            'dtlsParameters': {'role': 'auto', 'fingerprints': [
+                {'algorithm': 'sha-256', 'value': ':'.join(f"{random.randint(0, 255):02X}" for _ in range(32))}
+            ]}
+        }
+
+    def connect_transport(self, body):
+        with self.state.lock:
+            transport = self.state.transports.get(body.get('transportId'))
+            if not transport:
+                return 404, {'error': 'Transport not found'}
+            transport['connected'] = True
+        return 200, {'success': True}
+
+    def produce(self, body):
+        with self.state.lock:
+            transport = self.state.transports.get(body.get('transportId'))
+            if not transport:
+                return 404, {'error': 'Transport not found'}
+            producer_id = str(uuid.uuid4())
+            codecs = (body.get('rtpParameters') or {}).get('codecs') or [{}]
+            self.state.producers[producer_id] = {'transportId': body['transportId'], 'kind': body.get('kind'),
+                                                 'worker': transport['worker'], 'routerId': transport['routerId'],
+                                                 'userId': body.get('userId'), 'mimeType': codecs[0].get('mimeType')}
+        return 200, {'id': producer_id}
+
+    def consume(self, body):
+        with self.state.lock:
+            transport = self.state.transports.get(body.get('transportId'))
+            if not transport:
+                return 404, {'error': 'Transport not found'}
+            producer = self.state.producers.get(body.get('producerId'))
+            if not producer:
+                return 404, {'error': 'Producer not found'}
+            caps_hash = body.get('capsHash')
+            if caps_hash:
+                if body.get('rtpCapabilities'):
+                    self.state.capabilities[caps_hash] = body['rtpCapabilities']
+                elif caps_hash not in self.state.capabilities:
+                    return 409, {'error': 'Unknown capabilities hash'}
+            consumer_id = str(uuid.uuid4())
+            # Video producers are treated as simulcast, as the teacher client sends them
+            simulcast = producer['kind'] == 'video'
+            layers = body.get('preferredLayers') if simulcast else None
+            self.state.consumers[consumer_id] = {'transportId': body['transportId'], 'producerId': body['producerId'],
+                                                 'worker': transport['worker'], 'routerId': transport['routerId'],
+                                                 'simulcast': simulcast, 'layers': layers}
+        codec = next(c for c in RTP_CAPABILITIES['codecs'] if c['kind'] == producer['kind'])
+        return 200, {
+            'id': consumer_id,
+            'producerId': body['producerId'],
+            'kind': producer['kind'],
+            'type': 'simulcast' if simulcast else 'simple',
+            'preferredLayers': layers,
+            'rtpParameters': {
+                'codecs': [dict(codec, payloadType=codec['preferredPayloadType'])],
+                'encodings': [{'ssrc': random.randint(1, 2 ** 31)}],
+                'headerExtensions': [],
+                'rtcp': {'cname': uuid.uuid4().hex[:8], 'reducedSize': True}
+            }
+        }
+
+    def close_producer(self, body):
+        with self.state.lock:
+            if self.state.producers.pop(body.get('producerId'), None) is None:
+                return 404, {'error': 'Producer not found'}
+            closed = [cid for cid, c in self.state.consumers.items() if c['producerId'] == body['producerId']]
+            for consumer_id in closed:
+                del self.state.consumers[consumer_id]
+        return 200, {'success': True}
+
+    def close_resources(self, body):
+        state = self.state
+        with state.lock:
+            closed, missing = 0, []
+            for key, objects in (('consumerIds', state.consumers), ('producerIds', state.producers),
+                                 ('transportIds', state.transports)):
+                for object_id in body.get(key) or []:
+                    if objects.pop(object_id, None) is None:
+                        missing.append(object_id)
+                    else:
+                        closed += 1
+            # Closing a transport closes what lives on it; closing a producer closes its consumers
+            transports = set(body.get('transportIds') or [])
+            for object_id in [i for i, p in state.producers.items() if p['transportId'] in transports]:
+                del state.producers[object_id]
+            for object_id in [i for i, c in state.consumers.items()
+                              if c['transportId'] in transports or c['producerId'] not in state.producers]:
+                del state.consumers[object_id]
+        return 200, {'closed': closed, 'missing': missing}
+
+    def consumer_layers(self, body):
+        updated, missing = 0, []
+        with self.state.lock:
+            for layers in body.get('layers') or []:
+                consumer = self.state.consumers.get(layers.get('consumerId'))
+                if not consumer or not consumer.get('simulcast'):
+                    missing.append(layers.get('consumerId'))
+                    continue
+                consumer['layers'] = {'spatialLayer': layers.get('spatialLayer'),
+                                      'temporalLayer': layers.get('temporalLayer')}
+                updated += 1
+        return 200, {'updated': updated, 'missing': missing}
+
+    def object_stats(self, body):
+        """Plausible random stats for every known object, like POST /stats on server.js"""
+        stats, missing = {}, []
+        with self.state.lock:
+            for key, objects in (('transportIds', self.state.transports), ('producerIds', self.state.producers),
+                                 ('consumerIds', self.state.consumers)):
+                for object_id in body.get(key) or []:
+                    if object_id not in objects:
+                        missing.append(object_id)
+                        continue
+                    entry = objects[object_id]
+                    entry['packetsLost'] = entry.get('packetsLost', 0) + random.randint(0, 3)
+                    stats[object_id] = {
+                        'bitrate': random.randint(200_000, 900_000),
+                        'packetsLost': entry['packetsLost'],
+                        'loss': random.random() * 0.02,
+                        'rtt': random.uniform(10, 80) if key == 'consumerIds' else None,
+                        'jitter': random.uniform(0, 5) if key == 'producerIds' else None,
+                        'score': random.randint(7, 10) if key != 'transportIds' else None
+                    }
+        return 200, {'stats': stats, 'missing': missing}
+
+    def audio_levels(self, body):
+        """Random volumes for up to two audio producers per router, like the AudioLevelObserver"""
+        with self.state.lock:
+            self.state.audio_seq += 1
+            by_router = {}
+            for producer_id, producer in self.state.producers.items():
+                if producer['kind'] == 'audio':
+                    by_router.setdefault(producer['routerId'], []).append((producer_id, producer))
+            routers = {
+                router_id: [{'producerId': producer_id, 'userId': producer.get('userId'),
+                             'volume': random.randint(-70, -10)}
+                            for producer_id, producer in random.sample(entries, min(2, len(entries)))]
+                for router_id, entries in by_router.items()
+            }
+        return 200, {'seq': self.state.audio_seq, 'routers': routers}
+
+    def create_plain_transport(self, body):
+        """Accepts the transport but sends no RTP; replay a fixture to the tap for that"""
+        with self.state.lock:
+            worker = self.state.routers.get(body.get('routerId'))
+            if worker is None:
+                return 404, {'error': 'Router not found'}
+            transport_id = str(uuid.uuid4())
+            self.state.transports[transport_id] = {'connected': True, 'worker': worker,
+                                                   'routerId': body['routerId'], 'remote': (body.get('ip'), body.get('port'))}
+        return 200, {'id': transport_id}
+
+    def plain_consume(self, body):
+        with self.state.lock:
+            transport = self.state.transports.get(body.get('transportId'))
+            if not transport or 'remote' not in transport:
+                return 404, {'error': 'Transport not found'}
+            created, missing = [], []
+            for producer_id in body.get('producerIds', []):
+                producer = self.state.producers.get(producer_id)
+                if not producer:
+                    missing.append(producer_id)
+                    continue
+                consumer_id = str(uuid.uuid4())
+                self.state.consumers[consumer_id] = {'transportId': body['transportId'], 'producerId': producer_id,
+                                                     'worker': transport['worker'], 'routerId': transport['routerId']}
+                # The router's own capabilities: the consumer keeps the producer's codec
+                codec = next((c for c in RTP_CAPABILITIES['codecs'] if c['mimeType'] == producer.get('mimeType')),
+                             next(c for c in RTP_CAPABILITIES['codecs'] if c['kind'] == producer['kind']))
+                created.append({'id': consumer_id, 'producerId': producer_id, 'kind': producer['kind'],
+                                'rtpParameters': {'codecs': [dict(codec, payloadType=codec['preferredPayloadType'])],
+                                                  'encodings': [{'ssrc': random.randint(1, 2 ** 31)}]}})
+        return 200, {'consumers': created, 'missing': missing}
+
+    def request_key_frame(self, body):
+        with self.state.lock:
+            known = [i for i in body.get('consumerIds') or [] if i in self.state.consumers]
+        return 200, {'requested': len(known), 'missing': [i for i in body.get('consumerIds') or [] if i not in known]}
+
+    def create_pipe_transport(self, body):
+        with self.state.lock:
+            worker = self.state.routers.get(body.get('routerId'))
+            if worker is None:
+                return 404, {'error': 'Router not found'}
+            transport_id = str(uuid.uuid4())
+            self.state.transports[transport_id] = {'connected': False, 'worker': worker,
+                                                   'routerId': body['routerId'], 'piped': set()}
+        host = self.server.server_address[0]
+        return 200, {'id': transport_id, 'ip': host, 'port': random.randint(20000, 30000)}
+
+    def pipe_consume(self, body):
+        with self.state.lock:
+            transport = self.state.transports.get(body.get('transportId'))
+            if not transport or 'piped' not in transport:
+                return 404, {'error': 'Transport not found'}
+            if body.get('producerIds'):
+                candidates = [(pid, self.state.producers[pid]) for pid in body['producerIds']
+                              if pid in self.state.producers]
+            else:
+                candidates = [(pid, p) for pid, p in self.state.producers.items()
+                              if p.get('routerId') == transport['routerId']]
+            result = []
+            for producer_id, producer in candidates:
+                if producer_id in transport['piped']:
+                    continue
+                transport['piped'].add(producer_id)
+                codec = next(c for c in RTP_CAPABILITIES['codecs'] if c['kind'] == producer['kind'])
+                result.append({'producerId': producer_id, 'kind': producer['kind'], 'paused': False,
+                               'rtpParameters': {'codecs': [dict(codec, payloadType=codec['preferredPayloadType'])],
+                                                 'encodings': [{'ssrc': random.randint(1, 2 ** 31)}]}})
+        return 200, {'producers': result}
+
+    def pipe_produce(self, body):
+        with self.state.lock:
+            transport = self.state.transports.get(body.get('transportId'))
+            if not transport:
+                return 404, {'error': 'Transport not found'}
+            ids = []
+            for piped in body.get('producers', []):
+                if piped['producerId'] in self.state.producers:
+                    continue
+                self.state.producers[piped['producerId']] = {
+                    'transportId': body['transportId'], 'kind': piped['kind'],
+                    'worker': transport['worker'], 'routerId': transport['routerId']}
+                ids.append(piped['producerId'])
+        return 200, {'ids': ids}
+
+    def _delay(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like express
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def _dispatch(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    body = {}
+                path, _, query = self.path.partition('?')
+                if query:
+                    body.update((key, values[0]) for key, values in parse_qs(query).items())
+
+                handler = stub.routes.get((method, path))
+                with stub.state.lock:
+                    stub.state.requests += 1
+                stub._delay()
+                if handler is None:
+                    status, payload = 404, {'error': f"Unknown route {self.path}"}
+                else:
+                    status, payload = handler(body)
+
+                encoded = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub mediasoup control-plane server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Fixed delay added to every request')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Random extra delay, uniform in [0, jitter]')
+    parser.add_argument('--workers', type=int, default=4, help='Number of simulated mediasoup workers')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stub = StubSFU(args.host, args.port, args.latency_ms, args.jitter_ms, args.workers)
+    logger.info(f"Stub mediasoup server running on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -25,12 +25,15 @@ class Config:
         pool_size=5,         # Connection pool size
         max_overflow=10,     # Maximum overflow connections
         connect_args={
-            "sslmode": "require",
+            "sslmode": os.getenv('DATABASE_SSLMODE', 'require'),  # 'disable' for a local database
             "connect_timeout": 10,
             "application_name": "streaming_backend"
         }
     )
     
+    # Apply pending Alembic migrations at startup instead of refusing to start
+    DB_AUTO_MIGRATE = os.getenv('DB_AUTO_MIGRATE', 'False').lower() == 'true'
+    
     # Create session factory
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     
@@ -38,5 +41,81 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here-change-in-production')
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
 
+    # Socket.IO settings. SOCKETIO_MESSAGE_QUEUE enables multi-process mode
+    # (redis://, amqp://, kafka://, zmq+tcp://, or local:// for the in-process
+    # stand-in used by tests); the load balancer must keep clients sticky.
+    SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE') or None  # eventlet, gevent or threading; auto-detected if unset
+    SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE') or None
+    SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'flask-socketio')
+    SOCKETIO_SERIALIZER = os.getenv('SOCKETIO_SERIALIZER', 'json')  # msgpack: clients connecting with ?serializer=msgpack get MessagePack frames
+    EMIT_COALESCE_MS = int(os.getenv('EMIT_COALESCE_MS', 0))  # Batch room events per tick (e.g. 25-50); 0 disables
+
+    # Seconds the lobby's active-sessions listing may be served from memory
+    ACTIVE_SESSIONS_CACHE_TTL = float(os.getenv('ACTIVE_SESSIONS_CACHE_TTL', 2.0))
+
+    # Seconds send-message (HTTP and socket) reuses validated session and teacher info before reloading it
+    SESSION_INFO_CACHE_TTL = float(os.getenv('SESSION_INFO_CACHE_TTL', 30.0))
+
+    # Chat ingestion (group commit)
+    CHAT_QUEUE_MAX_PENDING = int(os.getenv('CHAT_QUEUE_MAX_PENDING', 5000))  # Queued messages before send-message returns 503
+    CHAT_BATCH_SIZE = int(os.getenv('CHAT_BATCH_SIZE', 500))                 # Rows per multi-row INSERT
+    CHAT_FLUSH_INTERVAL = float(os.getenv('CHAT_FLUSH_INTERVAL', 0.05))      # Group-commit window in seconds
+    CHAT_MAX_RETRIES = int(os.getenv('CHAT_MAX_RETRIES', 5))                 # Retries of a batch after connection errors before it is dropped
+
+    # Chat history paging
+    CHAT_HISTORY_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_PAGE_SIZE', 50))       # Messages returned on join
+    CHAT_HISTORY_MAX_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_MAX_PAGE_SIZE', 200))
+
+    # Presence write-behind settings
+    PRESENCE_FLUSH_INTERVAL = float(os.getenv('PRESENCE_FLUSH_INTERVAL', 1.0))  # Max seconds before a toggle is persisted
+    PRESENCE_MAX_BATCH = int(os.getenv('PRESENCE_MAX_BATCH', 500))              # Rows per batched UPDATE
+
+    # Diagnostics
+    SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'True').lower() == 'true'  # db/sfu/serialize/emit breakdown per request
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')                                    # Bearer token for /api/admin/*; empty disables them
+    PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS', 60))           # Longest profiling window an admin may request
+    PROFILER_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILER_SAMPLE_INTERVAL_MS', 5))
+
     #Mediasoup server configuration
-    MEDIASOUP_SERVER_URL = os.getenv('MEDIASOUP_SERVER_URL', 'http://localhost:3000')
\ No newline at end of file
+    MEDIASOUP_SERVER_URL = os.getenv('MEDIASOUP_SERVER_URL', 'http://localhost:3000')
+    MEDIASOUP_CONNECT_TIMEOUT = float(os.getenv('MEDIASOUP_CONNECT_TIMEOUT', 2))  # Seconds to open a connection
+    MEDIASOUP_TIMEOUT = float(os.getenv('MEDIASOUP_TIMEOUT', 5))                  # Seconds to wait for a response
+    MEDIASOUP_POOL_SIZE = int(os.getenv('MEDIASOUP_POOL_SIZE', 32))               # Keep-alive connections to the SFU
+    MEDIASOUP_MAX_CONCURRENCY = int(os.getenv('MEDIASOUP_MAX_CONCURRENCY', 32))   # In-flight SFU calls per process
+    # SFU cluster: comma-separated base URLs; the first node also serves requests not tied to a session
+    MEDIASOUP_NODES = [url.strip() for url in os.getenv('MEDIASOUP_NODES', MEDIASOUP_SERVER_URL).split(',') if url.strip()]
+    MEDIASOUP_HEALTH_INTERVAL = float(os.getenv('MEDIASOUP_HEALTH_INTERVAL', 5))    # Seconds between node health/load checks
+    MEDIASOUP_UNHEALTHY_AFTER = int(os.getenv('MEDIASOUP_UNHEALTHY_AFTER', 2))      # Failed checks before a node takes no new sessions
+    MEDIASOUP_SPILL_TRANSPORTS = int(os.getenv('MEDIASOUP_SPILL_TRANSPORTS', 0))    # Transports on a session's router before viewers spill to a second node; 0 disables
+    SFU_WORKER_THREADS = int(os.getenv('SFU_WORKER_THREADS', 16))                 # Threads running SFU work for socket handlers
+    RTP_CAPABILITY_CACHE_SIZE = int(os.getenv('RTP_CAPABILITY_CACHE_SIZE', 1024))  # Distinct client capability sets kept by hash
+
+    # Simulcast layers, lowest first; must match the encodings the teacher client sends
+    SIMULCAST_LAYER_KBPS = [int(kbps) for kbps in os.getenv('SIMULCAST_LAYER_KBPS', '100,300,900').split(',')]
+    SIMULCAST_LAYER_HEIGHTS = [int(px) for px in os.getenv('SIMULCAST_LAYER_HEIGHTS', '180,360,720').split(',')]
+    SIMULCAST_MAX_TEMPORAL_LAYER = int(os.getenv('SIMULCAST_MAX_TEMPORAL_LAYER', 2))
+    SFU_SESSION_EGRESS_BUDGET_KBPS = int(os.getenv('SFU_SESSION_EGRESS_BUDGET_KBPS', 200000))  # Video egress per session before default layers step down; 0 disables
+
+    # SFU stats collection: one POST /stats per node per tick
+    SFU_STATS_INTERVAL = float(os.getenv('SFU_STATS_INTERVAL', 5))   # Seconds between polls; 0 disables
+    SFU_STATS_WINDOW = float(os.getenv('SFU_STATS_WINDOW', 300))    # Seconds of samples kept per transport/producer/consumer
+
+    # Active speaker detection from the SFU's audio level observers
+    ACTIVE_SPEAKER_INTERVAL = float(os.getenv('ACTIVE_SPEAKER_INTERVAL', 0.25))  # Seconds between audio level polls; 0 disables
+    ACTIVE_SPEAKER_HOLD = float(os.getenv('ACTIVE_SPEAKER_HOLD', 0.5))          # Seconds a new speaker must stay loudest before it is announced
+    ACTIVE_SPEAKER_MAX_RATE = float(os.getenv('ACTIVE_SPEAKER_MAX_RATE', 4))     # active_speaker events per second per room, at most
+    ACTIVE_SPEAKER_TOP_N = int(os.getenv('ACTIVE_SPEAKER_TOP_N', 3))             # Speakers listed with each event and by default
+
+    # Server-side recording (RTP from a PlainTransport, written as segmented rtpdump files)
+    RTP_TAP_BIND_IP = os.getenv('RTP_TAP_BIND_IP', '127.0.0.1')  # Where SFU nodes send plain RTP; must be reachable from them
+    RECORDING_DIR = os.getenv('RECORDING_DIR', 'recordings')
+    RECORDING_SEGMENT_SECONDS = float(os.getenv('RECORDING_SEGMENT_SECONDS', 60))                  # Start a new segment after this long
+    RECORDING_SEGMENT_MAX_BYTES = int(os.getenv('RECORDING_SEGMENT_MAX_BYTES', 16 * 1024 * 1024))  # ... or once it reaches this size
+
+    # HLS broadcast mode (start-livestream with mode "hls"): producers packaged into fMP4 segments
+    HLS_DIR = os.getenv('HLS_DIR', 'hls')
+    HLS_SEGMENT_SECONDS = float(os.getenv('HLS_SEGMENT_SECONDS', 2))       # Target segment duration; segments start on keyframes
+    HLS_PLAYLIST_SEGMENTS = int(os.getenv('HLS_PLAYLIST_SEGMENTS', 6))     # Segments listed in the live playlist
+
+    # Versioned rosters (user_joined/user_left carry a version; GET /api/sessions/<id>/roster catches up)
+    ROSTER_LOG_SIZE = int(os.getenv('ROSTER_LOG_SIZE', 256))  # Joins/leaves kept per session for delta catch-up
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""Initial schema
+
+Creates the tables previously managed by Base.metadata.create_all. Tables that
+already exist are left untouched, so databases created before migrations were
+introduced can simply be upgraded.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if context.is_offline_mode():
+        existing = set()
+    else:
+        existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'users' not in existing:
+        op.create_table(
+            'users',
+            sa.Column('user_id', sa.String(), primary_key=True),
+            sa.Column('name', sa.String(), nullable=False),
+            sa.Column('is_teacher', sa.Boolean(), nullable=True),
+            sa.Column('hand_raised', sa.Boolean(), nullable=True),
+            sa.Column('is_muted', sa.Boolean(), nullable=True),
+            sa.Column('video_enabled', sa.Boolean(), nullable=True),
+            sa.Column('is_streaming', sa.Boolean(), nullable=True),
+        )
+
+    if 'sessions' not in existing:
+        op.create_table(
+            'sessions',
+            sa.Column('session_id', sa.String(), primary_key=True),
+            sa.Column('teacher_id', sa.String(), sa.ForeignKey('users.user_id'), nullable=False),
+            sa.Column('name', sa.String(), nullable=False),
+            sa.Column('is_active', sa.Boolean(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('shared_screen', sa.String(), nullable=True),
+            sa.Column('is_livestreaming', sa.Boolean(), nullable=True),
+            sa.Column('recording_url', sa.String(), nullable=True),
+            sa.Column('producer_id', sa.String(), nullable=True),
+        )
+
+    if 'session_participants' not in existing:
+        op.create_table(
+            'session_participants',
+            sa.Column('session_id', sa.String(), sa.ForeignKey('sessions.session_id'), primary_key=True),
+            sa.Column('user_id', sa.String(), sa.ForeignKey('users.user_id'), primary_key=True),
+        )
+
+    if 'messages' not in existing:
+        op.create_table(
+            'messages',
+            sa.Column('message_id', sa.String(), primary_key=True),
+            sa.Column('session_id', sa.String(), sa.ForeignKey('sessions.session_id'), nullable=False),
+            sa.Column('user_id', sa.String(), sa.ForeignKey('users.user_id'), nullable=False),
+            sa.Column('user_name', sa.String(), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('timestamp', sa.DateTime(), nullable=False),
+            sa.Column('is_question', sa.Boolean(), nullable=True),
+            sa.Column('answered', sa.Boolean(), nullable=True),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('messages')
+    op.drop_table('session_participants')
+    op.drop_table('sessions')
+    op.drop_table('users')
@@ -0,0 +1,48 @@
+"""Hot-path indexes
+
+- sessions: partial index over live sessions for get_active_sessions
+- messages: (session_id, timestamp, message_id) for chat history paging
+- session_participants: (user_id, session_id) for lookups by user
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LIVE_SESSIONS = sa.text('is_active AND is_livestreaming')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_sessions_live', 'sessions', ['created_at'],
+        postgresql_where=LIVE_SESSIONS, sqlite_where=LIVE_SESSIONS,
+        if_not_exists=True
+    )
+    op.create_index(
+        'ix_messages_session_timestamp', 'messages', ['session_id', 'timestamp', 'message_id'],
+        if_not_exists=True
+    )
+    op.create_index(
+        'ix_session_participants_user_id', 'session_participants', ['user_id', 'session_id'],
+        if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_session_participants_user_id', table_name='session_participants')
+    op.drop_index('ix_messages_session_timestamp', table_name='messages')
+    op.drop_index('ix_sessions_live', table_name='sessions')
@@ -0,0 +1,35 @@
+"""Session SFU placement
+
+- sessions.sfu_worker: index of the mediasoup worker hosting the session
+- sessions.sfu_router_id: mediasoup router created for the session
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('sessions') as batch_op:
+        batch_op.add_column(sa.Column('sfu_worker', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('sfu_router_id', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('sessions') as batch_op:
+        batch_op.drop_column('sfu_router_id')
+        batch_op.drop_column('sfu_worker')
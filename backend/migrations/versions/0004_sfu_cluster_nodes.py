@@ -0,0 +1,38 @@
+"""SFU cluster nodes
+
+- sessions.sfu_node: base URL of the SFU node hosting the session's router
+- sessions.sfu_edge_node / sfu_edge_router_id: second node and router serving
+  overflow viewers through pipe transports
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('sessions') as batch_op:
+        batch_op.add_column(sa.Column('sfu_node', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('sfu_edge_node', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('sfu_edge_router_id', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('sessions') as batch_op:
+        batch_op.drop_column('sfu_edge_router_id')
+        batch_op.drop_column('sfu_edge_node')
+        batch_op.drop_column('sfu_node')
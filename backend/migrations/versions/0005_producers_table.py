@@ -0,0 +1,74 @@
+"""Producers table
+
+- producers: one row per mediasoup producer (kind, source, state), replacing
+  sessions.producer_id, which could only hold one of a stream's producers
+- ix_producers_session_state: live producers of a session in one index scan
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'producers',
+        sa.Column('producer_id', sa.String(), nullable=False),
+        sa.Column('session_id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.String(), nullable=True),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('state', sa.String(), nullable=False),
+        sa.Column('sfu_node', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('closed_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['session_id'], ['sessions.session_id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.user_id']),
+        sa.PrimaryKeyConstraint('producer_id')
+    )
+    op.create_index('ix_producers_session_state', 'producers', ['session_id', 'state', 'kind', 'source'])
+
+    # Carry over the producer of streams that are live right now
+    sessions = sa.table('sessions', sa.column('session_id'), sa.column('teacher_id'),
+                        sa.column('producer_id'), sa.column('is_livestreaming'))
+    producers = sa.table('producers', sa.column('producer_id'), sa.column('session_id'), sa.column('user_id'),
+                         sa.column('kind'), sa.column('source'), sa.column('state'), sa.column('created_at'))
+    # One INSERT ... SELECT, so it also renders in offline (--sql) mode
+    op.execute(producers.insert().from_select(
+        ['producer_id', 'session_id', 'user_id', 'kind', 'source', 'state', 'created_at'],
+        sa.select(sessions.c.producer_id, sessions.c.session_id, sessions.c.teacher_id,
+                  sa.literal('video'), sa.literal('camera'), sa.literal('live'), sa.func.current_timestamp())
+        .where(sessions.c.producer_id.isnot(None), sessions.c.is_livestreaming.is_(True))
+    ))
+
+    with op.batch_alter_table('sessions') as batch_op:
+        batch_op.drop_column('producer_id')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('sessions') as batch_op:
+        batch_op.add_column(sa.Column('producer_id', sa.String(), nullable=True))
+
+    op.execute(
+        "UPDATE sessions SET producer_id = ("
+        "SELECT p.producer_id FROM producers p "
+        "WHERE p.session_id = sessions.session_id AND p.state = 'live' "
+        "ORDER BY p.kind DESC, p.created_at LIMIT 1)"
+    )
+
+    op.drop_index('ix_producers_session_state', table_name='producers')
+    op.drop_table('producers')
@@ -0,0 +1,34 @@
+"""Participant roster flag
+
+- session_participants.in_roster: whether the participant's join has been
+  recorded in the shared roster, so a REST join followed by the socket join
+  counts once
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('session_participants') as batch_op:
+        batch_op.add_column(sa.Column('in_roster', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('session_participants') as batch_op:
+        batch_op.drop_column('in_roster')
@@ -1,14 +1,25 @@
-from flask import Flask
-from flask_socketio import SocketIO
-from sqlalchemy.orm import Session as SQLSession
-from flask_cors import CORS
-import logging
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Under eventlet every blocking call must yield to the hub: SFU requests, the
+# message queue client and the background loops (presence, chat, health checks,
+# stats, audio levels) all run as green threads. Patch the standard library
+# before anything else is imported, and let psycopg2 wait through the hub too.
+if (os.getenv('SOCKETIO_ASYNC_MODE') or 'eventlet') == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+    from app.socket.workers import make_psycopg2_green
+    make_psycopg2_green()
+
+from flask import Flask
+from flask_socketio import SocketIO
+from sqlalchemy.orm import Session as SQLSession
+from flask_cors import CORS
+import logging
+
 # Import configurations and routes
 from app import create_app
 from config import Config
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import active_speakers as active_speakers_module
+from app.services.active_speakers import ActiveSpeakerTracker
+from app.services.sfu_resources import SFUResourceRegistry
+
+START = 1000.0
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    emitted = []
+    monkeypatch.setattr(active_speakers_module.room_events, 'emit',
+                        lambda event, payload, room: emitted.append((room, payload['userId'])))
+    resources = SFUResourceRegistry()
+    for user_id in ('u1', 'u2', 'u3'):
+        resources.add('producer', f"mic-{user_id}", 'n1', 's1', user_id)
+    tracker = ActiveSpeakerTracker(SimpleNamespace(resources=resources), interval=0.1, hold=0.5, max_rate=1,
+                                   top_n=2)
+    return tracker, emitted
+
+
+def feed(tracker, samples):
+    """samples: [(seconds after START, {user_id: volume dBov})]; decides after each one"""
+    for offset, volumes in samples:
+        now = START + offset
+        tracker.update({'r1': [{'producerId': f"mic-{u}", 'volume': v} for u, v in volumes.items()]}, now)
+        tracker.decide(now)
+
+
+def test_a_speaker_must_stay_loudest_for_the_hold_time(tracker):
+    tracker, emitted = tracker
+    feed(tracker, [(0.0, {'u1': -20, 'u2': -50}),
+                   (0.3, {'u1': -22, 'u2': -45})])
+    assert emitted == []
+    feed(tracker, [(0.5, {'u1': -21, 'u2': -48})])
+    assert emitted == [('s1', 'u1')]
+    assert tracker.active_speaker('s1') == 'u1'
+
+
+def test_short_interruptions_do_not_switch_the_speaker(tracker):
+    tracker, emitted = tracker
+    feed(tracker, [(0.0, {'u1': -20}), (0.5, {'u1': -20}),
+                   (0.6, {'u1': -30, 'u2': -10}),   # a cough
+                   (0.8, {'u1': -20, 'u2': -60}),
+                   (1.2, {'u1': -20, 'u2': -60})])
+    assert emitted == [('s1', 'u1')]
+
+    feed(tracker, [(2.0, {'u1': -50, 'u2': -15}), (2.4, {'u1': -50, 'u2': -15}), (2.5, {'u1': -50, 'u2': -15})])
+    assert emitted == [('s1', 'u1'), ('s1', 'u2')]
+
+
+def test_events_are_rate_limited_per_room(tracker):
+    tracker, emitted = tracker
+    feed(tracker, [(0.0, {'u1': -20}), (0.5, {'u1': -20}),
+                   (0.6, {'u1': -60, 'u2': -20}), (1.1, {'u1': -60, 'u2': -20}),  # held, but 0.6 s after the last
+                   (1.4, {'u1': -60, 'u2': -20})])
+    assert emitted == [('s1', 'u1')]
+    feed(tracker, [(1.5, {'u1': -60, 'u2': -20})])
+    assert emitted == [('s1', 'u1'), ('s1', 'u2')]
+
+
+def test_stale_levels_count_as_silence(tracker):
+    tracker, emitted = tracker
+    feed(tracker, [(0.0, {'u1': -10, 'u3': -30}), (0.5, {'u3': -30}), (1.1, {'u3': -30}),
+                   (1.6, {'u3': -30})])
+    # u1 went quiet after the first sample; once its level expired u3 became loudest
+    assert emitted == [('s1', 'u1'), ('s1', 'u3')]
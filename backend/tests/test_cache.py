@@ -0,0 +1,99 @@
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+from app.extensions import socketio
+from app.routes.api import api_bp
+from app.services import cache as cache_module
+from app.services.cache import TTLCache, active_sessions_cache, session_info_cache
+from app.services.sfu_placement import sfu_placement
+from app.socket.coalescer import room_events
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = TTLCache(ttl=5)
+    cache.set('k', 1)
+    clock[0] += 4.9
+    assert cache.get('k') == 1
+    clock[0] += 0.1
+    assert cache.get('k', 'gone') == 'gone'
+
+
+def test_least_recently_used_entry_goes_first(clock):
+    cache = TTLCache(ttl=5, maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+
+def test_a_load_overtaken_by_an_invalidation_is_not_cached(clock):
+    cache = TTLCache(ttl=5)
+
+    def loader():
+        cache.invalidate()  # a write lands while the query runs
+        return 'stale'
+
+    assert cache.get_or_load('k', loader) == 'stale'
+    assert cache.get_or_load('k', lambda: 'fresh') == 'fresh'
+    assert cache.get('k') == 'fresh'
+
+
+@pytest.fixture
+def client(engine, monkeypatch):
+    # Far longer than the test, so only invalidation can make a change visible
+    monkeypatch.setattr(active_sessions_cache, 'ttl', 3600)
+    monkeypatch.setattr(session_info_cache, 'ttl', 3600)
+    active_sessions_cache.invalidate()
+    session_info_cache.invalidate()
+    for name, value in (('assign', lambda session, verify=False: None), ('close_producers', lambda *args: None),
+                        ('close_user', lambda *args: []), ('release', lambda session: None)):
+        monkeypatch.setattr(sfu_placement, name, value)
+    monkeypatch.setattr(socketio, 'emit', lambda *args, **kwargs: None)
+    monkeypatch.setattr(room_events, 'emit', lambda *args, **kwargs: None)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (user_id, name, is_teacher) VALUES ('t1', 'Ada', 1)"))
+        conn.execute(text("INSERT INTO sessions (session_id, name, teacher_id, is_active, is_livestreaming) "
+                          "VALUES ('s1', 'Class', 't1', 1, 0)"))
+        conn.execute(text("INSERT INTO session_participants (session_id, user_id) VALUES ('s1', 't1')"))
+    app = Flask(__name__)
+    app.register_blueprint(api_bp)
+    return app.test_client()
+
+
+def lobby(client):
+    return {s['sessionId']: s['participantCount'] for s in client.get('/api/get-active-sessions').json['sessions']}
+
+
+def test_lobby_reflects_every_change_right_after_the_call(client):
+    assert lobby(client) == {}
+
+    assert client.post('/api/start-livestream', json={'sessionId': 's1', 'userId': 't1'}).status_code == 200
+    assert lobby(client) == {'s1': 1}
+
+    student = client.post('/api/join-session', json={'sessionId': 's1', 'userName': 'Bo'}).json['userId']
+    assert lobby(client) == {'s1': 2}
+
+    client.post('/api/leave-session', json={'sessionId': 's1', 'userId': student})
+    assert lobby(client) == {'s1': 1}
+
+    assert client.post('/api/stop-livestream', json={'sessionId': 's1', 'userId': 't1'}).status_code == 200
+    assert lobby(client) == {}
+
+
+def test_chat_sees_a_session_end_right_after_the_last_leave(client):
+    send = {'sessionId': 's1', 'userId': 't1', 'message': 'hello'}
+    assert client.post('/api/send-message', json=send).status_code == 200  # caches the session as active
+
+    client.post('/api/leave-session', json={'sessionId': 's1', 'userId': 't1'})
+    response = client.post('/api/send-message', json=send)
+    assert response.status_code == 400
+    assert response.json['error'] == 'Session is no longer active'
@@ -0,0 +1,80 @@
+import base64
+from datetime import datetime
+
+import pytest
+from flask import Flask
+from sqlalchemy import insert, text
+
+from app.models.models import Message
+from app.routes.api import api_bp
+
+NOON = datetime(2025, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def client(engine):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (user_id, name, is_teacher) VALUES ('u1', 'Ada', 0)"))
+        conn.execute(text("INSERT INTO sessions (session_id, name, teacher_id, is_active, is_livestreaming) "
+                          "VALUES ('s1', 'Class', 'u1', 1, 0)"))
+        # m0..m4 share one timestamp, so only message_id orders them; m5..m6 come a second later
+        conn.execute(insert(Message), [
+            {'message_id': f"m{n}", 'session_id': 's1', 'user_id': 'u1', 'user_name': 'Ada',
+             'content': f"message {n}", 'timestamp': NOON.replace(second=n // 5), 'is_question': False}
+            for n in range(7)
+        ])
+    app = Flask(__name__)
+    app.register_blueprint(api_bp)
+    return app.test_client()
+
+
+def page(client, **params):
+    response = client.get('/api/sessions/s1/messages', query_string=params)
+    return response.status_code, response.json
+
+
+def ids(body):
+    return [m['messageId'] for m in body['messages']]
+
+
+def test_pages_walk_back_through_timestamp_ties(client):
+    seen, cursor = [], None
+    for _ in range(10):
+        status, body = page(client, limit=2, **({'before': cursor} if cursor else {}))
+        assert status == 200
+        seen.insert(0, ids(body))
+        cursor = body['nextCursor']
+        if cursor is None:
+            break
+    else:
+        pytest.fail('paging did not reach the first message')
+    # Ties on timestamp are split by message_id, so no message is skipped or repeated
+    assert seen == [['m0'], ['m1', 'm2'], ['m3', 'm4'], ['m5', 'm6']]
+
+
+def test_last_page_has_no_cursor(client):
+    status, body = page(client, limit=7)
+    assert status == 200 and body['nextCursor'] is None and len(body['messages']) == 7
+
+    status, body = page(client, limit=6)
+    assert ids(body) == [f"m{n}" for n in range(1, 7)]
+    status, body = page(client, limit=6, before=body['nextCursor'])
+    assert ids(body) == ['m0'] and body['nextCursor'] is None
+
+
+def encoded(raw):
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    'curs\u00f6r',                     # not base64 at all
+    'bm9wZQ',                          # bad padding
+    encoded('no separator'),
+    encoded('yesterday|m1'),
+    base64.urlsafe_b64encode(b'\xff\xfe|m1').decode(),
+])
+def test_malformed_cursor_is_a_client_error(client, cursor):
+    status, body = page(client, before=cursor)
+    assert status == 400
+    assert body['success'] is False and 'cursor' in body['error']
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.services.chat_ingest import ChatIngestQueue
+
+
+def row(n, **overrides):
+    values = {'message_id': f"m{n}", 'session_id': 's1', 'user_id': 'u1', 'user_name': 'Ada',
+              'content': f"message {n}", 'timestamp': datetime(2025, 1, 1, 12, 0, n), 'is_question': False}
+    values.update(overrides)
+    return values
+
+
+def stored_ids(engine):
+    with engine.connect() as conn:
+        return [r[0] for r in conn.execute(text('SELECT message_id FROM messages ORDER BY timestamp'))]
+
+
+def test_bad_rows_are_dropped_and_the_rest_written(engine):
+    queue = ChatIngestQueue(max_pending=100, batch_size=4, flush_interval=0.05, max_retries=2)
+    for n in range(8):
+        queue.submit(row(n))
+    queue.submit(row(3))                      # duplicate primary key
+    queue.submit(row(9, user_name=None))      # violates NOT NULL
+    queue.submit(row(10))
+
+    assert queue.flush() == 9
+    assert queue.pending() == 0
+    assert queue.dropped == 2
+    assert stored_ids(engine) == [f"m{n}" for n in (0, 1, 2, 3, 4, 5, 6, 7, 10)]
+
+
+def test_flush_goes_past_a_batch_that_was_all_dropped(engine):
+    queue = ChatIngestQueue(max_pending=100, batch_size=2, flush_interval=0.05, max_retries=2)
+    queue.submit(row(1, user_name=None))
+    queue.submit(row(2, content=None))
+    queue.submit(row(3))
+
+    assert queue.flush() == 1
+    assert queue.pending() == 0
+    assert queue.dropped == 2
+    assert stored_ids(engine) == ['m3']
+
+
+def test_transient_errors_are_retried_then_dropped(engine, monkeypatch):
+    queue = ChatIngestQueue(max_pending=100, batch_size=4, flush_interval=0.05, max_retries=2)
+    queue.submit(row(1))
+
+    def unavailable(rows):
+        raise OperationalError('INSERT', {}, Exception('database unavailable'))
+
+    monkeypatch.setattr(queue, '_insert', unavailable)
+    for attempt in range(2):
+        assert queue.flush() == 0
+        assert queue.pending() == 1, f"row should be requeued after attempt {attempt + 1}"
+    queue.flush()
+    assert queue.pending() == 0
+    assert queue.dropped == 1
+
+
+def test_retry_succeeds_once_the_database_is_back(engine, monkeypatch):
+    queue = ChatIngestQueue(max_pending=100, batch_size=4, flush_interval=0.05, max_retries=3)
+    queue.submit(row(1))
+    insert = queue._insert
+    failures = iter([True])
+
+    def flaky(rows):
+        if next(failures, False):
+            raise OperationalError('INSERT', {}, Exception('connection reset'))
+        insert(rows)
+
+    monkeypatch.setattr(queue, '_insert', flaky)
+    assert queue.flush() == 0
+    assert queue.flush() == 1
+    assert stored_ids(engine) == ['m1']
@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from app.socket.coalescer import RoomEmitCoalescer
+
+
+class FakeServer:
+    def __init__(self, rooms):
+        self._rooms = rooms  # sid -> rooms it is in
+
+    def rooms(self, sid, namespace=None):
+        return self._rooms.get(sid, [])
+
+
+class FakeSocketIO:
+    def __init__(self, rooms):
+        self.server = FakeServer(rooms)
+        self.sent = []
+        self.on_emit = None
+
+    def emit(self, event, data, room=None, skip_sid=None):
+        self.sent.append((event, data, room, skip_sid))
+        if self.on_emit:
+            self.on_emit()
+
+
+@pytest.fixture
+def coalescer():
+    coalescer = RoomEmitCoalescer()
+    coalescer.socketio = FakeSocketIO({'sender': ['room', 'sender'], 'other': ['room', 'other']})
+    coalescer.tick = 0.025  # enabled, without starting the flush loop
+    return coalescer
+
+
+def test_skipped_sender_gets_its_own_frame(coalescer):
+    coalescer.emit('user_joined', {'userId': 'u1'}, room='room', skip_sid='sender')
+    coalescer.emit('hand_raise_changed', {'userId': 'u2'}, room='room')
+    coalescer.flush()
+
+    room_frame, sender_frame = coalescer.socketio.sent
+    assert room_frame == ('events', [{'event': 'user_joined', 'data': {'userId': 'u1'}},
+                                     {'event': 'hand_raise_changed', 'data': {'userId': 'u2'}}],
+                          'room', ['sender'])
+    assert sender_frame == ('hand_raise_changed', {'userId': 'u2'}, 'sender', None)
+    assert 'sender' not in repr(room_frame[1])
+
+
+def test_lone_skipped_event_goes_out_unwrapped(coalescer):
+    coalescer.emit('user_joined', {'userId': 'u1'}, room='room', skip_sid='sender')
+    coalescer.flush()
+    assert coalescer.socketio.sent == [('user_joined', {'userId': 'u1'}, 'room', ['sender'])]
+
+
+def test_bypass_event_waits_for_a_flush_in_progress(coalescer):
+    socketio = coalescer.socketio
+    coalescer.emit('user_joined', {'userId': 'u1'}, room='room')
+    coalescer.emit('user_left', {'userId': 'u2'}, room='room')
+    bypass = threading.Thread(target=coalescer.emit, args=('producerClosed', {'producerId': 'p1'}, 'room'))
+
+    def start_bypass():
+        socketio.on_emit = None
+        bypass.start()
+        bypass.join(0.2)
+        assert bypass.is_alive(), 'bypass emit should wait for the flush sending its room'
+
+    socketio.on_emit = start_bypass
+    coalescer.flush()
+    bypass.join(5)
+    assert [event for event, *_ in socketio.sent] == ['events', 'producerClosed']
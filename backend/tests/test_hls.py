@@ -0,0 +1,174 @@
+import struct
+
+import pytest
+
+from app.services.fmp4 import SYNC_SAMPLE
+from app.services.hls import HlsPackager
+from app.services.rtp_tap import rtp_header
+from benchmarks.rtp_fixture import (H264_PPS, PAYLOAD_TYPES, VIDEO, h264_payloads, rtp_packet, synthetic_packets,
+                                    synthetic_sps)
+
+START = 1_760_000_000.0
+CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'mvex', b'dinf', b'moof', b'traf'}
+
+
+def boxes(data, start=0, end=None):
+    """[(type, payload start, payload end)] of the boxes in data[start:end], checking their sizes"""
+    end = len(data) if end is None else end
+    found, position = [], start
+    while position < end:
+        size, kind = struct.unpack_from('!I4s', data, position)
+        assert size >= 8 and position + size <= end, f"{kind} overruns its parent"
+        found.append((kind, position + 8, position + size))
+        position += size
+    assert position == end
+    return found
+
+
+def walk(data, start=0, end=None):
+    """Every box in data with its descendants, depth first, as (type, payload start, payload end)"""
+    for kind, payload_start, payload_end in boxes(data, start, end):
+        yield kind, payload_start, payload_end
+        if kind in CONTAINERS:
+            yield from walk(data, payload_start, payload_end)
+
+
+def fragments(data):
+    """track id -> (base decode time, [(duration, size, flags)]) of one media segment"""
+    assert [kind for kind, _, _ in boxes(data)] == [b'moof', b'mdat']
+    (_, moof_start, _), (_, mdat_start, mdat_end) = boxes(data)
+    tracks, track_id, base_time = {}, None, None
+    for kind, start, _ in walk(data):
+        if kind == b'tfhd':
+            track_id = struct.unpack_from('!I', data, start + 4)[0]
+        elif kind == b'tfdt':
+            base_time = struct.unpack_from('!Q', data, start + 4)[0]
+        elif kind == b'trun':
+            count, offset = struct.unpack_from('!Ii', data, start + 4)
+            samples = [struct.unpack_from('!III', data, start + 12 + 12 * i) for i in range(count)]
+            # Sample data must sit inside mdat, where the data offset (from moof) points
+            assert mdat_start <= moof_start - 8 + offset
+            assert moof_start - 8 + offset + sum(size for _, size, _ in samples) <= mdat_end
+            tracks[track_id] = (base_time, samples)
+    return tracks
+
+
+def package(tmp_path, packets, streams, target_duration=2.0):
+    requests = []
+    packager = HlsPackager(str(tmp_path), target_duration, 100, on_key_frame_needed=lambda: requests.append(1))
+    assert packager.add_streams(streams) == streams
+    for offset, packet in packets:
+        packager.feed(packet, START + offset)
+    packager.finish()
+    playlist = (tmp_path / 'index.m3u8').read_text().splitlines()
+    segments = [(tmp_path / line).read_bytes() for line in playlist if line.endswith('.m4s')]
+    return playlist, segments, requests
+
+
+def streams_of(packets):
+    streams = {}
+    for _, packet in packets:
+        payload_type, _, _, _, ssrc = rtp_header(packet)
+        kind, mime_type = PAYLOAD_TYPES[payload_type]
+        streams.setdefault(ssrc, {'kind': kind, 'ssrc': ssrc, 'payloadType': payload_type, 'mimeType': mime_type})
+    return sorted(streams.values(), key=lambda s: s['kind'], reverse=True)
+
+
+def h264_packets(resolutions, seconds_each, fps=30, gop=60, ssrc=4321):
+    """A video-only H.264 stream that switches resolution (and sends a new SPS) every seconds_each"""
+    packets, sequence, frame = [], 0, 0
+    for width, height in resolutions:
+        sps = synthetic_sps(width, height)
+        for _ in range(int(seconds_each * fps)):
+            keyframe = frame % gop == 0
+            nals = [sps, H264_PPS, bytes([0x65]) + bytes(3000)] if keyframe else [bytes([0x41]) + bytes(500)]
+            payloads = h264_payloads(nals, VIDEO['mtu'])
+            for i, payload in enumerate(payloads):
+                packets.append((frame / fps, rtp_packet(102, i == len(payloads) - 1, sequence,
+                                                        frame * 90000 // fps, ssrc, payload)))
+                sequence += 1
+            frame += 1
+    return packets, [{'kind': 'video', 'ssrc': ssrc, 'payloadType': 102, 'mimeType': 'video/H264'}]
+
+
+@pytest.fixture
+def broadcast(tmp_path):
+    packets = synthetic_packets(9, video_kbps=200, video_codec='h264')
+    return package(tmp_path, packets, streams_of(packets), target_duration=1.2)
+
+
+def test_init_segment_boxes(tmp_path, broadcast):
+    init = (tmp_path / 'init-0.mp4').read_bytes()
+    assert [kind for kind, _, _ in boxes(init)] == [b'ftyp', b'moov']
+    kinds = [kind for kind, _, _ in walk(init)]
+    assert kinds.count(b'trak') == 2 and kinds.count(b'trex') == 2
+    assert b'avc1' in init and b'Opus' in init
+
+
+def test_segments_start_on_keyframes_with_increasing_decode_times(broadcast):
+    playlist, segments, requests = broadcast
+    assert len(segments) == 5  # keyframes every 2 s cut a 9 s stream, even with a 1.2 s target
+    last_base = {}
+    for data in segments:
+        tracks = fragments(data)
+        assert set(tracks) == {1, 2}
+        for track_id, (base_time, samples) in tracks.items():
+            assert base_time > last_base.get(track_id, -1)
+            last_base[track_id] = base_time + sum(duration for duration, _, _ in samples) - 1
+        video = next(samples for track_id, (_, samples) in tracks.items() if track_id == 1)
+        flags = [flags for _, _, flags in video]
+        assert flags[0] == SYNC_SAMPLE
+        assert flags.count(SYNC_SAMPLE) == 1
+    # The 1.2 s target ran out before each keyframe, so some were asked for
+    assert requests
+    assert playlist[-1] == '#EXT-X-ENDLIST'
+
+
+@pytest.mark.parametrize('seconds_each, gop', [
+    (4, 60),    # the new SPS comes with a keyframe that would end the segment anyway
+    (4.5, 45),  # ... or with one 1.5 s into a 2 s segment, which must end it early
+])
+def test_track_change_starts_a_discontinuity(tmp_path, seconds_each, gop):
+    packets, streams = h264_packets([(640, 360), (320, 180)], seconds_each=seconds_each, gop=gop)
+    playlist, segments, _ = package(tmp_path, packets, streams)
+
+    assert len(segments) == 4
+    assert playlist.count('#EXT-X-DISCONTINUITY') == 1
+    maps = [line for line in playlist if line.startswith('#EXT-X-MAP')]
+    assert maps == ['#EXT-X-MAP:URI="init-0.mp4"', '#EXT-X-MAP:URI="init-1.mp4"']
+    position = playlist.index('#EXT-X-DISCONTINUITY')
+    assert playlist[position + 1] == maps[1]
+    assert playlist[position + 3] == 'segment-00002.m4s'
+
+    bases = [fragments(data)[1][0] for data in segments]
+    assert bases == sorted(bases) and len(set(bases)) == len(bases)
+    for name, width in (('init-0.mp4', 640), ('init-1.mp4', 320)):
+        init = (tmp_path / name).read_bytes()
+        tkhd = next(start for kind, start, _ in walk(init) if kind == b'tkhd')
+        assert struct.unpack_from('!I', init, tkhd + 76)[0] >> 16 == width
+
+
+def test_key_frame_requests_leave_the_packet_path(monkeypatch):
+    from app.services import hls
+    from app.services.hls import Broadcast, BroadcastManager
+
+    tasks, calls = [], []
+
+    class FakeSocketIO:
+        async_mode = 'threading'
+
+        def start_background_task(self, fn, *args):
+            tasks.append((fn, args))
+
+    monkeypatch.setattr(hls.sfu_workers, 'run', lambda async_mode, fn, *args: calls.append((async_mode, fn, args)))
+    manager = BroadcastManager()
+    manager.init_app(FakeSocketIO())
+    broadcast = Broadcast.__new__(Broadcast)
+    broadcast.session_id = 's1'
+    broadcast.video_consumer_ids = lambda: ['c1']
+
+    manager._request_key_frame(broadcast)
+    assert calls == [] and len(tasks) == 1
+    fn, args = tasks.pop()
+    fn(*args)
+    assert calls == [('threading', hls.sfu_placement.request_key_frame, ('s1', ['c1']))]
@@ -0,0 +1,98 @@
+import pytest
+
+from app.services.layer_policy import LayerPolicy
+
+KBPS = [100, 300, 900]
+HEIGHTS = [180, 360, 720]
+
+
+def policy(budget_kbps=0):
+    return LayerPolicy(KBPS, HEIGHTS, 2, budget_kbps)
+
+
+@pytest.mark.parametrize('bandwidth_kbps, expected', [
+    (None, (2, 2)),
+    (1125, (2, 2)),   # 80% is exactly the top layer's 900 kbps
+    (1124, (1, 2)),
+    (375, (1, 2)),
+    (374, (0, 2)),
+    (125, (0, 2)),
+    (124, (0, 0)),    # not even the lowest layer fits: base frame rate only
+])
+def test_bandwidth_thresholds(bandwidth_kbps, expected):
+    layers = policy()
+    layers.report('s1', 'u1', bandwidth_kbps=bandwidth_kbps)
+    assert layers.initial('s1', 'u1') == {'spatialLayer': expected[0], 'temporalLayer': expected[1]}
+
+
+@pytest.mark.parametrize('viewport_height, spatial', [
+    (None, 2),
+    (120, 0),
+    (180, 0),
+    (181, 1),
+    (360, 1),
+    (361, 2),
+    (1080, 2),    # taller than every layer: the top one
+])
+def test_viewport_height_thresholds(viewport_height, spatial):
+    layers = policy()
+    layers.report('s1', 'u1', viewport_height=viewport_height)
+    assert layers.initial('s1', 'u1')['spatialLayer'] == spatial
+
+
+def test_bandwidth_and_viewport_take_the_lower_layer():
+    layers = policy()
+    layers.report('s1', 'u1', bandwidth_kbps=5000, viewport_height=200)
+    assert layers.initial('s1', 'u1')['spatialLayer'] == 1
+    layers.report('s1', 'u1', bandwidth_kbps=200)  # the viewport is kept
+    assert layers.initial('s1', 'u1')['spatialLayer'] == 0
+
+
+@pytest.mark.parametrize('budget_kbps, consumers, cap', [
+    (0, 1000, 2),      # no budget: never capped
+    (9000, 1, 2),
+    (9000, 10, 2),     # 10 x 900 kbps fills the budget exactly
+    (9000, 11, 1),
+    (9000, 30, 1),
+    (9000, 31, 0),
+    (50, 1, 0),        # the lowest layer is the floor, even over budget
+])
+def test_room_size_thresholds(budget_kbps, consumers, cap):
+    assert policy(budget_kbps).room_cap(consumers) == cap
+
+
+def test_room_cap_steps_everyone_down_and_back_up():
+    layers = policy(budget_kbps=1800)
+    assert layers.add('c1', 'n1', 's1', 'u1', layers.initial('s1', 'u1')) == []
+    assert layers.add('c2', 'n1', 's1', 'u2', layers.initial('s1', 'u2')) == []
+    # A third viewer lowers the cap to layer 1 for the whole room
+    assert sorted(layers.add('c3', 'n1', 's1', 'u3', {'spatialLayer': 2, 'temporalLayer': 2})) == [
+        ('n1', 'c1', 1, 2), ('n1', 'c2', 1, 2), ('n1', 'c3', 1, 2)]
+    assert layers.summary('s1') == {'consumers': 3, 'roomCap': 1, 'egressKbps': 900, 'budgetKbps': 1800}
+    assert sorted(layers.forget(['c3'])) == [('n1', 'c1', 2, 2), ('n1', 'c2', 2, 2)]
+
+
+@pytest.mark.parametrize('preferred, cap_consumers, spatial', [
+    (0, 1, 0),
+    (2, 1, 2),
+    (2, 3, 1),      # a pin never exceeds the room cap
+    (None, 1, 1),   # auto: back to what the 400 kbps downlink allows
+])
+def test_preference(preferred, cap_consumers, spatial):
+    layers = policy(budget_kbps=1800)
+    layers.report('s1', 'u1', bandwidth_kbps=400)
+    layers.add('c1', 'n1', 's1', 'u1', layers.initial('s1', 'u1'))
+    for n in range(2, cap_consumers + 1):
+        layers.add(f"c{n}", 'n1', 's1', f"u{n}", {'spatialLayer': 0, 'temporalLayer': 2})
+    layers.prefer('c1', 2)
+
+    described, _ = layers.prefer('c1', preferred)
+    assert described == {'consumerId': 'c1', 'spatialLayer': spatial, 'temporalLayer': 2,
+                         'preferredSpatialLayer': preferred}
+
+
+def test_preference_out_of_range_is_rejected():
+    layers = policy()
+    with pytest.raises(ValueError):
+        layers.prefer('c1', 3)
+    assert layers.prefer('missing', 1) == (None, [])
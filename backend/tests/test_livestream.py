@@ -0,0 +1,85 @@
+import pytest
+from flask import Flask
+from flask_socketio import SocketIO, join_room
+from sqlalchemy import text
+
+from app.extensions import socketio as shared_socketio
+from app.routes.api import api_bp
+from app.services.sfu_placement import sfu_placement
+from app.socket import events
+from app.socket.events import register_socket_events
+
+
+@pytest.fixture
+def live_session(engine, monkeypatch):
+    closed = []
+    monkeypatch.setattr(sfu_placement, 'close_producers', lambda session_id, ids: closed.append((session_id, ids)))
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (user_id, name, is_teacher) VALUES ('t1', 'Ada', 1), ('t2', 'Bo', 1)"))
+        conn.execute(text("INSERT INTO sessions (session_id, name, teacher_id, is_active, is_livestreaming) "
+                          "VALUES ('s1', 'Class', 't1', 1, 1), ('s2', 'Other', 't2', 1, 1)"))
+        conn.execute(text("INSERT INTO producers (producer_id, session_id, user_id, kind, source, state, created_at) "
+                          "VALUES ('cam', 's1', 't1', 'video', 'camera', 'live', '2025-01-01'), "
+                          "('mic', 's1', 't1', 'audio', 'mic', 'live', '2025-01-01'), "
+                          "('old', 's1', 't1', 'video', 'screen', 'closed', '2025-01-01'), "
+                          "('theirs', 's2', 't2', 'video', 'camera', 'live', '2025-01-01')"))
+    return closed
+
+
+def producer_states(engine):
+    with engine.connect() as conn:
+        return dict(conn.execute(text('SELECT producer_id, state FROM producers')).all())
+
+
+def test_socket_stop_closes_producers_and_tells_the_room(engine, live_session, monkeypatch):
+    calls = []
+
+    def run(async_mode, fn, *args):
+        calls.append(args)
+        return fn(*args)
+
+    monkeypatch.setattr(events.sfu_workers, 'run', run)
+    app = Flask(__name__)
+    socketio = SocketIO(app, async_mode='threading')
+    register_socket_events(socketio)
+    socketio.on_event('enter', lambda data: join_room(data))
+    client = socketio.test_client(app)
+    client.emit('enter', 's1')
+
+    client.emit('stop_livestream', {'sessionId': 's1', 'userId': 't1'})
+
+    received = client.get_received()
+    closed = sorted(event['args'][0]['producerId'] for event in received if event['name'] == 'producerClosed')
+    assert closed == ['cam', 'mic']
+    assert [event['name'] for event in received][-1] == 'livestream_ended'
+    # Only the SFU call goes to the worker; the database work stays in the handler
+    assert [(session_id, sorted(ids)) for session_id, ids in calls] == [('s1', ['cam', 'mic'])]
+    assert producer_states(engine) == {'cam': 'closed', 'mic': 'closed', 'old': 'closed', 'theirs': 'live'}
+
+
+@pytest.fixture
+def client(live_session, monkeypatch):
+    monkeypatch.setattr(shared_socketio, 'emit', lambda *args, **kwargs: None)
+    app = Flask(__name__)
+    app.register_blueprint(api_bp)
+    return app.test_client()
+
+
+def test_rest_stop_refuses_another_sessions_producer(engine, live_session, client):
+    response = client.post('/api/stop-livestream', json={'sessionId': 's1', 'userId': 't1', 'producerId': 'theirs'})
+
+    assert response.status_code == 403
+    assert live_session == []
+    assert producer_states(engine)['theirs'] == 'live'
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT is_livestreaming FROM sessions WHERE session_id = 's1'")).scalar()
+
+
+def test_rest_stop_accepts_its_own_producer(engine, live_session, client, monkeypatch):
+    single = []
+    monkeypatch.setattr(sfu_placement, 'close_producer', lambda session_id, producer_id: single.append(producer_id))
+    response = client.post('/api/stop-livestream', json={'sessionId': 's1', 'userId': 't1', 'producerId': 'old'})
+
+    assert response.status_code == 200
+    assert single == ['old']
+    assert producer_states(engine) == {'cam': 'closed', 'mic': 'closed', 'old': 'closed', 'theirs': 'live'}
@@ -0,0 +1,80 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from app.services.mediasoup_client import MediasoupClient
+from benchmarks.loadtest import Recorder
+
+# Runs the load test against an in-process backend on a throwaway SQLite database
+RUN = '''
+import sys
+from sqlalchemy import create_engine
+import config
+config.Config.engine = create_engine('sqlite:///{db}', connect_args={{'check_same_thread': False, 'timeout': 30}})
+from benchmarks import loadtest
+sys.exit(loadtest.main(sys.argv[1:]))
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_summary_percentiles_and_errors():
+    recorder = Recorder()
+    for elapsed in range(100, 0, -1):
+        recorder.record('join', float(elapsed))
+    recorder.timed('ack', lambda: {'error': 'Session not found'})
+    recorder.timed('ack', lambda: {'success': True})
+    with pytest.raises(RuntimeError):
+        recorder.timed('ack', lambda: (_ for _ in ()).throw(RuntimeError('disconnected')))
+
+    ack, join = recorder.summary(wall_seconds=2.0)
+    assert (join['name'], join['count'], join['errors']) == ('join', 100, 0)
+    assert (join['p50'], join['p95'], join['p99'], join['max']) == (51.0, 96.0, 100.0, 100.0)
+    assert join['throughput'] == 50.0
+    # An error payload and a raised exception both count against the operation
+    assert (ack['name'], ack['count'], ack['errors']) == ('ack', 3, 2)
+
+
+def test_stub_closing_a_transport_closes_what_lives_on_it(stubs):
+    client = MediasoupClient(stubs[0].url, 5)
+    router_id = client.post('/routers', {'workerIndex': 1})['routerId']
+    send = client.post('/createProducerTransport', {'routerId': router_id})['id']
+    receive = client.post('/createConsumerTransport', {'routerId': router_id})['id']
+    producer = client.post('/produce', {'transportId': send, 'kind': 'audio', 'rtpParameters': {}})['id']
+    client.post('/consume', {'transportId': receive, 'producerId': producer, 'rtpCapabilities': {}})
+    workers = client.get('/workers')['workers']
+    assert [w['consumers'] for w in workers] == [0, 1]
+
+    assert client.post('/closeResources', {'transportIds': [send, 'gone']}) == {'closed': 1, 'missing': ['gone']}
+    state = stubs[0].state
+    assert list(state.transports) == [receive]
+    assert state.producers == {} and state.consumers == {}
+
+
+def test_end_to_end_run_reports_no_errors(tmp_path):
+    report = tmp_path / 'report.json'
+    sfu_port = free_port()
+    args = ['--teachers', '1', '--students', '3', '--messages', '1', '--port', str(free_port()),
+            '--sfu-port', str(sfu_port), '--sfu-latency-ms', '0', '--sfu-jitter-ms', '0', '--json', str(report)]
+    # A fresh interpreter, since the backend starts background tasks; config is imported before main() sets the
+    # SFU URL, so it goes in the environment up front
+    result = subprocess.run([sys.executable, '-c', RUN.format(db=tmp_path / 'loadtest.db'), *args],
+                            capture_output=True, text=True, timeout=240,
+                            env=dict(os.environ, SOCKETIO_ASYNC_MODE='threading', DB_AUTO_MIGRATE='true',
+                                     MEDIASOUP_SERVER_URL=f'http://127.0.0.1:{sfu_port}'),
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    results = json.loads(report.read_text())
+    assert results['failures'] == 0
+    rows = {row['name']: row for row in results['results']}
+    assert rows and all(row['errors'] == 0 for row in rows.values())
+    assert sum(row['count'] for row in rows.values()) == results['operations']
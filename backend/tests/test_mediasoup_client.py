@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+from app.services.mediasoup_client import MediasoupClient, MediasoupError
+from benchmarks.stub_sfu import StubSFU
+
+
+@pytest.fixture
+def stub():
+    started = StubSFU(port=0).start()
+    yield started
+    started.stop()
+
+
+def client_for(stub, **options):
+    return MediasoupClient(stub.url, connect_timeout=1, **dict({'timeout': 2}, **options))
+
+
+def count_connections(stub):
+    """List that gets the address of every connection the stub accepts"""
+    accepted = []
+    process_request = stub.server.process_request
+
+    def counting(request, client_address):
+        accepted.append(client_address)
+        process_request(request, client_address)
+
+    stub.server.process_request = counting
+    return accepted
+
+
+def test_calls_reuse_one_keep_alive_connection(stub):
+    accepted = count_connections(stub)
+    client = client_for(stub)
+    for _ in range(20):
+        client.get('/workers')
+        client.post('/routers', {'workerIndex': 0})
+    assert len(accepted) == 1
+
+    # Concurrent callers each get a pooled connection, and they are kept
+    threads = [threading.Thread(target=lambda: [client.get('/workers') for _ in range(5)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    opened = len(accepted)
+    assert 1 <= opened <= 4
+    client.get('/workers')
+    assert len(accepted) == opened
+    client.close()
+
+
+def test_slow_responses_time_out_as_504(stub):
+    client = client_for(stub, timeout=0.1)
+    stub.latency = 0.5
+    with pytest.raises(MediasoupError) as raised:
+        client.get('/workers')
+    assert (raised.value.status_code, raised.value.route) == (504, '/workers')
+    assert client.stats()['/workers']['errors'] == 1
+
+
+def test_a_full_client_answers_503_instead_of_queueing(stub):
+    client = client_for(stub, timeout=0.2, max_concurrency=1)
+    entered, release = threading.Event(), threading.Event()
+
+    def slow(body):
+        entered.set()
+        release.wait(5)
+        return 200, {}
+
+    stub.routes[('POST', '/slow')] = slow
+    holder = threading.Thread(target=client.post, args=('/slow',), kwargs={'timeout': 5})
+    holder.start()
+    assert entered.wait(5)
+    try:
+        with pytest.raises(MediasoupError) as raised:
+            client.get('/workers')
+        assert raised.value.status_code == 503
+    finally:
+        release.set()
+        holder.join()
+    assert client.get('/workers')['workers']  # the slot is free again
+
+
+def test_errors_carry_the_sfu_status_and_message(stub):
+    client = client_for(stub)
+    stub.routes[('POST', '/consume')] = lambda body: (409, {'error': 'Unknown capabilities hash'})
+    with pytest.raises(MediasoupError) as raised:
+        client.post('/consume', {})
+    assert raised.value.status_code == 409 and str(raised.value) == 'Unknown capabilities hash'
+
+    stub.stop()
+    refused = client_for(stub)
+    with pytest.raises(MediasoupError) as raised:
+        refused.get('/workers')
+    assert raised.value.status_code == 502
+
+
+def test_stats_group_routes_without_their_query(stub):
+    client = client_for(stub)
+    client.get('/audioLevels?since=1')
+    client.get('/audioLevels?since=2')
+    stats = client.stats()
+    assert list(stats) == ['/audioLevels']
+    assert stats['/audioLevels']['count'] == 2 and stats['/audioLevels']['errors'] == 0
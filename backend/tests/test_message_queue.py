@@ -0,0 +1,57 @@
+import threading
+import uuid
+
+import pytest
+import socketio
+from werkzeug.serving import make_server
+
+from app.socket.message_queue import LocalQueueManager, create_emitter
+
+
+@pytest.fixture
+def channel():
+    name = f"test-{uuid.uuid4().hex}"
+    yield name
+    LocalQueueManager.reset(name)
+
+
+def serve(channel):
+    """Start a threading socketio.Server on a free port, subscribed to channel"""
+    server = socketio.Server(async_mode='threading', client_manager=LocalQueueManager(channel=channel))
+    http = make_server('127.0.0.1', 0, socketio.WSGIApp(server), threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    return server, http
+
+
+def connect(http):
+    """Connect a client over long-polling; returns it and a dict of received events"""
+    received = {}
+    arrived = threading.Event()
+    client = socketio.Client()
+
+    @client.on('*')
+    def on_event(event, data):
+        received[event] = data
+        arrived.set()
+
+    client.connect(f"http://127.0.0.1:{http.server_port}", transports=['polling'], wait_timeout=5)
+    return client, received, arrived
+
+
+def test_emits_cross_servers_and_reach_clients_from_an_emitter(channel):
+    first, first_http = serve(channel)
+    second, second_http = serve(channel)
+    client, received, arrived = connect(second_http)
+    try:
+        first.emit('from_first', {'n': 1})
+        assert arrived.wait(5)
+        assert received == {'from_first': {'n': 1}}
+
+        arrived.clear()
+        create_emitter('local://', channel).emit('from_emitter', {'n': 2})
+        assert arrived.wait(5)
+        assert received['from_emitter'] == {'n': 2}
+    finally:
+        client.disconnect()
+        first_http.shutdown()
+        second_http.shutdown()
@@ -0,0 +1,97 @@
+import re
+
+import pytest
+from flask import Flask
+
+from app import extensions
+from app.extensions import InstrumentedSocketIO
+from app.routes import metrics as metrics_routes
+from app.routes.metrics import register_metrics_routes
+from app.services.metrics import MetricsRegistry
+
+# An event name with every character the exposition format escapes
+ODD_EVENT = 'say "hi"\\now\nplease'
+
+
+@pytest.fixture
+def app(engine, monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics_routes, 'metrics', registry)
+    monkeypatch.setattr(extensions, 'metrics', registry)
+    app = Flask(__name__)
+    socketio = InstrumentedSocketIO(app, async_mode='threading')
+    register_metrics_routes(app, socketio)
+
+    @app.route('/api/ping/<name>')
+    def ping(name):
+        return {'pong': name}
+
+    @socketio.on('echo')
+    def echo(data):
+        return data
+
+    @socketio.on(ODD_EVENT)
+    def odd(data):
+        raise RuntimeError('boom')
+
+    return app, socketio
+
+
+def scrape(app):
+    response = app.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    return response.get_data(as_text=True).splitlines()
+
+
+def samples(lines, name):
+    """{labels: value} of every sample line of name"""
+    found = {}
+    for line in lines:
+        match = re.fullmatch(rf'{name}(\{{.*\}})? (\S+)', line)
+        if match:
+            found[match.group(1) or ''] = float(match.group(2))
+    return found
+
+
+def test_scrape_after_a_request_and_a_socket_event(app):
+    app, socketio = app
+    http = app.test_client()
+    assert http.get('/api/ping/a').status_code == 200
+    assert http.get('/api/ping/b').status_code == 200
+    assert http.get('/nowhere').status_code == 404
+    client = socketio.test_client(app)
+    assert client.emit('echo', {'n': 1}, callback=True) == {'n': 1}
+    client.disconnect()
+
+    lines = scrape(app)
+    assert '# TYPE http_requests_total counter' in lines
+    assert '# TYPE http_request_duration_seconds histogram' in lines
+    requests = samples(lines, 'http_requests_total')
+    assert requests['{method="GET",route="/api/ping/<name>",status="200"}'] == 2
+    assert requests['{method="GET",route="unmatched",status="404"}'] == 1
+
+    buckets = samples(lines, 'http_request_duration_seconds_bucket')
+    route = 'method="GET",route="/api/ping/<name>"'
+    assert buckets['{' + route + ',le="+Inf"}'] == 2
+    route_buckets = [v for labels, v in buckets.items() if labels.startswith('{' + route)]
+    assert route_buckets == sorted(route_buckets)  # cumulative
+    assert samples(lines, 'http_request_duration_seconds_count')['{' + route + '}'] == 2
+    assert samples(lines, 'http_request_duration_seconds_sum')['{' + route + '}'] > 0
+
+    assert samples(lines, 'socketio_event_duration_seconds_count')['{event="echo"}'] == 1
+    assert samples(lines, 'socketio_connected_clients') == {'': 0}
+
+
+def test_label_values_are_escaped(app):
+    app, socketio = app
+    client = socketio.test_client(app)
+    with pytest.raises(RuntimeError):  # the test client re-raises handler errors
+        client.emit(ODD_EVENT, {})
+
+    lines = scrape(app)
+    escaped = '{event="say \\"hi\\"\\\\now\\nplease"}'
+    assert samples(lines, 'socketio_event_errors_total') == {escaped: 1}
+    assert samples(lines, 'socketio_event_duration_seconds_count') == {escaped: 1}
+    # Every sample stays on one line, so no line starts inside a label value
+    assert all(line.startswith(('#', 'http_', 'socketio_', 'db_', 'sfu_', 'chat_')) for line in lines)
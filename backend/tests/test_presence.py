@@ -0,0 +1,44 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import User
+from app.services.presence import PresenceStore
+
+
+def add_user(engine, user_id):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (user_id, name, is_teacher) VALUES (:id, 'Ada', 0)"), {'id': user_id})
+
+
+def hand_raised(engine, user_id):
+    with engine.connect() as conn:
+        return conn.execute(text('SELECT hand_raised FROM users WHERE user_id = :id'), {'id': user_id}).scalar()
+
+
+def test_discarded_entries_leave_memory_once_flushed(engine):
+    store = PresenceStore(flush_interval=1, max_batch=10)
+    for user_id in ('u1', 'u2'):
+        add_user(engine, user_id)
+        store.ensure(user_id)
+    store.update('u1', hand_raised=True)
+
+    store.discard('u1')
+    store.discard('u2')
+    assert set(store._state) == {'u1'}  # nothing pending for u2, so it goes at once
+
+    assert store.flush() == 1
+    assert store._state == {} and store._evict == set()
+    assert hand_raised(engine, 'u1')
+
+
+def test_rejoining_before_the_flush_keeps_the_entry(engine):
+    store = PresenceStore(flush_interval=1, max_batch=10)
+    add_user(engine, 'u1')
+    store.ensure('u1')
+    store.update('u1', hand_raised=True)
+    store.discard('u1')
+
+    with SQLSession(engine) as db_session:  # as the join handler does
+        assert store.seed(db_session.get(User, 'u1'))['hand_raised'] is True
+    store.flush()
+    assert set(store._state) == {'u1'}
@@ -0,0 +1,149 @@
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+from app.services import recording as recording_module
+from app.services.recording import Recording, SegmentWriter, read_rtpdump, write_rtpdump_header, write_rtpdump_record
+from app.services.rtp_tap import RtpTap, udp_socket
+from benchmarks.rtp_fixture import fixture_streams, rtp_packet, synthetic_packets
+
+START = 1_760_000_000.25
+
+
+def packets(count, size=100, interval=0.02, ssrc=1234):
+    """count RTP packets with payload size bytes, interval seconds apart"""
+    return [(START + n * interval, rtp_packet(100, False, n, n * 960, ssrc, bytes([n % 256]) * size))
+            for n in range(count)]
+
+
+def write_all(writer, items):
+    for arrival, packet in items:
+        writer.write(packet, arrival)
+    writer.close()
+
+
+def test_rtpdump_round_trip(tmp_path):
+    path = tmp_path / 'stream.rtpdump'
+    items = packets(50)
+    with open(path, 'wb') as file:
+        write_rtpdump_header(file, START)
+        for arrival, packet in items:
+            write_rtpdump_record(file, packet, round((arrival - START) * 1000))
+
+    read = list(read_rtpdump(path))
+    assert [packet for _, packet in read] == [packet for _, packet in items]
+    assert [arrival for arrival, _ in read] == pytest.approx([arrival for arrival, _ in items], abs=0.001)
+
+
+def test_rejects_files_that_are_not_rtpdump(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'not rtpdump\n')
+    with pytest.raises(ValueError):
+        list(read_rtpdump(path))
+
+
+def test_segments_roll_over_at_max_bytes(tmp_path):
+    segments = []
+    writer = SegmentWriter(tmp_path, max_bytes=2000, max_seconds=3600, on_segment=segments.append)
+    items = packets(60)
+    write_all(writer, items)
+
+    assert len(segments) > 1
+    assert sum(s['packets'] for s in segments) == len(items)
+    for segment in segments:
+        assert segment['bytes'] <= 2000
+        assert os.path.getsize(tmp_path / segment['name']) == segment['bytes']
+        assert segment['ssrcs'] == [1234]
+    replayed = [p for s in segments for _, p in read_rtpdump(tmp_path / s['name'])]
+    assert replayed == [packet for _, packet in items]
+
+
+def test_segments_roll_over_at_max_seconds(tmp_path):
+    segments = []
+    writer = SegmentWriter(tmp_path, max_bytes=1 << 30, max_seconds=1.0, on_segment=segments.append)
+    write_all(writer, packets(175))  # 3.5 s of packets
+
+    assert [s['name'] for s in segments] == [f'segment-{n:05d}.rtpdump' for n in range(4)]
+    for segment in segments:
+        assert segment['end'] - segment['start'] < 1.0
+    assert [s['packets'] for s in segments] == [50, 50, 50, 25]
+
+
+def test_recording_writes_its_index(tmp_path):
+    fixture = tmp_path / 'fixture.rtpdump'
+    with open(fixture, 'wb') as file:
+        write_rtpdump_header(file, START)
+        for offset, packet in synthetic_packets(3, video_kbps=200):
+            write_rtpdump_record(file, packet, int(offset * 1000))
+
+    recording = Recording('s1', root=str(tmp_path / 'recordings'), recording_id='r1',
+                          max_seconds=1.0, publish=False)
+    recording.add_streams(fixture_streams(fixture))
+    for arrival, packet in read_rtpdump(fixture):
+        recording.feed(packet, arrival)
+    recording.finish()
+
+    with open(os.path.join(recording.directory, 'index.json')) as file:
+        index = json.load(file)
+    assert index['sessionId'] == 's1' and index['recordingId'] == 'r1'
+    assert index['finished'] is True
+    assert sorted(s['mimeType'] for s in index['streams']) == ['audio/opus', 'video/VP8']
+    assert len(index['segments']) == 3
+    assert all(os.path.exists(os.path.join(recording.directory, s['name'])) for s in index['segments'])
+    assert {ssrc for s in index['segments'] for ssrc in s['ssrcs']} == {s['ssrc'] for s in index['streams']}
+    assert recording.url == '/api/recordings/s1/r1/index.json'
+
+
+def test_recording_url_is_published_off_the_packet_path(tmp_path, monkeypatch):
+    published, scheduled = [], []
+    monkeypatch.setattr(recording_module, 'publish_recording_url', lambda *args: published.append(args) or True)
+    recording = Recording('s1', root=str(tmp_path), recording_id='r1', max_seconds=1.0, schedule=scheduled.append)
+    for arrival, packet in packets(100):  # 2 s: the first segment is finalized on the way
+        recording.feed(packet, arrival)
+
+    assert published == [] and len(scheduled) == 1
+    scheduled.pop()()
+    assert published == [('s1', '/api/recordings/s1/r1/index.json')]
+    recording.finish()
+    assert scheduled == []  # published once, not per segment
+
+
+def test_green_sockets_under_eventlet():
+    eventlet = pytest.importorskip('eventlet')
+    sock = udp_socket('eventlet')
+    try:
+        assert isinstance(sock, eventlet.greenio.GreenSocket)
+    finally:
+        sock.close()
+
+
+def test_tap_receive_loop_feeds_rtp_and_yields():
+    received, yields = [], []
+    tap = RtpTap('s1', lambda packet, arrival: received.append(packet), bind_ip='127.0.0.1')
+    tap._sock = udp_socket('threading')
+    tap._sock.bind(('127.0.0.1', 0))
+    tap._sock.settimeout(0.1)
+    tap._sleep = yields.append
+    tap._running = True
+    loop = threading.Thread(target=tap._receive_loop, daemon=True)
+    loop.start()
+
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    items = packets(3)
+    for _, packet in items:
+        sender.sendto(packet, ('127.0.0.1', tap.port))
+    sender.sendto(bytes([0x80, 200]) + bytes(10), ('127.0.0.1', tap.port))  # RTCP sender report
+    for _ in range(50):
+        if len(yields) == 4:
+            break
+        loop.join(0.02)
+    tap._running = False
+    loop.join(1)
+    sender.close()
+    tap._sock.close()
+
+    assert received == [packet for _, packet in items]
+    assert tap.dropped == 1 and yields == [0] * 4
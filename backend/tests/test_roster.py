@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import User
+from app.services.roster import SHARED_EPOCH, SharedRosterStore
+
+
+@pytest.fixture
+def db_session(engine):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (user_id, name, is_teacher) VALUES "
+                          "('t1', 'Ada', 1), ('u1', 'Bo', 0), ('u2', 'Cy', 0)"))
+        conn.execute(text("INSERT INTO sessions (session_id, name, teacher_id, is_active, is_livestreaming) "
+                          "VALUES ('s1', 'Class', 't1', 1, 0)"))
+        conn.execute(text("INSERT INTO session_participants (session_id, user_id) VALUES "
+                          "('s1', 't1'), ('s1', 'u1'), ('s1', 'u2')"))
+    with SQLSession(engine) as db_session:
+        yield db_session
+
+
+def test_processes_share_one_version_sequence(db_session):
+    first, second = SharedRosterStore(16), SharedRosterStore(16)
+    users = {u.user_id: u for u in db_session.query(User)}
+
+    events = [first.join(db_session, 's1', users['t1']),
+              second.join(db_session, 's1', users['u1']),
+              first.leave(db_session, 's1', 'u1')]
+
+    assert [e['version'] for e in events] == [1, 2, 3]
+    assert {e['epoch'] for e in events} == {SHARED_EPOCH}
+    epoch, version, participants = second.snapshot(db_session, 's1')
+    assert (epoch, version) == (SHARED_EPOCH, 3)
+    assert {p['userId'] for p in participants} == {'t1', 'u1', 'u2'}
+
+
+def test_catch_up_needs_every_missed_change(db_session):
+    first, second = SharedRosterStore(16), SharedRosterStore(16)
+    users = {u.user_id: u for u in db_session.query(User)}
+    first.join(db_session, 's1', users['t1'])
+    second.join(db_session, 's1', users['u1'])
+    first.join(db_session, 's1', users['u2'])
+
+    # Version 2 was made by the other process, so only a snapshot is complete
+    assert 'participants' in first.since(db_session, 's1', 1, SHARED_EPOCH)
+    caught_up = first.since(db_session, 's1', 2, SHARED_EPOCH)
+    assert caught_up['version'] == 3
+    assert [d['userId'] for d in caught_up['deltas']] == ['u2']
+    assert 'participants' in second.since(db_session, 's1', 2, 'other-epoch')
+
+
+def test_rest_and_socket_join_count_once(db_session):
+    rest, socket = SharedRosterStore(16), SharedRosterStore(16)
+    user = db_session.get(User, 'u1')
+
+    joined = rest.join(db_session, 's1', user)
+    again = socket.join(db_session, 's1', user)
+
+    assert joined['version'] == again['version'] == 1
+    assert rest.since(db_session, 's1', 0, SHARED_EPOCH)['deltas'] == [
+        {'op': 'join', 'userId': 'u1', 'user': {'userId': 'u1', 'name': 'Bo', 'isTeacher': False}, 'version': 1}]
+    assert socket.stats()['deltas'] == 0
+
+    # A socket leave keeps the participant row; joining after it is a change again
+    assert socket.leave(db_session, 's1', 'u1')['version'] == 2
+    assert socket.join(db_session, 's1', user)['version'] == 3
+    assert rest.join(db_session, 's1', user)['version'] == 3
@@ -0,0 +1,111 @@
+import pytest
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import Session
+from app.services import sfu_placement as sfu_placement_module
+from app.services.mediasoup_client import MediasoupError
+from app.services.rtp_capabilities import RtpCapabilityCache, capabilities_hash
+from app.services.sfu_cluster import SFUCluster
+from app.services.sfu_placement import SFUPlacement
+
+VP8 = {'codecs': [{'mimeType': 'video/VP8', 'clockRate': 90000}]}
+H264 = {'codecs': [{'mimeType': 'video/H264', 'clockRate': 90000}]}
+
+
+def caps(*mime_types):
+    return {'codecs': [{'kind': 'video', 'mimeType': m, 'clockRate': 90000} for m in mime_types],
+            'headerExtensions': []}
+
+
+def test_least_recently_used_capabilities_are_evicted():
+    cache = RtpCapabilityCache(maxsize=2)
+    first, second, third = (cache.register(caps(m)) for m in ('video/VP8', 'video/H264', 'video/VP9'))
+
+    assert cache.get(first) is None  # registering a third blob pushed out the oldest
+    assert cache.get(second) == caps('video/H264') and cache.get(third) == caps('video/VP9')
+    cache.get(second)  # now the most recently used
+    fourth = cache.register(caps('video/AV1'))
+    assert cache.get(third) is None
+    assert cache.get(second) is not None and cache.get(fourth) is not None
+    assert cache.stats()['capabilities'] == 2
+
+
+def test_registering_the_same_blob_twice_keeps_one_entry():
+    cache = RtpCapabilityCache(maxsize=4)
+    assert cache.register(caps('video/VP8'), sid='a') == cache.register(caps('video/VP8'), sid='b')
+    assert cache.stats()['capabilities'] == 1 and cache.for_sid('b') == capabilities_hash(caps('video/VP8'))
+    cache.forget_sid('a')
+    assert cache.for_sid('a') is None
+
+
+@pytest.fixture
+def room(engine, stubs, session_row, monkeypatch):
+    """A placed session with a VP8 camera, an H.264 screen and a viewer transport, on a fresh cache"""
+    cache = RtpCapabilityCache(maxsize=8)
+    monkeypatch.setattr(sfu_placement_module, 'rtp_capabilities', cache)
+    stub = stubs[0]
+    placement = SFUPlacement(SFUCluster([stub.url], 5, 3), 0)
+    with SQLSession(engine) as db_session:
+        placement.assign(db_session.get(Session, session_row))
+        db_session.commit()
+    send = placement.create_transport('/createProducerTransport', session_row, user_id='t1')
+    producers = {name: placement.produce(session_row, 't1', send['id'], 'video', rtp)['id']
+                 for name, rtp in (('camera', VP8), ('screen', H264), ('second_camera', VP8))}
+    recv = placement.create_transport('/createConsumerTransport', session_row, consumer=True, user_id='u1')
+
+    # The stub consumes anything; make it refuse producers whose codec the client lacks
+    sfu_calls = []
+    consume = stub.routes[('POST', '/consume')]
+
+    def checked_consume(body):
+        sfu_calls.append(body)
+        known = body.get('rtpCapabilities') or stub.state.capabilities.get(body.get('capsHash'), {})
+        mime_type = stub.state.producers[body['producerId']]['mimeType']
+        if known and mime_type not in {c['mimeType'] for c in known['codecs']}:
+            return 400, {'error': 'Cannot consume'}
+        return consume(body)
+
+    stub.routes[('POST', '/consume')] = checked_consume
+    return placement, cache, stub, producers, recv['id'], sfu_calls
+
+
+def consume(placement, transport_id, producer_id, **data):
+    return placement.consume('s1', 'u1', dict(data, transportId=transport_id, producerId=producer_id))
+
+
+def test_unknown_hash_is_answered_with_409(room):
+    placement, _, _, producers, transport_id, sfu_calls = room
+    with pytest.raises(MediasoupError) as raised:
+        consume(placement, transport_id, producers['camera'], capsHash='0' * 32)
+    assert raised.value.status_code == 409
+    assert sfu_calls == []
+
+
+def test_capabilities_go_to_a_node_once_and_again_after_it_loses_them(room):
+    placement, cache, stub, producers, transport_id, sfu_calls = room
+    caps_hash = cache.register(caps('video/VP8'))
+
+    consume(placement, transport_id, producers['camera'], capsHash=caps_hash)
+    consume(placement, transport_id, producers['second_camera'], capsHash=caps_hash)
+    assert ['rtpCapabilities' in body for body in sfu_calls] == [True, False]
+
+    stub.state.capabilities.clear()  # SFU restart: the node answers 409 and gets the blob again
+    consume(placement, transport_id, producers['camera'], capsHash=caps_hash)
+    assert ['rtpCapabilities' in body for body in sfu_calls[2:]] == [False, True]
+
+
+def test_incompatible_pairs_are_refused_without_asking_the_sfu(room):
+    placement, cache, _, producers, transport_id, sfu_calls = room
+    caps_hash = cache.register(caps('video/VP8'))
+
+    for _ in range(2):
+        with pytest.raises(MediasoupError) as raised:
+            consume(placement, transport_id, producers['screen'], capsHash=caps_hash)
+        assert raised.value.status_code == 400
+    assert len(sfu_calls) == 1  # the second refusal came from the verdict cache
+    assert cache.stats()['hits'] == 1
+
+    # A client that can decode H.264 has its own hash and verdict
+    other = cache.register(caps('video/VP8', 'video/H264'))
+    assert consume(placement, transport_id, producers['screen'], capsHash=other)['kind'] == 'video'
+    assert len(sfu_calls) == 2
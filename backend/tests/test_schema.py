@@ -0,0 +1,59 @@
+import os
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, inspect
+
+from app.models.models import Base
+from app.models.schema import (SchemaVersionError, alembic_config, check_schema_version, current_revision,
+                               head_revision)
+
+
+@pytest.fixture
+def blank(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    yield engine
+    engine.dispose()
+
+
+def upgrade(engine, revision):
+    config = alembic_config()
+    with engine.begin() as connection:
+        config.attributes['connection'] = connection
+        command.upgrade(config, revision)
+
+
+def test_head_is_the_newest_migration_file():
+    script = ScriptDirectory.from_config(alembic_config())
+    assert len(script.get_heads()) == 1
+    files = sorted(f for f in os.listdir(script.versions) if f.endswith('.py'))
+    assert head_revision() == files[-1].split('_', 1)[0]
+
+
+def test_an_unmigrated_database_is_refused(blank):
+    with pytest.raises(SchemaVersionError) as raised:
+        check_schema_version(blank)
+    assert 'none' in str(raised.value) and head_revision() in str(raised.value)
+    assert inspect(blank).get_table_names() == []
+
+
+def test_a_database_behind_head_is_refused(blank):
+    upgrade(blank, '0005')
+    with pytest.raises(SchemaVersionError) as raised:
+        check_schema_version(blank)
+    assert 'at revision 0005' in str(raised.value)
+    assert current_revision(blank) == '0005'
+
+
+def test_auto_migrate_upgrades_to_a_schema_matching_the_models(blank):
+    upgrade(blank, '0003')
+    assert check_schema_version(blank, auto_migrate=True) == head_revision()
+    assert current_revision(blank) == head_revision()
+    assert check_schema_version(blank) == head_revision()  # at head: nothing to do
+
+    with blank.connect() as connection:
+        differences = compare_metadata(MigrationContext.configure(connection), Base.metadata)
+    assert differences == []
@@ -0,0 +1,41 @@
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+from app.routes.api import api_bp
+from app.services.cache import session_info_cache
+from app.socket.coalescer import room_events
+
+
+@pytest.fixture
+def client(engine, monkeypatch):
+    monkeypatch.setattr(room_events, 'emit', lambda *args, **kwargs: None)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (user_id, name, is_teacher) VALUES ('u1', 'Ada', 0)"))
+        conn.execute(text("INSERT INTO sessions (session_id, name, teacher_id, is_active, is_livestreaming) "
+                          "VALUES ('live', 'Class', 'u1', 1, 0), ('ended', 'Class', 'u1', 0, 0)"))
+    session_info_cache.invalidate()
+    app = Flask(__name__)
+    app.register_blueprint(api_bp)
+    return app.test_client()
+
+
+def send(client, **payload):
+    return client.post('/api/send-message', json={'userId': 'u1', 'message': 'hello', **payload})
+
+
+def test_rejects_ended_session(client):
+    response = send(client, sessionId='ended')
+    assert response.status_code == 400
+    assert response.json['error'] == 'Session is no longer active'
+
+
+def test_rejects_malformed_timestamp(client):
+    response = send(client, sessionId='live', timestamp='yesterday at noon')
+    assert response.status_code == 400
+
+
+def test_accepts_iso_timestamp(client):
+    response = send(client, sessionId='live', timestamp='2025-01-01T12:00:00Z')
+    assert response.status_code == 200
+    assert response.json['success'] is True
@@ -0,0 +1,91 @@
+import threading
+
+import msgpack
+import pytest
+import socketio
+from flask import Flask
+from werkzeug.serving import make_server
+
+from app.extensions import InstrumentedSocketIO
+from app.services.metrics import MetricsRegistry
+from app.socket import serializer as serializer_module
+from app.socket.serializer import NegotiatedPacket, NegotiatingServer, offered_serializers, serializer_options
+
+
+def test_options_for_each_serializer():
+    assert serializer_options('json') == {}
+    assert serializer_options('msgpack') == {'serializer': NegotiatedPacket}
+    assert offered_serializers('msgpack') == ['msgpack', 'json']
+    assert offered_serializers('json') == ['json']
+    with pytest.raises(ValueError):
+        serializer_options('cbor')
+
+
+def test_packets_decode_from_either_encoding():
+    sent = NegotiatedPacket(socketio.packet.EVENT, ['chat', {'text': 'hi'}], namespace='/', id=7)
+    encoded = sent.encode()
+    assert msgpack.loads(encoded) == {'type': socketio.packet.EVENT, 'data': ['chat', {'text': 'hi'}],
+                                      'nsp': '/', 'id': 7}
+    for wire in (encoded, encoded.json()):
+        received = NegotiatedPacket(encoded_packet=wire)
+        assert (received.packet_type, received.data, received.id) == (socketio.packet.EVENT, ['chat', {'text': 'hi'}], 7)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(serializer_module, 'metrics', registry)
+    app = Flask(__name__)
+    sio = InstrumentedSocketIO(app, async_mode='threading', **serializer_options('msgpack'))
+
+    @sio.on('echo')
+    def echo(data):
+        return data
+
+    http = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    yield sio, http, registry
+    http.shutdown()
+
+
+def connect(http, serializer):
+    received = []
+    arrived = threading.Event()
+    client = socketio.Client(serializer=serializer)
+
+    @client.on('news')
+    def on_news(data):
+        received.append(data)
+        arrived.set()
+
+    query = '?serializer=msgpack' if serializer == 'msgpack' else ''
+    client.connect(f"http://127.0.0.1:{http.server_port}{query}", transports=['polling'], wait_timeout=5)
+    return client, received, arrived
+
+
+def encodes(registry, serializer):
+    values = registry.snapshot().histograms.get(('socketio_encode_duration_seconds', (('serializer', serializer),)))
+    return values[-2] if values else 0
+
+
+def test_each_client_gets_the_serializer_it_asked_for(server):
+    sio, http, registry = server
+    assert isinstance(sio.server, NegotiatingServer)
+    clients = [connect(http, 'msgpack'), connect(http, 'default'), connect(http, 'default')]
+    try:
+        assert sorted(sio.server.client_serializer(eio_sid) for eio_sid in sio.server.environ) == \
+            ['json', 'json', 'msgpack']
+        before = {name: encodes(registry, name) for name in ('msgpack', 'json')}
+        sio.emit('news', {'text': 'hello', 'n': 1})
+        for _, received, arrived in clients:
+            assert arrived.wait(5)
+            assert received == [{'text': 'hello', 'n': 1}]
+        # Encoded once per serializer, not once per client
+        assert {name: encodes(registry, name) - count for name, count in before.items()} == {'msgpack': 1, 'json': 1}
+
+        # Incoming frames decode either way too
+        for client, _, _ in clients:
+            assert client.call('echo', {'n': 2}, timeout=5) == {'n': 2}
+    finally:
+        for client, _, _ in clients:
+            client.disconnect()
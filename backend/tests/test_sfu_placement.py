@@ -0,0 +1,94 @@
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import Session
+from app.services.sfu_cluster import SFUCluster
+from app.services.sfu_placement import SFUPlacement
+
+
+def placement_for(stubs, spill_transports=0):
+    return SFUPlacement(SFUCluster([stub.url for stub in stubs], 5, 3), spill_transports)
+
+
+def test_concurrent_first_assign_keeps_one_router(engine, stubs, session_row):
+    stub = stubs[0]
+    first, second = placement_for([stub]), placement_for([stub])
+    with SQLSession(engine) as a, SQLSession(engine) as b:
+        session_a = a.get(Session, session_row)
+        session_b = b.get(Session, session_row)
+        assert session_a.sfu_router_id is None and session_b.sfu_router_id is None
+
+        winner = first.assign(session_a)
+        a.commit()
+        loser = second.assign(session_b)
+        b.commit()
+
+    assert loser == winner
+    assert list(stub.state.routers) == [winner]
+    assert second.router_for(session_row) == winner
+    with SQLSession(engine) as db_session:
+        assert db_session.get(Session, session_row).sfu_router_id == winner
+
+
+def test_new_sessions_go_to_the_least_loaded_node_and_worker(stubs):
+    cluster = SFUCluster([stub.url for stub in stubs], 5, 2)
+    busy, idle = (cluster.node(stub.url) for stub in stubs)
+    for _ in range(3):
+        busy.client.post('/routers', {'workerIndex': 0})
+    cluster.check_all()
+
+    assert cluster.pick_node() is idle
+    assert cluster.pick_worker(busy) == 1
+    # Routers placed since the last check count too
+    for _ in range(4):
+        cluster.pick_worker(idle)
+    assert cluster.pick_node() is busy
+
+
+def test_unhealthy_nodes_are_skipped(stubs):
+    cluster = SFUCluster([stub.url for stub in stubs], 5, 2)
+    up, down = (cluster.node(stub.url) for stub in stubs)
+    cluster.check_all()
+    stubs[1].routes[('GET', '/workers')] = lambda body: (500, {'error': 'Worker died'})
+    for _ in range(2):
+        cluster.check(down)
+
+    assert not down.healthy and up.healthy
+    assert cluster.pick_node() is up
+    assert cluster.pick_node(exclude={up.id}) is None
+
+
+def test_viewers_spill_onto_an_edge_fed_by_pipe_transports(engine, stubs, session_row):
+    origin_stub, edge_stub = stubs
+    placement = placement_for(stubs, spill_transports=3)
+    with SQLSession(engine) as db_session:
+        session = db_session.get(Session, session_row)
+        # Keep the edge node out of the first placement
+        placement.cluster.node(edge_stub.url).client.post('/routers', {'workerIndex': 0})
+        placement.cluster.check_all()
+        router_id = placement.assign(session)
+        db_session.commit()
+    assert origin_stub.state.routers.get(router_id) is not None
+
+    send = placement.create_transport('/createProducerTransport', session_row, user_id='t1')
+    camera = placement.produce(session_row, 't1', send['id'], 'video', {'codecs': [{'mimeType': 'video/VP8'}]})
+    for viewer in ('u1', 'u2'):
+        transport = placement.create_transport('/createConsumerTransport', session_row, consumer=True, user_id=viewer)
+        assert transport['id'] in origin_stub.state.transports
+
+    spilled = placement.create_transport('/createConsumerTransport', session_row, consumer=True, user_id='u3')
+    edge = placement.locate(session_row).edge
+    assert edge is not None and edge.node_id == placement.cluster.node(edge_stub.url).id
+    assert edge_stub.state.transports[spilled['id']]['routerId'] == edge.router_id
+    assert edge_stub.state.producers[camera['id']]['routerId'] == edge.router_id
+    assert edge.origin_pipe_id in origin_stub.state.transports
+
+    screen = placement.produce(session_row, 't1', send['id'], 'video', {'codecs': [{'mimeType': 'video/VP8'}]})
+    assert placement.pipe_producers(session_row, [screen['id']]) == [screen['id']]
+    assert screen['id'] in edge_stub.state.producers
+
+    # Later viewers stay on the edge, and other processes find it in the database
+    later = placement.create_transport('/createConsumerTransport', session_row, consumer=True, user_id='u4')
+    assert later['id'] in edge_stub.state.transports
+    with SQLSession(engine) as db_session:
+        stored = db_session.get(Session, session_row)
+        assert (stored.sfu_edge_node, stored.sfu_edge_router_id) == (edge.node_id, edge.router_id)
@@ -0,0 +1,83 @@
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import Session
+from app.services.sfu_cluster import SFUCluster
+from app.services.sfu_placement import SFUPlacement
+from app.services.sfu_resources import SFUResourceRegistry
+
+VP8 = {'codecs': [{'mimeType': 'video/VP8'}]}
+
+
+def ids(resources):
+    return sorted(r.id for r in resources)
+
+
+def test_taking_a_user_takes_dependents_of_other_users():
+    registry = SFUResourceRegistry()
+    registry.add('transport', 'send', 'n1', 's1', 't1')
+    registry.add('producer', 'camera', 'n1', 's1', 't1', ('send',))
+    registry.add('transport', 'receive', 'n1', 's1', 'u1')
+    registry.add('consumer', 'watch', 'n1', 's1', 'u1', ('receive', 'camera'))
+    registry.add('transport', 'elsewhere', 'n1', 's2', 't1')
+
+    assert ids(registry.take_user('t1', 's1', kinds=('producer',))) == ['camera', 'watch']
+    # The student's transport stays; its consumer went with the producer it read
+    assert registry.counts() == {'transport': 3, 'producer': 0, 'consumer': 0}
+    assert ids(registry.take_user('t1', 's1')) == ['send']
+    assert ids(registry.take_session('s1')) == ['receive']
+    assert registry.take_user('u1') == []
+    assert ids(registry.snapshot()) == ['elsewhere']
+
+
+def test_socket_bindings():
+    registry = SFUResourceRegistry()
+    registry.bind('sid1', 'u1', 's1')
+    assert registry.owner('sid1') == ('u1', 's1')
+    assert registry.unbind('sid1') == ('u1', 's1')
+    assert registry.unbind('sid1') is None and registry.owner('sid1') is None
+
+
+def record_closes(stub):
+    calls = []
+    close = stub.routes[('POST', '/closeResources')]
+    stub.routes[('POST', '/closeResources')] = lambda body: calls.append(body) or close(body)
+    return calls
+
+
+def test_leaving_closes_a_users_objects_in_one_call(engine, stubs, session_row):
+    stub = stubs[0]
+    placement = SFUPlacement(SFUCluster([stub.url], 5, 2), 0)
+    with SQLSession(engine) as db_session:
+        placement.assign(db_session.get(Session, session_row))
+        db_session.commit()
+    send = placement.create_transport('/createProducerTransport', session_row, user_id='t1')['id']
+    camera = placement.produce(session_row, 't1', send, 'video', VP8)['id']
+    receivers = {}
+    for user_id in ('u1', 'u2'):
+        receivers[user_id] = placement.create_transport('/createConsumerTransport', session_row, consumer=True,
+                                                        user_id=user_id)['id']
+        placement.consume(session_row, user_id, {'transportId': receivers[user_id], 'producerId': camera,
+                                                 'rtpCapabilities': {'codecs': []}})
+    calls = record_closes(stub)
+
+    assert placement.close_user('u1', session_row) == []
+    # Only the transport is sent: the SFU closes its consumer with it
+    assert calls == [{'transportIds': [receivers['u1']], 'producerIds': [], 'consumerIds': []}]
+    assert receivers['u1'] not in stub.state.transports
+    assert [c['transportId'] for c in stub.state.consumers.values()] == [receivers['u2']]
+
+    calls.clear()
+    assert placement.close_user('t1', session_row) == [camera]
+    assert calls == [{'transportIds': [send], 'producerIds': [], 'consumerIds': []}]
+    assert stub.state.producers == {} and stub.state.consumers == {}
+    assert placement.resources.counts() == {'transport': 1, 'producer': 0, 'consumer': 0}
+
+    calls.clear()
+    placement.close_producers(session_row, ['p1', 'p2'])
+    assert calls == [{'producerIds': ['p1', 'p2']}]
+
+    # Ending the session closes the router, which takes the remaining transport with it
+    with SQLSession(engine) as db_session:
+        placement.release(db_session.get(Session, session_row))
+    assert stub.state.routers == {} and stub.state.transports == {}
+    assert placement.resources.counts() == {'transport': 0, 'producer': 0, 'consumer': 0}
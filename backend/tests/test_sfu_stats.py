@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.sfu_resources import SFUResourceRegistry
+from app.services.sfu_stats import SFUStatsCollector, StatsSeries
+
+
+def sample(n, **overrides):
+    values = {'bitrate': 1000 * n, 'packetsLost': 10 * n, 'loss': n / 100, 'rtt': n, 'jitter': None, 'score': 10 - n}
+    values.update(overrides)
+    return values
+
+
+def test_ring_buffer_keeps_the_newest_samples_in_order():
+    series = StatsSeries(3, 'consumer')
+    for n in range(1, 3):
+        series.append(n, sample(n))
+    assert series.size == 2 and series.values('rtt') == [1, 2]
+
+    for n in range(3, 8):  # wraps around twice
+        series.append(n, sample(n))
+    assert series.size == 3 and series.head == 7 % 3
+    assert series.values('rtt') == [5, 6, 7]
+    assert list(series.timestamps[series.head:]) + list(series.timestamps[:series.head]) == [5, 6, 7]
+
+
+def test_window_summary_skips_missing_metrics():
+    series = StatsSeries(4, 'consumer', 's1', 'u1')
+    for n in range(1, 7):
+        series.append(n, sample(n, rtt=None if n == 5 else n))
+
+    assert series.summary() == {
+        'kind': 'consumer', 'userId': 'u1', 'samples': 4,
+        'bitrate': 4500,
+        'packetsLost': 30,     # lost during the window (60 - 30), not since the consumer started
+        'maxLoss': 0.06,
+        'rtt': pytest.approx((3 + 4 + 6) / 3),
+        'jitter': None,
+        'minScore': 4
+    }
+
+
+@pytest.mark.parametrize('interval, window, capacity', [
+    (2, 60, 30),
+    (7, 60, 9),     # rounds up so the window is always covered
+    (5, 1, 1),
+    (0, 60, 1),     # collection disabled
+])
+def test_window_sets_the_buffer_size(interval, window, capacity):
+    assert SFUStatsCollector(None, interval, window).capacity == capacity
+
+
+def test_collect_tracks_live_objects_and_aggregates_them():
+    resources = SFUResourceRegistry()
+    resources.add('producer', 'p1', 'n1', 's1', 't1')
+    resources.add('consumer', 'c1', 'n1', 's1', 'u1')
+    resources.add('consumer', 'c2', 'n1', 's1', 'u2')
+    tick = iter(range(1, 100))
+
+    def post(route, ids):
+        n = next(tick)
+        objects = ids['producerIds'] + ids['consumerIds']
+        return {'stats': {object_id: sample(n) for object_id in objects}}
+
+    node = SimpleNamespace(client=SimpleNamespace(post=post))
+    placement = SimpleNamespace(resources=resources, cluster=SimpleNamespace(node=lambda node_id: node))
+    collector = SFUStatsCollector(placement, interval=1, window=2)
+    for now in range(3):
+        assert collector.collect(now=now) == 3
+
+    summary = collector.session_summary('s1')
+    assert summary['byKind']['consumer']['objects'] == 2
+    assert summary['byKind']['consumer']['bitrate'] == 2 * 2500  # ticks 2 and 3 of each consumer
+    assert set(summary['users']) == {'t1', 'u1', 'u2'}
+    assert collector.user_summary('u1')['objects']['c1']['samples'] == 2
+
+    resources.take(['c2'])
+    collector.collect(now=3)
+    assert set(collector.session_summary('s1')['users']) == {'t1', 'u1'}
+    assert collector.stats()['series'] == 2
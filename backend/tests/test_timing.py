@@ -0,0 +1,117 @@
+import re
+import threading
+import time
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+from app.extensions import InstrumentedSocketIO
+from app.routes import admin as admin_routes
+from app.routes.admin import register_admin_routes
+from app.routes.metrics import register_metrics_routes
+from app.services import timing
+from app.services.mediasoup_client import MediasoupClient
+from app.services.profiler import profiler
+from config import Config
+
+
+def server_timing(response):
+    """{phase: (calls, ms)} plus 'total', parsed from the Server-Timing header"""
+    phases = {}
+    for entry in response.headers['Server-Timing'].split(', '):
+        name, *params = entry.split(';')
+        params = dict(p.split('=', 1) for p in params)
+        calls = int(re.match(r'"(\d+) calls"', params['desc']).group(1)) if 'desc' in params else None
+        phases[name] = (calls, float(params['dur']))
+    return phases
+
+
+def test_server_timing_breaks_a_request_down_by_phase(engine, stubs):
+    app = Flask(__name__)
+    socketio = InstrumentedSocketIO(app, async_mode='threading')
+    register_metrics_routes(app, socketio)
+    client = MediasoupClient(stubs[0].url, 5)
+
+    @app.route('/api/work')
+    def work():
+        with Config.engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+            connection.execute(text('SELECT 2'))
+        client.get('/workers')
+        socketio.emit('tick', {'n': 1})
+        return {'ok': True}
+
+    phases = server_timing(app.test_client().get('/api/work'))
+    assert list(phases) == ['db', 'sfu', 'serialize', 'emit', 'total']
+    assert [phases[p][0] for p in ('db', 'sfu', 'serialize', 'emit')] == [2, 1, 1, 1]
+    assert phases['total'][1] >= sum(ms for _, ms in list(phases.values())[:-1])
+
+
+def test_spans_report_exclusive_time():
+    token = timing.begin()
+    try:
+        with timing.span('serialize'):
+            time.sleep(0.02)
+            timing.record('db', 0.5)  # a query lazily loaded while serializing
+        request_timing = timing.current()
+    finally:
+        timing.end(token)
+    assert request_timing.durations['db'] == 0.5
+    # The nested query's time is not counted twice
+    assert request_timing.durations['serialize'] < 0.5
+    assert timing.current() is None
+    timing.record('db', 1.0)  # outside a request, nothing to attribute to
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(Config, 'ADMIN_TOKEN', 'secret')
+    # The blueprint is shared, so put back whichever socketio another app registered with it
+    monkeypatch.setattr(admin_routes.admin_bp, 'socketio', None, raising=False)
+    app = Flask(__name__)
+    register_admin_routes(app, type('SocketIO', (), {'sleep': staticmethod(time.sleep)}))
+    return app.test_client()
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profile_requires_the_admin_token(admin):
+    assert admin.post('/api/admin/profile?seconds=0.1').status_code == 403
+    response = admin.post('/api/admin/profile?seconds=0.1', headers={'Authorization': 'Bearer wrong'})
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize('query', ['seconds=0', f'seconds={Config.PROFILER_MAX_SECONDS + 1}', 'seconds=soon'])
+def test_profile_rejects_bad_windows(admin, query):
+    response = admin.post(f'/api/admin/profile?{query}', headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 400
+
+
+def test_profile_samples_running_threads(admin):
+    stop = threading.Event()
+    worker = threading.Thread(target=spin, args=(stop,), daemon=True)
+    worker.start()
+    try:
+        response = admin.post('/api/admin/profile?seconds=0.3&limit=500', headers={'Authorization': 'Bearer secret'})
+    finally:
+        stop.set()
+        worker.join()
+
+    assert response.status_code == 200
+    profile = response.get_json()['profile']
+    assert profile['seconds'] == 0.3 and profile['samples'] > 0
+    assert any(row['function'].startswith('spin (') for row in profile['topTotal'])
+    assert any('spin (' in row['stack'] for row in profile['stacks'])
+
+
+def test_one_profile_window_at_a_time(admin):
+    assert profiler._busy.acquire(blocking=False)
+    try:
+        response = admin.post('/api/admin/profile?seconds=0.1', headers={'Authorization': 'Bearer secret'})
+    finally:
+        profiler._busy.release()
+    assert response.status_code == 409
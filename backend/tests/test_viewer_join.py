@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import pytest
+from flask import Flask, request
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session as SQLSession
+
+from app.models.models import Message, Session
+from app.routes import api
+from app.services.roster import rosters
+from app.services.sfu_cluster import SFUCluster
+from app.services.sfu_placement import SFUPlacement
+from benchmarks.stub_sfu import RTP_CAPABILITIES
+
+SNAPSHOT_KEYS = {'sessionId', 'participants', 'rosterEpoch', 'rosterVersion', 'messages', 'messagesCursor',
+                 'isLivestreaming', 'producers', 'routerId', 'success'}
+
+
+@pytest.fixture
+def placement(engine, stubs, session_row, monkeypatch):
+    placement = SFUPlacement(SFUCluster([stubs[0].url], 5, 2), 0)
+    with SQLSession(engine) as db_session:
+        placement.assign(db_session.get(Session, session_row))
+        db_session.commit()
+    monkeypatch.setattr(api, 'sfu_placement', placement)
+    monkeypatch.setattr(api.socketio, 'async_mode', 'threading', raising=False)
+    monkeypatch.setattr(api.sfu_workers, 'run', lambda async_mode, fn, *args, **kwargs: fn(*args, **kwargs))
+    rosters.forget(session_row)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (user_id, name, is_teacher) VALUES ('u1', 'Bea', 0)"))
+        conn.execute(text("INSERT INTO session_participants (session_id, user_id) VALUES ('s1', 't1'), ('s1', 'u1')"))
+        conn.execute(text("INSERT INTO producers (producer_id, session_id, user_id, kind, source, state, created_at) "
+                          "VALUES ('cam', 's1', 't1', 'video', 'camera', 'live', '2025-01-01'), "
+                          "('old', 's1', 't1', 'video', 'screen', 'closed', '2025-01-01')"))
+        conn.execute(insert(Message), [{'message_id': 'm1', 'session_id': 's1', 'user_id': 't1', 'user_name': 'Ada',
+                                        'content': 'Welcome', 'timestamp': datetime(2025, 1, 1, 12)}])
+    yield placement
+    rosters.forget(session_row)
+
+
+def viewer_join(user_id, sid='sid1'):
+    with Flask(__name__).test_request_context():
+        request.sid = sid
+        return api.handle_viewer_join({'sessionId': 's1', 'userId': user_id})
+
+
+def test_one_response_carries_snapshot_capabilities_and_transport(stubs, placement):
+    response = viewer_join('u1')
+
+    assert set(response) == SNAPSHOT_KEYS | {'rtpCapabilities', 'consumerTransport'}
+    assert response['success'] is True and response['sessionId'] == 's1'
+    assert sorted(p['userId'] for p in response['participants']) == ['t1', 'u1']
+    assert [m['content'] for m in response['messages']] == ['Welcome']
+    assert [p['id'] for p in response['producers']] == ['cam']
+    assert response['routerId'] == placement.router_for('s1')
+    assert response['rtpCapabilities'] == RTP_CAPABILITIES
+    transport = response['consumerTransport']
+    assert {'id', 'iceParameters', 'iceCandidates', 'dtlsParameters'} <= set(transport)
+    assert stubs[0].state.transports[transport['id']]['routerId'] == response['routerId']
+    assert placement.resources.get(transport['id']).user_id == 'u1'
+
+
+def test_broadcast_viewers_get_the_playlist_instead_of_a_transport(stubs, placement, monkeypatch):
+    monkeypatch.setattr(api.broadcasts, 'url', lambda session_id: f'/api/hls/{session_id}/b1/index.m3u8')
+    response = viewer_join('u1')
+
+    assert set(response) == SNAPSHOT_KEYS | {'hlsUrl'}
+    assert response['hlsUrl'] == '/api/hls/s1/b1/index.m3u8'
+    assert [p['id'] for p in response['producers']] == ['cam']
+    assert stubs[0].state.transports == {}
+
+
+def test_only_participants_of_an_active_session(engine, stubs, placement):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (user_id, name, is_teacher) VALUES ('u2', 'Cy', 0)"))
+    assert viewer_join('u2') == {'error': 'Join the session first'}
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE sessions SET is_active = 0 WHERE session_id = 's1'"))
+    assert viewer_join('u1') == {'error': 'Session not found or no longer active'}
+    assert stubs[0].state.transports == {}
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('eventlet')
+
+# Reports whether fn ran in the calling green thread under eventlet
+PROBE = '''
+import eventlet
+{patch}
+from eventlet import greenthread
+from app.socket.workers import SFUWorkerPool
+caller = greenthread.getcurrent()
+print(SFUWorkerPool(2).run('eventlet', greenthread.getcurrent) is caller)
+'''
+
+
+def probe(patch):
+    # A fresh interpreter, since monkey-patching cannot be undone; conftest has set DATABASE_URL
+    result = subprocess.run([sys.executable, '-c', PROBE.format(patch=patch)], capture_output=True, text=True,
+                            timeout=60, env=dict(os.environ),
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip()
+
+
+def test_runs_inline_when_sockets_are_green():
+    assert probe('eventlet.monkey_patch()') == 'True'
+
+
+def test_uses_native_threads_when_sockets_block():
+    assert probe('') == 'False'
+
+
+def test_run_py_makes_sockets_and_psycopg2_cooperative_under_eventlet():
+    check = ("import run, psycopg2.extensions as e; from eventlet import patcher; "
+             "print(patcher.is_monkey_patched('socket'), e.get_wait_callback() is not None)")
+    result = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True, timeout=60,
+                            env=dict(os.environ, SOCKETIO_ASYNC_MODE=''),
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-2:] == ['True', 'True']
@@ -1,7 +1,13 @@
-const socket = io('http://127.0.0.1:5000');
+const SERVER_URL = 'http://127.0.0.1:5000';
+const MSGPACK_PARSER_URL = 'https://cdn.jsdelivr.net/npm/socket.io-msgpack-parser@3.0.2/+esm';
+let socket = null;  // opened by connectSocket() once the frame encoding is negotiated
 let device, producerTransport, consumerTransport, producers = new Map(), consumers = new Map();
 let userId, sessionId, isTeacher, currentStream = null;
+let capsHash = null;  // our device rtpCapabilities, registered once with the backend
 let participants = [];
+let rosterEpoch = null, rosterVersion = null;  // roster version the participant list reflects
+let activeSpeakerId = null;  // from the debounced active_speaker room event
+let hls = null, hlsUrl = null;  // set while watching an HLS broadcast instead of consuming
 
 document.addEventListener('DOMContentLoaded', () => {
   const joinForm = document.getElementById('joinForm');
@@ -111,24 +117,128 @@ async function init() {
       document.getElementById('sessionId').textContent = sessionId;
     }
 
+    socket = await connectSocket();
     socket.emit('join', { sessionId, userId });
     
     device = new mediasoupClient.Device();
-    const response = await fetch('http://127.0.0.1:5000/api/router-capabilities');
-    const data = await response.json();
-    await device.load({ routerRtpCapabilities: data.rtpCapabilities });
+    let liveProducers = [];
+    if (isTeacher) {
+      const response = await fetch(`http://127.0.0.1:5000/api/router-capabilities?sessionId=${encodeURIComponent(sessionId)}`);
+      const data = await response.json();
+      await device.load({ routerRtpCapabilities: data.rtpCapabilities });
+      await syncRoster();
+    } else {
+      const data = await viewerJoin();
+      if (data.participants) {
+        applyRosterSnapshot({ epoch: data.rosterEpoch, version: data.rosterVersion, participants: data.participants });
+      }
+      if (data.hlsUrl) {
+        playHls(data.hlsUrl);
+      } else {
+        await setupConsumerTransport(data);
+        liveProducers = data.producers || [];
+      }
+    }
 
     status.textContent = 'Connected and ready';
     updateParticipantList();
 
     setupEventHandlers();
     setupSocketHandlers();
+
+    // Video first: audio tracks attach to the stream the video consumer creates
+    liveProducers.sort((a, b) => (b.kind === 'video') - (a.kind === 'video'));
+    for (const { id, kind } of liveProducers) {
+      await consumeStream(id, kind);
+    }
   } catch (error) {
     console.error('Initialization error:', error);
     status.textContent = `Error: ${error.message}`;
   }
 }
 
+// MessagePack frames when the backend offers them and the parser loads; JSON
+// otherwise. The backend sends JSON to any client that does not ask for msgpack
+async function connectSocket() {
+  try {
+    const response = await fetch(`${SERVER_URL}/api/socketio-serializers`);
+    const { serializers = [] } = await response.json();
+    if (serializers.includes('msgpack')) {
+      const parser = await import(MSGPACK_PARSER_URL);
+      return io(SERVER_URL, { parser: parser.default || parser, query: { serializer: 'msgpack' } });
+    }
+  } catch (error) {
+    console.warn('Using JSON Socket.IO frames:', error);
+  }
+  return io(SERVER_URL);
+}
+
+// Snapshot plus either an HLS playlist URL or router capabilities, a consumer
+// transport and the live producers, in one round trip
+function viewerJoin() {
+  return new Promise((resolve, reject) => {
+    socket.emit('viewer_join', { sessionId, userId }, (response) => {
+      if (response && response.error) reject(new Error(response.error));
+      else resolve(response);
+    });
+  });
+}
+
+// Roster changes are numbered per epoch; an event exactly one version ahead is
+// applied, an older one is already reflected, and a gap or a new epoch means
+// events were missed, so fetch the deltas (or a snapshot) from the server
+function applyRosterSnapshot({ epoch, version, participants: list }) {
+  rosterEpoch = epoch;
+  rosterVersion = version;
+  participants = list;
+}
+
+function applyRosterDelta({ op, userId: deltaUserId, user }) {
+  participants = participants.filter(p => p.userId !== deltaUserId);
+  if (op === 'join') participants.push(user);
+}
+
+let rosterSync = null;
+function syncRoster() {
+  if (rosterSync) return rosterSync;
+  const params = new URLSearchParams();
+  if (rosterEpoch !== null) {
+    params.set('epoch', rosterEpoch);
+    params.set('since', rosterVersion);
+  }
+  rosterSync = fetch(`http://127.0.0.1:5000/api/sessions/${encodeURIComponent(sessionId)}/roster?${params}`)
+    .then(response => response.json())
+    .then(data => {
+      if (!data.success) throw new Error(data.error);
+      if (data.deltas) {
+        data.deltas.filter(d => d.version > rosterVersion).forEach(applyRosterDelta);
+        rosterVersion = data.version;
+      } else {
+        applyRosterSnapshot({ epoch: data.epoch, version: data.version, participants: data.participants });
+      }
+      updateParticipantList();
+    })
+    .catch(error => console.error('Roster sync error:', error))
+    .finally(() => { rosterSync = null; });
+  return rosterSync;
+}
+
+// Returns false when the event cannot be applied in order and a sync was started
+function inRosterOrder({ epoch, version }) {
+  if (version === undefined) return true;
+  if (epoch === rosterEpoch && version <= rosterVersion + 1) {
+    rosterVersion = Math.max(rosterVersion, version);
+    return true;
+  }
+  syncRoster();
+  return false;
+}
+
+async function setupConsumerTransport(data) {
+  if (!device.loaded) await device.load({ routerRtpCapabilities: data.rtpCapabilities });
+  consumerTransport = await createTransport('consumer', data.consumerTransport);
+}
+
 function setupEventHandlers() {
   if (isTeacher) {
     const startVideoBtn = document.getElementById('startVideo');
@@ -143,6 +253,8 @@ function setupEventHandlers() {
   } else {
     const leaveSessionBtn = document.getElementById('leaveSession');
     leaveSessionBtn.onclick = leaveSession;
+    window.addEventListener('resize', reportViewerConditions);
+    if (navigator.connection) navigator.connection.addEventListener('change', reportViewerConditions);
   }
 
   const qualitySelect = document.getElementById('qualitySelect');
@@ -155,34 +267,63 @@ function setupEventHandlers() {
 }
 
 function setupSocketHandlers() {
+  // Coalesced room events arrive as one batched frame; replay each entry
+  // through the regular handlers in order
+  socket.on('events', (batch) => {
+    batch.forEach(({ event, data }) => {
+      socket.listeners(event).forEach(listener => listener(data));
+    });
+  });
+
   socket.on('newProducer', async ({ producerId, kind, userId: producerUserId }) => {
     console.log('New producer detected:', producerId, kind, 'from user:', producerUserId);
-    if (!isTeacher) {
+    if (!isTeacher && !hlsUrl) {
       await consumeStream(producerId, kind);
     }
   });
 
-  socket.on('user_joined', (user) => {
+  socket.on('active_speaker', ({ userId: speakerId }) => {
+    activeSpeakerId = speakerId;
+    updateParticipantList();
+  });
+
+  socket.on('user_joined', ({ epoch, version, ...user }) => {
     console.log('User joined:', user);
-    participants.push(user);
+    if (!inRosterOrder({ epoch, version })) return;
+    // The REST join and the socket join both announce a user; keep one entry
+    applyRosterDelta({ op: 'join', userId: user.userId, user });
     updateParticipantList();
   });
 
-  socket.on('user_left', ({ userId: leftUserId }) => {
+  socket.on('user_left', ({ epoch, version, userId: leftUserId }) => {
     console.log('User left:', leftUserId);
-    participants = participants.filter(p => p.userId !== leftUserId);
+    if (!inRosterOrder({ epoch, version })) return;
+    applyRosterDelta({ op: 'leave', userId: leftUserId });
     updateParticipantList();
   });
 
-  socket.on('livestream_started', () => {
+  socket.on('livestream_started', async (data) => {
     console.log('Livestream started');
     const status = document.getElementById('status');
     if (status) status.textContent = 'Livestream started';
+    if (isTeacher) return;
+    if (data && data.hlsUrl) {
+      playHls(data.hlsUrl);
+    } else if (hlsUrl) {
+      // Back to WebRTC: producers arrive through newProducer
+      stopHls();
+      try {
+        await setupConsumerTransport(await viewerJoin());
+      } catch (error) {
+        console.error('Viewer join error:', error);
+      }
+    }
   });
 
   socket.on('livestream_ended', () => {
     console.log('Livestream ended');
     if (!isTeacher) {
+      stopHls();
       const remoteVideo = document.getElementById('remoteVideo');
       if (remoteVideo) remoteVideo.srcObject = null;
       const status = document.getElementById('status');
@@ -219,6 +360,8 @@ function setupSocketHandlers() {
     console.log('Socket connected');
     if (sessionId && userId) {
       socket.emit('join', { sessionId, userId });
+      // Room events sent while disconnected are gone; catch up on the roster
+      syncRoster();
     }
   });
 
@@ -264,10 +407,13 @@ async function startStream(type) {
     const localVideo = document.getElementById('localVideo');
     if (localVideo) localVideo.srcObject = stream;
 
+    // Broadcast mode packages the stream into HLS without transcoding, which needs H.264 video
+    const broadcastMode = document.getElementById('broadcastMode');
+    const broadcast = Boolean(broadcastMode && broadcastMode.checked);
     const response = await fetch('http://127.0.0.1:5000/api/start-livestream', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ sessionId, userId })
+      body: JSON.stringify({ sessionId, userId, mode: broadcast ? 'hls' : 'webrtc' })
     });
     
     const data = await response.json();
@@ -277,8 +423,13 @@ async function startStream(type) {
 
     const videoTrack = stream.getVideoTracks()[0];
     if (videoTrack) {
+      const h264 = broadcast
+        ? device.rtpCapabilities.codecs.find(codec => codec.mimeType.toLowerCase() === 'video/h264')
+        : undefined;
+      if (broadcast && !h264) console.warn('No H.264 encoder available: the broadcast will be audio only');
       const videoProducer = await producerTransport.produce({
         track: videoTrack,
+        codec: h264,
         encodings: [
           { maxBitrate: 100000 },  // Low
           { maxBitrate: 300000 },  // Medium
@@ -286,7 +437,8 @@ async function startStream(type) {
         ],
         codecOptions: {
           videoGoogleStartBitrate: 1000
-        }
+        },
+        appData: { source: type === 'screen' ? 'screen' : 'camera' }
       });
       producers.set(videoProducer.id, videoProducer);
       videoProducer.on('trackended', () => stopStream());
@@ -297,7 +449,10 @@ async function startStream(type) {
 
     const audioTrack = stream.getAudioTracks()[0];
     if (audioTrack) {
-      const audioProducer = await producerTransport.produce({ track: audioTrack });
+      const audioProducer = await producerTransport.produce({
+        track: audioTrack,
+        appData: { source: type === 'screen' ? 'screen' : 'mic' }
+      });
       producers.set(audioProducer.id, audioProducer);
       audioProducer.on('trackended', () => console.log('Audio track ended'));
       console.log('Audio producer created:', audioProducer.id);
@@ -360,12 +515,16 @@ async function stopStream() {
   }
 }
 
-async function createTransport(type) {
+// preset is transport parameters the server already sent (e.g. with viewer_join)
+async function createTransport(type, preset) {
   const isProducer = type === 'producer';
   const eventName = isProducer ? 'createProducerTransport' : 'createConsumerTransport';
   
   return new Promise((resolve, reject) => {
-    socket.emit(eventName, (response) => {
+    const request = preset
+      ? (callback) => callback(preset)
+      : (callback) => socket.emit(eventName, { sessionId, userId }, callback);
+    request((response) => {
       if (response && response.error) {
         console.error(`Error in ${eventName}:`, response.error);
         reject(new Error(response.error));
@@ -383,7 +542,7 @@ async function createTransport(type) {
         const transport = device[isProducer ? 'createSendTransport' : 'createRecvTransport'](response);
         
         transport.on('connect', ({ dtlsParameters }, callback, errback) => {
-          socket.emit('connectTransport', { transportId: transport.id, dtlsParameters }, (response) => {
+          socket.emit('connectTransport', { transportId: transport.id, dtlsParameters, sessionId }, (response) => {
             if (response && response.error) {
               console.error('Error connecting transport:', response.error);
               errback(new Error(response.error));
@@ -394,8 +553,8 @@ async function createTransport(type) {
         });
 
         if (isProducer) {
-          transport.on('produce', ({ kind, rtpParameters }, callback, errback) => {
-            socket.emit('produce', { transportId: transport.id, kind, rtpParameters, sessionId, userId }, (response) => {
+          transport.on('produce', ({ kind, rtpParameters, appData }, callback, errback) => {
+            socket.emit('produce', { transportId: transport.id, kind, rtpParameters, source: appData.source, sessionId, userId }, (response) => {
               if (response && response.error) {
                 console.error('Error producing:', response.error);
                 errback(new Error(response.error));
@@ -427,6 +586,33 @@ async function createTransport(type) {
   });
 }
 
+function registerCapabilities() {
+  return new Promise((resolve, reject) => {
+    socket.emit('register_rtp_capabilities', { rtpCapabilities: device.rtpCapabilities }, (response) => {
+      if (response && response.capsHash) {
+        resolve(response.capsHash);
+      } else {
+        reject(new Error((response && response.error) || 'Could not register RTP capabilities'));
+      }
+    });
+  });
+}
+
+// Only ids and the capabilities hash travel with each consume
+function requestConsumer(producerId) {
+  return new Promise((resolve) => {
+    socket.emit('consume', {
+      transportId: consumerTransport.id,
+      sessionId,
+      userId,
+      producerId,
+      capsHash,
+      bandwidthKbps: estimatedBandwidthKbps(),
+      viewportHeight: videoViewportHeight()
+    }, (response) => resolve(response || { error: 'No response to consume' }));
+  });
+}
+
 async function consumeStream(producerId, kind) {
   try {
     console.log('Starting to consume stream:', producerId, kind);
@@ -435,20 +621,19 @@ async function consumeStream(producerId, kind) {
       consumerTransport = await createTransport('consumer');
     }
     
-    const response = await new Promise((resolve, reject) => {
-      socket.emit('consume', { 
-        transportId: consumerTransport.id,
-        producerId, 
-        rtpParameters: device.rtpCapabilities 
-      }, (response) => {
-        if (response && response.error) {
-          console.error('Error consuming stream:', response.error);
-          reject(new Error(response.error));
-        } else {
-          resolve(response);
-        }
-      });
-    });
+    if (!capsHash) {
+      capsHash = await registerCapabilities();
+    }
+    let response = await requestConsumer(producerId);
+    if (response.status === 409) {
+      // The server no longer knows our capabilities hash
+      capsHash = await registerCapabilities();
+      response = await requestConsumer(producerId);
+    }
+    if (response.error) {
+      console.error('Error consuming stream:', response.error);
+      throw new Error(response.error);
+    }
 
     const consumer = await consumerTransport.consume({
       id: response.id,
@@ -490,21 +675,96 @@ async function consumeStream(producerId, kind) {
   }
 }
 
+function playHls(url) {
+  stopHls();
+  consumers.forEach(consumer => consumer.close());
+  consumers.clear();
+  hlsUrl = url;
+  const remoteVideo = document.getElementById('remoteVideo');
+  if (!remoteVideo) return;
+  remoteVideo.srcObject = null;
+  const source = `http://127.0.0.1:5000${url}`;
+  if (window.Hls && Hls.isSupported()) {
+    // The playlist appears with the first segment, a couple of seconds after the stream starts
+    hls = new Hls({
+      manifestLoadPolicy: {
+        default: {
+          maxTimeToFirstByteMs: 10000,
+          maxLoadTimeMs: 20000,
+          timeoutRetry: { maxNumRetry: 2, retryDelayMs: 0, maxRetryDelayMs: 0 },
+          errorRetry: { maxNumRetry: 10, retryDelayMs: 1000, maxRetryDelayMs: 4000 }
+        }
+      }
+    });
+    hls.loadSource(source);
+    hls.attachMedia(remoteVideo);
+  } else if (remoteVideo.canPlayType('application/vnd.apple.mpegurl')) {
+    remoteVideo.src = source;  // Safari plays HLS natively
+  }
+  remoteVideo.play().catch(error => console.log('Waiting for the user to start playback:', error.message));
+}
+
+function stopHls() {
+  if (hls) {
+    hls.destroy();
+    hls = null;
+  }
+  if (hlsUrl) {
+    const remoteVideo = document.getElementById('remoteVideo');
+    if (remoteVideo) {
+      remoteVideo.removeAttribute('src');
+      remoteVideo.load();
+    }
+    hlsUrl = null;
+  }
+}
+
 function updateQuality(quality) {
   const qualityMap = {
-    'low': 0,    // First encoding (100 kbps)
-    'medium': 1, // Second encoding (300 kbps)
-    'high': 2    // Third encoding (900 kbps)
+    'auto': null, // Chosen by the server from bandwidth, viewport and room size
+    'low': 0,     // First encoding (100 kbps)
+    'medium': 1,  // Second encoding (300 kbps)
+    'high': 2     // Third encoding (900 kbps)
   };
-  const level = qualityMap[quality] || 1;
+  const level = quality in qualityMap ? qualityMap[quality] : null;
   
+  // Layers are switched on the SFU side; the browser just receives what it is sent
   consumers.forEach(consumer => {
     if (consumer.kind === 'video') {
-      consumer.setPreferredLayers({ spatialLayer: level, temporalLayer: level });
+      socket.emit('set_preferred_layers', { consumerId: consumer.id, spatialLayer: level, sessionId, userId }, (response) => {
+        if (response && response.error) console.error('Error setting preferred layers:', response.error);
+      });
     }
   });
 }
 
+// Downlink estimate in kbps from the Network Information API, where the browser has it
+function estimatedBandwidthKbps() {
+  const connection = navigator.connection;
+  return connection && connection.downlink ? Math.round(connection.downlink * 1000) : null;
+}
+
+// Height in device pixels the remote video is drawn at
+function videoViewportHeight() {
+  const remoteVideo = document.getElementById('remoteVideo');
+  return remoteVideo && remoteVideo.clientHeight
+    ? Math.round(remoteVideo.clientHeight * (window.devicePixelRatio || 1))
+    : null;
+}
+
+let viewerConditionsTimer = null;
+function reportViewerConditions() {
+  clearTimeout(viewerConditionsTimer);
+  viewerConditionsTimer = setTimeout(() => {
+    socket.emit('viewer_conditions', {
+      sessionId,
+      userId,
+      bandwidthKbps: estimatedBandwidthKbps(),
+      viewportHeight: videoViewportHeight()
+    });
+  }, 500);
+}
+
 async function leaveSession() {
   try {
     if (isTeacher && currentStream) await stopStream();
@@ -538,7 +798,9 @@ async function leaveSession() {
 function updateParticipantList() {
   const participantList = document.getElementById('participantList');
   if (participantList) {
-    participantList.innerHTML = participants.map(p => `<li>${p.name} (${p.isTeacher ? 'Teacher' : 'Student'})</li>`).join('');
+    participantList.innerHTML = participants.map(p =>
+      `<li>${p.name} (${p.isTeacher ? 'Teacher' : 'Student'})${p.userId === activeSpeakerId ? ' - speaking' : ''}</li>`
+    ).join('');
   }
 }
 
@@ -554,5 +816,5 @@ window.addEventListener('beforeunload', async () => {
   const blob = new Blob([JSON.stringify({ sessionId, userId })], { type: 'application/json' });
   navigator.sendBeacon('http://127.0.0.1:5000/api/leave-session', blob);
 
-  socket.emit('leave', { sessionId, userId });
+  if (socket) socket.emit('leave', { sessionId, userId });
 });
\ No newline at end of file
@@ -1,7 +1,11 @@
 module.exports = {
-  listenIp: '127.0.0.1',
-  listenPort: 3000,
+  listenIp: process.env.LISTEN_IP || '127.0.0.1',
+  listenPort: parseInt(process.env.LISTEN_PORT, 10) || 3000,
   mediasoup: {
+    // One worker per CPU core unless overridden
+    numWorkers: parseInt(process.env.MEDIASOUP_NUM_WORKERS, 10) || 0,
+    // Distinct client rtpCapabilities kept by hash (canConsume verdicts get 4x this)
+    capabilityCacheSize: parseInt(process.env.CAPABILITY_CACHE_SIZE, 10) || 1024,
     worker: {
       rtcMinPort: 10000,
       rtcMaxPort: 20000,
@@ -50,6 +54,26 @@ module.exports = {
       enableUdp: true,
       enableTcp: true,
       preferUdp: true
+    },
+    // Loudest audio producers per router, reported every interval ms (volumes in dBov)
+    audioLevelObserver: {
+      maxEntries: 10,
+      threshold: -70,
+      interval: 250
+    },
+    // RTP out to the backend's recorder/packager; announcedIp must be reachable from the backend
+    plainTransport: {
+      listenIp: {
+        ip: process.env.PLAIN_LISTEN_IP || '127.0.0.1',
+        announcedIp: process.env.PLAIN_ANNOUNCED_IP || null
+      }
+    },
+    // Router-to-router links between SFU nodes; announcedIp must be reachable from the other nodes
+    pipeTransport: {
+      listenIp: {
+        ip: process.env.PIPE_LISTEN_IP || '127.0.0.1',
+        announcedIp: process.env.PIPE_ANNOUNCED_IP || null
+      }
     }
   }
 };
\ No newline at end of file
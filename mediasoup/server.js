@@ -1,51 +1,288 @@
+const os = require('os');
 const express = require('express');
 const mediasoup = require('mediasoup');
 const config = require('./config');
 
 const app = express();
+app.use(express.json({ limit: '1mb' }));
+
 const httpServer = app.listen(config.listenPort, config.listenIp, () => {
   console.log(`Mediasoup server running on http://${config.listenIp}:${config.listenPort}`);
 });
 
-let worker, router;
+// One entry per mediasoup worker (one CPU core each). The backend decides
+// which worker hosts a session and asks for a router there via POST /routers.
+const workers = [];
+let defaultRouter;
+
+// Every live object by id, so lookups do not depend on which router owns it
+const routers = new Map();
+const transports = new Map();
+const producers = new Map();
+const consumers = new Map();
+
+// Per-router object counts, reported by GET /workers for spill decisions
+const routerLoad = new Map();
+// routerId -> { observer, volumes, seq }: loudest audio producers per router for GET /audioLevels
+const audioLevels = new Map();
+let audioLevelsSeq = 0;
+
+// Client rtpCapabilities by hash (the backend sends each blob once per node)
+// and memoized canConsume verdicts per (producer codecs, capabilities hash)
+const clientCapabilities = new Map();
+const consumable = new Map();
+
+function lruGet(map, key) {
+  if (!map.has(key)) return undefined;
+  const value = map.get(key);
+  map.delete(key);
+  map.set(key, value);
+  return value;
+}
+
+function lruSet(map, key, value, limit) {
+  map.delete(key);
+  map.set(key, value);
+  while (map.size > limit) {
+    map.delete(map.keys().next().value);
+  }
+}
+
+function codecKey(producer) {
+  if (!producer.appData.codecKey) {
+    producer.appData.codecKey = JSON.stringify(producer.consumableRtpParameters.codecs
+      .map(({ mimeType, clockRate, channels, parameters }) => [mimeType, clockRate, channels, parameters]));
+  }
+  return producer.appData.codecKey;
+}
 
 async function startMediasoup() {
-  worker = await mediasoup.createWorker(config.mediasoup.worker);
-  worker.on('died', () => {
-    console.error('Mediasoup worker died, exiting...');
-    process.exit(1);
+  const numWorkers = config.mediasoup.numWorkers || os.cpus().length;
+  for (let index = 0; index < numWorkers; index++) {
+    const worker = await mediasoup.createWorker(config.mediasoup.worker);
+    worker.on('died', () => {
+      console.error(`Mediasoup worker ${index} died, exiting...`);
+      process.exit(1);
+    });
+    workers.push({ index, worker, routers: new Set(), transports: 0, producers: 0, consumers: 0 });
+  }
+
+  // Serves requests that do not name a router (older backends)
+  defaultRouter = await createRouter(workers[0]);
+  console.log(`Started ${workers.length} mediasoup workers`);
+}
+
+async function createRouter(entry) {
+  const router = await entry.worker.createRouter({
+    mediaCodecs: config.mediasoup.router.mediaCodecs,
+    appData: { workerIndex: entry.index }
+  });
+  routers.set(router.id, router);
+  routerLoad.set(router.id, { transports: 0, producers: 0, consumers: 0 });
+  entry.routers.add(router.id);
+  router.observer.on('close', () => {
+    routers.delete(router.id);
+    routerLoad.delete(router.id);
+    audioLevels.delete(router.id);
+    entry.routers.delete(router.id);
   });
 
-  router = await worker.createRouter({ mediaCodecs: config.mediasoup.router.mediaCodecs });
+  const observer = await router.createAudioLevelObserver(config.mediasoup.audioLevelObserver);
+  const levels = { observer, volumes: [], seq: 0 };
+  audioLevels.set(router.id, levels);
+  observer.on('volumes', (volumes) => {
+    levels.volumes = volumes.map(({ producer, volume }) => ({
+      producerId: producer.id,
+      userId: producer.appData.userId || null,
+      volume
+    }));
+    levels.seq = ++audioLevelsSeq;
+  });
+  observer.on('silence', () => {
+    levels.volumes = [];
+    levels.seq = ++audioLevelsSeq;
+  });
+  return router;
 }
 
-startMediasoup();
+function getRouter(routerId) {
+  return routerId ? routers.get(routerId) : defaultRouter;
+}
 
-app.get('/router-capabilities', (req, res) => {
-  if (!router) {
-    return res.status(500).json({ error: 'Router not initialized' });
+// Keep the id maps and per-worker/per-router counters in sync with object lifetimes
+function trackTransport(transport, entry) {
+  const load = routerLoad.get(transport.appData.routerId);
+  const count = (key, delta) => {
+    entry[key] += delta;
+    if (load) load[key] += delta;
+  };
+
+  transports.set(transport.id, transport);
+  count('transports', 1);
+  transport.observer.on('close', () => {
+    transports.delete(transport.id);
+    count('transports', -1);
+  });
+  transport.observer.on('newproducer', (producer) => {
+    producers.set(producer.id, producer);
+    count('producers', 1);
+    producer.observer.on('close', () => {
+      producers.delete(producer.id);
+      count('producers', -1);
+    });
+  });
+  transport.observer.on('newconsumer', (consumer) => {
+    consumers.set(consumer.id, consumer);
+    count('consumers', 1);
+    consumer.observer.on('close', () => {
+      consumers.delete(consumer.id);
+      count('consumers', -1);
+    });
+  });
+}
+
+// Current send + receive bitrate of every WebRTC transport, summed per worker
+async function workerBitrates() {
+  const totals = workers.map(() => 0);
+  await Promise.all([...transports.values()].map(async (transport) => {
+    if (transport.type !== 'webrtc') return;
+    try {
+      const [stats] = await transport.getStats();
+      const router = routers.get(transport.appData.routerId);
+      totals[router.appData.workerIndex] += (stats.recvBitrate || 0) + (stats.sendBitrate || 0);
+    } catch (error) {
+      // Transport closed while we were collecting
+    }
+  }));
+  return totals;
+}
+
+// Reduce getStats() output to the numbers the backend's stats collector keeps:
+// bitrate (bits/s), packetsLost (cumulative), loss (0-1), rtt (ms), jitter and score (0-10).
+// A consumer also reports its producer's inbound stream; only what it sends counts.
+function summarizeStats(entries, kind) {
+  const worst = (a, b, pick) => (b === undefined || b === null ? a : a === null ? b : pick(a, b));
+  const summary = { bitrate: 0, packetsLost: null, loss: null, rtt: null, jitter: null, score: null };
+  for (const stats of entries) {
+    if (stats.type.endsWith('-transport')) {
+      summary.bitrate += (stats.recvBitrate || 0) + (stats.sendBitrate || 0);
+      summary.loss = worst(summary.loss, stats.rtpPacketLossReceived, Math.max);
+      continue;
+    }
+    if (kind === 'consumer' ? stats.type !== 'outbound-rtp' : stats.type !== 'inbound-rtp') continue;
+    summary.bitrate += stats.bitrate || 0;
+    summary.packetsLost = (summary.packetsLost || 0) + (stats.packetsLost || 0);
+    summary.loss = worst(summary.loss, stats.fractionLost !== undefined ? stats.fractionLost / 256 : null, Math.max);
+    summary.rtt = worst(summary.rtt, stats.roundTripTime, Math.max);
+    summary.jitter = worst(summary.jitter, stats.jitter, Math.max);
+    summary.score = worst(summary.score, stats.score, Math.min);
+  }
+  return summary;
+}
+
+// Stats of many transports, producers and consumers in one request
+app.post('/stats', async (req, res) => {
+  const { transportIds = [], producerIds = [], consumerIds = [] } = req.body;
+  const stats = {};
+  const missing = [];
+  try {
+    const jobs = [];
+    for (const [kind, ids, objects] of [
+      ['transport', transportIds, transports], ['producer', producerIds, producers], ['consumer', consumerIds, consumers]
+    ]) {
+      for (const id of ids) {
+        const object = objects.get(id);
+        if (!object || object.closed) {
+          missing.push(id);
+          continue;
+        }
+        jobs.push(object.getStats()
+          .then((entries) => { stats[id] = summarizeStats(entries, kind); })
+          .catch(() => missing.push(id)));  // Closed while we were collecting
+      }
+    }
+    await Promise.all(jobs);
+    res.json({ stats, missing });
+  } catch (error) {
+    console.error('Error collecting stats:', error);
+    res.status(500).json({ error: error.message });
   }
-  res.json({ rtpCapabilities: router.rtpCapabilities });
 });
 
-app.post('/createProducerTransport', async (req, res) => {
+startMediasoup();
+
+app.get('/workers', async (req, res) => {
   try {
-    const transport = await router.createWebRtcTransport(config.mediasoup.webRtcTransport);
+    const [usage, bitrates] = await Promise.all([
+      Promise.all(workers.map(({ worker }) => worker.getResourceUsage().catch(() => null))),
+      workerBitrates()
+    ]);
     res.json({
-      id: transport.id,
-      iceParameters: transport.iceParameters,
-      iceCandidates: transport.iceCandidates,
-      dtlsParameters: transport.dtlsParameters
+      workers: workers.map((entry, i) => ({
+        index: entry.index,
+        pid: entry.worker.pid,
+        routers: entry.routers.size,
+        transports: entry.transports,
+        producers: entry.producers,
+        consumers: entry.consumers,
+        bitrate: bitrates[i],
+        cpuMs: usage[i] ? usage[i].ru_utime + usage[i].ru_stime : null
+      })),
+      routerLoad: Object.fromEntries(routerLoad)
     });
   } catch (error) {
-    console.error('Error creating producer transport:', error);
+    console.error('Error reading worker load:', error);
     res.status(500).json({ error: error.message });
   }
 });
 
-app.post('/createConsumerTransport', async (req, res) => {
+app.post('/routers', async (req, res) => {
+  const { workerIndex } = req.body;
+  try {
+    const entry = workers[workerIndex];
+    if (!entry) {
+      return res.status(404).json({ error: 'Worker not found' });
+    }
+    const router = await createRouter(entry);
+    res.json({ routerId: router.id, workerIndex: entry.index, rtpCapabilities: router.rtpCapabilities });
+  } catch (error) {
+    console.error('Error creating router:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+app.post('/closeRouter', (req, res) => {
+  const { routerId } = req.body;
+  const router = routers.get(routerId);
+  if (!router || router === defaultRouter) {
+    return res.status(404).json({ error: 'Router not found' });
+  }
+  // Closing a router closes its transports, producers and consumers
+  router.close();
+  res.json({ success: true });
+});
+
+app.get('/router-capabilities', (req, res) => {
+  const router = getRouter(req.query.routerId);
+  if (!router) {
+    return res.status(req.query.routerId ? 404 : 500).json({
+      error: req.query.routerId ? 'Router not found' : 'Router not initialized'
+    });
+  }
+  res.json({ rtpCapabilities: router.rtpCapabilities });
+});
+
+async function createWebRtcTransport(req, res) {
   try {
-    const transport = await router.createWebRtcTransport(config.mediasoup.webRtcTransport);
+    const router = getRouter(req.body.routerId);
+    if (!router) {
+      return res.status(404).json({ error: 'Router not found' });
+    }
+    const transport = await router.createWebRtcTransport({
+      ...config.mediasoup.webRtcTransport,
+      appData: { routerId: router.id }
+    });
+    trackTransport(transport, workers[router.appData.workerIndex]);
     res.json({
       id: transport.id,
       iceParameters: transport.iceParameters,
@@ -53,15 +290,18 @@ app.post('/createConsumerTransport', async (req, res) => {
       dtlsParameters: transport.dtlsParameters
     });
   } catch (error) {
-    console.error('Error creating consumer transport:', error);
+    console.error('Error creating transport:', error);
     res.status(500).json({ error: error.message });
   }
-});
+}
+
+app.post('/createProducerTransport', createWebRtcTransport);
+app.post('/createConsumerTransport', createWebRtcTransport);
 
-app.post('/connectTransport', async (req, res) => {
+async function connectTransport(req, res) {
   const { transportId, dtlsParameters } = req.body;
   try {
-    const transport = router.transports.find(t => t.id === transportId);
+    const transport = transports.get(transportId);
     if (!transport) {
       return res.status(404).json({ error: 'Transport not found' });
     }
@@ -71,16 +311,33 @@ app.post('/connectTransport', async (req, res) => {
     console.error('Error connecting transport:', error);
     res.status(500).json({ error: error.message });
   }
-});
+}
+
+app.post('/connectTransport', connectTransport);
+app.post('/connectProducerTransport', connectTransport);
+app.post('/connectConsumerTransport', connectTransport);
 
 app.post('/produce', async (req, res) => {
-  const { transportId, kind, rtpParameters } = req.body;
+  const { transportId, kind, rtpParameters, userId } = req.body;
   try {
-    const transport = router.transports.find(t => t.id === transportId);
+    const transport = transports.get(transportId);
     if (!transport) {
       return res.status(404).json({ error: 'Transport not found' });
     }
-    const producer = await transport.produce({ kind, rtpParameters });
+    const producer = await transport.produce({
+      kind,
+      rtpParameters,
+      appData: { routerId: transport.appData.routerId, userId }
+    });
+    const levels = audioLevels.get(transport.appData.routerId);
+    if (kind === 'audio' && levels) {
+      // Levels are optional; a failure here must not orphan a working producer
+      try {
+        await levels.observer.addProducer({ producerId: producer.id });
+      } catch (error) {
+        console.error(`Error observing audio levels of producer ${producer.id}:`, error);
+      }
+    }
     res.json({ id: producer.id });
   } catch (error) {
     console.error('Error producing:', error);
@@ -88,25 +345,64 @@ app.post('/produce', async (req, res) => {
   }
 });
 
+// Loudest audio producers of every router whose levels changed after sequence number `since`
+app.get('/audioLevels', (req, res) => {
+  const since = parseInt(req.query.since, 10) || 0;
+  const changed = {};
+  for (const [routerId, levels] of audioLevels) {
+    if (levels.seq > since) changed[routerId] = levels.volumes;
+  }
+  res.json({ seq: audioLevelsSeq, routers: changed });
+});
+
+// Takes rtpCapabilities, capsHash, or both (to store the blob under the hash)
 app.post('/consume', async (req, res) => {
-  const { transportId, producerId, rtpCapabilities } = req.body;
+  const { transportId, producerId, capsHash, preferredLayers } = req.body;
+  let { rtpCapabilities } = req.body;
+  const limit = config.mediasoup.capabilityCacheSize;
   try {
-    if (!router.canConsume({ producerId, rtpCapabilities })) {
-      return res.status(400).json({ error: 'Cannot consume this producer' });
-    }
-    const transport = router.transports.find(t => t.id === transportId);
+    const transport = transports.get(transportId);
     if (!transport) {
       return res.status(404).json({ error: 'Transport not found' });
     }
+    const producer = producers.get(producerId);
+    if (!producer) {
+      return res.status(404).json({ error: 'Producer not found' });
+    }
+    if (capsHash) {
+      if (rtpCapabilities) {
+        lruSet(clientCapabilities, capsHash, rtpCapabilities, limit);
+      } else {
+        rtpCapabilities = lruGet(clientCapabilities, capsHash);
+      }
+      if (!rtpCapabilities) {
+        return res.status(409).json({ error: 'Unknown capabilities hash' });
+      }
+    }
+
+    const router = routers.get(transport.appData.routerId);
+    const verdictKey = capsHash && `${codecKey(producer)}|${capsHash}`;
+    let canConsume = verdictKey ? lruGet(consumable, verdictKey) : undefined;
+    if (canConsume === undefined) {
+      canConsume = router.canConsume({ producerId, rtpCapabilities });
+      if (verdictKey) lruSet(consumable, verdictKey, canConsume, limit * 4);
+    }
+    if (!canConsume) {
+      return res.status(400).json({ error: 'Cannot consume this producer' });
+    }
+    // preferredLayers only applies to simulcast/SVC producers and is ignored for the rest
     const consumer = await transport.consume({
       producerId,
       rtpCapabilities,
-      paused: false
+      paused: false,
+      ...(preferredLayers && { preferredLayers })
     });
     res.json({
       id: consumer.id,
       producerId,
       kind: consumer.kind,
+      type: consumer.type,
+      preferredLayers: consumer.preferredLayers || null,
       rtpParameters: consumer.rtpParameters
     });
   } catch (error) {
@@ -118,7 +414,7 @@ app.post('/consume', async (req, res) => {
 app.post('/closeProducer', async (req, res) => {
   const { producerId } = req.body;
   try {
-    const producer = router.producers.find(p => p.id === producerId);
+    const producer = producers.get(producerId);
     if (!producer) {
       return res.status(404).json({ error: 'Producer not found' });
     }
@@ -128,4 +424,225 @@ app.post('/closeProducer', async (req, res) => {
     console.error('Error closing producer:', error);
     res.status(500).json({ error: error.message });
   }
+});
+
+// Close many objects at once, e.g. everything a user opened when they leave.
+// Consumers go first, then producers, then transports (which would otherwise
+// close their producers and consumers and make them show up as missing).
+app.post('/closeResources', (req, res) => {
+  const { transportIds = [], producerIds = [], consumerIds = [] } = req.body;
+  const missing = [];
+  let closed = 0;
+  try {
+    for (const [ids, objects] of [[consumerIds, consumers], [producerIds, producers], [transportIds, transports]]) {
+      for (const id of ids) {
+        const object = objects.get(id);
+        if (!object) {
+          missing.push(id);
+          continue;
+        }
+        object.close();
+        closed++;
+      }
+    }
+    res.json({ closed, missing });
+  } catch (error) {
+    console.error('Error closing resources:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+// Preferred simulcast/SVC layers for many consumers at once
+app.post('/consumerLayers', async (req, res) => {
+  const { layers = [] } = req.body;
+  const missing = [];
+  try {
+    const updates = [];
+    for (const { consumerId, spatialLayer, temporalLayer } of layers) {
+      const consumer = consumers.get(consumerId);
+      if (!consumer || consumer.closed || (consumer.type !== 'simulcast' && consumer.type !== 'svc')) {
+        missing.push(consumerId);
+        continue;
+      }
+      updates.push(consumer.setPreferredLayers({ spatialLayer, temporalLayer }));
+    }
+    await Promise.all(updates);
+    res.json({ updated: updates.length, missing });
+  } catch (error) {
+    console.error('Error setting consumer layers:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+// Plain transports send a router's producers as RTP to a receiver outside
+// mediasoup (the backend's recorder and HLS packager). comedia is off: the
+// backend names the address and port it listens on.
+
+app.post('/plainTransports', async (req, res) => {
+  const { routerId, ip, port } = req.body;
+  try {
+    const router = getRouter(routerId);
+    if (!router) {
+      return res.status(404).json({ error: 'Router not found' });
+    }
+    const transport = await router.createPlainTransport({
+      ...config.mediasoup.plainTransport,
+      rtcpMux: true,
+      comedia: false,
+      appData: { routerId: router.id }
+    });
+    trackTransport(transport, workers[router.appData.workerIndex]);
+    await transport.connect({ ip, port });
+    res.json({ id: transport.id });
+  } catch (error) {
+    console.error('Error creating plain transport:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+app.post('/plainConsume', async (req, res) => {
+  const { transportId, producerIds = [] } = req.body;
+  try {
+    const transport = transports.get(transportId);
+    if (!transport) {
+      return res.status(404).json({ error: 'Transport not found' });
+    }
+    const router = routers.get(transport.appData.routerId);
+    const created = [];
+    const missing = [];
+    for (const producerId of producerIds) {
+      if (!producers.has(producerId)) {
+        missing.push(producerId);
+        continue;
+      }
+      const consumer = await transport.consume({ producerId, rtpCapabilities: router.rtpCapabilities, paused: false });
+      if (consumer.kind === 'video') await consumer.requestKeyFrame();
+      created.push({ id: consumer.id, producerId, kind: consumer.kind, rtpParameters: consumer.rtpParameters });
+    }
+    res.json({ consumers: created, missing });
+  } catch (error) {
+    console.error('Error consuming into plain transport:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+// Keyframes on demand, so a packager can start segments on them
+app.post('/requestKeyFrame', async (req, res) => {
+  const { consumerIds = [] } = req.body;
+  const missing = [];
+  try {
+    const requests = [];
+    for (const consumerId of consumerIds) {
+      const consumer = consumers.get(consumerId);
+      if (!consumer || consumer.closed || consumer.kind !== 'video') {
+        missing.push(consumerId);
+        continue;
+      }
+      requests.push(consumer.requestKeyFrame());
+    }
+    await Promise.all(requests);
+    res.json({ requested: requests.length, missing });
+  } catch (error) {
+    console.error('Error requesting keyframes:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+// Pipe transports connect a session's router on this node to a router on
+// another node, so a large audience can be served from a second SFU host.
+
+app.post('/pipeTransports', async (req, res) => {
+  const { routerId } = req.body;
+  try {
+    const router = routers.get(routerId);
+    if (!router) {
+      return res.status(404).json({ error: 'Router not found' });
+    }
+    const transport = await router.createPipeTransport({
+      ...config.mediasoup.pipeTransport,
+      appData: { routerId: router.id }
+    });
+    trackTransport(transport, workers[router.appData.workerIndex]);
+    const { announcedIp, ip } = config.mediasoup.pipeTransport.listenIp;
+    res.json({ id: transport.id, ip: announcedIp || ip, port: transport.tuple.localPort });
+  } catch (error) {
+    console.error('Error creating pipe transport:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+app.post('/connectPipeTransport', async (req, res) => {
+  const { transportId, ip, port } = req.body;
+  try {
+    const transport = transports.get(transportId);
+    if (!transport) {
+      return res.status(404).json({ error: 'Transport not found' });
+    }
+    await transport.connect({ ip, port });
+    res.json({ success: true });
+  } catch (error) {
+    console.error('Error connecting pipe transport:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+// Consume producers into a pipe transport: the listed ones, or every producer
+// of the transport's router that is not piped yet
+app.post('/pipeConsume', async (req, res) => {
+  const { transportId, producerIds } = req.body;
+  try {
+    const transport = transports.get(transportId);
+    if (!transport) {
+      return res.status(404).json({ error: 'Transport not found' });
+    }
+    const piped = transport.appData.piped || (transport.appData.piped = new Set());
+    const candidates = producerIds
+      ? producerIds.map((id) => producers.get(id)).filter(Boolean)
+      : [...producers.values()].filter((p) => p.appData.routerId === transport.appData.routerId);
+
+    const result = [];
+    for (const producer of candidates) {
+      if (piped.has(producer.id)) continue;
+      const consumer = await transport.consume({ producerId: producer.id });
+      piped.add(producer.id);
+      consumer.observer.on('close', () => piped.delete(producer.id));
+      result.push({
+        producerId: producer.id,
+        kind: consumer.kind,
+        rtpParameters: consumer.rtpParameters,
+        paused: consumer.producerPaused
+      });
+    }
+    res.json({ producers: result });
+  } catch (error) {
+    console.error('Error consuming into pipe transport:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+// Re-create piped producers on this side under their original ids
+app.post('/pipeProduce', async (req, res) => {
+  const { transportId, producers: piped = [] } = req.body;
+  try {
+    const transport = transports.get(transportId);
+    if (!transport) {
+      return res.status(404).json({ error: 'Transport not found' });
+    }
+    const ids = [];
+    for (const { producerId, kind, rtpParameters, paused } of piped) {
+      if (producers.has(producerId)) continue;
+      const producer = await transport.produce({
+        id: producerId,
+        kind,
+        rtpParameters,
+        paused,
+        appData: { routerId: transport.appData.routerId }
+      });
+      ids.push(producer.id);
+    }
+    res.json({ ids });
+  } catch (error) {
+    console.error('Error producing from pipe transport:', error);
+    res.status(500).json({ error: error.message });
+  }
 });
\ No newline at end of file